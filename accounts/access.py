@@ -0,0 +1,79 @@
+# accounts/access.py
+"""
+ユーザーの所属店舗・店舗ロールの解決（キャッシュ付き）
+
+- 1リクエスト内: user オブジェクトに載せて使い回す
+- リクエスト間: Django cache（本番 Redis）に「ユーザー × 所属バージョン」のキーで保存
+- StoreMembership / Staff / Cast / User の保存で bump_access_version(user_id) → 次回は DB から読み直す
+
+get_caps_for / user_store_ids はここを通すので、認証後の権限判定は DB を叩かない。
+"""
+import uuid
+from dataclasses import dataclass
+
+from django.core.cache import cache
+
+_VERSION_KEY = 'accounts:access:ver:{}'
+_ACCESS_KEY = 'accounts:access:{}:{}'
+# signals を通らない更新（queryset.update 等）の取りこぼしを有限にする
+ACCESS_TTL = 60 * 60
+
+_REQUEST_ATTR = '_cached_access'
+
+
+@dataclass(frozen=True)
+class UserAccess:
+    roles: dict            # store_id → StoreMembership.role
+    store_ids: frozenset   # 所属店舗（Membership + Cast + Staff + 旧 User.store）
+
+
+def _version_of(user_id) -> str:
+    key = _VERSION_KEY.format(user_id)
+    ver = cache.get(key)
+    if ver is None:
+        ver = uuid.uuid4().hex
+        if not cache.add(key, ver, None):
+            ver = cache.get(key) or ver
+    return ver
+
+
+def bump_access_version(user_id) -> None:
+    """所属・ロールが変わったら呼ぶ（signals から）"""
+    if user_id:
+        cache.set(_VERSION_KEY.format(user_id), uuid.uuid4().hex, None)
+
+
+def _load_access(user) -> UserAccess:
+    from accounts.models import StoreMembership
+    from billing.models import Cast, Staff
+
+    roles = dict(StoreMembership.objects.filter(user=user).values_list('store_id', 'role'))
+
+    ids = set(roles)
+    ids.update(Cast.objects.filter(user=user).values_list('store_id', flat=True))
+    ids.update(Staff.stores.through.objects.filter(staff__user=user).values_list('store_id', flat=True))
+    sid = getattr(user, 'store_id', None)
+    if sid:
+        ids.add(sid)
+    ids.discard(None)
+
+    return UserAccess(roles=roles, store_ids=frozenset(ids))
+
+
+def get_user_access(user) -> UserAccess:
+    """認証済みユーザーの所属情報（未認証は空）"""
+    if not getattr(user, 'is_authenticated', False):
+        return UserAccess(roles={}, store_ids=frozenset())
+
+    access = getattr(user, _REQUEST_ATTR, None)
+    if access is not None:
+        return access
+
+    key = _ACCESS_KEY.format(user.pk, _version_of(user.pk))
+    access = cache.get(key)
+    if access is None:
+        access = _load_access(user)
+        cache.set(key, access, ACCESS_TTL)
+
+    setattr(user, _REQUEST_ATTR, access)
+    return access
@@ -1,4 +1,5 @@
 # accounts/caps.py
+from .access import get_user_access
 from .models import StoreRole
 
 # 固定の機能名（フロントと共有）
@@ -26,8 +27,11 @@ def get_caps_for(user, store_id: int | None) -> set[str]:
         return set(ALL_CAPS)
 
     caps = set()
+    # 所属ロールはキャッシュ済み（accounts.access）。ここでは DB を読まない
+    roles_by_store = get_user_access(user).roles
+
     # store_idが無いAPI（/me等）は「横断可否」だけ先に判定
-    roles = set(m.role for m in user.memberships.all())
+    roles = set(roles_by_store.values())
     if StoreRole.OWNER in roles:
         caps.update({'view_pl_multi', 'view_details'})
 
@@ -35,8 +39,7 @@ def get_caps_for(user, store_id: int | None) -> set[str]:
         return caps
 
     # 単一店舗の役割
-    role = (user.memberships.filter(store_id=store_id)
-            .values_list('role', flat=True).first())
+    role = roles_by_store.get(store_id)
 
     if role == StoreRole.MANAGER:
         caps.update({'view_pl_store','operate_orders','manage_master','user_manage',
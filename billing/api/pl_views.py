@@ -10,7 +10,7 @@ from rest_framework.response    import Response
 from rest_framework             import serializers, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-from billing.utils.pl_daily   import get_daily_pl
+from billing.services.pl_snapshot import get_daily_pl_cached, get_daily_pl_range
 from billing.utils.pl_monthly import get_monthly_pl
 from billing.utils.pl_yearly  import get_yearly_pl
 
@@ -86,7 +86,7 @@ class DailyPLAPIView(APIView):
         if store_id is None:
             return Response({"detail": "store_id を指定してください"}, status=400)
 
-        dpl = get_daily_pl(data["date"], store_id=store_id)
+        dpl = get_daily_pl_cached(data["date"], store_id=store_id)
         return Response(_add_front_stubs(dpl))
 
 # ───────────────────────────────
@@ -111,17 +111,14 @@ class MonthlyPLAPIView(APIView):
         first = date(data["year"], data["month"], 1)
         last  = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
 
-        days: List[Dict[str, Any]] = []
-        cur = first
-        while cur <= last:
-            dpl = get_daily_pl(cur, store_id=store_id)
-            days.append(_add_front_stubs(dpl))
-            cur += timedelta(days=1)
+        rows = get_daily_pl_range(first, last, store_id=store_id)
 
-        # ---- 月次合計 ----------------------------------
-        mpl = get_monthly_pl(data["year"], data["month"], store_id=store_id)
+        # ---- 月次合計（日次の行から合算。当日分を生計算し直さない） ----
+        mpl = get_monthly_pl(data["year"], data["month"], store_id=store_id, days=rows)
         monthly_total = _add_front_stubs(mpl)
 
+        days: List[Dict[str, Any]] = [_add_front_stubs(dpl) for dpl in rows]
+
         return Response({"days": days, "monthly_total": monthly_total})
 
 # ───────────────────────────────
@@ -1,20 +1,40 @@
 # billing/api_kds.py
-import time
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from .kds_broker import READY_ROUTE, channel_for
+from .kds_views import LONG_POLL_TIMEOUT, _ready_tickets, _require_store_id, _station_tickets, _wait_for_tickets
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def order_events(request):
     """
-    KDS用のロングポーリング・スタブ
-    ?station=drinker|kitchen|hall
-    ?since=<cursor文字列>
+    KDS用のロングポーリング（チケット通知で即時に返る）
+    ?station=drinker|kitchen|hall   （hall = デシャップの READY 一覧）
+    ?since=<cursor文字列>           （最後に受け取ったチケットID）
     ?wait=<秒(最大25)>
     """
-    wait = int(request.query_params.get('wait', '1'))
-    wait = max(0, min(wait, 25))
+    station = request.query_params.get('station')
+    if station not in ('drinker', 'kitchen', 'hall'):
+        return Response({'detail': 'station 必須: drinker|kitchen|hall'}, status=400)
+    sid = _require_store_id(request)
+    if not sid:
+        return Response({'detail': 'store コンテキストが必要です'}, status=400)
+
+    try:
+        wait = int(request.query_params.get('wait', '1'))
+    except ValueError:
+        wait = 1
+    wait = max(0, min(wait, LONG_POLL_TIMEOUT))
     since = request.query_params.get('since') or ''
-    time.sleep(wait)  # 疑似で待つ
-    return Response({'events': [], 'cursor': since, 'retryAfter': 800})
+    since_id = int(since) if since.isdigit() else 0
+
+    if station == 'hall':
+        channel, fetch = channel_for(sid, READY_ROUTE), lambda: _ready_tickets(sid, since_id)
+    else:
+        channel, fetch = channel_for(sid, station), lambda: _station_tickets(sid, station, since_id)
+
+    events = _wait_for_tickets(channel, fetch, wait)
+    cursor = str(max(e['id'] for e in events)) if events else since
+    return Response({'events': events, 'cursor': cursor, 'retryAfter': 800})
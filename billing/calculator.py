@@ -4,8 +4,10 @@ Bill / CastPayout 計算ロジック（割引フック + 席種別サービス
 """
 from dataclasses import dataclass
 from decimal import Decimal, ROUND_FLOOR, ROUND_CEILING
-from typing import List, Dict
+from typing import List, Dict, Iterable
 from billing.payroll.engines import get_engine
+from billing.utils.prefetch import prefetched_list
+
 
 @dataclass(slots=True)
 class BillCalculationResult:
@@ -26,12 +28,14 @@ class BillCalculationResult:
 class BillCalculator:
     """伝票(Bill)を入力して金額 & CastPayout を計算する"""
 
-    def __init__(self, bill):
+    def __init__(self, bill, *, service_rate: Decimal | None = None, engine=None):
         self.bill = bill
+        # BatchBillCalculator から席種別サービス率を渡された場合はそれを使う
+        self._service_rate = service_rate
         table = getattr(bill, "table", None)
         self.store = getattr(table, "store", None)
-        # 保険: stays 経由
-        if self.store is None:
+        # 保険: stays 経由（prefetch 済み＝同一伝票の stays なので引き直さない）
+        if self.store is None and prefetched_list(bill, "stays") is None:
             st = bill.stays.select_related("bill__table__store").first()
             if st and getattr(st.bill, "table", None):
                 self.store = getattr(st.bill.table, "store", None)
@@ -39,13 +43,27 @@ class BillCalculator:
             # どうしても取れない場合は 0%計算 or 例外。ここでは 0% にフォールバック。
             class _Dummy: service_rate = 0; tax_rate = 0; nom_pool_rate = 0
             self.store = _Dummy()
+        # PayrollComputation から共有エンジンを渡された場合はそれを使う
+        self.engine = engine if engine is not None else get_engine(self.store)
 
-    # ---------------- 金額計算 ----------------
-    def _subtotal_raw(self) -> Decimal:
+    # ---------------- 明細取得（prefetch 済みなら再利用） ----------------
+    def _items(self):
         if not hasattr(self, '_cached_items'):
-            self._cached_items = list(self.bill.items.select_related("item_master__category", "served_by_cast"))
+            items = prefetched_list(self.bill, "items")
+            if items is None:
+                items = list(self.bill.items.select_related("item_master__category", "served_by_cast"))
+            self._cached_items = items
+        return self._cached_items
+
+    def _substitute_items(self):
         if not hasattr(self, '_cached_substitute_items'):
             self._cached_substitute_items = list(self.bill.substitute_items.all())
+        return self._cached_substitute_items
+
+    # ---------------- 金額計算 ----------------
+    def _subtotal_raw(self) -> Decimal:
+        self._items()
+        self._substitute_items()
         items_total = Decimal(sum(it.subtotal for it in self._cached_items))
         sub_total = Decimal(sum(
             (si.price or 0) * (si.qty or 1)
@@ -74,6 +92,8 @@ class BillCalculator:
         """席種別の実効サービス率（Bill._effective_service_rate）を優先"""
         if getattr(self.bill, "apply_service_charge", True) is False:
             return Decimal(0)
+        if self._service_rate is not None:
+            return (subtotal * self._service_rate).quantize(0, rounding=ROUND_FLOOR)
         # Bill にヘルパがある想定（過去に追加済み）。無ければ store.service_rate を使う。
         if hasattr(self.bill, "_effective_service_rate"):
             rate = Decimal(str(self.bill._effective_service_rate()))
@@ -96,18 +116,27 @@ class BillCalculator:
         base = subtotal + service_fee
         return (base * rate).quantize(0, rounding=ROUND_FLOOR)
 
+    # --------------- エンジン計算（1伝票につき1回） ----------------
+    def nomination_payouts(self) -> dict:
+        if not hasattr(self, '_cached_nomination_payouts'):
+            self._cached_nomination_payouts = self.engine.nomination_payouts(self.bill) or {}
+        return self._cached_nomination_payouts
+
+    def dohan_payouts(self) -> dict:
+        if not hasattr(self, '_cached_dohan_payouts'):
+            self._cached_dohan_payouts = self.engine.dohan_payouts(self.bill) or {}
+        return self._cached_dohan_payouts
+
     # --------------- CastPayout ----------------
     def _cast_payouts(self):
         from .models import CastPayout
         from billing.services.payout_helper import get_payout_base
         totals = {}
 
-        engine = get_engine(self.store)
+        engine = self.engine
 
         # A) 明細ごとの歩合（店舗エンジンの上書き > 既定：％ back_rate）
-        if not hasattr(self, '_cached_items'):
-            self._cached_items = list(self.bill.items.select_related("item_master__category", "served_by_cast"))
-        for item in self._cached_items:
+        for item in self._items():
             if item.exclude_from_payout or not item.served_by_cast or item.is_nomination:
                 continue
 
@@ -129,11 +158,11 @@ class BillCalculator:
                 totals[item.served_by_cast_id] = totals.get(item.served_by_cast_id, 0) + amt
 
         # B) 本指名（既存エンジン）
-        for cid, add in (engine.nomination_payouts(self.bill) or {}).items():
+        for cid, add in self.nomination_payouts().items():
             totals[cid] = totals.get(cid, 0) + int(add or 0)
 
         # C) 同伴（既存エンジン）
-        for cid, add in (engine.dohan_payouts(self.bill) or {}).items():
+        for cid, add in self.dohan_payouts().items():
             totals[cid] = totals.get(cid, 0) + int(add or 0)
 
         # materialize（既存どおり）
@@ -224,4 +253,87 @@ class BillCalculator:
 
     # 後方互換（古い呼び出しが .calc() の場合に備えて）
     def calc(self):
-        return self.execute()
\ No newline at end of file
+        return self.execute()
+
+
+# ---------------- 一括計算 ----------------
+def bill_graph_prefetches(*, payroll: bool = False) -> list:
+    """
+    BillCalculator / エンジンが参照する伝票グラフの prefetch 定義
+    payroll=True: 給与スナップショット用に明細の担当キャスト（M2M）と立替の商品も読む
+    """
+    from django.db.models import Prefetch
+    from .models import BillItem, BillCustomer, BillSubstituteItem
+    items = BillItem.objects.select_related("item_master__category", "served_by_cast")
+    substitute_items = BillSubstituteItem.objects.all()
+    if payroll:
+        items = items.prefetch_related("served_by_casts")
+        substitute_items = substitute_items.select_related("item_master")
+    return [
+        Prefetch("items", queryset=items),
+        Prefetch("substitute_items", queryset=substitute_items),
+        "stays",
+        "nominated_casts",
+        Prefetch("billcustomer_set", queryset=BillCustomer.objects.select_related("customer")),
+        "customer_nominations",
+    ]
+
+
+BILL_GRAPH_SELECT_RELATED = ("table__store", "table__seat_type", "discount_rule", "main_cast")
+
+
+class BatchBillCalculator:
+    """
+    複数の伝票を固定クエリ数で計算する。
+    items / substitute_items / stays / nominations / 席種設定 / 割引ルールを
+    まとめて読み込み、{bill_id: BillCalculationResult} を返す。
+    """
+
+    def __init__(self, bills: Iterable):
+        self.bills = bills
+
+    @staticmethod
+    def prefetch(qs):
+        return qs.select_related(*BILL_GRAPH_SELECT_RELATED).prefetch_related(*bill_graph_prefetches())
+
+    def _load(self) -> list:
+        from django.db.models import QuerySet, prefetch_related_objects
+        if isinstance(self.bills, QuerySet):
+            return list(self.prefetch(self.bills))
+        bills = list(self.bills)
+        if bills:
+            prefetch_related_objects(bills, *BILL_GRAPH_SELECT_RELATED, *bill_graph_prefetches())
+        return bills
+
+    @staticmethod
+    def _seat_rates(bills) -> dict:
+        """{(store_id, seat_type_id): service_rate} を1クエリで取得"""
+        from .models import StoreSeatSetting
+        store_ids = {b.table.store_id for b in bills if b.table_id}
+        seat_ids = {b.table.seat_type_id for b in bills if b.table_id and b.table.seat_type_id}
+        if not store_ids or not seat_ids:
+            return {}
+        rows = StoreSeatSetting.objects.filter(
+            store_id__in=store_ids, seat_type_id__in=seat_ids, service_rate__isnull=False,
+        ).values_list("store_id", "seat_type_id", "service_rate")
+        return {(sid, tid): rate for sid, tid, rate in rows}
+
+    @staticmethod
+    def _service_rate(bill, seat_rates) -> Decimal:
+        """Bill._effective_service_rate と同じ規則（席種設定 > 店舗既定）"""
+        if not bill.table_id:
+            return Decimal(0)
+        table = bill.table
+        sr = Decimal(table.store.service_rate or 0)
+        override = seat_rates.get((table.store_id, table.seat_type_id))
+        if table.seat_type_id and override is not None:
+            sr = Decimal(override)
+        return (sr / 100) if sr >= 1 else sr
+
+    def execute(self) -> Dict[int, BillCalculationResult]:
+        bills = self._load()
+        seat_rates = self._seat_rates(bills)
+        return {
+            bill.id: BillCalculator(bill, service_rate=self._service_rate(bill, seat_rates)).execute()
+            for bill in bills
+        }
@@ -1,22 +1,55 @@
 # billing/excel.py
-"""Excel出力ロジック（個別伝票 / 日次ZIP / 売上日報）"""
+"""
+Excel出力ロジック（個別伝票 / 日次ZIP / 売上日報）
+- シートの中身は「行 = [(値, スタイル名) | None, ...]」の素のデータとして組み立てる（ORM はここまで）
+- 描画は openpyxl の write_only。列幅はシートを走査せず行データから求めて先に設定する
+- 日次ZIPは伝票を1枚ずつ描画し、できた順に ZIP エントリとして流す（ZIP 全体はメモリに持たない）
+"""
+import io
 import re
 import zipfile
 from io import BytesIO
+
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
-from django.utils import timezone
 
 
 # ── 共通スタイル ──
 HEADER_FONT = Font(bold=True, size=10)
 HEADER_FILL = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
 TITLE_FONT = Font(bold=True, size=14)
+SECTION_FONT = Font(bold=True, size=12)
 THIN_BORDER = Border(
     left=Side(style="thin"), right=Side(style="thin"),
     top=Side(style="thin"), bottom=Side(style="thin"),
 )
+SUM_FONT = Font(bold=True, size=10)
+SUM_BORDER = Border(top=Side(style="medium"), bottom=Side(style="medium"),
+                    left=Side(style="thin"), right=Side(style="thin"))
+AMOUNT_FORMAT = "#,##0"
+
+CELL_STYLES = {
+    "title": {"font": TITLE_FONT},
+    "section": {"font": SECTION_FONT},
+    "header": {"font": HEADER_FONT, "fill": HEADER_FILL, "border": THIN_BORDER,
+               "alignment": Alignment(horizontal="center")},
+    "label": {"font": HEADER_FONT, "fill": HEADER_FILL, "border": THIN_BORDER},
+    "data": {"border": THIN_BORDER},
+    "amount": {"border": THIN_BORDER, "number_format": AMOUNT_FORMAT},
+    "sum": {"font": SUM_FONT, "border": SUM_BORDER},
+    "sum_amount": {"font": SUM_FONT, "border": SUM_BORDER, "number_format": AMOUNT_FORMAT},
+}
+
+# generate_bill_excel / 日次ZIP が読む伝票グラフ
+BILL_EXCEL_PREFETCH = (
+    "tables", "customers",
+    "items__served_by_cast", "items__served_by_casts",
+    "substitute_items__cast", "stays__cast",
+)
 
 
 def _fmt_dt(dt):
@@ -34,29 +67,50 @@ def _fmt_time(dt):
     return local.strftime("%H:%M")
 
 
-def _set_header_row(ws, row, headers):
-    for col_idx, h in enumerate(headers, 1):
-        cell = ws.cell(row=row, column=col_idx, value=h)
-        cell.font = HEADER_FONT
-        cell.fill = HEADER_FILL
-        cell.border = THIN_BORDER
-        cell.alignment = Alignment(horizontal="center")
+def _header_row(headers):
+    return [(h, "header") for h in headers]
+
+
+def _data_row(values, amount_cols=()):
+    return [(v, "amount" if i in amount_cols else "data") for i, v in enumerate(values)]
 
 
-def _set_data_row(ws, row, values):
-    for col_idx, v in enumerate(values, 1):
-        cell = ws.cell(row=row, column=col_idx, value=v)
-        cell.border = THIN_BORDER
+def _column_widths(rows):
+    """列ごとの幅（値の文字数+2 を 8〜30 に収める）。空の列も 8 にする"""
+    lengths = {}
+    for row in rows:
+        for col_idx, cell in enumerate(row, 1):
+            value = cell[0] if cell else None
+            length = len(str(value)) if value is not None else 0
+            lengths[col_idx] = max(lengths.get(col_idx, 0), length)
+    return {col: min(max(n + 2, 8), 30) for col, n in lengths.items()}
 
 
-def _auto_width(ws):
-    for col in ws.columns:
-        max_len = 0
-        col_letter = get_column_letter(col[0].column)
-        for cell in col:
-            if cell.value is not None:
-                max_len = max(max_len, len(str(cell.value)))
-        ws.column_dimensions[col_letter].width = min(max(max_len + 2, 8), 30)
+def _render_sheet(title, rows, merged=()) -> bytes:
+    """行データ → xlsx の bytes（write_only。ORM には触れない）"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    for col, width in _column_widths(rows).items():
+        ws.column_dimensions[get_column_letter(col)].width = width
+    for ref in merged:
+        ws.merged_cells.add(ref)
+
+    for row in rows:
+        cells = []
+        for cell in row:
+            if cell is None:
+                cells.append(None)
+                continue
+            value, style = cell
+            wc = WriteOnlyCell(ws, value=value)
+            for attr, v in CELL_STYLES[style].items():
+                setattr(wc, attr, v)
+            cells.append(wc)
+        ws.append(cells)
+
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
 
 
 def _get_cast_names(bill_item):
@@ -74,18 +128,14 @@ def _get_cast_names(bill_item):
 # ============================================================
 #  個別伝票Excel
 # ============================================================
-def generate_bill_excel(bill):
-    """1伝票のExcelをBytesIOで返す"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "伝票"
+STAY_TYPE_LABELS = {"free": "フリー", "in": "場内指名", "nom": "本指名", "dohan": "同伴"}
+
 
-    # ─── ヘッダ情報 ───
-    row = 1
-    ws.cell(row=row, column=1, value="伝票").font = TITLE_FONT
-    row += 2
+def _bill_sheet_rows(bill):
+    """1伝票シートの行データ（bill は BILL_EXCEL_PREFETCH 済みであること）"""
+    rows = [[("伝票", "title")], []]
 
-    # 基本情報
+    # ─── 基本情報 ───
     info_labels = ["伝票番号", "営業日", "開始", "終了", "テーブル", "顧客", "人数", "メモ"]
     tables_str = ", ".join(t.code or str(t.id) for t in bill.tables.all()) or (bill.table.code if bill.table else "")
     customers = list(bill.customers.all())
@@ -102,73 +152,41 @@ def generate_bill_excel(bill):
         bill.pax,
         bill.memo or "",
     ]
-
-    for i, (label, value) in enumerate(zip(info_labels, info_values)):
-        r = row + i
-        cell_l = ws.cell(row=r, column=1, value=label)
-        cell_l.font = HEADER_FONT
-        cell_l.fill = HEADER_FILL
-        cell_l.border = THIN_BORDER
-        cell_v = ws.cell(row=r, column=2, value=value)
-        cell_v.border = THIN_BORDER
-    row += len(info_labels) + 1
+    rows += [[(label, "label"), (value, "data")] for label, value in zip(info_labels, info_values)]
+    rows.append([])
 
     # ─── 注文明細 ───
-    ws.cell(row=row, column=1, value="注文明細").font = Font(bold=True, size=12)
-    row += 1
-
-    order_headers = ["注文", "注文日時", "担当", "個数", "計"]
-    _set_header_row(ws, row, order_headers)
-    row += 1
-
-    items = bill.items.select_related("served_by_cast", "item_master").prefetch_related("served_by_casts").all()
-    for item in items:
-        cast_names = _get_cast_names(item)
-        values = [
+    rows.append([("注文明細", "section")])
+    rows.append(_header_row(["注文", "注文日時", "担当", "個数", "計"]))
+    for item in bill.items.all():
+        rows.append(_data_row([
             item.name,
             _fmt_dt(item.ordered_at),
-            cast_names,
+            _get_cast_names(item),
             item.qty,
             item.subtotal,
-        ]
-        _set_data_row(ws, row, values)
-        row += 1
-
-    row += 1
+        ]))
+    rows.append([])
 
     # ─── 立替明細 ───
-    ws.cell(row=row, column=1, value="立替明細").font = Font(bold=True, size=12)
-    row += 1
-
-    sub_headers = ["立替", "日時", "対象キャスト", "個数", "客引き額", "給与控除額"]
-    _set_header_row(ws, row, sub_headers)
-    row += 1
-
-    subs = bill.substitute_items.select_related("cast").all()
+    rows.append([("立替明細", "section")])
+    rows.append(_header_row(["立替", "日時", "対象キャスト", "個数", "客引き額", "給与控除額"]))
+    subs = list(bill.substitute_items.all())
     for s in subs:
-        values = [
+        rows.append(_data_row([
             s.name,
             _fmt_dt(s.ordered_at),
             s.cast.stage_name if s.cast else "",
             s.qty,
             (s.price or 0) * (s.qty or 1),
             s.substitute_amount,
-        ]
-        _set_data_row(ws, row, values)
-        row += 1
-
-    row += 1
+        ]))
+    rows.append([])
 
     # ─── 会計 ───
-    ws.cell(row=row, column=1, value="会計").font = Font(bold=True, size=12)
-    row += 1
-
+    rows.append([("会計", "section")])
     # 立替による控除合計
-    substitute_total = sum(
-        (si.price or 0) * (si.qty or 1)
-        for si in bill.substitute_items.all()
-    )
-
+    substitute_total = sum((si.price or 0) * (si.qty or 1) for si in subs)
     accounting = [
         ("注文小計", bill.subtotal),
         ("立替による控除", substitute_total),
@@ -176,45 +194,26 @@ def generate_bill_excel(bill):
         ("税", bill.tax),
         ("総額", bill.grand_total),
     ]
-
-    for label, value in accounting:
-        cell_l = ws.cell(row=row, column=1, value=label)
-        cell_l.font = HEADER_FONT
-        cell_l.fill = HEADER_FILL
-        cell_l.border = THIN_BORDER
-        cell_v = ws.cell(row=row, column=2, value=value)
-        cell_v.border = THIN_BORDER
-        cell_v.number_format = "#,##0"
-        row += 1
-
-    row += 1
+    rows += [[(label, "label"), (value, "amount")] for label, value in accounting]
+    rows.append([])
 
     # ─── 稼働キャスト ───
-    ws.cell(row=row, column=1, value="稼働キャスト").font = Font(bold=True, size=12)
-    row += 1
-
-    stay_headers = ["キャスト", "種別", "入店", "退店"]
-    _set_header_row(ws, row, stay_headers)
-    row += 1
-
-    STAY_TYPE_LABELS = {"free": "フリー", "in": "場内指名", "nom": "本指名", "dohan": "同伴"}
-    stays = bill.stays.select_related("cast").all()
-    for stay in stays:
-        values = [
+    rows.append([("稼働キャスト", "section")])
+    rows.append(_header_row(["キャスト", "種別", "入店", "退店"]))
+    for stay in bill.stays.all():
+        rows.append(_data_row([
             stay.cast.stage_name if stay.cast else "",
             STAY_TYPE_LABELS.get(stay.stay_type, stay.stay_type),
             _fmt_time(stay.entered_at),
             _fmt_time(stay.left_at),
-        ]
-        _set_data_row(ws, row, values)
-        row += 1
+        ]))
+    return rows
 
-    _auto_width(ws)
 
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return buf
+def generate_bill_excel(bill):
+    """1伝票のExcelをBytesIOで返す"""
+    prefetch_related_objects([bill], *BILL_EXCEL_PREFETCH)
+    return BytesIO(_render_sheet("伝票", _bill_sheet_rows(bill)))
 
 
 def _safe_filename(s):
@@ -225,32 +224,60 @@ def _safe_filename(s):
 # ============================================================
 #  1日分まとめZIP
 # ============================================================
-def generate_daily_zip(bills):
-    """伝票リストからZIP(BytesIO)を生成。billsが空ならNoneを返す"""
-    if not bills:
-        return None
+def _bill_zip_name(bill):
+    # テーブルコード
+    tables = list(bill.tables.all())
+    if tables:
+        table_code = '_'.join(_safe_filename(t.code or str(t.id)) for t in tables)
+    elif bill.table:
+        table_code = _safe_filename(bill.table.code or str(bill.table.id))
+    else:
+        table_code = 'notable'
+
+    # 開始時刻
+    time_str = timezone.localtime(bill.opened_at).strftime('%H%M') if bill.opened_at else '0000'
+    return f'bill_{bill.id}_{table_code}_{time_str}.xlsx'
+
+
+class _ZipStream(io.RawIOBase):
+    """ZipFile の書き出し先。書かれた bytes を drain() で取り出す（シーク不可なのでデータ記述子付きで書かれる）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
 
-    zip_buf = BytesIO()
-    with zipfile.ZipFile(zip_buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for bill in bills:
-            # テーブルコード
-            tables = list(bill.tables.all())
-            if tables:
-                table_code = '_'.join(_safe_filename(t.code or str(t.id)) for t in tables)
-            elif bill.table:
-                table_code = _safe_filename(bill.table.code or str(bill.table.id))
-            else:
-                table_code = 'notable'
 
-            # 開始時刻
-            time_str = timezone.localtime(bill.opened_at).strftime('%H%M') if bill.opened_at else '0000'
+def iter_daily_zip(bills):
+    """
+    伝票リストの日次ZIPを bytes の断片として順に返す（StreamingHttpResponse 用）。
+    bills は BILL_EXCEL_PREFETCH 済みであること（伝票ごとに DB を引かない）。
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for bill in bills:
+            zf.writestr(_bill_zip_name(bill), _render_sheet("伝票", _bill_sheet_rows(bill)))
+            yield stream.drain()
+    # セントラルディレクトリ
+    yield stream.drain()
 
-            fname = f'bill_{bill.id}_{table_code}_{time_str}.xlsx'
-            excel_buf = generate_bill_excel(bill)
-            zf.writestr(fname, excel_buf.getvalue())
 
-    zip_buf.seek(0)
-    return zip_buf
+def generate_daily_zip(bills):
+    """伝票リストからZIP(BytesIO)を生成。billsが空ならNoneを返す"""
+    if not bills:
+        return None
+    prefetch_related_objects(bills, *BILL_EXCEL_PREFETCH)
+    return BytesIO(b''.join(iter_daily_zip(bills)))
 
 
 # ============================================================
@@ -265,10 +292,6 @@ REPORT_COLUMNS = [
 # 合計対象の列インデックス（0始まり）
 _SUM_COLS = {3, 8, 9, 10, 11, 12, 13, 14}  # 人数,注文小計,立替控除,サービス料,税,総額,現金,カード
 
-SUM_FONT = Font(bold=True, size=10)
-SUM_BORDER = Border(top=Side(style="medium"), bottom=Side(style="medium"),
-                    left=Side(style="thin"), right=Side(style="thin"))
-
 
 def _bill_cast_str(bill):
     """日報用の担当キャスト名。main_cast優先、なければstaysから重複排除"""
@@ -292,22 +315,9 @@ def _bill_table_str(bill):
     return ""
 
 
-def generate_daily_report(bills, target_date):
-    """売上日報ExcelをBytesIOで返す"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "売上日報"
-
-    # ─── タイトル ───
-    row = 1
-    title_cell = ws.cell(row=row, column=1, value=f"売上日報 {target_date}")
-    title_cell.font = TITLE_FONT
-    ws.merge_cells(start_row=row, start_column=1, end_row=row, end_column=len(REPORT_COLUMNS))
-    row += 2
-
-    # ─── ヘッダ ───
-    _set_header_row(ws, row, REPORT_COLUMNS)
-    row += 1
+def _daily_report_rows(bills, target_date):
+    # ─── タイトル（列幅いっぱいに結合）・ヘッダ ───
+    rows = [[(f"売上日報 {target_date}", "title")], [], _header_row(REPORT_COLUMNS)]
 
     # ─── データ行 ───
     sums = {i: 0 for i in _SUM_COLS}
@@ -328,7 +338,7 @@ def generate_daily_report(bills, target_date):
             bill.pax,                                     # 人数
             _fmt_time(bill.opened_at),                    # 開始
             _fmt_time(bill.closed_at),                    # 終了
-            _bill_cast_str(bill),                             # 担当
+            _bill_cast_str(bill),                         # 担当
             bill.id,                                      # 伝票番号
             bill.subtotal,                                # 注文小計
             substitute_deduction,                         # 立替控除
@@ -340,29 +350,25 @@ def generate_daily_report(bills, target_date):
             bill.get_card_brand_display() if bill.card_brand else "",  # カード種別
             bill.memo or "",                              # メモ
         ]
-
-        _set_data_row(ws, row, values)
-        # 金額列に書式
+        rows.append(_data_row(values, amount_cols=_SUM_COLS))
         for ci in _SUM_COLS:
-            ws.cell(row=row, column=ci + 1).number_format = "#,##0"
             sums[ci] += (values[ci] or 0)
-        row += 1
 
-    # ─── 合計行 ───
-    row += 0  # データ直下
+    # ─── 合計行（データ直下） ───
+    total_row = []
     for col_idx in range(len(REPORT_COLUMNS)):
-        cell = ws.cell(row=row, column=col_idx + 1)
-        cell.border = SUM_BORDER
-        cell.font = SUM_FONT
         if col_idx == 0:
-            cell.value = "合計"
+            total_row.append(("合計", "sum"))
         elif col_idx in _SUM_COLS:
-            cell.value = sums[col_idx]
-            cell.number_format = "#,##0"
+            total_row.append((sums[col_idx], "sum_amount"))
+        else:
+            total_row.append((None, "sum"))
+    rows.append(total_row)
+    return rows
 
-    _auto_width(ws)
 
-    buf = BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return buf
+def generate_daily_report(bills, target_date):
+    """売上日報ExcelをBytesIOで返す"""
+    rows = _daily_report_rows(bills, target_date)
+    title_range = f"A1:{get_column_letter(len(REPORT_COLUMNS))}1"
+    return BytesIO(_render_sheet("売上日報", rows, merged=[title_range]))
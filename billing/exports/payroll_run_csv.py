@@ -1,13 +1,11 @@
 # billing/exports/payroll_run_csv.py
 import csv
-import io
 from datetime import date, datetime
 
 from dateutil.relativedelta import relativedelta
 
-from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models import Sum, Value
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse
 
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
@@ -24,7 +22,9 @@ from ..models import (
     PayrollRunBackRow,
 )
 from ..permissions import RequireCap
+from ..services.snapshot_casts import bills_with_substitute_deduction, substitute_deduction_by_cast
 from ..payroll.engines import get_engine
+from ..utils.streaming import streaming_response
 
 
 # exp.csv に合わせた 17列
@@ -130,12 +130,81 @@ def _safe_int(v, default=0):
 
 def _row(writer, values):
     """
-    常に 17 列に揃えて書き出す
+    常に 17 列に揃えて書き出す（writer が _Echo なら整形済みの1行を返す）
     """
     vals = list(values)
     if len(vals) < len(CSV_COLUMNS):
         vals += [""] * (len(CSV_COLUMNS) - len(vals))
-    writer.writerow(vals[: len(CSV_COLUMNS)])
+    return writer.writerow(vals[: len(CSV_COLUMNS)])
+
+
+class _Echo:
+    """csv.writer の書き込み先。書いた文字列をそのまま返す（ストリーミング用）"""
+
+    def write(self, value):
+        return value
+
+
+# bulk_create / iterator の1回あたりの件数
+BATCH_SIZE = 1000
+
+
+def _sum_by_cast(qs, **sums):
+    """cast_id 別の合計を1クエリで {cast_id: {name: total}} にする"""
+    return {
+        r["cast_id"]: r
+        for r in qs.values("cast_id").order_by().annotate(
+            **{name: Coalesce(Sum(field), Value(0)) for name, field in sums.items()}
+        )
+    }
+
+
+def _iter_by_cast(rows, cast_ids):
+    """
+    cast の並び順と同じ順に並んだ rows を先頭から1回だけ読み、
+    cast_ids の順に (cast_id, その cast の行の iterator) を返す。
+    """
+    rows = iter(rows)
+    head = next(rows, None)
+
+    def take(cast_id):
+        nonlocal head
+        while head is not None and head.cast_id == cast_id:
+            yield head
+            head = next(rows, None)
+
+    for cast_id in cast_ids:
+        group = take(cast_id)
+        yield cast_id, group
+        for _ in group:  # 呼び出し側が読み残した行を飛ばす
+            pass
+
+
+def _save_back_rows(run, sid, df, dt):
+    """CastPayout（期間内すべて）を PayrollRunBackRow へ。1パスで読み、BATCH_SIZE ずつ保存"""
+    payouts = (
+        CastPayout.objects.filter(
+            bill__table__store_id=sid,
+            bill__closed_at__date__range=(df, dt),
+        )
+        .order_by("cast__stage_name", "bill__closed_at", "id")
+        .values_list("cast_id", "bill_id", "bill_item_id", "bill__closed_at", "amount")
+    )
+    batch = []
+    for cast_id, bill_id, bill_item_id, closed_at, amount in payouts.iterator(chunk_size=BATCH_SIZE):
+        batch.append(PayrollRunBackRow(
+            run=run,
+            cast_id=cast_id,
+            bill_id=bill_id,
+            bill_item_id=bill_item_id,
+            occurred_at=closed_at,
+            amount=amount,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            PayrollRunBackRow.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PayrollRunBackRow.objects.bulk_create(batch)
 
 
 def _aggregate_substitute_deduction_from_snapshots(store_id, period_start, period_end):
@@ -143,28 +212,31 @@ def _aggregate_substitute_deduction_from_snapshots(store_id, period_start, perio
     期間内のクローズ済み伝票の payroll_snapshot から、
     cast_id 別の立替控除合計を集計する。
     snapshot がクローズ時確定値の唯一の根拠。
+    合計は正規化済みの BillPayrollSnapshotCast の SUM、明細は控除のある伝票の snapshot だけ読む。
     """
     bills = Bill.objects.filter(
         table__store_id=store_id,
         closed_at__date__range=(period_start, period_end),
         payroll_snapshot__isnull=False,
-    ).only('payroll_snapshot')
+    )
+    cast_deduction = substitute_deduction_by_cast(bills)   # {cast_id: int}
 
-    cast_deduction = {}   # {cast_id: int}
     cast_details = {}     # {cast_id: [detail,...]}
-    for bill in bills:
-        snap = bill.payroll_snapshot
+    if not cast_deduction:
+        return cast_deduction, cast_details
+
+    snapshots = bills_with_substitute_deduction(bills).values_list('id', 'payroll_snapshot')
+    for bill_id, snap in snapshots.iterator(chunk_size=BATCH_SIZE):
         if not isinstance(snap, dict):
             continue
         for cast_rec in snap.get('by_cast', []):
             cid = cast_rec.get('cast_id')
             ded = int(cast_rec.get('substitute_deduction', 0) or 0)
             if cid and ded > 0:
-                cast_deduction[cid] = cast_deduction.get(cid, 0) + ded
                 for s in cast_rec.get('substitutes', []):
                     cast_details.setdefault(cid, []).append({
                         **s,
-                        "bill_id": bill.id if hasattr(bill, 'id') else None,
+                        "bill_id": bill_id,
                     })
     return cast_deduction, cast_details
 
@@ -214,49 +286,19 @@ class PayrollRunExportCSVView(APIView):
             note=note,
         )
 
-        # --- 集計（キャストは常に全員） ---
-        attendance_sq = (
-            CastDailySummary.objects.filter(
-                store_id=sid,
-                cast_id=OuterRef("pk"),
-                work_date__range=(df, dt),
-            )
-            .values("cast_id")
-            .annotate(total=Coalesce(Sum("worked_min"), Value(0)))
-            .values("total")[:1]
+        # --- 集計（キャストは常に全員。ソースごとに cast_id 別の1クエリ） ---
+        daily_totals = _sum_by_cast(
+            CastDailySummary.objects.filter(store_id=sid, work_date__range=(df, dt)),
+            worked_min="worked_min", hourly_total="payroll",
         )
-
-        hourly_sq = (
-            CastDailySummary.objects.filter(
-                store_id=sid,
-                cast_id=OuterRef("pk"),
-                work_date__range=(df, dt),
-            )
-            .values("cast_id")
-            .annotate(total=Coalesce(Sum("payroll"), Value(0)))
-            .values("total")[:1]
-        )
-
-        back_sq = (
+        back_totals = _sum_by_cast(
             CastPayout.objects.filter(
-                cast_id=OuterRef("pk"),
                 bill__table__store_id=sid,
                 bill__closed_at__date__range=(df, dt),
-            )
-            .values("cast_id")
-            .annotate(total=Coalesce(Sum("amount"), Value(0)))
-            .values("total")[:1]
-        )
-
-        casts = (
-            Cast.objects.filter(store_id=sid)
-            .annotate(
-                worked_min=Coalesce(Subquery(attendance_sq), Value(0)),
-                hourly_total=Coalesce(Subquery(hourly_sq), Value(0)),
-                back_total=Coalesce(Subquery(back_sq), Value(0)),
-            )
-            .order_by("stage_name", "id")
+            ),
+            back_total="amount",
         )
+        casts = list(Cast.objects.filter(store_id=sid).order_by("stage_name", "id"))
 
         # --- 立替控除（snapshotから集計） ---
         sub_ded_map, sub_det_map = _aggregate_substitute_deduction_from_snapshots(sid, df, dt)
@@ -264,9 +306,10 @@ class PayrollRunExportCSVView(APIView):
         # --- DBへ保存（サマリ） ---
         lines = []
         for c in casts:
-            worked_min = int(c.worked_min or 0)
-            hourly_total = int(c.hourly_total or 0)
-            back_total = int(c.back_total or 0)
+            daily = daily_totals.get(c.id, {})
+            worked_min = int(daily.get("worked_min") or 0)
+            hourly_total = int(daily.get("hourly_total") or 0)
+            back_total = int(back_totals.get(c.id, {}).get("back_total") or 0)
             sub_ded = sub_ded_map.get(c.id, 0)
             lines.append(
                 PayrollRunLine(
@@ -285,8 +328,7 @@ class PayrollRunExportCSVView(APIView):
         engine = get_engine(store)
         finalize_extra_rows = []
         lines_to_save = []
-        for line in lines:
-            extra = engine.finalize_payroll_line(line, df, dt)
+        for line, extra in zip(lines, engine.finalize_payroll_lines(lines, df, dt)):
             if extra:
                 finalize_extra_rows.extend(extra)
                 lines_to_save.append(line)
@@ -296,50 +338,10 @@ class PayrollRunExportCSVView(APIView):
                 ["hourly_pay", "commission", "substitute_deduction", "total", "garden_snapshot"],
             )
         if finalize_extra_rows:
-            PayrollRunBackRow.objects.bulk_create(finalize_extra_rows)
+            PayrollRunBackRow.objects.bulk_create(finalize_extra_rows, batch_size=BATCH_SIZE)
 
         # --- バック根拠明細（CastPayout "全部"） ---
-        payout_qs = (
-            CastPayout.objects.filter(
-                bill__table__store_id=sid,
-                bill__closed_at__date__range=(df, dt),
-            )
-            .select_related("cast", "bill", "bill_item")
-            .order_by("cast__stage_name", "bill__closed_at", "id")
-        )
-
-        back_rows = []
-        for p in payout_qs:
-            back_rows.append(
-                PayrollRunBackRow(
-                    run=run,
-                    cast=p.cast,
-                    bill_id=p.bill_id,
-                    bill_item_id=p.bill_item_id,
-                    occurred_at=p.bill.closed_at if p.bill else None,
-                    amount=p.amount,
-                )
-            )
-        PayrollRunBackRow.objects.bulk_create(back_rows)
-
-        # --- 勤務(時給)明細（CastDailySummary "全部"） ---
-        daily_qs = (
-            CastDailySummary.objects.filter(
-                store_id=sid,
-                work_date__range=(df, dt),
-            )
-            .select_related("cast")
-            .order_by("cast__stage_name", "work_date", "id")
-        )
-
-        # キャスト別に束ねる
-        daily_by_cast = {}
-        for d in daily_qs:
-            daily_by_cast.setdefault(d.cast_id, []).append(d)
-
-        payouts_by_cast = {}
-        for p in payout_qs:
-            payouts_by_cast.setdefault(p.cast_id, []).append(p)
+        _save_back_rows(run, sid, df, dt)
 
         # finalize 後の値を参照するための lookup
         line_by_cast = {l.cast_id: l for l in lines}
@@ -350,184 +352,209 @@ class PayrollRunExportCSVView(APIView):
             if r.label and r.label.startswith("GDN_"):
                 monthly_by_cast.setdefault(r.cast_id, []).append(r)
 
-        # --- CSV書き出し（exp.csv 形式：1テーブル） ---
-        output = io.StringIO()
-        writer = csv.writer(output)
+        # --- CSV書き出し（exp.csv 形式：1テーブル。明細は DB から読みながら流す） ---
+        filename = f"payroll_{df.isoformat()}_{dt.isoformat()}.csv"
+        resp = streaming_response(
+            request,
+            _iter_csv(sid, df, dt, casts, line_by_cast, sub_det_map, monthly_by_cast),
+            content_type="text/csv; charset=utf-8",
+        )
+        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return resp
 
-        # 1行目：ヘッダ
-        _row(writer, CSV_COLUMNS)
 
-        for c in casts:
-            cast_id = c.id
-            cast_name = c.stage_name or f"cast-{cast_id}"
-
-            # finalize 後の確定値を使う
-            ln = line_by_cast.get(cast_id)
-            hourly_total = ln.hourly_pay if ln else int(c.hourly_total or 0)
-            back_total = ln.commission if ln else int(c.back_total or 0)
-            sub_ded = ln.substitute_deduction if ln else sub_ded_map.get(cast_id, 0)
-            total = ln.total if ln else max(0, hourly_total + back_total - sub_ded)
-
-            # サマリ行（出勤/売上欄は空）
-            _row(
+def _iter_csv(sid, df, dt, casts, line_by_cast, sub_det_map, monthly_by_cast):
+    """
+    CSV を1行ずつ生成する。
+    出勤・売上明細はキャストと同じ並び（stage_name, id）で取得し、
+    各クエリを1回だけ先頭から読む（期間が長くてもメモリは一定）。
+    """
+    writer = csv.writer(_Echo())
+
+    # 1行目：ヘッダ（UTF-8 BOM 付き）
+    yield "\ufeff" + _row(writer, CSV_COLUMNS)
+
+    # 勤務(時給)明細（CastDailySummary）
+    daily_qs = (
+        CastDailySummary.objects.filter(
+            store_id=sid,
+            cast__store_id=sid,
+            work_date__range=(df, dt),
+        )
+        .order_by("cast__stage_name", "cast_id", "work_date", "id")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    # 売上（バック）明細（CastPayout）
+    payout_qs = (
+        CastPayout.objects.filter(
+            bill__table__store_id=sid,
+            bill__closed_at__date__range=(df, dt),
+            cast__store_id=sid,
+        )
+        .select_related("bill_item")
+        .order_by("cast__stage_name", "cast_id", "bill__closed_at", "id")
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+    cast_ids = [c.id for c in casts]
+    for c, (_, d_list), (_, p_list) in zip(
+        casts, _iter_by_cast(daily_qs, cast_ids), _iter_by_cast(payout_qs, cast_ids),
+    ):
+        cast_id = c.id
+        cast_name = c.stage_name or f"cast-{cast_id}"
+
+        # finalize 後の確定値を使う
+        ln = line_by_cast[cast_id]
+
+        # サマリ行（出勤/売上欄は空）
+        yield _row(
+            writer,
+            [
+                cast_name,
+                ln.hourly_pay,
+                ln.commission,
+                ln.substitute_deduction if ln.substitute_deduction else "",
+                ln.total,
+                "", "", "", "", "", "", "", "", "", "", "", "", "",
+            ],
+        )
+
+        # 出勤明細（区分=出勤日時）
+        has_rows = False
+        for d in d_list:
+            has_rows = True
+            worked_min = int(d.worked_min or 0)
+            hours = _round_hours(worked_min)
+            wage_amount = int(d.payroll or 0)
+
+            # できるだけ "あるなら使う" 方針（無ければ空）
+            in_dt = getattr(d, "clock_in_at", None) or getattr(d, "started_at", None) or getattr(d, "check_in_at", None)
+            out_dt = getattr(d, "clock_out_at", None) or getattr(d, "ended_at", None) or getattr(d, "check_out_at", None)
+
+            # それらが無い場合は、work_date を出勤欄に置く（最低限の明細として成立）
+            if not in_dt and not out_dt:
+                in_dt = d.work_date
+
+            # 時給がスナップされているなら優先。無ければ推定（給与/時間）。
+            hourly_snap = getattr(d, "hourly_wage_snap", None)
+            if hourly_snap is None:
+                est_hourly = int(round(wage_amount / hours)) if hours else ""
+            else:
+                est_hourly = int(hourly_snap or 0)
+
+            yield _row(
+                writer,
+                [
+                    "", "", "", "", "",
+                    "出勤日時",
+                    _fmt_dt(in_dt),
+                    _fmt_dt(out_dt),
+                    hours if hours else 0,
+                    est_hourly,
+                    wage_amount,
+                    "", "", "", "", "", "", "",
+                ],
+            )
+        if not has_rows:
+            yield _row(
                 writer,
                 [
-                    cast_name,
-                    hourly_total,
-                    back_total,
-                    sub_ded if sub_ded else "",
-                    total,
-                    "", "", "", "", "", "", "", "", "", "", "", "", "",
+                    "", "", "", "", "",
+                    "出勤日時",
+                    "", "", "", "", "",
+                    "", "", "", "", "", "", "",
                 ],
             )
 
-            # 出勤明細（区分=出勤日時）
-            d_list = daily_by_cast.get(cast_id, [])
-            if d_list:
-                for d in d_list:
-                    worked_min = int(d.worked_min or 0)
-                    hours = _round_hours(worked_min)
-                    wage_amount = int(d.payroll or 0)
-
-                    # できるだけ "あるなら使う" 方針（無ければ空）
-                    in_dt = getattr(d, "clock_in_at", None) or getattr(d, "started_at", None) or getattr(d, "check_in_at", None)
-                    out_dt = getattr(d, "clock_out_at", None) or getattr(d, "ended_at", None) or getattr(d, "check_out_at", None)
-
-                    # それらが無い場合は、work_date を出勤欄に置く（最低限の明細として成立）
-                    if not in_dt and not out_dt:
-                        in_dt = d.work_date
-
-                    # 時給がスナップされているなら優先。無ければ推定（給与/時間）。
-                    hourly_snap = getattr(d, "hourly_wage_snap", None)
-                    if hourly_snap is None:
-                        est_hourly = int(round(wage_amount / hours)) if hours else ""
-                    else:
-                        est_hourly = int(hourly_snap or 0)
-
-                    _row(
-                        writer,
-                        [
-                            "", "", "", "", "",
-                            "出勤日時",
-                            _fmt_dt(in_dt),
-                            _fmt_dt(out_dt),
-                            hours if hours else 0,
-                            est_hourly,
-                            wage_amount,
-                            "", "", "", "", "", "", "",
-                        ],
-                    )
-            else:
-                _row(
-                    writer,
-                    [
-                        "", "", "", "", "",
-                        "出勤日時",
-                        "", "", "", "", "",
-                        "", "", "", "", "", "", "",
-                    ],
-                )
+        # 売上（バック）明細（区分=売上）
+        has_rows = False
+        for p in p_list:
+            has_rows = True
+            item = p.bill_item
+            bill_id = p.bill_id or ""
+            item_id = item.id if item else ""
+            item_name = item.name if item else ""
+
+            unit_price = (
+                getattr(item, "unit_price", None)
+                or getattr(item, "price", None)
+                or getattr(item, "amount", None)
+            )
+            qty = (
+                getattr(item, "qty", None)
+                or getattr(item, "quantity", None)
+                or getattr(item, "count", None)
+            )
 
-            # 売上（バック）明細（区分=売上）
-            p_list = payouts_by_cast.get(cast_id, [])
-            if p_list:
-                for p in p_list:
-                    bill_id = p.bill.id if p.bill else ""
-                    item_id = p.bill_item.id if p.bill_item else ""
-                    item_name = p.bill_item.name if p.bill_item else ""
-
-                    unit_price = (
-                        getattr(p.bill_item, "unit_price", None)
-                        or getattr(p.bill_item, "price", None)
-                        or getattr(p.bill_item, "amount", None)
-                    )
-                    qty = (
-                        getattr(p.bill_item, "qty", None)
-                        or getattr(p.bill_item, "quantity", None)
-                        or getattr(p.bill_item, "count", None)
-                    )
-
-                    unit_price_i = _safe_int(unit_price, default=0)
-                    qty_i = _safe_int(qty, default=0)
-
-                    # 小計がモデルにあれば優先、無ければ unit_price * qty が作れれば計算
-                    subtotal = getattr(p.bill_item, "subtotal", None) or getattr(p.bill_item, "total", None)
-                    if subtotal is None and unit_price_i and qty_i:
-                        subtotal_i = unit_price_i * qty_i
-                    else:
-                        subtotal_i = _safe_int(subtotal, default=0)
-
-                    _row(
-                        writer,
-                        [
-                            "", "", "", "", "",
-                            "売上",
-                            "", "", "", "", "",
-                            bill_id,
-                            item_id,
-                            item_name,
-                            unit_price_i,
-                            qty_i,
-                            subtotal_i,
-                            int(p.amount or 0),
-                        ],
-                    )
-            else:
-                _row(
-                    writer,
-                    [
-                        "", "", "", "", "",
-                        "売上",
-                        "", "", "", "", "",
-                        "", "", "", "", "", "", "",
-                    ],
-                )
+            unit_price_i = _safe_int(unit_price, default=0)
+            qty_i = _safe_int(qty, default=0)
 
-            # 立替控除明細（区分=立替）
-            s_list = sub_det_map.get(cast_id, [])
-            for s in s_list:
-                _row(
-                    writer,
-                    [
-                        "", "", "", "", "",
-                        "立替",
-                        "", "", "", "", "",
-                        s.get("bill_id", ""),
-                        s.get("bill_substitute_item_id", ""),
-                        s.get("item_name", ""),
-                        s.get("price", ""),
-                        s.get("qty", ""),
-                        "",
-                        -int(s.get("substitute_amount", 0)),
-                    ],
-                )
+            # 小計がモデルにあれば優先、無ければ unit_price * qty が作れれば計算
+            subtotal = getattr(item, "subtotal", None) or getattr(item, "total", None)
+            if subtotal is None and unit_price_i and qty_i:
+                subtotal_i = unit_price_i * qty_i
+            else:
+                subtotal_i = _safe_int(subtotal, default=0)
 
-            # 月次バック明細（GDN_* 行）
-            m_list = monthly_by_cast.get(cast_id, [])
-            for m in m_list:
-                _row(
-                    writer,
-                    [
-                        "", "", "", "", "",
-                        "月次バック",
-                        "", "", "", "", "",
-                        "", "",
-                        m.label,
-                        "", "", "",
-                        int(m.amount or 0),
-                    ],
-                )
+            yield _row(
+                writer,
+                [
+                    "", "", "", "", "",
+                    "売上",
+                    "", "", "", "", "",
+                    bill_id,
+                    item_id,
+                    item_name,
+                    unit_price_i,
+                    qty_i,
+                    subtotal_i,
+                    int(p.amount or 0),
+                ],
+            )
+        if not has_rows:
+            yield _row(
+                writer,
+                [
+                    "", "", "", "", "",
+                    "売上",
+                    "", "", "", "", "",
+                    "", "", "", "", "", "", "",
+                ],
+            )
 
-            # キャスト区切り（空行）
-            _row(writer, [""] * len(CSV_COLUMNS))
+        # 立替控除明細（区分=立替）
+        for s in sub_det_map.get(cast_id, []):
+            yield _row(
+                writer,
+                [
+                    "", "", "", "", "",
+                    "立替",
+                    "", "", "", "", "",
+                    s.get("bill_id", ""),
+                    s.get("bill_substitute_item_id", ""),
+                    s.get("item_name", ""),
+                    s.get("price", ""),
+                    s.get("qty", ""),
+                    "",
+                    -int(s.get("substitute_amount", 0)),
+                ],
+            )
 
-        filename = f"payroll_{df.isoformat()}_{dt.isoformat()}.csv"
-        csv_text = output.getvalue()
-        output.close()
+        # 月次バック明細（GDN_* 行）
+        for m in monthly_by_cast.get(cast_id, []):
+            yield _row(
+                writer,
+                [
+                    "", "", "", "", "",
+                    "月次バック",
+                    "", "", "", "", "",
+                    "", "",
+                    m.label,
+                    "", "", "",
+                    int(m.amount or 0),
+                ],
+            )
 
-        resp = HttpResponse(
-            content="\ufeff" + csv_text,  # UTF-8 BOM
-            content_type="text/csv; charset=utf-8",
-        )
-        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-        return resp
\ No newline at end of file
+        # キャスト区切り（空行）
+        yield _row(writer, [""] * len(CSV_COLUMNS))
@@ -0,0 +1,223 @@
+# billing/kds_broker.py
+"""
+KDS チケットのイベント配信（pub/sub）
+
+- チャネルは店舗×ルート単位: kds:<store_id>:<route>（route = kitchen / drinker / ready）
+- publish はトランザクションのコミット後に届く（購読側がすぐ行を読めるように）
+- InProcessBroker : 同一プロセス内だけで配信（開発・テスト用）
+- PostgresBroker  : LISTEN/NOTIFY でプロセス間に配信（本番）
+
+使う側は get_broker() を通す。settings.KDS_BROKER（dotted path）で差し替え可能。
+
+    with get_broker().subscribe(channel) as sub:     # 同期（long-poll）
+        event = sub.wait(timeout=25)
+    async with get_broker().subscribe_async(channel) as sub:   # 非同期（SSE）
+        event = await sub.wait(timeout=15)
+"""
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+READY_ROUTE = 'ready'
+
+
+def channel_for(store_id, route) -> str:
+    return f'kds:{store_id}:{route}'
+
+
+# ---------- 購読 ----------
+class Subscription:
+    """同期側の購読（long-poll 用）"""
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self._queue = queue.SimpleQueue()
+
+    def deliver(self, event):
+        self._queue.put(event)
+
+    def wait(self, timeout=None):
+        """次のイベント。timeout 秒来なければ None"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncSubscription(Subscription):
+    """非同期側の購読（SSE 用）。配信はどのスレッドからでもよい"""
+
+    def __init__(self, broker, channel):
+        super().__init__(broker, channel)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def deliver(self, event):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    async def wait(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+# ---------- ブローカー ----------
+class InProcessBroker:
+    """同一プロセス内の購読者へ配信する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: dict[str, set] = {}
+
+    def subscribe(self, channel) -> Subscription:
+        return self._register(Subscription(self, channel))
+
+    def subscribe_async(self, channel) -> AsyncSubscription:
+        return self._register(AsyncSubscription(self, channel))
+
+    def _register(self, sub):
+        with self._lock:
+            self._subs.setdefault(sub.channel, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.channel]
+
+    def _dispatch(self, channel, event):
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            sub.deliver(event)
+
+    def publish(self, channel, event: dict):
+        """コミット後に配信（トランザクション外なら即時）"""
+        transaction.on_commit(lambda: self._dispatch(channel, event))
+
+
+class PostgresBroker(InProcessBroker):
+    """
+    pg_notify で送り、プロセスごとに1本の LISTEN 接続で受けて同一プロセスの購読者へ配る。
+    NOTIFY はコミット時に配送されるため on_commit は不要。
+    """
+    PG_CHANNEL = 'billing_kds'
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def publish(self, channel, event: dict):
+        payload = json.dumps({'channel': channel, 'event': event})
+        with connection.cursor() as cur:
+            cur.execute('SELECT pg_notify(%s, %s)', [self.PG_CHANNEL, payload])
+
+    def _register(self, sub):
+        self._ensure_listener()
+        return super()._register(sub)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name='kds-listener', daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        from django.db import connections
+        while True:
+            wrapper = connections.create_connection('default')
+            try:
+                wrapper.ensure_connection()
+                raw = wrapper.connection
+                raw.autocommit = True
+                with raw.cursor() as cur:
+                    cur.execute(f'LISTEN {self.PG_CHANNEL}')
+                while True:
+                    if select.select([raw], [], [], 30) == ([], [], []):
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        note = raw.notifies.pop(0)
+                        try:
+                            msg = json.loads(note.payload)
+                            self._dispatch(msg['channel'], msg['event'])
+                        except (ValueError, KeyError):
+                            logger.warning('[kds] bad notify payload: %r', note.payload)
+            except Exception:
+                logger.exception('[kds] listener connection lost; reconnecting')
+            finally:
+                try:
+                    wrapper.close()
+                except Exception:
+                    pass
+            threading.Event().wait(1)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> InProcessBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                path = getattr(settings, 'KDS_BROKER', None)
+                if not path:
+                    path = (
+                        'billing.kds_broker.PostgresBroker'
+                        if connection.vendor == 'postgresql'
+                        else 'billing.kds_broker.InProcessBroker'
+                    )
+                _broker = import_string(path)()
+    return _broker
+
+
+def publish_ticket_event(ticket, kind: str, ids=None):
+    """
+    OrderTicket の変化を配信する。
+    kind: created / ack / ready / archived
+    - created / ack / ready はステーション（route）チャネルへ
+    - ready / archived はデシャップ（ready）チャネルへ
+    """
+    event = {'type': kind, 'store_id': ticket.store_id, 'route': ticket.route}
+    if ids is not None:
+        event['ids'] = list(ids)
+    elif ticket.pk:
+        event['ids'] = [ticket.pk]
+
+    broker = get_broker()
+    if kind in ('created', 'ack', 'ready'):
+        broker.publish(channel_for(ticket.store_id, ticket.route), event)
+    if kind in ('ready', 'archived'):
+        broker.publish(channel_for(ticket.store_id, READY_ROUTE), event)
@@ -1,15 +1,24 @@
 # billing/kds_views.py（丸ごと置き換え）
+import asyncio
+import json
 import time
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.db.models import Exists, OuterRef
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.exceptions import APIException
 from rest_framework.generics import ListAPIView
 from rest_framework import permissions
 from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from billing.permissions import RequireCap
+from accounts.caps import get_caps_for
 
+from .kds_broker import READY_ROUTE, channel_for, get_broker
 from .models import OrderTicket, Staff, Store, StaffShift
 from .serializers import (
     OrderTicketSerializer,
@@ -48,6 +57,49 @@ def _require_store_id(request):
     return sid
 
 
+# ---------- 新着チケット（IDカーソル） ----------
+LONG_POLL_TIMEOUT = 25
+
+
+def _ticket_qs():
+    return OrderTicket.objects.select_related('bill_item', 'bill_item__bill', 'bill_item__bill__table')
+
+
+def _station_tickets(sid, route, since_id):
+    """ステーション: NEW/ACK で since_id より新しいもの"""
+    qs = (_ticket_qs()
+          .filter(store_id=sid, route=route,
+                  state__in=[OrderTicket.STATE_NEW, OrderTicket.STATE_ACK],
+                  pk__gt=since_id)
+          .order_by('pk'))
+    return OrderTicketSerializer(qs, many=True).data
+
+
+def _ready_tickets(sid, since_id):
+    """デシャップ: READY 未アーカイブで since_id より新しいもの"""
+    qs = (_ticket_qs()
+          .filter(store_id=sid, state=OrderTicket.STATE_READY,
+                  archived_at__isnull=True, pk__gt=since_id)
+          .order_by('pk'))
+    return OrderTicketSerializer(qs, many=True).data
+
+
+def _wait_for_tickets(channel, fetch, timeout):
+    """
+    fetch() が空なら、channel に通知が来るたびに再取得する（最大 timeout 秒）。
+    取りこぼさないよう、最初の取得より先に購読しておく。
+    """
+    with get_broker().subscribe(channel) as sub:
+        data = fetch()
+        deadline = time.monotonic() + timeout
+        while not data:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or sub.wait(remaining) is None:
+                break
+            data = fetch()
+    return data
+
+
 # ---------- station: NEW/ACK 一覧 ----------
 class KDSTicketList(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -97,9 +149,11 @@ class KDSTicketReady(APIView):
 class KDSTicketLongPoll(APIView):
     """
     GET /api/billing/kds/longpoll-tickets?route=drinker&since_id=0
+    新着が無ければ broker の通知を待つ（DB はポーリングしない）
     """
     permission_classes = [IsAuthenticated, RequireCap]
     required_cap = 'station_view'
+    timeout = LONG_POLL_TIMEOUT
 
     def get(self, request):
         route = request.query_params.get('route')
@@ -115,19 +169,13 @@ class KDSTicketLongPoll(APIView):
         except ValueError:
             since_id = 0
 
-        deadline = time.time() + 25
-        while time.time() < deadline:
-            qs = (OrderTicket.objects
-                  .select_related('bill_item','bill_item__bill','bill_item__bill__table')
-                  .filter(store_id=sid, route=route,
-                          state__in=[OrderTicket.STATE_NEW, OrderTicket.STATE_ACK],
-                          pk__gt=since_id)
-                  .order_by('pk'))
-            if qs.exists():
-                data = OrderTicketSerializer(qs, many=True).data
-                cursor = max(x['id'] for x in data)
-                return Response({'tickets': data, 'cursor': cursor})
-            time.sleep(1)
+        data = _wait_for_tickets(
+            channel_for(sid, route),
+            lambda: _station_tickets(sid, route, since_id),
+            self.timeout,
+        )
+        if data:
+            return Response({'tickets': data, 'cursor': max(x['id'] for x in data)})
 
         return Response({'tickets': [], 'cursor': since_id, 'timeout': True})
 
@@ -176,8 +224,10 @@ class KDSTakeTicket(APIView):
 class KDSReadyLongPoll(APIView):
     """
     GET /api/billing/kds/longpoll-ready?since_id=0
+    新着が無ければ broker の通知を待つ（DB はポーリングしない）
     """
     permission_classes = [permissions.IsAuthenticated]
+    timeout = LONG_POLL_TIMEOUT
 
     def get(self, request):
         sid = _require_store_id(request)
@@ -189,24 +239,103 @@ class KDSReadyLongPoll(APIView):
         except ValueError:
             since_id = 0
 
-        deadline = time.time() + 25
-        while time.time() < deadline:
-            qs = (OrderTicket.objects
-                  .select_related('bill_item','bill_item__bill','bill_item__bill__table')
-                  .filter(store_id=sid,
-                          state=OrderTicket.STATE_READY,
-                          archived_at__isnull=True,
-                          pk__gt=since_id)
-                  .order_by('pk'))
-            if qs.exists():
-                data = OrderTicketSerializer(qs, many=True).data
-                cursor = max(x['id'] for x in data)
-                return Response({'ready': data, 'cursor': cursor})
-            time.sleep(1)
+        data = _wait_for_tickets(
+            channel_for(sid, READY_ROUTE),
+            lambda: _ready_tickets(sid, since_id),
+            self.timeout,
+        )
+        if data:
+            return Response({'ready': data, 'cursor': max(x['id'] for x in data)})
 
         return Response({'ready': [], 'cursor': since_id, 'timeout': True})
 
 
+# ---------- station / deshap: SSE ストリーム（ASGI） ----------
+SSE_HEARTBEAT = 15      # 秒。無通信時に keepalive コメントを送る間隔
+SSE_MAX_AGE = 300       # 秒。接続を閉じてクライアントに再接続させる（retry: で自動）
+
+
+def _sse(event, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, ensure_ascii=False)}\n\n"
+
+
+@sync_to_async
+def _stream_allowed(request, sid, cap) -> bool:
+    """DRF の認証クラス（Token）で認証し、必要なら cap を確認する"""
+    drf_request = Request(request, authenticators=[a() for a in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except APIException:
+        return False
+    if not user.is_authenticated:
+        return False
+    return cap is None or cap in get_caps_for(user, sid)
+
+
+async def _ticket_events(channel, fetch, key, since_id):
+    fetch = sync_to_async(fetch)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SSE_MAX_AGE
+    cursor = since_id
+
+    yield "retry: 3000\n\n"
+    async with get_broker().subscribe_async(channel) as sub:
+        need_fetch = True
+        while True:
+            if need_fetch:
+                data = await fetch(cursor)
+                if data:
+                    cursor = max(x['id'] for x in data)
+                    yield _sse('tickets', {key: data, 'cursor': cursor})
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            event = await sub.wait(min(SSE_HEARTBEAT, remaining))
+            if event is None:
+                need_fetch = False
+                yield ": keepalive\n\n"
+                continue
+            need_fetch = True
+            if event.get('type') != 'created':
+                yield _sse('update', event)
+
+
+async def kds_stream(request):
+    """
+    GET /api/billing/kds/stream/?route=kitchen|drinker|ready&since_id=0
+    long-poll の代わりに text/event-stream で push する（ASGI で配信すること）。
+      event: tickets  data: {"tickets"|"ready": [...], "cursor": N}   ← long-poll と同じ形・同じ since_id カーソル
+      event: update   data: {"type": "ack"|"ready"|"archived", "ids": [...], ...}
+    """
+    route = request.GET.get('route')
+    if route not in ALLOWED_ROUTES | {READY_ROUTE}:
+        return JsonResponse({'detail': 'route 必須: kitchen|drinker|ready'}, status=400)
+
+    sid = getattr(getattr(request, 'store', None), 'id', None)
+    if not sid:
+        return JsonResponse({'detail': 'store コンテキストが必要です'}, status=400)
+
+    cap = None if route == READY_ROUTE else 'station_view'
+    if not await _stream_allowed(request, sid, cap):
+        return JsonResponse({'detail': '権限がありません'}, status=403)
+
+    try:
+        since_id = int(request.GET.get('since_id', 0) or 0)
+    except ValueError:
+        since_id = 0
+
+    if route == READY_ROUTE:
+        events = _ticket_events(channel_for(sid, route), lambda c: _ready_tickets(sid, c), 'ready', since_id)
+    else:
+        events = _ticket_events(channel_for(sid, route), lambda c: _station_tickets(sid, route, c), 'tickets', since_id)
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # ---------- deshap: 今日の履歴 ----------
 class KDSTakenTodayList(APIView):
     """
@@ -0,0 +1,86 @@
+# billing/management/commands/check_garden_tally.py
+"""
+Garden 暫定ランクの日次集計（CastDailySummary の売上・同伴売上・本指名/同伴伝票数）が
+伝票からの生集計（calculate_garden_stats_bulk）と一致するかを検証するコマンド。
+ズレがあれば一覧を出して終了コード 1。--repair で期間内の日次集計を全再構築する。
+
+使用例:
+  python manage.py check_garden_tally
+  python manage.py check_garden_tally --store-slug garden --date 2026-01-15 --repair
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from billing.models import BillCastStay, BillItem, CastDailySummary, Store
+from billing.payroll.engines.stores.garden import calculate_garden_stats_bulk, garden_stats_from_tally
+from billing.services.cast_summary import rebuild_cast_daily_summaries
+from billing.views import get_default_payroll_period
+
+COMPARED = ('sales_total', 'dohan_sales_total', 'nom_count', 'dohan_count')
+
+
+class Command(BaseCommand):
+    help = 'Compare the Garden provisional-rank tally with a full recompute for the payroll period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-slug', type=str, default='garden', help='Store slug (default: garden)')
+        parser.add_argument('--date', type=str, help='Any day in the payroll period (YYYY-MM-DD, default: today)')
+        parser.add_argument('--repair', action='store_true', help='Rebuild the period when a mismatch is found')
+
+    def handle(self, *args, **options):
+        try:
+            ref = date.fromisoformat(options['date']) if options['date'] else localdate()
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        store = Store.objects.filter(slug=options['store_slug']).first()
+        if store is None:
+            raise CommandError('No store matched')
+
+        period_start, period_end = get_default_payroll_period(store, ref)
+        mismatches = self._compare(store, period_start, period_end)
+        for cast_id, tally, actual in mismatches:
+            diff = ', '.join(f'{k}: {tally[k]} != {actual[k]}' for k in COMPARED if tally[k] != actual[k])
+            self.stdout.write(f'cast={cast_id} {diff}')
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(
+                f'Garden tally OK: store={store.slug} period={period_start}..{period_end}'
+            ))
+            return
+        if not options['repair']:
+            raise CommandError(f'{len(mismatches)} cast(s) out of sync (run with --repair to rebuild)')
+
+        d = period_start
+        while d <= period_end:
+            rebuild_cast_daily_summaries(store.id, d)
+            d += timedelta(days=1)
+        remaining = self._compare(store, period_start, period_end)
+        if remaining:
+            raise CommandError(f'{len(remaining)} cast(s) still out of sync after rebuild')
+        self.stdout.write(self.style.SUCCESS(
+            f'Repaired Garden tally: store={store.slug} casts={len(mismatches)}'
+        ))
+
+    def _compare(self, store, period_start, period_end):
+        """[(cast_id, tally, actual)]（不一致のキャストだけ）"""
+        bills = {
+            'bill__table__store': store,
+            'bill__closed_at__date__range': (period_start, period_end),
+        }
+        cast_ids = (
+            set(BillItem.objects.filter(served_by_cast__isnull=False, **bills).values_list('served_by_cast_id', flat=True))
+            | set(BillCastStay.objects.filter(**bills).values_list('cast_id', flat=True))
+            | set(
+                CastDailySummary.objects.filter(store=store, work_date__range=(period_start, period_end))
+                .values_list('cast_id', flat=True)
+            )
+        )
+        tally = garden_stats_from_tally(store, cast_ids, period_start, period_end)
+        actual = calculate_garden_stats_bulk(store, cast_ids, period_start, period_end)
+        return [
+            (cast_id, tally[cast_id], actual[cast_id])
+            for cast_id in sorted(cast_ids)
+            if any(tally[cast_id][k] != actual[cast_id][k] for k in COMPARED)
+        ]
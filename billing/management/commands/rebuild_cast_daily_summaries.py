@@ -0,0 +1,57 @@
+# billing/management/commands/rebuild_cast_daily_summaries.py
+"""
+CastDailySummary を Bill / BillItem / CastShift から全再構築する修復用コマンド。
+通常は signals の差分更新で保守されるため、ズレの修復や過去分の作り直しにだけ使う。
+
+使用例:
+  python manage.py rebuild_cast_daily_summaries --date 2026-01-15
+  python manage.py rebuild_cast_daily_summaries --from 2026-01-01 --to 2026-01-31 --store-slug xxx
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from billing.models import Store
+from billing.services.cast_summary import rebuild_cast_daily_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CastDailySummary rows for store x day from closed bills and shifts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=str, help='Single day (YYYY-MM-DD)')
+        parser.add_argument('--from', dest='date_from', type=str, help='Start day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=str, help='End day (YYYY-MM-DD)')
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+
+    def handle(self, *args, **options):
+        try:
+            if options['date']:
+                d_from = d_to = date.fromisoformat(options['date'])
+            else:
+                d_from = date.fromisoformat(options['date_from']) if options['date_from'] else localdate()
+                d_to = date.fromisoformat(options['date_to']) if options['date_to'] else d_from
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+        if d_to < d_from:
+            raise CommandError('--to must be on or after --from')
+
+        stores = Store.objects.all()
+        if options['store_slug']:
+            stores = stores.filter(slug=options['store_slug'])
+        store_ids = list(stores.values_list('id', flat=True))
+        if not store_ids:
+            raise CommandError('No store matched')
+
+        days = 0
+        d = d_from
+        while d <= d_to:
+            for store_id in store_ids:
+                rebuild_cast_daily_summaries(store_id, d)
+            days += 1
+            d += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt CastDailySummary: stores={len(store_ids)} days={days}'
+        ))
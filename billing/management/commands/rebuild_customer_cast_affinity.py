@@ -0,0 +1,36 @@
+# billing/management/commands/rebuild_customer_cast_affinity.py
+"""
+CustomerCastAffinity（顧客×キャスト相性）を締め済み伝票の履歴から全再構築するコマンド。
+導入時のバックフィルと、ズレの修復に使う（通常は signals の差分更新で保守される）。
+
+使用例:
+  python manage.py rebuild_customer_cast_affinity
+  python manage.py rebuild_customer_cast_affinity --store-slug xxx
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Store
+from billing.services.affinity import rebuild_customer_cast_affinity
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CustomerCastAffinity rows from closed bills'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+
+    def handle(self, *args, **options):
+        stores = Store.objects.all()
+        if options['store_slug']:
+            stores = stores.filter(slug=options['store_slug'])
+        store_ids = list(stores.values_list('id', flat=True))
+        if not store_ids:
+            raise CommandError('No store matched')
+
+        rows = 0
+        for store_id in store_ids:
+            rows += rebuild_customer_cast_affinity(store_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt CustomerCastAffinity: stores={len(store_ids)} rows={rows}'
+        ))
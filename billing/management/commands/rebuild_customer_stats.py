@@ -0,0 +1,36 @@
+# billing/management/commands/rebuild_customer_stats.py
+"""
+CustomerStats（店舗×顧客の来店実績）を締め済み伝票の履歴から全再構築するコマンド。
+ズレの修復に使う（通常は signals の差分更新で保守される）。
+
+使用例:
+  python manage.py rebuild_customer_stats
+  python manage.py rebuild_customer_stats --store-slug xxx
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Store
+from billing.services.customer_stats import rebuild_customer_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild CustomerStats rows from closed bills'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+
+    def handle(self, *args, **options):
+        stores = Store.objects.all()
+        if options['store_slug']:
+            stores = stores.filter(slug=options['store_slug'])
+        store_ids = list(stores.values_list('id', flat=True))
+        if not store_ids:
+            raise CommandError('No store matched')
+
+        rows = 0
+        for store_id in store_ids:
+            rows += rebuild_customer_stats(store_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt CustomerStats: stores={len(store_ids)} rows={rows}'
+        ))
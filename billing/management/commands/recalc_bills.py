@@ -13,25 +13,103 @@ python manage.py recalc_bills --from 2025-01-01
 
 # 店舗 slug 指定
 python manage.py recalc_bills --store ginza
+
+# 書き込まずに金額が変わる伝票だけ確認
+python manage.py recalc_bills --dry-run --diff
+
+# 4プロセスで並列
+python manage.py recalc_bills --workers 4
 ```
 
 ・対象 Bill は closed_at が NULL でない (= クローズ済) もののみ。
 ・CastPayout を削除→再生成。
-・transaction.atomic() + chunked iteration でメモリ節約。
+・チャンク（--chunk-size 件）ごとに伝票グラフを一括取得してメモリ上で計算し、
+  1トランザクションで Bill は bulk_update（金額が変わった伝票だけ）、
+  CastPayout は bill_id__in の一括削除 + bulk_create で入れ替える。
+・bulk_update は signals を通らないので、金額が変わった伝票の日次P&L（stale）と
+  CustomerStats（total_spent）はここでまとめて反映する。
 """
 
 import itertools
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.utils import timezone
 
 from billing.models import Bill, CastPayout
-from billing.calculator import BillCalculator
+from billing.calculator import BatchBillCalculator
+from billing.services.customer_stats import apply_spent_deltas
+from billing.services.pl_snapshot import mark_business_dates_stale
+from billing.utils.parallel import map_chunks, parallel_workers
 
 CHUNK_SIZE = 200
 
+TOTAL_FIELDS = ("subtotal", "service_charge", "tax", "grand_total", "total")
+
+
+@dataclass
+class ChunkResult:
+    bills: int = 0
+    payouts: int = 0
+    changes: list = field(default_factory=list)   # [(bill_id, {field: (old, new)})]
+
+
+def recalc_chunk(bill_ids, dry_run=False) -> ChunkResult:
+    """伝票 id 1チャンク分を再計算し、1トランザクションで書き戻す（dry_run は計算と差分だけ）"""
+    bills = list(BatchBillCalculator.prefetch(Bill.objects.filter(id__in=bill_ids).order_by("id")))
+    results = BatchBillCalculator(bills).execute()
+
+    out = ChunkResult(bills=len(bills))
+    changed, payouts, spent, pl_dates = [], [], {}, {}
+    for bill in bills:
+        result = results[bill.id]
+        new = {
+            "subtotal": result.subtotal,
+            "service_charge": result.service_fee,
+            "tax": result.tax,
+            "grand_total": result.total,
+            "total": result.total if bill.settled_total is None else bill.settled_total,
+        }
+        diff = {f: (getattr(bill, f), v) for f, v in new.items() if getattr(bill, f) != v}
+        payouts.extend(result.cast_payouts)
+
+        # signals の代わり: 日次P&L（締め時刻前は前日の営業日）。CastPayout は金額が同じ伝票も
+        # 作り直す（人件費が変わりうる）ので、チャンク内の締め済み伝票すべての日付を無効化する
+        store_id = bill.table.store_id if bill.table_id else None
+        if store_id and bill.closed_at:
+            day = timezone.localdate(bill.closed_at)
+            pl_dates.setdefault(store_id, set()).update({day, day - timedelta(days=1)})
+
+        if not diff:
+            continue
+        out.changes.append((bill.id, diff))
+        old_grand_total = bill.grand_total or 0
+        for f, v in new.items():
+            setattr(bill, f, v)
+        changed.append(bill)
+
+        # 顧客の累計金額は金額が変わった伝票だけ
+        if store_id and bill.closed_at:
+            for bc in bill.billcustomer_set.all():
+                key = (store_id, bc.customer_id)
+                spent[key] = spent.get(key, 0) + (bill.grand_total or 0) - old_grand_total
+
+    out.payouts = len(payouts)
+    if dry_run:
+        return out
+
+    with transaction.atomic():
+        if changed:
+            Bill.objects.bulk_update(changed, TOTAL_FIELDS, batch_size=CHUNK_SIZE)
+        CastPayout.objects.filter(bill_id__in=[b.id for b in bills]).delete()
+        CastPayout.objects.bulk_create(payouts, batch_size=1000)
+        for store_id, dates in pl_dates.items():
+            mark_business_dates_stale(store_id, dates)
+        apply_spent_deltas(spent)
+    return out
+
 
 class Command(BaseCommand):
     help = "Recalculate existing Bills with new BillCalculator logic"
@@ -51,12 +129,38 @@ class Command(BaseCommand):
             dest="date_to",
             help="対象期間の終了 (YYYY-MM-DD)。省略時は now()",
         )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help=f"1トランザクションで処理する伝票数 (default: {CHUNK_SIZE})",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="並列プロセス数 (default: 1)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="計算だけ行い書き込まない",
+        )
+        parser.add_argument(
+            "--diff",
+            action="store_true",
+            help="金額が変わる伝票を一覧表示",
+        )
 
     # ------------------------------------------------------------------
     def handle(self, *args, **options):
         store_slug: str | None = options.get("store")
         date_from: str | None = options.get("date_from")
-        date_to: str | None = options.get("date_to") or timezone.now().date().isoformat()
+        date_to: str | None = options.get("date_to") or timezone.localdate().isoformat()
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
 
         qs = Bill.objects.filter(closed_at__isnull=False)
         if store_slug:
@@ -71,44 +175,37 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("No Bills matched the criteria."))
             return
 
-        self.stdout.write(f"Recalculating {total} Bills…")
+        dry_run = options["dry_run"]
+        chunks = list(_chunked(qs.order_by("id").values_list("id", flat=True), options["chunk_size"]))
+        workers = parallel_workers(options["workers"], len(chunks))
+        if workers < min(options["workers"], len(chunks)):
+            self.stdout.write(self.style.WARNING("SQLite does not support parallel writers; using 1 worker"))
+
+        self.stdout.write(f"Recalculating {total} Bills{' (dry run)' if dry_run else ''}…")
 
         processed = 0
-        for chunk in _chunked_queryset(qs.order_by("id"), CHUNK_SIZE):
-            with transaction.atomic():
-                for bill in chunk:
-                    result = BillCalculator(bill).execute()
-
-                    # Update Bill fields
-                    bill.subtotal = result.subtotal
-                    bill.service_charge = result.service_fee
-                    bill.tax = result.tax
-                    bill.grand_total = result.total
-                    bill.total = result.total if bill.settled_total is None else bill.settled_total
-                    bill.save(update_fields=[
-                        "subtotal",
-                        "service_charge",
-                        "tax",
-                        "grand_total",
-                        "total",
-                    ])
-
-                    # Refresh CastPayouts
-                    bill.payouts.all().delete()
-                    CastPayout.objects.bulk_create(result.cast_payouts)
-
-            processed += len(chunk)
+        changed = 0
+        for result in map_chunks(recalc_chunk, [(chunk, dry_run) for chunk in chunks], workers):
+            processed += result.bills
+            changed += len(result.changes)
+            if options["diff"]:
+                for bill_id, diff in result.changes:
+                    detail = ", ".join(f"{f} {old} → {new}" for f, (old, new) in diff.items())
+                    self.stdout.write(f"  Bill #{bill_id}: {detail}")
             self.stdout.write(f"  …{processed}/{total} done")
 
-        self.stdout.write(self.style.SUCCESS("Recalculation complete!"))
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f"Dry run: {changed} Bills would change."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Recalculation complete! ({changed} Bills changed)"))
 
 
 # ────────────────────────────────────────────────────────────────────
 # Helpers
 # ────────────────────────────────────────────────────────────────────
 
-def _chunked_queryset(queryset, size):
-    """Yield queryset in chunks without evaluating all at once."""
-    iterator = queryset.iterator(chunk_size=size)
-    for first in iterator:
-        yield list(itertools.chain([first], itertools.islice(iterator, size - 1)))
+def _chunked(iterable, size):
+    """Split ids into lists of `size` items."""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,62 @@
+# billing/management/commands/reconcile_open_bills.py
+"""
+OPEN 伝票の自動 SET / 延長（AUTO_SET_60 / AUTO_EXT_30）を全店舗まとめて同期するコマンド。
+顧客が座っているだけでも延長行が進むよう、スケジューラ（Procfile の clock 等）から定期実行する。
+
+使用例:
+  python manage.py reconcile_open_bills                 # 1回だけ
+  python manage.py reconcile_open_bills --every 5       # 5分ごとに実行し続ける（ワーカー）
+  python manage.py reconcile_open_bills --store-slug xxx
+"""
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from billing.models import Store
+from billing.services.customer_charge_reconcile import reconcile_open_bills
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Reconcile auto SET / extension charges for every open bill in one batched pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running and reconcile every N minutes')
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+
+    def handle(self, *args, **options):
+        store_ids = None
+        if options['store_slug']:
+            store_ids = list(Store.objects.filter(slug=options['store_slug']).values_list('id', flat=True))
+            if not store_ids:
+                raise CommandError(f"Store not found: {options['store_slug']}")
+
+        every = options['every']
+        if every is not None and every <= 0:
+            raise CommandError('--every must be positive')
+
+        while True:
+            started = time.monotonic()
+            try:
+                self._tick(store_ids)
+            except Exception:
+                if every is None:
+                    raise
+                # ワーカーは次の tick で再試行する
+                logger.exception('[reconcile_open_bills] tick failed')
+            if every is None:
+                return
+            close_old_connections()
+            time.sleep(max(0.0, every * 60 - (time.monotonic() - started)))
+
+    def _tick(self, store_ids):
+        tick = reconcile_open_bills(store_ids=store_ids)
+        self.stdout.write(
+            f'reconcile_open_bills bills={tick.bills} touched={tick.touched} '
+            f'created={tick.created} updated={tick.updated} deleted={tick.deleted} '
+            f'elapsed_ms={tick.elapsed_ms}'
+        )
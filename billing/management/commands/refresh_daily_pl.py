@@ -0,0 +1,73 @@
+# billing/management/commands/refresh_daily_pl.py
+"""
+DailyPLSnapshot を確定・作り直すコマンド。
+営業日の締め時刻の後に cron で実行すると、締まった前営業日の行を確定させる。
+（実行しなくても P&L 参照時に欠け・古い行は作り直されるが、初回参照が重くなる）
+
+使用例:
+  python manage.py refresh_daily_pl                                   # 全店舗の前営業日
+  python manage.py refresh_daily_pl --from 2026-01-01 --to 2026-12-31 # 期間を一括（古い行のみ）
+  python manage.py refresh_daily_pl --date 2026-01-15 --store-slug xxx --force
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from billing.models import DailyPLSnapshot, Store
+from billing.services.pl_snapshot import refresh_daily_pl
+from billing.utils.bizday import business_date_for
+
+
+class Command(BaseCommand):
+    help = 'Finalize / rebuild DailyPLSnapshot rows for closed business days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=str, help='Single business day (YYYY-MM-DD)')
+        parser.add_argument('--from', dest='date_from', type=str, help='Start business day (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=str, help='End business day (YYYY-MM-DD)')
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+        parser.add_argument('--force', action='store_true', help='Recompute even if the row is up to date')
+
+    def handle(self, *args, **options):
+        try:
+            d_from = d_to = None
+            if options['date']:
+                d_from = d_to = date.fromisoformat(options['date'])
+            elif options['date_from']:
+                d_from = date.fromisoformat(options['date_from'])
+                d_to = date.fromisoformat(options['date_to']) if options['date_to'] else d_from
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        stores = Store.objects.all()
+        if options['store_slug']:
+            stores = stores.filter(slug=options['store_slug'])
+
+        refreshed = skipped = 0
+        for store in stores:
+            today = business_date_for(timezone.now(), store_id=store.id)
+            start = d_from or today - timedelta(days=1)
+            # 営業中の当日以降は確定させない
+            end = min(d_to or start, today - timedelta(days=1))
+
+            fresh = set()
+            if not options['force']:
+                fresh = set(
+                    DailyPLSnapshot.objects
+                    .filter(store=store, business_date__range=(start, end), is_stale=False)
+                    .values_list('business_date', flat=True)
+                )
+
+            d = start
+            while d <= end:
+                if d in fresh:
+                    skipped += 1
+                else:
+                    refresh_daily_pl(d, store_id=store.id)
+                    refreshed += 1
+                d += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'DailyPLSnapshot refreshed={refreshed} skipped={skipped}'
+        ))
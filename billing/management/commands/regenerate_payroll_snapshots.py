@@ -8,14 +8,79 @@
   python manage.py regenerate_payroll_snapshots --bill-id 123          # 特定bill
   python manage.py regenerate_payroll_snapshots --after 2026-01-01    # 期間指定
   python manage.py regenerate_payroll_snapshots --only-closed --limit 20  # 制限付き
+  python manage.py regenerate_payroll_snapshots --force --workers 4    # 4プロセスで並列
+  python manage.py regenerate_payroll_snapshots --force --workers 4 --resume  # 中断したところから
+
+伝票は id 昇順のチャンク（--chunk-size 件）ごとに1トランザクションでコミットし、
+コミット済みの最後の id と失敗した伝票 id をチェックポイント（--checkpoint）に書く。
+--resume は失敗した伝票をやり直してから、最後の id の次から再開する。
+失敗が残ったまま終わった場合はチェックポイントを残し、失敗した id をサマリに出す。
+--workers N は id 範囲のチャンクをプロセスプールに配り、各ワーカーが自分の DB 接続で処理する。
+チャンクの処理は直列・並列で同じ関数（regenerate_chunk）なので結果は同一。
 """
 
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from billing.models import Bill
-from billing.services import generate_payroll_snapshot
-import hashlib
-import json
+from billing.payroll.computation import PayrollComputation, payroll_graph_prefetch
+from billing.utils.parallel import map_chunks, parallel_workers
+
+DEFAULT_CHECKPOINT = 'regenerate_payroll_snapshots.checkpoint.json'
+
+# チェックポイントに記録する対象条件（--resume 時に一致を確認する）
+FILTER_OPTIONS = ('bill_id', 'store_slug', 'after', 'before', 'only_closed', 'limit', 'force')
+
+
+@dataclass
+class ChunkResult:
+    last_id: int
+    regenerated: int = 0
+    skipped: int = 0
+    lines: list = field(default_factory=list)    # [(verbosity, style, message)] 伝票ごとのログ
+    errors: list = field(default_factory=list)   # [(bill_id, message)]
+
+
+def regenerate_chunk(bill_ids, force=False) -> ChunkResult:
+    """
+    伝票 id 1チャンク分の snapshot を再生成して1トランザクションでコミットする。
+    伝票グラフはチャンクまとめて読み込む（PayrollComputation(prefetched=True)）。
+    """
+    result = ChunkResult(last_id=max(bill_ids))
+    with transaction.atomic():
+        bills = payroll_graph_prefetch(Bill.objects.filter(id__in=bill_ids).order_by('id'))
+        for bill in bills:
+            store_slug = bill.table.store.slug if bill.table and bill.table.store else 'unknown'
+            if bill.payroll_snapshot and not force:
+                result.skipped += 1
+                result.lines.append((2, 'WARNING', f'Bill #{bill.id} - skipped (snapshot exists)'))
+                continue
+            old_hash = bill.payroll_snapshot.get('hash', '?')[:16] if bill.payroll_snapshot else None
+            try:
+                with transaction.atomic():
+                    snapshot = PayrollComputation(bill, prefetched=True).snapshot()
+                    # 再生成した snapshot は現在状態と一致するので dirty マーカーも外す
+                    bill.payroll_snapshot = snapshot
+                    bill.payroll_dirty_at = None
+                    bill.save(update_fields=['payroll_snapshot', 'payroll_dirty_at'])
+            except Exception as e:
+                result.errors.append((bill.id, str(e)))
+                continue
+            new_hash = snapshot.get('hash', '?')[:16]
+            change_mark = '✎' if old_hash != new_hash else '='
+            result.regenerated += 1
+            result.lines.append((
+                1, 'SUCCESS',
+                f'{change_mark} Bill #{bill.id} | store={store_slug} | {old_hash or "none"} → {new_hash}',
+            ))
+    return result
 
 
 class Command(BaseCommand):
@@ -67,8 +132,36 @@ class Command(BaseCommand):
             action='store_true',
             help='Stop on first error (default: skip and continue)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of worker processes (default: 1 = in-process)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Bills per transaction / checkpoint (default: 200)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default=DEFAULT_CHECKPOINT,
+            help=f'Checkpoint file (default: {DEFAULT_CHECKPOINT})',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue after the last committed id in the checkpoint',
+        )
 
     def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+
         # Build queryset
         qs = Bill.objects.all()
         
@@ -146,65 +239,68 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR('Aborted'))
                 return
         
-        # Process Bills
+        # 対象 id（--limit は closed_at 降順で切ってから id 昇順に並べ直す）
+        bill_ids = sorted(qs.values_list('id', flat=True))
+        filters = {k: options[k] for k in FILTER_OPTIONS}
+        checkpoint = options['checkpoint']
+        last_id, failed = 0, set()
+        if options['resume']:
+            last_id, failed = self._read_checkpoint(checkpoint, filters)
+            failed &= set(bill_ids)
+            bill_ids = [i for i in bill_ids if i > last_id or i in failed]
+            self.stdout.write(
+                f'Resuming after Bill #{last_id}: {len(bill_ids)} Bills left ({len(failed)} failed before)'
+            )
+
+        chunk_size = options['chunk_size']
+        chunks = [bill_ids[i:i + chunk_size] for i in range(0, len(bill_ids), chunk_size)]
+        workers = parallel_workers(options['workers'], len(chunks))
+        if workers < min(options['workers'], len(chunks)):
+            self.stdout.write(self.style.WARNING('SQLite does not support parallel writers; using 1 worker'))
+
+        self.stdout.write(f'\nProcessing {len(bill_ids)} Bills in {len(chunks)} chunks with {workers} worker(s)...\n')
+
         success_count = 0
         error_count = 0
         skipped_count = 0
-        
-        self.stdout.write('\nProcessing...\n')
-        
-        for i, bill in enumerate(qs, 1):
-            try:
-                # Get store info
-                store_slug = bill.table.store.slug if bill.table and bill.table.store else 'unknown'
-                
-                # Check if snapshot exists
-                if bill.payroll_snapshot and not options['force']:
-                    skipped_count += 1
-                    if options.get('verbosity', 1) >= 2:
-                        self.stdout.write(
-                            self.style.WARNING(f'  {i}/{count} Bill #{bill.id} - skipped (snapshot exists)')
-                        )
-                    continue
-                
-                # Get old hash
-                old_hash = None
-                if bill.payroll_snapshot:
-                    old_hash = bill.payroll_snapshot.get('hash', '?')[:16]
-                
-                # Regenerate snapshot
-                snapshot = generate_payroll_snapshot(bill)
-                
-                # Get new hash
-                new_hash = snapshot.get('hash', '?')[:16]
-                
-                # Check if changed
-                changed = old_hash != new_hash
-                
-                # Save
-                bill.payroll_snapshot = snapshot
-                bill.save(update_fields=['payroll_snapshot'])
-                
-                success_count += 1
-                
-                # Progress log
-                change_mark = '✎' if changed else '='
-                self.stdout.write(
-                    self.style.SUCCESS(
-                        f'  {i}/{count} {change_mark} Bill #{bill.id} | store={store_slug} | '
-                        f'{old_hash or "none"} → {new_hash}'
-                    )
-                )
-                
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(f'  {i}/{count} ✗ Bill #{bill.id} - ERROR: {str(e)}')
-                )
-                
-                if options['stop_on_error']:
-                    raise CommandError(f'Stopped on error at Bill #{bill.id}: {e}')
-        
+        done = 0
+        started = time.monotonic()
+
+        jobs = [(chunk, options['force']) for chunk in chunks]
+        for (chunk, _), result in zip(jobs, map_chunks(regenerate_chunk, jobs, workers)):
+            done += result.regenerated + result.skipped + len(result.errors)
+            success_count += result.regenerated
+            skipped_count += result.skipped
+            error_count += len(result.errors)
+
+            for verbosity, style, line in result.lines:
+                if options.get('verbosity', 1) >= verbosity:
+                    self.stdout.write(getattr(self.style, style)(f'  {line}'))
+            for bill_id, message in result.errors:
+                self.stdout.write(self.style.ERROR(f'  ✗ Bill #{bill_id} - ERROR: {message}'))
+
+            if result.errors and options['stop_on_error']:
+                # 失敗したチャンクはチェックポイントを進めない（--resume でやり直す）
+                bill_id, message = result.errors[0]
+                raise CommandError(f'Stopped on error at Bill #{bill_id}: {message}')
+
+            # やり直した伝票は成功なら外し、今回の失敗を加える（last_id は戻さない）
+            failed.difference_update(chunk)
+            failed.update(bill_id for bill_id, _ in result.errors)
+            last_id = max(last_id, result.last_id)
+            self._write_checkpoint(checkpoint, filters, last_id, failed)
+            elapsed = time.monotonic() - started
+            rate = done / elapsed if elapsed > 0 else 0.0
+            eta = timedelta(seconds=int((len(bill_ids) - done) / rate)) if rate else '?'
+            self.stdout.write(
+                f'  {done}/{len(bill_ids)} up to Bill #{result.last_id} | '
+                f'{rate:.1f} bills/sec | ETA {eta}'
+            )
+
+        # 全件成功したらチェックポイントは不要（失敗が残るなら --resume でやり直せるよう残す）
+        if not failed and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
         # Summary
         self.stdout.write('\n' + '=' * 60)
         self.stdout.write(
@@ -212,10 +308,32 @@ class Command(BaseCommand):
                 f'Done: {success_count} regenerated, {skipped_count} skipped, {error_count} failed'
             )
         )
-        
-        if error_count > 0:
+
+        if failed:
             self.stdout.write(
                 self.style.WARNING(
-                    '\nSome Bills failed to regenerate. Check errors above.'
+                    f'\nSome Bills failed to regenerate: {", ".join(f"#{i}" for i in sorted(failed))}\n'
+                    f'Checkpoint kept at {checkpoint}; rerun with --resume to retry them.'
                 )
             )
+
+    @staticmethod
+    def _read_checkpoint(path, filters) -> tuple[int, set]:
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'No checkpoint to resume from: {path}')
+        if data.get('filters') != filters:
+            raise CommandError('Checkpoint was written with different filters; rerun without --resume')
+        return int(data['last_id']), set(data.get('failed_ids', ()))
+
+    @staticmethod
+    def _write_checkpoint(path, filters, last_id, failed_ids=()):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'filters': filters, 'last_id': last_id, 'failed_ids': sorted(failed_ids),
+                'updated_at': timezone.now().isoformat(),
+            }, f)
+        os.replace(tmp, path)
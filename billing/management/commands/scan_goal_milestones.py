@@ -0,0 +1,79 @@
+# billing/management/commands/scan_goal_milestones.py
+"""
+キャスト目標（CastGoal）のマイルストーン（50/80/90/100%）到達を店舗単位でまとめて検出するコマンド。
+目標ごとに集計せず、店舗の有効な目標を指標ごとの集計1回で評価して milestones_hit を一括更新する。
+スケジューラ（Procfile の goals）から定期実行し、前回以降に変更があった店舗だけを見る。
+変更 = 伝票の締め（closed_at を遡らせた締めも含む）・締め後の明細/stay の編集（Bill.touched_at）・
+手入力売上（CastManualSubtotal）の更新。
+
+使用例:
+  python manage.py scan_goal_milestones                 # 1回だけ（全店舗）
+  python manage.py scan_goal_milestones --every 5       # 5分ごと。変更があった店舗だけ再評価
+  python manage.py scan_goal_milestones --store-slug xxx
+"""
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from billing.models import Store
+from billing.services.goal_progress import scan_store_milestones, touched_store_ids
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Detect new CastGoal milestones for whole stores in one batched evaluation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float, default=None,
+                            help='Keep running and scan every N minutes (only stores with closes or edits)')
+        parser.add_argument('--store-slug', type=str, help='Filter by store slug')
+
+    def handle(self, *args, **options):
+        store_ids = None
+        if options['store_slug']:
+            store_ids = list(Store.objects.filter(slug=options['store_slug']).values_list('id', flat=True))
+            if not store_ids:
+                raise CommandError(f"Store not found: {options['store_slug']}")
+
+        every = options['every']
+        if every is not None and every <= 0:
+            raise CommandError('--every must be positive')
+
+        since = None   # 初回は全店舗
+        while True:
+            started = time.monotonic()
+            tick_at = timezone.now()
+            try:
+                self._tick(self._targets(store_ids, since))
+                since = tick_at
+            except Exception:
+                if every is None:
+                    raise
+                # ワーカーは次の tick で（同じ since から）再試行する
+                logger.exception('[scan_goal_milestones] tick failed')
+            if every is None:
+                return
+            close_old_connections()
+            time.sleep(max(0.0, every * 60 - (time.monotonic() - started)))
+
+    def _targets(self, store_ids, since):
+        """前回 tick 以降に締め・締め後の編集があった店舗（since=None なら指定店舗すべて）"""
+        if since is None:
+            return store_ids
+        return touched_store_ids(since, store_ids)
+
+    def _tick(self, store_ids):
+        if store_ids == []:
+            return
+        results = scan_store_milestones(store_ids)
+        hits = [r for r in results if r.new_hits]
+        for r in hits:
+            logger.info(
+                '[scan_goal_milestones] goal=%s cast=%s metric=%s hits=%s percent=%s',
+                r.goal.id, r.goal.cast_id, r.goal.metric, r.new_hits, r.progress['percent'],
+            )
+        self.stdout.write(f'scan_goal_milestones goals={len(results)} new_hits={len(hits)}')
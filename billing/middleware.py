@@ -1,6 +1,7 @@
 from django.http import JsonResponse
 from django.core.exceptions import PermissionDenied
 from django.utils.deprecation import MiddlewareMixin
+from django.core.cache import cache
 from .models import Store
 
 # Store-Locked: ヘッダ一本化
@@ -21,6 +22,27 @@ SKIP_PATHS = (
     "/api/accounts/contact",    # お問い合わせ（認証・Store不要）
 )
 
+STORE_EXISTS_KEY = "billing:store:exists:{}"
+STORE_EXISTS_TTL = 60 * 10
+
+
+def get_store_ref(sid: int) -> Store:
+	"""
+	id だけ確定した Store（他の属性は参照時に遅延ロード = only("id") と同じ）。
+	存在確認は cache に載せ、2回目以降は DB を読まない。無ければ Store.DoesNotExist。
+	"""
+	key = STORE_EXISTS_KEY.format(sid)
+	if not cache.get(key):
+		Store.objects.only("id").get(pk=sid)
+		cache.set(key, True, STORE_EXISTS_TTL)
+	return Store.from_db("default", ["id"], [sid])
+
+
+def forget_store(sid: int) -> None:
+	"""店舗削除時に呼ぶ（signals から）"""
+	cache.delete(STORE_EXISTS_KEY.format(sid))
+
+
 class AttachStoreMiddleware(MiddlewareMixin):
 	def process_request(self, request):
 		path = (request.path or "").rstrip("/")
@@ -45,10 +67,10 @@ class AttachStoreMiddleware(MiddlewareMixin):
 		if q_sid and q_sid != raw_sid:
 			return JsonResponse({"detail": "store_id mismatch between header and query."}, status=409)
 
-		# Store 存在チェック
+		# Store 存在チェック（存在は cache に覚えておく）
 		try:
 			sid = int(raw_sid)
-			store = Store.objects.only("id").get(pk=sid)
+			store = get_store_ref(sid)
 		except Exception:
 			return JsonResponse({"detail": "Invalid X-Store-Id."}, status=400)
 
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-17 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0141_alter_storecategorypreference_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyPLSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_date', models.DateField(help_text='営業日')),
+                ('sales_total', models.IntegerField(default=0)),
+                ('sales_cash', models.IntegerField(default=0)),
+                ('sales_card', models.IntegerField(default=0)),
+                ('guest_count', models.IntegerField(default=0)),
+                ('commission', models.IntegerField(default=0)),
+                ('hourly_pay', models.IntegerField(default=0)),
+                ('labor_cost', models.IntegerField(default=0)),
+                ('operating_profit', models.IntegerField(default=0)),
+                ('data', models.JSONField(default=dict)),
+                ('is_stale', models.BooleanField(default=False, help_text='再計算が必要')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_pl_snapshots', to='billing.store')),
+            ],
+            options={
+                'verbose_name': '日次P&Lスナップショット',
+                'verbose_name_plural': '日次P&Lスナップショット',
+                'ordering': ['business_date'],
+                'indexes': [models.Index(fields=['store', 'business_date'], name='billing_dai_store_i_b8ca5f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('store', 'business_date'), name='uniq_dailypl_store_business_date')],
+            },
+        ),
+    ]
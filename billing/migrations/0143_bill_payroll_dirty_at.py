@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 17:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0142_dailyplsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='payroll_dirty_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='スナップショット保存後に給与へ影響する編集があった最初の時刻（再生成でクリア）', null=True, verbose_name='給与dirty検知日時'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.1 on 2026-10-17 17:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_snapshot_casts(apps, schema_editor):
+    """既存の payroll_snapshot から by_cast を展開（signals と同じ規則）"""
+    Bill = apps.get_model('billing', 'Bill')
+    Cast = apps.get_model('billing', 'Cast')
+    Row = apps.get_model('billing', 'BillPayrollSnapshotCast')
+
+    alive = set(Cast.objects.values_list('pk', flat=True))
+    batch = []
+    bills = Bill.objects.filter(payroll_snapshot__isnull=False).values_list('id', 'payroll_snapshot')
+    for bill_id, snap in bills.iterator(chunk_size=1000):
+        if not isinstance(snap, dict):
+            continue
+        rows = {}
+        for rec in snap.get('by_cast') or []:
+            cid = rec.get('cast_id') or None
+            row = rows.setdefault(cid, {'amount': 0, 'substitute_deduction': 0, 'nomination': 0, 'dohan': 0})
+            row['amount'] += int(rec.get('amount', 0) or 0)
+            row['substitute_deduction'] += int(rec.get('substitute_deduction', 0) or 0)
+            for b in rec.get('breakdown') or []:
+                if b.get('type') == 'nomination_pool':
+                    row['nomination'] += int(b.get('amount', 0) or 0)
+                elif b.get('type') == 'dohan_pool':
+                    row['dohan'] += int(b.get('amount', 0) or 0)
+        for cid, vals in rows.items():
+            batch.append(Row(bill_id=bill_id, cast_id=cid if cid in alive else None, **vals))
+        if len(batch) >= 1000:
+            Row.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Row.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0143_bill_payroll_dirty_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillPayrollSnapshotCast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0, help_text='by_cast[].amount（歩合合計）')),
+                ('substitute_deduction', models.IntegerField(default=0, help_text='by_cast[].substitute_deduction')),
+                ('nomination', models.IntegerField(default=0, help_text='breakdown の nomination_pool 合計')),
+                ('dohan', models.IntegerField(default=0, help_text='breakdown の dohan_pool 合計')),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_casts', to='billing.bill')),
+                ('cast', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshot_rows', to='billing.cast')),
+            ],
+            options={
+                'verbose_name': '給与スナップショット（キャスト別）',
+                'verbose_name_plural': '給与スナップショット（キャスト別）',
+                'indexes': [models.Index(fields=['cast', 'bill'], name='billing_bil_cast_id_f472b1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bill', 'cast'), name='uniq_snapshotcast_bill_cast')],
+            },
+        ),
+        migrations.RunPython(backfill_snapshot_casts, migrations.RunPython.noop),
+    ]
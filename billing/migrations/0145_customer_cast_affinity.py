@@ -0,0 +1,67 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0144_billpayrollsnapshotcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerCastAffinity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spent_total', models.PositiveIntegerField(default=0, help_text='このキャストの明細売上（price × qty）')),
+                ('item_count', models.PositiveIntegerField(default=0, help_text='明細数')),
+                ('bill_count', models.PositiveIntegerField(default=0, help_text='伝票数')),
+                ('last_served_at', models.DateTimeField(blank=True, help_text='最後の伝票の opened_at', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('cast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customer_affinities', to='billing.cast')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cast_affinities', to='billing.customer')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customer_cast_affinities', to='billing.store')),
+            ],
+            options={
+                'verbose_name': '顧客×キャスト相性',
+                'verbose_name_plural': '顧客×キャスト相性',
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerCastAffinityDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('spent', models.PositiveIntegerField(default=0)),
+                ('item_count', models.PositiveIntegerField(default=0)),
+                ('bill_count', models.PositiveIntegerField(default=0)),
+                ('affinity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='days', to='billing.customercastaffinity')),
+            ],
+            options={
+                'verbose_name': '顧客×キャスト相性（日別）',
+                'verbose_name_plural': '顧客×キャスト相性（日別）',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customercastaffinity',
+            index=models.Index(fields=['store', 'cast', '-spent_total'], name='billing_cus_store_i_4c8075_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customercastaffinity',
+            index=models.Index(fields=['store', 'cast', '-last_served_at'], name='billing_cus_store_i_d65a60_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customercastaffinity',
+            index=models.Index(fields=['store', 'cast', '-bill_count'], name='billing_cus_store_i_ab27d2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='customercastaffinity',
+            constraint=models.UniqueConstraint(fields=('store', 'customer', 'cast'), name='uniq_affinity_store_customer_cast'),
+        ),
+        migrations.AddConstraint(
+            model_name='customercastaffinityday',
+            constraint=models.UniqueConstraint(fields=('affinity', 'date'), name='uniq_affinityday_affinity_date'),
+        ),
+    ]
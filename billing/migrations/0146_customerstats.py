@@ -0,0 +1,65 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def backfill_customer_stats(apps, schema_editor):
+    """締め済み伝票の BillCustomer から店舗×顧客で集計（services.customer_stats と同じ規則）"""
+    BillCustomer = apps.get_model('billing', 'BillCustomer')
+    CustomerStats = apps.get_model('billing', 'CustomerStats')
+
+    rows = (
+        BillCustomer.objects.filter(bill__closed_at__isnull=False, bill__table__isnull=False)
+        .values('bill__table__store_id', 'customer_id')
+        .annotate(
+            visits=Count('id'),
+            spent=Sum('bill__grand_total'),
+            first=Min('bill__opened_at'),
+            last=Max('bill__closed_at'),
+        )
+        .order_by()
+    )
+    batch = []
+    for r in rows.iterator(chunk_size=2000):
+        batch.append(CustomerStats(
+            store_id=r['bill__table__store_id'], customer_id=r['customer_id'],
+            visit_count=r['visits'], total_spent=r['spent'] or 0,
+            first_visit_at=r['first'], last_visit_at=r['last'],
+        ))
+        if len(batch) >= 1000:
+            CustomerStats.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        CustomerStats.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0145_customer_cast_affinity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visit_count', models.PositiveIntegerField(default=0, help_text='来店数（締め済み伝票数）')),
+                ('total_spent', models.PositiveIntegerField(default=0, help_text='伝票 grand_total の合計')),
+                ('first_visit_at', models.DateTimeField(blank=True, help_text='最初の伝票の opened_at', null=True)),
+                ('last_visit_at', models.DateTimeField(blank=True, help_text='最後の伝票の closed_at', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='billing.customer')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='customer_stats', to='billing.store')),
+            ],
+            options={
+                'verbose_name': '顧客来店実績',
+                'verbose_name_plural': '顧客来店実績',
+                'indexes': [models.Index(fields=['store', '-total_spent'], name='billing_cus_store_i_94efcd_idx'), models.Index(fields=['store', '-last_visit_at'], name='billing_cus_store_i_7a6dae_idx')],
+                'constraints': [models.UniqueConstraint(fields=('store', 'customer'), name='uniq_customerstats_store_customer')],
+            },
+        ),
+        migrations.RunPython(backfill_customer_stats, migrations.RunPython.noop),
+    ]
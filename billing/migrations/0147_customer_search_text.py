@@ -0,0 +1,64 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:19
+
+from django.db import migrations, models
+
+from billing.utils.search_text import customer_search_text, phone_digits
+
+# pg_trgm の GIN インデックス（LIKE '%..%' と類似度 % 演算子の両方に効く）。SQLite では作らない
+TRGM_INDEXES = (
+    ('billing_customer_search_trgm', 'search_text'),
+    ('billing_customer_phone_trgm', 'phone_digits'),
+)
+
+
+def backfill_search_fields(apps, schema_editor):
+    Customer = apps.get_model('billing', 'Customer')
+    batch = []
+    for c in Customer.objects.only('full_name', 'alias', 'bottle_shelf', 'phone').iterator(chunk_size=2000):
+        c.search_text = customer_search_text(c.full_name, c.alias, c.bottle_shelf)
+        c.phone_digits = phone_digits(c.phone)
+        batch.append(c)
+        if len(batch) >= 2000:
+            Customer.objects.bulk_update(batch, ['search_text', 'phone_digits'])
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, ['search_text', 'phone_digits'])
+
+
+def create_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRGM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON billing_customer USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trgm_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in TRGM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0146_customerstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_digits',
+            field=models.CharField(blank=True, default='', editable=False, help_text='電話番号の数字だけ', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, help_text='氏名|あだ名|棚番号 を正規化（かな・半角全角・大小文字を畳む）'),
+        ),
+        migrations.RunPython(backfill_search_fields, migrations.RunPython.noop),
+        migrations.RunPython(create_trgm_indexes, drop_trgm_indexes),
+    ]
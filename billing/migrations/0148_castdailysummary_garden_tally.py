@@ -0,0 +1,71 @@
+# Generated by Django 5.2.1 on 2026-10-17 18:25
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_garden_tally(apps, schema_editor):
+    """締め済み伝票から sales_dohan / nom_bills / dohan_bills を埋める（work_date = closed_at の現地日付）"""
+    BillItem = apps.get_model('billing', 'BillItem')
+    BillCastStay = apps.get_model('billing', 'BillCastStay')
+    CastDailySummary = apps.get_model('billing', 'CastDailySummary')
+
+    closed = Q(bill__closed_at__isnull=False, bill__table__isnull=False)
+    tally = defaultdict(lambda: {'sales_dohan': 0, 'nom_bills': 0, 'dohan_bills': 0})
+
+    cast_dohan = Exists(BillCastStay.objects.filter(
+        bill_id=OuterRef('bill_id'), cast_id=OuterRef('served_by_cast_id'), stay_type='dohan',
+    ))
+    for r in (
+        BillItem.objects.filter(closed, cast_dohan, served_by_cast__isnull=False)
+        .annotate(day=TruncDate('bill__closed_at'))
+        .values('bill__table__store_id', 'served_by_cast_id', 'day')
+        .annotate(total=Sum(F('price') * F('qty'), output_field=IntegerField()))
+        .order_by()
+    ):
+        key = (r['bill__table__store_id'], r['served_by_cast_id'], r['day'])
+        tally[key]['sales_dohan'] = int(r['total'] or 0)
+
+    for r in (
+        BillCastStay.objects.filter(closed, stay_type__in=('nom', 'dohan'))
+        .annotate(day=TruncDate('bill__closed_at'))
+        .values('bill__table__store_id', 'cast_id', 'day', 'stay_type')
+        .annotate(bills=Count('bill_id', distinct=True))
+        .order_by()
+    ):
+        key = (r['bill__table__store_id'], r['cast_id'], r['day'])
+        tally[key][f"{r['stay_type']}_bills"] = r['bills']
+
+    for (store_id, cast_id, day), values in tally.items():
+        CastDailySummary.objects.update_or_create(
+            store_id=store_id, cast_id=cast_id, work_date=day, defaults=values,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0147_customer_search_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='castdailysummary',
+            name='dohan_bills',
+            field=models.PositiveIntegerField(default=0, help_text='同伴した伝票数'),
+        ),
+        migrations.AddField(
+            model_name='castdailysummary',
+            name='nom_bills',
+            field=models.PositiveIntegerField(default=0, help_text='本指名が付いた伝票数'),
+        ),
+        migrations.AddField(
+            model_name='castdailysummary',
+            name='sales_dohan',
+            field=models.PositiveIntegerField(default=0, help_text='同伴した伝票での自分の売上'),
+        ),
+        migrations.RunPython(backfill_garden_tally, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0148_castdailysummary_garden_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='touched_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='締め・締め日時の変更・締め後の明細/stay 変更の最終時刻（目標マイルストーンの差分スキャン用）', null=True, verbose_name='締め後の更新日時'),
+        ),
+    ]
@@ -14,6 +14,7 @@ from django.db.models.signals import post_save
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator
 from django.db.models import Sum, Q, F, IntegerField, ExpressionWrapper
+from billing.utils.search_text import customer_search_text, phone_digits as digits_only
 
 
 User = get_user_model()
@@ -622,13 +623,34 @@ class Customer(models.Model):
     last_cast  = models.ForeignKey('Cast', null=True, blank=True,
                                    on_delete=models.SET_NULL)
 
+    # 検索用の正規化カラム（save で自動更新。Postgres では pg_trgm の GIN インデックス付き）
+    search_text  = models.TextField(blank=True, default='', editable=False,
+                                    help_text='氏名|あだ名|棚番号 を正規化（かな・半角全角・大小文字を畳む）')
+    phone_digits = models.CharField(max_length=30, blank=True, default='', editable=False,
+                                    help_text='電話番号の数字だけ')
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    SEARCH_SOURCE_FIELDS = ('full_name', 'alias', 'bottle_shelf', 'phone')
+
     @property
     def display_name(self):
         return self.alias or self.full_name or f'Guest-{self.id:06d}'
 
+    def refresh_search_fields(self):
+        self.search_text = customer_search_text(self.full_name, self.alias, self.bottle_shelf)
+        self.phone_digits = digits_only(self.phone)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.refresh_search_fields()
+        elif set(update_fields) & set(self.SEARCH_SOURCE_FIELDS):
+            self.refresh_search_fields()
+            kwargs['update_fields'] = {*update_fields, 'search_text', 'phone_digits'}
+        super().save(*args, **kwargs)
+
 
 class CustomerLog(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
@@ -639,6 +661,36 @@ class CustomerLog(models.Model):
     at       = models.DateTimeField(auto_now_add=True)
 
 
+class CustomerStats(models.Model):
+    """
+    顧客の来店実績（1店舗 x 1顧客）
+    締め済み伝票（BillCustomer）から集計し、クローズ・締め後の編集で差分更新される（services/customer_stats.py）。
+    """
+    store    = models.ForeignKey('billing.Store', on_delete=models.CASCADE, related_name='customer_stats')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='stats')
+
+    visit_count    = models.PositiveIntegerField(default=0, help_text='来店数（締め済み伝票数）')
+    total_spent    = models.PositiveIntegerField(default=0, help_text='伝票 grand_total の合計')
+    first_visit_at = models.DateTimeField(null=True, blank=True, help_text='最初の伝票の opened_at')
+    last_visit_at  = models.DateTimeField(null=True, blank=True, help_text='最後の伝票の closed_at')
+    updated_at     = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'customer'], name='uniq_customerstats_store_customer'),
+        ]
+        indexes = [
+            models.Index(fields=['store', '-total_spent']),
+            models.Index(fields=['store', '-last_visit_at']),
+        ]
+        verbose_name = '顧客来店実績'
+        verbose_name_plural = verbose_name
+
+    @property
+    def avg_spend(self) -> int:
+        return self.total_spent // self.visit_count if self.visit_count else 0
+
+
 
 
 
@@ -716,6 +768,16 @@ class Bill(models.Model):
         verbose_name='給与スナップショット',
         help_text='クローズ時点の給与内訳を保存（不変）'
     )
+    payroll_dirty_at = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        verbose_name='給与dirty検知日時',
+        help_text='スナップショット保存後に給与へ影響する編集があった最初の時刻（再生成でクリア）'
+    )
+    touched_at = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        verbose_name='締め後の更新日時',
+        help_text='締め・締め日時の変更・締め後の明細/stay 変更の最終時刻（目標マイルストーンの差分スキャン用）'
+    )
 
     @property
     def manual_discount_total(self) -> int:
@@ -808,11 +870,13 @@ class Bill(models.Model):
         if settled_total is None and self.paid_total:
             settled_total = int(self.paid_total)
 
-        from billing.services.backrate import resolve_back_rate
+        from billing.services.backrate import get_back_rate_resolver
 
         with transaction.atomic():
             # 1) back_rate を bill 状態に依存させずに確定させる
+            #    （店舗単位のリゾルバで解決し、明細ごとの CastCategoryRate クエリを避ける）
             items = list(self.items.select_related('item_master__category','served_by_cast','item_master__store','bill__table__store'))
+            resolvers = {}
             for item in items:
                 cat = item.item_master.category if item.item_master else None
                 cast = item.served_by_cast
@@ -827,7 +891,10 @@ class Bill(models.Model):
                     store = getattr(self, 'store', None)
 
                 if store:
-                    item.back_rate = resolve_back_rate(store=store, category=cat, cast=cast, stay_type=stay)
+                    resolver = resolvers.get(store.id)
+                    if resolver is None:
+                        resolver = resolvers[store.id] = get_back_rate_resolver(store)
+                    item.back_rate = resolver.resolve(category=cat, cast=cast, stay_type=stay)
                 else:
                     item.back_rate = item.back_rate
 
@@ -864,19 +931,7 @@ class Bill(models.Model):
             # ④ 一括退席
             self.stays.filter(left_at__isnull=True).update(left_at=self.closed_at)
 
-            # ⑤ cast_id → 売上合計を集計
-            sales_map = defaultdict(int)
-            champ_sales = defaultdict(int)
-            for it in self.items.select_related('served_by_cast', 'item_master__category'):
-                if not it.served_by_cast:
-                    continue
-                sales_map[it.served_by_cast_id] += it.subtotal
-                cat_code = (getattr(getattr(it, 'item_master', None), 'category', None) or None)
-                cat_code = (getattr(cat_code, 'code', '') or '').lower()
-                if cat_code in ('champagne', 'original-champagne'):
-                    champ_sales[it.served_by_cast_id] += it.subtotal
-
-            work_date = self.closed_at.date()
+            # ⑤ 時間別サマリ用の集計は ① で読んだ items を1パスで使い回す（再クエリしない）
 
             # テーブルが無い伝票でも落ちないようにフォールバック
             store_id = None
@@ -892,99 +947,84 @@ class Bill(models.Model):
             if not store_id:
                 logger.warning(f"[Bill.close] could not determine store_id for bill_id={self.id}, skipping CastDailySummary")
             else:
-                # ⑥ CastDailySummary を upsert（staysから直接stay_typeを取得）
+                # ⑥ CastDailySummary は closed_at の保存を受けて signals 側で差分加算される
                 stay_type_map = {}
                 for s in self.stays.all():
                     stay_type_map[s.cast_id] = s.stay_type or 'free'
 
-                for cid, amt in sales_map.items():
-                    stay_type = stay_type_map.get(cid, 'free')
-                    col = {
-                        'nom': 'sales_nom', 'in': 'sales_in', 'free': 'sales_free',
-                    }.get(stay_type, 'sales_free')
-
-                    rec, _ = CastDailySummary.objects.get_or_create(
-                        store_id=store_id, cast_id=cid, work_date=work_date,
-                        defaults={}
-                    )
-                    setattr(rec, col, (getattr(rec, col) or 0) + amt)
-                    champ_add = champ_sales.get(cid, 0)
-                    update_fields = [col]
-                    if champ_add:
-                        rec.sales_champ = (rec.sales_champ or 0) + champ_add
-                        update_fields.append('sales_champ')
-                    rec.save(update_fields=update_fields)
-
                 # ⑦ 時間別サマリを更新（リアルタイム集計）
-                self._update_hourly_summary(store_id, stay_type_map, sales_map)
+                self._update_hourly_summary(store_id, stay_type_map, items)
+
+    def _update_hourly_summary(self, store_id: int, stay_type_map: dict, items):
+        """
+        時間別サマリ（HourlySalesSummary + HourlyCastSales）を更新
+        items（item_master__category 付きで読み込み済み）を1パスで集計し、
+        それぞれ1文の INSERT ... ON CONFLICT DO UPDATE で加算する（同時クローズでも取りこぼさない）。
+        """
+        from billing.services.upsert import upsert_add
 
-    def _update_hourly_summary(self, store_id: int, stay_type_map: dict, sales_map: dict):
-        """時間別サマリ（HourlySalesSummary + HourlyCastSales）を更新"""
-        # HourlySalesSummary, HourlyCastSales, ItemCategory は同一ファイル内なので直接参照可能
-        
         if not self.closed_at:
             return
         
         dt = timezone.localtime(self.closed_at)
-        date = dt.date()
-        hour = dt.hour
-        
-        # HourlySalesSummary を取得または作成
-        summary, _ = HourlySalesSummary.objects.get_or_create(
-            store_id=store_id,
-            date=date,
-            hour=hour,
-            defaults={}
-        )
         
-        # 全体集計を加算
-        summary.sales_total += self.grand_total or 0
-        summary.bill_count += 1
-        summary.customer_count += self.customers.count()
-        
-        # カテゴリ別売上を集計
+        # カテゴリ別売上・キャスト別売上／シャンパン売上を1パスで集計
         category_sales = defaultdict(int)
-        for item in self.items.select_related('item_master__category'):
-            if item.item_master and item.item_master.category:
-                cat_code = item.item_master.category.code
+        cast_sales = defaultdict(int)
+        cast_champ = defaultdict(int)
+        for item in items:
+            cat = item.item_master.category if item.item_master else None
+            cat_code = cat.code if cat else None
+            if cat_code:
                 category_sales[cat_code] += item.subtotal
+            if item.served_by_cast_id:
+                cast_sales[item.served_by_cast_id] += item.subtotal
+                if cat_code in ('champagne', 'original-champagne'):
+                    cast_champ[item.served_by_cast_id] += item.subtotal
+
+        summary_fields = (
+            'sales_total', 'bill_count', 'customer_count',
+            'sales_set', 'sales_drink', 'sales_food', 'sales_champagne',
+        )
+        [summary_id] = upsert_add(
+            HourlySalesSummary,
+            [{
+                'store_id': store_id,
+                'date': dt.date(),
+                'hour': dt.hour,
+                'sales_total': self.grand_total or 0,
+                'bill_count': 1,
+                'customer_count': self.customers.count(),
+                'sales_set': category_sales.get('set', 0),
+                'sales_drink': category_sales.get('drink', 0),
+                'sales_food': category_sales.get('food', 0),
+                'sales_champagne': category_sales.get('champagne', 0) + category_sales.get('original-champagne', 0),
+            }],
+            unique_fields=('store', 'date', 'hour'),
+            add_fields=summary_fields,
+            returning='id',
+        )
         
-        summary.sales_set += category_sales.get('set', 0)
-        summary.sales_drink += category_sales.get('drink', 0)
-        summary.sales_food += category_sales.get('food', 0)
-        summary.sales_champagne += category_sales.get('champagne', 0) + category_sales.get('original-champagne', 0)
-        summary.save()
-        
-        # キャスト別内訳を更新
-        for cast_id, total_sales in sales_map.items():
-            cast_sales, _ = HourlyCastSales.objects.get_or_create(
-                hourly_summary=summary,
-                cast_id=cast_id,
-                defaults={}
-            )
-            
-            cast_sales.sales_total += total_sales
-            cast_sales.bill_count += 1
-            
-            # stay_type に応じて分類
-            stay_type = stay_type_map.get(cast_id, 'free')
-            if stay_type == 'nom':
-                cast_sales.sales_nom += total_sales
-            elif stay_type == 'in':
-                cast_sales.sales_in += total_sales
-            else:
-                cast_sales.sales_free += total_sales
-            
-            # シャンパン売上（このキャスト担当分）
-            champ_sales = sum(
-                item.subtotal for item in self.items.select_related('item_master__category')
-                if item.served_by_cast_id == cast_id
-                and item.item_master
-                and item.item_master.category
-                and item.item_master.category.code in ('champagne', 'original-champagne')
-            )
-            cast_sales.sales_champagne += champ_sales
-            cast_sales.save()
+        # キャスト別内訳（stay_type に応じて分類）
+        lanes = {'nom': 'sales_nom', 'in': 'sales_in'}
+        rows = []
+        for cast_id, total_sales in cast_sales.items():
+            row = {
+                'hourly_summary_id': summary_id,
+                'cast_id': cast_id,
+                'sales_total': total_sales,
+                'bill_count': 1,
+                'sales_nom': 0, 'sales_in': 0, 'sales_free': 0,
+                'sales_champagne': cast_champ.get(cast_id, 0),
+            }
+            row[lanes.get(stay_type_map.get(cast_id, 'free'), 'sales_free')] = total_sales
+            rows.append(row)
+        upsert_add(
+            HourlyCastSales,
+            rows,
+            unique_fields=('hourly_summary', 'cast'),
+            add_fields=('sales_total', 'bill_count', 'sales_nom', 'sales_in', 'sales_free', 'sales_champagne'),
+        )
 
     # 席別の実効サービス率（% or 小数両対応）を返すヘルパ
     def _effective_service_rate(self) -> Decimal:
@@ -1117,13 +1157,21 @@ class BillItem(models.Model):
         
         計算: store を A/B/C ルートで解決 → resolve_back_rate を呼ぶ
         """
+        return self.resolve_effective_back_rate()
+
+    def resolve_effective_back_rate(self, resolvers: dict | None = None) -> Decimal:
+        """
+        effective_back_rate の本体。
+        resolvers: {store_id: BackRateResolver}。一覧のシリアライズなど明細をまとめて解決するときに
+        呼び出し側で1つ持ち回すと、リゾルバ（キャッシュのバージョン確認）の取得が店舗ごとに1回で済む。
+        """
         try:
             # CLOSED済みなら DB の back_rate を確定値として返す
             if self.bill and self.bill.closed_at is not None:
                 return self.back_rate
             
-            # OPEN中なら都度計算
-            from billing.services.backrate import resolve_back_rate
+            # OPEN中なら都度計算（店舗単位のリゾルバ経由）
+            from billing.services.backrate import get_back_rate_resolver
             
             bill = self.bill
             im = self.item_master
@@ -1143,7 +1191,12 @@ class BillItem(models.Model):
                 store = getattr(bill, 'store', None)
             
             if store:
-                return resolve_back_rate(store=store, category=cat, cast=cast, stay_type=stay)
+                if resolvers is None:
+                    resolvers = {}
+                resolver = resolvers.get(store.id)
+                if resolver is None:
+                    resolver = resolvers[store.id] = get_back_rate_resolver(store)
+                return resolver.resolve(category=cat, cast=cast, stay_type=stay)
             else:
                 # store が取得できなかった場合は DB の back_rate を返す（フォールバック）
                 import logging
@@ -1350,6 +1403,33 @@ class CastPayout(models.Model):
     def __str__(self): return f'{self.cast}: ¥{self.amount}'
 
 
+class BillPayrollSnapshotCast(models.Model):
+    """
+    Bill.payroll_snapshot の by_cast を正規化した行（1伝票 × 1キャスト）。
+    スナップショット保存時に signals で作り直す。期間の歩合・立替控除はこの表の SUM で出す。
+    """
+    bill = models.ForeignKey(Bill, on_delete=models.CASCADE, related_name='snapshot_casts')
+    cast = models.ForeignKey(Cast, null=True, blank=True, on_delete=models.SET_NULL,
+                             related_name='snapshot_rows')
+    amount = models.IntegerField(default=0, help_text='by_cast[].amount（歩合合計）')
+    substitute_deduction = models.IntegerField(default=0, help_text='by_cast[].substitute_deduction')
+    nomination = models.IntegerField(default=0, help_text='breakdown の nomination_pool 合計')
+    dohan = models.IntegerField(default=0, help_text='breakdown の dohan_pool 合計')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bill', 'cast'], name='uniq_snapshotcast_bill_cast'),
+        ]
+        indexes = [
+            models.Index(fields=['cast', 'bill']),
+        ]
+        verbose_name = '給与スナップショット（キャスト別）'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f'Bill#{self.bill_id} cast={self.cast_id}: ¥{self.amount:,}'
+
+
 
 class CastCategoryRate(models.Model):
     cast      = models.ForeignKey('billing.Cast', on_delete=models.CASCADE,
@@ -1465,6 +1545,10 @@ class CastDailySummary(models.Model):
     sales_in    = models.PositiveIntegerField(default=0)
     sales_nom   = models.PositiveIntegerField(default=0)
     sales_champ = models.PositiveIntegerField(default=0)
+    # Garden 暫定ランク用（期間分を合算すれば calculate_garden_stats と同じ値になる）
+    sales_dohan = models.PositiveIntegerField(default=0, help_text='同伴した伝票での自分の売上')
+    nom_bills   = models.PositiveIntegerField(default=0, help_text='本指名が付いた伝票数')
+    dohan_bills = models.PositiveIntegerField(default=0, help_text='同伴した伝票数')
     business_date = models.DateField(null=True, blank=True, db_index=True)
 
     class Meta:
@@ -1720,24 +1804,30 @@ class OrderTicket(models.Model):
         ordering = ['created_at']
 
     def mark_ack(self):
+        from billing.kds_broker import publish_ticket_event
         if self.state == self.STATE_NEW:
             self.state = self.STATE_ACK
             self.acked_at = timezone.now()
             self.save(update_fields=['state', 'acked_at'])
+            publish_ticket_event(self, 'ack')
 
     def mark_ready(self):
+        from billing.kds_broker import publish_ticket_event
         if self.state in (self.STATE_NEW, self.STATE_ACK):
             self.state = self.STATE_READY
             self.ready_at = timezone.now()
             self.save(update_fields=['state', 'ready_at'])
+            publish_ticket_event(self, 'ready')
 
     def archive_by(self, staff):
         """デシャップで『持ってく』→ 即アーカイブ"""
+        from billing.kds_broker import publish_ticket_event
         self.taken_by_staff = staff
         now = timezone.now()
         self.taken_at = now
         self.archived_at = now
         self.save(update_fields=['taken_by_staff', 'taken_at', 'archived_at'])
+        publish_ticket_event(self, 'archived')
 
 
 
@@ -1830,77 +1920,27 @@ class CastGoal(models.Model):
             if not self.end_date:   self.end_date   = e
         super().save(*args, **kwargs)
 
-    # 現在値の集計（既存テーブルだけで算出）
+    # 現在値の集計（既存テーブルだけで算出）。複数目標は services.goal_progress.goal_values でまとめて
     def current_value(self, on_date=None):
-        s, e = self.period_bounds(on_date)
-
-        if self.metric == self.METRIC_REVENUE:
-            # 手入力値（CastManualSubtotal）があればそちらを優先
-            manual_total = CastManualSubtotal.objects.filter(
-                store=self.cast.store,
-                cast_id=self.cast_id,
-                work_date__range=(s, e),
-            ).aggregate(x=Sum('manual_subtotal'))['x']
-            if manual_total is not None:
-                return int(manual_total)
-            # なければ従来の担当売上 = Σ(price * qty)
-            return int(BillItem.objects.filter(
-                served_by_cast_id=self.cast_id,
-                bill__closed_at__date__range=(s, e),
-                bill__table__store=self.cast.store,
-            ).aggregate(
-                x=Sum(ExpressionWrapper(F('price') * F('qty'), output_field=IntegerField()))
-            )['x'] or 0)
-
-        if self.metric == self.METRIC_NOMINATIONS:
-            # 本指名：入店イベント数（期間内にenteredのnom）
-            return int(BillCastStay.objects.filter(
-                cast_id=self.cast_id, stay_type='nom',
-                bill__closed_at__date__range=(s, e),
-                bill__table__store=self.cast.store,
-            ).count())
-
-        if self.metric == self.METRIC_INHOUSE:
-            # 場内指名：入店イベント数（期間内にenteredのin）
-            return int(BillCastStay.objects.filter(
-                cast_id=self.cast_id, stay_type='in',
-                bill__closed_at__date__range=(s, e),
-                bill__table__store=self.cast.store,
-            ).count())
-
-        if self.metric in (self.METRIC_CHAMP_REVENUE, self.METRIC_CHAMP_COUNT):
-            qs = BillItem.objects.filter(
-                bill__closed_at__date__range=(s, e),
-                bill__table__store=self.cast.store,
-                item_master__category__code__in=['champagne', 'original-champagne'],
-                served_by_cast_id=self.cast_id,
-            )
-            if self.metric == self.METRIC_CHAMP_REVENUE:
-                return int(qs.aggregate(
-                    x=Sum(ExpressionWrapper(F('price') * F('qty'), output_field=IntegerField()))
-                )['x'] or 0)
-            else:  # METRIC_CHAMP_COUNT
-                return int(qs.aggregate(x=Sum('qty'))['x'] or 0)
-
-        return 0
+        from billing.services.goal_progress import goal_values
+        return goal_values([self], on_date)[self.id]
 
-    def progress(self, on_date=None):
-        cur = self.current_value(on_date)
+    def progress_for(self, value):
+        """現在値 → 進捗（率・％・到達マイルストーン）"""
         tgt = int(self.target_value or 0)
-        ratio = (cur / tgt) if tgt > 0 else 0.0
+        ratio = (value / tgt) if tgt > 0 else 0.0
         pct   = int(ratio * 100)
         hits  = [m for m in self.MILESTONES if pct >= m]
-        return {'value': cur, 'ratio': ratio, 'percent': pct, 'hits': hits}
+        return {'value': value, 'ratio': ratio, 'percent': pct, 'hits': hits}
+
+    def progress(self, on_date=None):
+        return self.progress_for(self.current_value(on_date))
 
     def record_new_hits(self, on_date=None):
         """未通知のマイルストーンがあれば milestones_hit を更新して返す"""
-        pr = self.progress(on_date)
-        cur = set(self.milestones_hit or [])
-        new = [m for m in pr['hits'] if m not in cur]
-        if new:
-            self.milestones_hit = sorted(cur.union(new))
-            self.save(update_fields=['milestones_hit','updated_at'])
-        return new, pr
+        from billing.services.goal_progress import record_new_hits_bulk
+        [result] = record_new_hits_bulk([self], on_date)
+        return result.new_hits, result.progress
 
 
 
@@ -2016,6 +2056,95 @@ class HourlyCastSales(models.Model):
         return f'{self.cast.stage_name} {self.hourly_summary.date} {self.hourly_summary.hour:02d}:00 - ¥{self.sales_total:,}'
 
 
+class CustomerCastAffinity(models.Model):
+    """
+    顧客×キャスト相性（1店舗 x 1顧客 x 1キャスト）の通算値
+    締め済み伝票の served_by_cast 付き明細を、伝票の全顧客に計上する。
+    伝票のクローズ・締め後の編集で差分更新される（services/affinity.py）。
+    """
+    store = models.ForeignKey('billing.Store', on_delete=models.CASCADE, related_name='customer_cast_affinities')
+    customer = models.ForeignKey('billing.Customer', on_delete=models.CASCADE, related_name='cast_affinities')
+    cast = models.ForeignKey('billing.Cast', on_delete=models.CASCADE, related_name='customer_affinities')
+
+    spent_total = models.PositiveIntegerField(default=0, help_text='このキャストの明細売上（price × qty）')
+    item_count = models.PositiveIntegerField(default=0, help_text='明細数')
+    bill_count = models.PositiveIntegerField(default=0, help_text='伝票数')
+    last_served_at = models.DateTimeField(null=True, blank=True, help_text='最後の伝票の opened_at')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'customer', 'cast'], name='uniq_affinity_store_customer_cast'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'cast', '-spent_total']),
+            models.Index(fields=['store', 'cast', '-last_served_at']),
+            models.Index(fields=['store', 'cast', '-bill_count']),
+        ]
+        verbose_name = '顧客×キャスト相性'
+        verbose_name_plural = verbose_name
+
+
+class CustomerCastAffinityDay(models.Model):
+    """
+    顧客×キャスト相性の日別バケット（直近N日の集計用）
+    date は伝票の opened_at の現地日付。
+    """
+    affinity = models.ForeignKey('billing.CustomerCastAffinity', on_delete=models.CASCADE, related_name='days')
+    date = models.DateField()
+
+    spent = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    bill_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['affinity', 'date'], name='uniq_affinityday_affinity_date'),
+        ]
+        verbose_name = '顧客×キャスト相性（日別）'
+        verbose_name_plural = verbose_name
+
+
+class DailyPLSnapshot(models.Model):
+    """
+    日次P&L（1店舗 x 1営業日）の確定値
+    get_daily_pl の結果を保存し、月次・年次はこの行を合算する。
+    伝票や経費の変更で is_stale が立ち、次回参照時に再計算される。
+    """
+    store = models.ForeignKey('billing.Store', on_delete=models.CASCADE, related_name='daily_pl_snapshots')
+    business_date = models.DateField(help_text='営業日')
+
+    # 月次・年次で合算する列（get_daily_pl の同名キー）
+    sales_total = models.IntegerField(default=0)
+    sales_cash = models.IntegerField(default=0)
+    sales_card = models.IntegerField(default=0)
+    guest_count = models.IntegerField(default=0)
+    commission = models.IntegerField(default=0)
+    hourly_pay = models.IntegerField(default=0)
+    labor_cost = models.IntegerField(default=0)
+    operating_profit = models.IntegerField(default=0)
+
+    # get_daily_pl(include_breakdown=True) の結果そのもの
+    data = models.JSONField(default=dict)
+
+    is_stale = models.BooleanField(default=False, help_text='再計算が必要')
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'business_date'], name='uniq_dailypl_store_business_date'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'business_date']),
+        ]
+        verbose_name = '日次P&Lスナップショット'
+        verbose_name_plural = verbose_name
+        ordering = ['business_date']
+
+    def __str__(self):
+        return f'{self.store_id} {self.business_date} - ¥{self.sales_total:,}'
+
+
 # ═══════════════════════════════════════════════════════════════════
 # 給与締め（PayrollRun）モデル
 # ═══════════════════════════════════════════════════════════════════
@@ -0,0 +1,125 @@
+# billing/payroll/computation.py
+"""
+1伝票分の給与計算を1回だけ行うオブジェクト
+- 伝票グラフ（明細＋担当キャスト・stay・本指名・顧客・立替・店舗設定）を1回で読み込む
+- エンジンの本指名/同伴計算は BillCalculator と共有して1回だけ
+- 金額（BillCalculationResult）・CastPayout・スナップショット dict を同じ中間結果から作る
+"""
+import copy
+from functools import cached_property
+
+from django.conf import settings
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+
+from billing.calculator import BILL_GRAPH_SELECT_RELATED, BillCalculator, bill_graph_prefetches
+from billing.payroll.snapshot import (
+    _build_by_cast, _build_items_info, _build_totals, _compute_snapshot_hash,
+)
+
+
+def payroll_graph_prefetch(qs):
+    """PayrollComputation(prefetched=True) に渡す伝票 queryset の読み込み定義"""
+    return qs.select_related(*BILL_GRAPH_SELECT_RELATED).prefetch_related(*bill_graph_prefetches(payroll=True))
+
+
+class PayrollComputation:
+    """
+    使い方:
+        comp = PayrollComputation(bill)
+        comp.result          # BillCalculationResult（BillCalculator(bill).execute() と同じ）
+        comp.cast_payouts    # [CastPayout]
+        comp.snapshot()      # build_payroll_snapshot(bill) と同じ dict
+
+    prefetched=True: bill が payroll_graph_prefetch 済み（一括処理用）。
+    省略時は bill のコピーへ読み込むので、呼び出し側の bill の prefetch キャッシュは汚さない。
+    """
+
+    def __init__(self, bill, *, prefetched: bool = False):
+        self.bill = bill if prefetched else self._load(bill)
+        table = getattr(self.bill, "table", None)
+        self.store = getattr(table, "store", None)
+        self.calculator = BillCalculator(self.bill)
+        self.engine = self.calculator.engine
+
+    @staticmethod
+    def _load(bill):
+        from billing.models import Table
+
+        graph = copy.copy(bill)
+        graph.__dict__.pop("_prefetched_objects_cache", None)
+        prefetch_related_objects(
+            [graph],
+            # 卓・店舗・席種は1クエリで（select_related 済みならそのまま使う）
+            Prefetch("table", queryset=Table.objects.select_related("store", "seat_type")),
+            *BILL_GRAPH_SELECT_RELATED,
+            *bill_graph_prefetches(payroll=True),
+        )
+        return graph
+
+    # ---------------- 共有する中間結果 ----------------
+    @cached_property
+    def result(self):
+        return self.calculator.execute()
+
+    @property
+    def cast_payouts(self):
+        return self.result.cast_payouts
+
+    @cached_property
+    def stay_type_map(self) -> dict:
+        """cast_id → stay_type（在席中の stay のみ）"""
+        return {s.cast_id: s.stay_type for s in self.bill.stays.all() if s.left_at is None}
+
+    @cached_property
+    def resolver(self):
+        from billing.services.backrate import get_back_rate_resolver
+        return get_back_rate_resolver(self.store)
+
+    @cached_property
+    def items_info(self) -> list:
+        return _build_items_info(
+            self.bill, self.engine, self.store,
+            items=self.calculator._items(), stay_type_map=self.stay_type_map, resolver=self.resolver,
+        )
+
+    @cached_property
+    def by_cast(self) -> list:
+        return _build_by_cast(
+            self.bill, self.cast_payouts, self.items_info, self.store, self.engine,
+            stay_type_map=self.stay_type_map,
+            substitute_items=self.calculator._substitute_items(),
+            nom_payouts=self.calculator.nomination_payouts(),
+            dohan_payouts=self.calculator.dohan_payouts(),
+        )
+
+    @cached_property
+    def totals(self) -> dict:
+        return _build_totals(self.by_cast, self.items_info, self.result)
+
+    # ---------------- スナップショット ----------------
+    def snapshot(self) -> dict:
+        store_slug = self.store.slug if self.store else "unknown"
+        use_timeboxed = getattr(settings, "USE_TIMEBOXED_NOM_POOL", False)
+        meta = {
+            "snapshot_version": 2,
+            "generated_at": timezone.now().isoformat(),
+            "use_timeboxed_nom_pool": use_timeboxed,
+            "nom_pool_mode": "timeboxed" if use_timeboxed else "legacy",
+            "engine": self.engine.__class__.__name__,
+            "store_id": self.store.id if self.store else None,
+            "store_slug": store_slug,
+        }
+        snapshot = {
+            "meta": meta,
+            "version": 1,
+            "bill_id": self.bill.id,
+            "store_slug": store_slug,
+            "closed_at": (self.bill.closed_at or timezone.now()).isoformat(),
+            "totals": self.totals,
+            "by_cast": self.by_cast,
+            "items": self.items_info,
+        }
+        # ハッシュ付与（改ざん検知用）
+        snapshot["hash"] = _compute_snapshot_hash(snapshot)
+        return snapshot
@@ -1,18 +1,27 @@
 # billing/payroll/engines/base.py
 from decimal import Decimal, ROUND_FLOOR
 from django.conf import settings
-from django.utils import timezone
 from billing.payroll.nom_pool_filter import should_exclude_from_nom_pool
+from billing.payroll.nom_timeline import NominationTimeline, OrderedSubtotals
+from billing.utils.prefetch import prefetched_list
+
 
 class BaseEngine:
     def __init__(self, store): self.store = store
 
+    def _bill_items(self, bill):
+        """明細一覧（BatchBillCalculator 等で prefetch 済みならそれを使う）"""
+        items = prefetched_list(bill, 'items')
+        if items is None:
+            items = list(bill.items.select_related('item_master__category').all())
+        return items
+
     def _pool_items_all_included(self, bill):
         """
         フェーズ2：除外判定フックを通すための土台。
         まだ除外ルールは常にFalseなので、実質 bill.items と同じ。
         """
-        items = bill.items.select_related('item_master__category').all()
+        items = self._bill_items(bill)
         return [it for it in items if not should_exclude_from_nom_pool(it)]
 
     def nomination_payouts(self, bill) -> dict[int, int]:
@@ -49,9 +58,8 @@ class BaseEngine:
         Base では既存ロジックに触れず、別メソッドとして実装。
         """
         totals: dict[int, int] = {}
-        now = timezone.now()
 
-        items = bill.items.select_related('item_master__category').all()
+        items = self._bill_items(bill)
         items_for_pool = [
             it for it in items
             if not it.exclude_from_payout and not should_exclude_from_nom_pool(it)
@@ -63,47 +71,11 @@ class BaseEngine:
         if pr >= 1:
             pr /= 100
 
-        bill_customers = bill.billcustomer_set.select_related('customer').all()
-        for bc in bill_customers:
-            c_start = bc.arrived_at
-            if not c_start:
-                continue
-            c_end = bc.left_at or now
-            if c_end <= c_start:
-                continue
-
-            nominations = bill.customer_nominations.filter(customer=bc.customer)
-            if not nominations:
-                continue
-
-            boundaries = {c_start, c_end}
-            for nom in nominations:
-                n_start = max(nom.started_at, c_start)
-                n_end = min(nom.ended_at or c_end, c_end)
-                if n_start < n_end:
-                    boundaries.add(n_start)
-                    boundaries.add(n_end)
-
-            times = sorted(t for t in boundaries if c_start <= t <= c_end)
-            if len(times) < 2:
-                continue
-
-            for t_i, t_j in zip(times, times[1:]):
-                if t_i >= t_j:
-                    continue
-
-                active_cast_ids = [
-                    nom.cast_id for nom in nominations
-                    if nom.started_at <= t_i and (nom.ended_at is None or t_i < nom.ended_at)
-                ]
-                active_cast_ids = list(dict.fromkeys(active_cast_ids))
-                if not active_cast_ids:
-                    continue
-
-                pool_subtotal = sum(
-                    it.subtotal for it in items_for_pool
-                    if it.ordered_at and t_i <= it.ordered_at < t_j
-                )
+        pool = OrderedSubtotals(items_for_pool)
+        timeline = NominationTimeline(bill)
+        for bc in timeline.bill_customers:
+            for t_i, t_j, active_cast_ids in timeline.segments(bc):
+                pool_subtotal = pool.between(t_i, t_j)
                 if not pool_subtotal:
                     continue
 
@@ -136,5 +108,13 @@ class BaseEngine:
         """
         return []
 
+    def finalize_payroll_lines(self, lines, period_start, period_end):
+        """
+        finalize_payroll_line のバッチ版（PayrollRun 全キャスト分をまとめて補正）。
+        集計をキャスト横断で1回にしたい店舗はこちらを上書きする。
+        戻り値: 各 line の追加 PayrollRunBackRow リスト（lines と同じ順）。
+        """
+        return [self.finalize_payroll_line(line, period_start, period_end) for line in lines]
+
 class DefaultEngine(BaseEngine):
     pass  # Base のまま（従来どおりの本指名プール）
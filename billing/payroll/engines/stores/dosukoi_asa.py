@@ -9,14 +9,15 @@ class DosukoiAsaEngine(BaseEngine):
     RATE_DOHAN = Decimal("0.30")  # 同伴   30%
     
 
+    # stays / nominated_casts は prefetch 済みならキャッシュから判定する
     def _has_dohan(self, bill) -> bool:
-        return bill.stays.filter(stay_type='dohan').exists()
+        return any(s.stay_type == 'dohan' for s in bill.stays.all())
 
     def _has_nom(self, bill) -> bool:
-        return (
+        return bool(
             bill.main_cast_id or
-            bill.nominated_casts.exists() or
-            bill.stays.filter(stay_type='nom').exists() or
+            bill.nominated_casts.all() or
+            any(s.stay_type == 'nom' for s in bill.stays.all()) or
             any(it.is_nomination for it in bill.items.all())
         )
 
@@ -33,7 +34,7 @@ class DosukoiAsaEngine(BaseEngine):
         payout   = int(Decimal(subtotal) * self.RATE_DOHAN)
 
         # 同伴が付いたキャスト（複数いたら均等）
-        target_ids = list(bill.stays.filter(stay_type='dohan').values_list('cast_id', flat=True).distinct())
+        target_ids = list(dict.fromkeys(s.cast_id for s in bill.stays.all() if s.stay_type == 'dohan'))
         if not target_ids:
             return totals
 
@@ -57,7 +58,7 @@ class DosukoiAsaEngine(BaseEngine):
         if bill.main_cast_id:
             return {bill.main_cast_id: payout}
 
-        ids = list(bill.nominated_casts.values_list('id', flat=True))
+        ids = [c.id for c in bill.nominated_casts.all()]
         if not ids:
             return {}
         each = int(payout // len(ids))
@@ -1,5 +1,5 @@
 # billing/payroll/engines/stores/garden.py
-from django.db.models import Q, Sum, F, IntegerField
+from django.db.models import Q, Sum, F, Count, Exists, OuterRef, IntegerField
 from django.db.models.functions import Coalesce
 from django.db.models.expressions import ExpressionWrapper
 
@@ -8,6 +8,7 @@ from ..base import BaseEngine
 from ....models import (
     BillCastStay,
     BillItem,
+    CastDailySummary,
     PayrollRunBackRow,
 )
 
@@ -91,61 +92,7 @@ def calc_monthly_back(rank, sales_total, dohan_sales_total):
 # ──────────────────────────────────────────────
 # 集計クエリ
 # ──────────────────────────────────────────────
-def calculate_garden_stats(store, cast_id, period_start, period_end):
-    """
-    Garden 月次制度の集計を行い dict を返す。
-    bill.closed_at__date が period 内のものを対象。
-    """
-    item_subtotal_expr = ExpressionWrapper(F("price") * F("qty"), output_field=IntegerField())
-
-    bill_item_filter = Q(
-        bill__table__store=store,
-        bill__closed_at__date__range=(period_start, period_end),
-        served_by_cast_id=cast_id,
-    )
-
-    # sales_total: served_by_cast ベース（price*qty）
-    sales_total = (
-        BillItem.objects.filter(bill_item_filter)
-        .aggregate(total=Coalesce(Sum(item_subtotal_expr), 0))
-        .get("total")
-    ) or 0
-
-    # dohan bill ids (QuerySet)
-    dohan_bill_ids_qs = (
-        BillCastStay.objects.filter(
-            bill__table__store=store,
-            bill__closed_at__date__range=(period_start, period_end),
-            stay_type="dohan",
-            cast_id=cast_id,
-        )
-        .values_list("bill_id", flat=True)
-        .distinct()
-    )
-
-    # dohan_count: 伝票単位
-    dohan_count = dohan_bill_ids_qs.count()
-
-    # dohan_sales_total: 同伴伝票の served_by_cast ベース小計
-    dohan_sales_total = (
-        BillItem.objects.filter(
-            bill_id__in=dohan_bill_ids_qs,
-            served_by_cast_id=cast_id,
-        )
-        .aggregate(total=Coalesce(Sum(item_subtotal_expr), 0))
-        .get("total")
-    ) or 0
-
-    # nom_count: 伝票単位（本指名）
-    nom_count = (
-        BillCastStay.objects.filter(
-            bill__table__store=store,
-            bill__closed_at__date__range=(period_start, period_end),
-            stay_type="nom",
-            cast_id=cast_id,
-        ).values("bill_id").distinct().count()
-    )
-
+def _stats_from_totals(sales_total, dohan_sales_total, nom_count, dohan_count):
     points = calc_points(sales_total, nom_count, dohan_count)
     rank = calc_rank(points)
     backs = calc_monthly_back(rank, sales_total, dohan_sales_total)
@@ -163,17 +110,123 @@ def calculate_garden_stats(store, cast_id, period_start, period_end):
     }
 
 
+def calculate_garden_stats_bulk(store, cast_ids, period_start, period_end):
+    """
+    Garden 月次制度の集計を複数キャスト分まとめて行い {cast_id: dict} を返す。
+    bill.closed_at__date が period 内のものを対象。キャスト数に依らず 2 クエリ。
+    """
+    cast_ids = list(dict.fromkeys(cast_ids))
+    if not cast_ids:
+        return {}
+
+    item_subtotal_expr = ExpressionWrapper(F("price") * F("qty"), output_field=IntegerField())
+    bill_scope = Q(
+        bill__table__store=store,
+        bill__closed_at__date__range=(period_start, period_end),
+    )
+
+    # sales_total / dohan_sales_total: served_by_cast ベース（price*qty）。
+    # 同伴売上は「その明細のキャストが同伴している伝票」の明細だけ
+    cast_dohan = Exists(BillCastStay.objects.filter(
+        bill_id=OuterRef("bill_id"),
+        cast_id=OuterRef("served_by_cast_id"),
+        stay_type="dohan",
+    ))
+    sales = {
+        r["served_by_cast_id"]: r
+        for r in (
+            BillItem.objects.filter(bill_scope, served_by_cast_id__in=cast_ids)
+            .alias(cast_dohan=cast_dohan)
+            .values("served_by_cast_id")
+            .annotate(
+                total=Coalesce(Sum(item_subtotal_expr), 0),
+                dohan_total=Coalesce(Sum(item_subtotal_expr, filter=Q(cast_dohan=True)), 0),
+            )
+            .order_by()
+        )
+    }
+
+    # dohan_count / nom_count: 伝票単位
+    counts = {
+        (r["cast_id"], r["stay_type"]): r["bills"]
+        for r in (
+            BillCastStay.objects.filter(bill_scope, cast_id__in=cast_ids, stay_type__in=("dohan", "nom"))
+            .values("cast_id", "stay_type")
+            .annotate(bills=Count("bill_id", distinct=True))
+            .order_by()
+        )
+    }
+
+    result = {}
+    for cast_id in cast_ids:
+        row = sales.get(cast_id) or {}
+        result[cast_id] = _stats_from_totals(
+            sales_total=row.get("total") or 0,
+            dohan_sales_total=row.get("dohan_total") or 0,
+            nom_count=counts.get((cast_id, "nom"), 0),
+            dohan_count=counts.get((cast_id, "dohan"), 0),
+        )
+    return result
+
+
+def calculate_garden_stats(store, cast_id, period_start, period_end):
+    """1キャスト分（calculate_garden_stats_bulk の薄いラッパー）"""
+    return calculate_garden_stats_bulk(store, [cast_id], period_start, period_end)[cast_id]
+
+
+def garden_stats_from_tally(store, cast_ids, period_start, period_end):
+    """
+    暫定ランク用: CastDailySummary の日次集計（締め・締め後編集で差分更新済み）を期間分足して
+    {cast_id: dict} を返す。伝票・明細は読まない（1クエリ、行数は キャスト数 × 日数）。
+    値は calculate_garden_stats_bulk と一致する（check_garden_tally で検証）。
+    """
+    cast_ids = list(dict.fromkeys(cast_ids))
+    if not cast_ids:
+        return {}
+    tally = {
+        r["cast_id"]: r
+        for r in (
+            CastDailySummary.objects.filter(
+                store=store, cast_id__in=cast_ids, work_date__range=(period_start, period_end),
+            )
+            .values("cast_id")
+            .annotate(
+                sales=Coalesce(Sum(F("sales_free") + F("sales_in") + F("sales_nom")), 0),
+                dohan_sales=Coalesce(Sum("sales_dohan"), 0),
+                noms=Coalesce(Sum("nom_bills"), 0),
+                dohans=Coalesce(Sum("dohan_bills"), 0),
+            )
+            .order_by()
+        )
+    }
+    result = {}
+    for cast_id in cast_ids:
+        row = tally.get(cast_id) or {}
+        result[cast_id] = _stats_from_totals(
+            sales_total=row.get("sales") or 0,
+            dohan_sales_total=row.get("dohan_sales") or 0,
+            nom_count=row.get("noms") or 0,
+            dohan_count=row.get("dohans") or 0,
+        )
+    return result
+
+
 # ──────────────────────────────────────────────
 # Engine
 # ──────────────────────────────────────────────
 @register("garden")
 class GardenEngine(BaseEngine):
 
-    def finalize_payroll_line(self, line, period_start, period_end):
-        stats = calculate_garden_stats(
-            self.store, line.cast_id, period_start, period_end,
+    def finalize_payroll_lines(self, lines, period_start, period_end):
+        stats_by_cast = calculate_garden_stats_bulk(
+            self.store, [line.cast_id for line in lines], period_start, period_end,
         )
+        return [self._apply_stats(line, stats_by_cast[line.cast_id]) for line in lines]
+
+    def finalize_payroll_line(self, line, period_start, period_end):
+        return self.finalize_payroll_lines([line], period_start, period_end)[0]
 
+    def _apply_stats(self, line, stats):
         # 時給再計算: worked_min * hourly / 60
         new_hourly_pay = int((int(line.worked_min or 0) * int(stats["hourly"] or 0)) / 60)
         monthly_back = stats["slide_back"] + stats["dohan_back"] + stats["b_back"]
@@ -196,23 +249,22 @@ class GardenEngine(BaseEngine):
             "monthly_back": monthly_back,
         }
 
-        # 追加の BackRow
+        # 追加の BackRow（cast / run は id で渡してキャスト毎の取得を避ける）
         extra_rows = []
-        run = line.run
 
         if stats["slide_back"]:
             extra_rows.append(PayrollRunBackRow(
-                run=run, cast=line.cast,
+                run_id=line.run_id, cast_id=line.cast_id,
                 label="GDN_SLIDE", amount=stats["slide_back"],
             ))
         if stats["dohan_back"]:
             extra_rows.append(PayrollRunBackRow(
-                run=run, cast=line.cast,
+                run_id=line.run_id, cast_id=line.cast_id,
                 label="GDN_DOHAN", amount=stats["dohan_back"],
             ))
         if stats["b_back"]:
             extra_rows.append(PayrollRunBackRow(
-                run=run, cast=line.cast,
+                run_id=line.run_id, cast_id=line.cast_id,
                 label="GDN_SUBTOTAL_5", amount=stats["b_back"],
             ))
 
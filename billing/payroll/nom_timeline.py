@@ -0,0 +1,120 @@
+# billing/payroll/nom_timeline.py
+"""
+本指名の時間区間計算（エンジンの時間区間プールと本指名卓小計APIで共有）
+- 本指名・伝票顧客はそれぞれ1クエリ（prefetch 済みならクエリなし）で読み込み、顧客ごとに振り分ける
+- 明細は ordered_at 順に1回だけ並べて累積和を持ち、区間 [start, end) の小計を bisect で引く
+- 区間ごとの在籍本指名は開始順・終了順の掃き出しで求める（区間ごとに全件を見直さない）
+"""
+import heapq
+from bisect import bisect_left
+from functools import cached_property
+from itertools import accumulate
+
+from django.utils import timezone
+
+from billing.utils.prefetch import prefetched_list
+
+
+class OrderedSubtotals:
+    """明細の小計を ordered_at 順に並べた累積和（ordered_at なしの明細はどの区間にも入らない）"""
+
+    def __init__(self, items):
+        rows = sorted(
+            ((it.ordered_at, it.subtotal) for it in items if it.ordered_at),
+            key=lambda row: row[0],
+        )
+        self.times = [t for t, _ in rows]
+        self.prefix = list(accumulate((s for _, s in rows), initial=0))
+
+    def between(self, start, end) -> int:
+        """start <= ordered_at < end の小計合計"""
+        if end <= start:
+            return 0
+        return self.prefix[bisect_left(self.times, end)] - self.prefix[bisect_left(self.times, start)]
+
+
+class NominationTimeline:
+    """
+    使い方:
+        timeline = NominationTimeline(bill)
+        pool = OrderedSubtotals(items)
+        for bc in timeline.bill_customers:
+            for start, end, cast_ids in timeline.segments(bc):
+                pool.between(start, end)
+    """
+
+    def __init__(self, bill, *, now=None):
+        self.bill = bill
+        self.now = now or timezone.now()
+
+    @cached_property
+    def nominations(self) -> list:
+        noms = prefetched_list(self.bill, 'customer_nominations')
+        if noms is None:
+            noms = list(self.bill.customer_nominations.order_by('id'))
+        return noms
+
+    @cached_property
+    def nominations_by_customer(self) -> dict:
+        """customer_id → [BillCustomerNomination]（本指名の並び順のまま）"""
+        grouped = {}
+        for nom in self.nominations:
+            grouped.setdefault(nom.customer_id, []).append(nom)
+        return grouped
+
+    @cached_property
+    def bill_customers(self) -> list:
+        bcs = prefetched_list(self.bill, 'billcustomer_set')
+        if bcs is None:
+            bcs = list(self.bill.billcustomer_set.select_related('customer').order_by('id'))
+        return bcs
+
+    def items(self) -> list:
+        items = prefetched_list(self.bill, 'items')
+        if items is None:
+            items = list(self.bill.items.all())
+        return items
+
+    def segments(self, bc):
+        """
+        顧客の滞在 [arrived_at, left_at or now) を本指名の開始・終了で区切り、
+        (区間開始, 区間終了, 在籍本指名キャストID) を時刻順に返す（本指名のいない区間は飛ばす）
+        """
+        c_start = bc.arrived_at
+        if not c_start:
+            return
+        c_end = bc.left_at or self.now
+        if c_end <= c_start:
+            return
+        nominations = self.nominations_by_customer.get(bc.customer_id)
+        if not nominations:
+            return
+
+        boundaries = {c_start, c_end}
+        for nom in nominations:
+            n_start = max(nom.started_at, c_start)
+            n_end = min(nom.ended_at or c_end, c_end)
+            if n_start < n_end:
+                boundaries.add(n_start)
+                boundaries.add(n_end)
+        times = sorted(boundaries)
+
+        # started_at <= t < ended_at の本指名を掃き出しで保つ（同じキャストの重複は1人扱い）
+        starts = sorted(nominations, key=lambda n: n.started_at)
+        ends = []
+        active = {}
+        k = 0
+        for t_i, t_j in zip(times, times[1:]):
+            while k < len(starts) and starts[k].started_at <= t_i:
+                nom = starts[k]
+                k += 1
+                active[nom.cast_id] = active.get(nom.cast_id, 0) + 1
+                if nom.ended_at is not None:
+                    heapq.heappush(ends, (nom.ended_at, k, nom.cast_id))
+            while ends and ends[0][0] <= t_i:
+                _, _, cast_id = heapq.heappop(ends)
+                active[cast_id] -= 1
+                if not active[cast_id]:
+                    del active[cast_id]
+            if active:
+                yield t_i, t_j, list(active)
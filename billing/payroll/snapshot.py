@@ -109,69 +109,10 @@ def build_payroll_snapshot(bill: "Bill") -> Dict[str, Any]:
           "hash": "sha256:abc123..."
         }
     """
-    from ..calculator import BillCalculator
-    from .engines import get_engine
-    from ..models import BillCastStay
-    
-    # 金額計算を実行（既存ロジック）
-    calc = BillCalculator(bill)
-    result = calc.execute()
-    
-    # 店舗情報取得（Phase 8-1：bill.table.store 直接使用）
-    store = None
-    if getattr(bill, "table", None) and getattr(bill.table, "store", None):
-        store = bill.table.store
-    
-    store_slug = store.slug if store else "unknown"
-    store_id = store.id if store else None
-    engine = get_engine(store)
-    
-    # ─────────────────────────────────────────
-    # items: 各伝票明細の給与効果
-    # ─────────────────────────────────────────
-    items_info = _build_items_info(bill, engine, store)
+    from .computation import PayrollComputation
 
-    # ─────────────────────────────────────────
-    # by_cast: 各キャストの給与集計 + 内訳
-    # ─────────────────────────────────────────
-    by_cast = _build_by_cast(bill, result.cast_payouts, items_info, store, engine)
-    
-    # ─────────────────────────────────────────
-    # totals: 給与関連の合計値
-    # ─────────────────────────────────────────
-    totals_dict = _build_totals(by_cast, items_info, result)
-    
-    # ─────────────────────────────────────────
-    # スナップショット構築
-    # ─────────────────────────────────────────
-    
-    # meta情報の構築（Phase 7-4・8-1）
-    use_timeboxed = getattr(settings, "USE_TIMEBOXED_NOM_POOL", False)
-    meta = {
-        "snapshot_version": 2,
-        "generated_at": timezone.now().isoformat(),
-        "use_timeboxed_nom_pool": use_timeboxed,
-        "nom_pool_mode": "timeboxed" if use_timeboxed else "legacy",
-        "engine": engine.__class__.__name__,
-        "store_id": store_id,
-        "store_slug": store_slug,
-    }
-    
-    snapshot = {
-        "meta": meta,
-        "version": 1,
-        "bill_id": bill.id,
-        "store_slug": store_slug,
-        "closed_at": (bill.closed_at or timezone.now()).isoformat(),
-        "totals": totals_dict,
-        "by_cast": by_cast,
-        "items": items_info,
-    }
-    
-    # ハッシュ付与（改ざん検知用）
-    snapshot["hash"] = _compute_snapshot_hash(snapshot)
-    
-    return snapshot
+    # 伝票グラフの読み込み・エンジン計算は1回だけ（金額・CastPayout と同じ中間結果から構築）
+    return PayrollComputation(bill).snapshot()
 
 
 def _get_item_served_casts(item) -> list:
@@ -184,18 +125,22 @@ def _get_item_served_casts(item) -> list:
     return []
 
 
-def _compute_item_back_split(item, store, stay_type_map: dict, engine, bill) -> dict:
+def _compute_item_back_split(item, store, stay_type_map: dict, engine, bill, resolver=None, casts=None) -> dict:
     """
     1アイテムの item_back を担当キャスト全員に均等分配。
     各キャストの back_rate は stay_type ベースで個別算出。
     端数は 100 円単位 floor（店残し）。
 
+    resolver: BackRateResolver（省略時は店舗のリゾルバを取得）
+    casts: _get_item_served_casts(item) の結果（呼び出し側で取得済みなら渡す）
+
     Returns:
         {cast_id: {"amount": int, "rate": Decimal, "basis_type": str}}
     """
-    from billing.services.backrate import resolve_back_rate
+    from billing.services.backrate import get_back_rate_resolver
 
-    casts = _get_item_served_casts(item)
+    if casts is None:
+        casts = _get_item_served_casts(item)
     if not casts or not item.item_master:
         return {}
 
@@ -205,11 +150,12 @@ def _compute_item_back_split(item, store, stay_type_map: dict, engine, bill) ->
     total = Decimal(0)
     cast_info = {}
 
+    if resolver is None:
+        resolver = get_back_rate_resolver(store)
+
     for cast in casts:
         stay_type = stay_type_map.get(cast.id, "free")
-        rate = resolve_back_rate(
-            store=store, category=category, cast=cast, stay_type=stay_type
-        )
+        rate = resolver.resolve(category=category, cast=cast, stay_type=stay_type)
         contrib = base * rate
         bt = basis_type
         override = engine.item_payout_override(bill, item, stay_type)
@@ -234,10 +180,16 @@ def _build_by_cast(
     cast_payouts: List["CastPayout"],
     items_info: List[Dict[str, Any]],
     store,
-    engine
+    engine,
+    *,
+    stay_type_map: dict,
+    substitute_items: list,
+    nom_payouts: dict,
+    dohan_payouts: dict,
 ) -> List[Dict[str, Any]]:
     """
     CastPayout を cast 別に集計し、内訳（breakdown）を構築。
+    stay / 立替 / エンジンの本指名・同伴額は PayrollComputation で計算済みのものを受け取る。
     
     Returns:
         [
@@ -252,19 +204,12 @@ def _build_by_cast(
           ...
         ]
     """
-    from ..models import BillCastStay
-
     result = []
 
-    # cast_id → stay_type マップ
-    stay_type_map = {}
-    for stay in bill.stays.filter(left_at__isnull=True):
-        stay_type_map[stay.cast_id] = stay.stay_type
-
     # ─── 立替控除: cast_id 別に集計 ───
     sub_deduction_map = {}   # {cast_id: int}
     sub_details_map = {}     # {cast_id: [detail,...]}
-    for si in bill.substitute_items.select_related('item_master').all():
+    for si in substitute_items:
         cid = si.cast_id
         sub_deduction_map[cid] = sub_deduction_map.get(cid, 0) + int(si.substitute_amount or 0)
         sub_details_map.setdefault(cid, []).append({
@@ -310,8 +255,6 @@ def _build_by_cast(
     # by_cast 母集団 = payout cast_id ∪ payroll_effect cast_id ∪ 立替cast_id
     cast_ids = set(payout_amount_map.keys()) | set(item_back_amount_map.keys()) | set(sub_deduction_map.keys())
 
-    nom_payouts = engine.nomination_payouts(bill) or {}
-    dohan_payouts = engine.dohan_payouts(bill) or {}
     nom_items = [
         it for it in bill.items.all()
         if getattr(it, "is_nomination", False)
@@ -423,8 +366,11 @@ def _build_cast_breakdown(
     # ─────────────────────────────────────────
     # 1) Item Back（served_by_casts M2M 経由、FK へフォールバック）
     # ─────────────────────────────────────────
+    from billing.services.backrate import get_back_rate_resolver
+
     item_back_amount = 0
     item_details = []
+    resolver = get_back_rate_resolver(store)
 
     for item in bill.items.select_related("item_master__category", "served_by_cast").prefetch_related("served_by_casts").all():
         if item.exclude_from_payout:
@@ -434,7 +380,7 @@ def _build_cast_breakdown(
         if cast_id not in {c.id for c in _get_item_served_casts(item)}:
             continue
 
-        split = _compute_item_back_split(item, store, stay_type_map, engine, bill)
+        split = _compute_item_back_split(item, store, stay_type_map, engine, bill, resolver)
         entry = split.get(cast_id)
         if not entry or entry["amount"] <= 0:
             continue
@@ -524,10 +470,19 @@ def _build_cast_breakdown(
     return breakdown
 
 
-def _build_items_info(bill: "Bill", engine, store) -> List[Dict[str, Any]]:
+def _build_items_info(
+    bill: "Bill",
+    engine,
+    store,
+    *,
+    items: list,
+    stay_type_map: dict,
+    resolver,
+) -> List[Dict[str, Any]]:
     """
     Bill の明細（items）を構築。
     各アイテムの給与効果（payroll_effects）を記載。
+    items は served_by_casts を prefetch 済みのもの、resolver は伝票内の全明細で共有する。
 
     Returns:
         [
@@ -551,16 +506,9 @@ def _build_items_info(bill: "Bill", engine, store) -> List[Dict[str, Any]]:
           ...
         ]
     """
-    from ..models import BillCastStay
-
-    # cast_id → stay_type マップ
-    stay_type_map = {}
-    for stay in bill.stays.filter(left_at__isnull=True):
-        stay_type_map[stay.cast_id] = stay.stay_type
-
     result = []
 
-    for item in bill.items.select_related("item_master__category", "served_by_cast").prefetch_related("served_by_casts").all():
+    for item in items:
         if item.exclude_from_payout:
             continue
 
@@ -573,7 +521,7 @@ def _build_items_info(bill: "Bill", engine, store) -> List[Dict[str, Any]]:
         payroll_effects = []
 
         if served_casts and not item.is_nomination:
-            split = _compute_item_back_split(item, store, stay_type_map, engine, bill)
+            split = _compute_item_back_split(item, store, stay_type_map, engine, bill, resolver, served_casts)
             for cast in served_casts:
                 entry = split.get(cast.id)
                 if not entry:
@@ -742,6 +690,65 @@ def is_payroll_dirty(bill: "Bill") -> bool:
     return current_hash != snapshot_hash
 
 
+def mark_payroll_dirty(bill_id) -> int:
+    """
+    スナップショット保存済みの伝票に dirty マーカー（payroll_dirty_at）を立てる。
+    明細・stay・本指名・立替・割引の書き込み時に signals から呼ばれる。
+    最初の変更時刻を残すため、既に立っている伝票は触らない。
+
+    Returns:
+        更新行数（0 = 未クローズ / snapshot なし / 既に dirty）
+    """
+    from billing.models import Bill
+
+    if not bill_id:
+        return 0
+    return Bill.objects.filter(
+        pk=bill_id,
+        closed_at__isnull=False,
+        payroll_snapshot__isnull=False,
+        payroll_dirty_at__isnull=True,
+    ).update(payroll_dirty_at=timezone.now())
+
+
+def payroll_dirty_flag(bill: "Bill") -> bool:
+    """
+    一覧用の軽量な dirty 判定（再計算しない）。
+    snapshot（hash 付き）があり、保存後に給与へ影響する書き込みがあれば True。
+    """
+    snapshot = bill.payroll_snapshot
+    if not snapshot or not snapshot.get("hash"):
+        return False
+    return bill.payroll_dirty_at is not None
+
+
+def verify_payroll_dirty(bill: "Bill") -> Dict[str, Any]:
+    """
+    現在状態から hash を計算し直して dirty を確定させ、マーカーを実態に合わせる。
+    （値が変わらない編集で立ったマーカーはここで外れる）
+    """
+    from billing.models import Bill
+
+    snapshot = bill.payroll_snapshot or {}
+    snapshot_hash = snapshot.get("hash")
+    current_hash = compute_current_hash(bill) if snapshot_hash else None
+    dirty = bool(snapshot_hash) and current_hash != snapshot_hash
+
+    if dirty and bill.payroll_dirty_at is None:
+        bill.payroll_dirty_at = timezone.now()
+    elif not dirty and bill.payroll_dirty_at is not None:
+        bill.payroll_dirty_at = None
+    Bill.objects.filter(pk=bill.pk).update(payroll_dirty_at=bill.payroll_dirty_at)
+
+    return {
+        "bill_id": bill.pk,
+        "payroll_dirty": dirty,
+        "payroll_dirty_at": bill.payroll_dirty_at,
+        "snapshot_hash": snapshot_hash,
+        "current_hash": current_hash,
+    }
+
+
 def snapshot_is_stale(bill: "Bill") -> bool:
     """
     Bill の payroll_snapshot が古い（設定変更により再生成が必要）かどうかを判定。
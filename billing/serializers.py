@@ -16,6 +16,7 @@ from django.contrib.auth import get_user_model
 from django.utils.crypto import get_random_string
 from datetime import date
 from .services import sync_nomination_fees
+from .services.customer_stats import stats_summary
 from django.templatetags.static import static
 from django.utils import timezone
 from .models_profile import get_user_avatar_url
@@ -125,6 +126,76 @@ class BillMiniSerializer(serializers.ModelSerializer):
                   'table', 'memo', 'display_name']
 
 
+class BillBoardSerializer(serializers.ModelSerializer):
+    """
+    フロアボード用の伝票1行（ネストなし・クエリなし）
+    - 卓・main_cast・顧客は view 側で select/prefetch 済みのものだけを読む
+    - grand_total は締め済みなら保存値、未締めなら view が載せた _calc_cache（BatchBillCalculator）
+    - fields=[...] で返す列を絞る（?fields= の sparse fieldset。id は常に返す）
+    """
+    table_id = serializers.IntegerField(read_only=True)
+    table_label = serializers.SerializerMethodField()
+    status = serializers.SerializerMethodField()
+    main_cast_id = serializers.IntegerField(read_only=True)
+    main_cast_name = serializers.SerializerMethodField()
+    customer_display_name = serializers.SerializerMethodField()
+    grand_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Bill
+        fields = (
+            "id", "table_id", "table_label", "status", "opened_at", "expected_out", "pax",
+            "main_cast_id", "main_cast_name", "customer_display_name", "display_name", "grand_total",
+        )
+        read_only_fields = fields
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - {"id"}:
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, raw):
+        """?fields=a,b → ['a', 'b']（未指定なら全列）。知らない列名は 400"""
+        if not raw:
+            return list(cls.Meta.fields)
+        names = [f.strip() for f in raw.split(",") if f.strip()]
+        unknown = [f for f in names if f not in cls.Meta.fields]
+        if unknown:
+            raise serializers.ValidationError({"fields": f"不明なフィールドです: {', '.join(unknown)}"})
+        return names
+
+    def get_table_label(self, obj):
+        codes = [t.code for t in obj.tables.all()]
+        if codes:
+            return ''.join(codes)
+        return obj.table.code if obj.table else ''
+
+    def get_status(self, obj):
+        """open / overdue（退店予定を過ぎた）/ closed"""
+        if obj.closed_at is not None:
+            return "closed"
+        if obj.expected_out and obj.expected_out <= self.context.get("now", timezone.now()):
+            return "overdue"
+        return "open"
+
+    def get_main_cast_name(self, obj):
+        return obj.main_cast.stage_name if obj.main_cast else None
+
+    def get_customer_display_name(self, obj):
+        # BillSerializer の customers.first()（pk 最小）と同じ顧客を prefetch 済みの billcustomer_set から選ぶ
+        bcs = [bc for bc in obj.billcustomer_set.all() if bc.customer_id]
+        first = min(bcs, key=lambda bc: bc.customer_id, default=None)
+        return first.customer.display_name if first else ''
+
+    def get_grand_total(self, obj):
+        if obj.closed_at is not None:
+            return int(obj.total or obj.grand_total or 0)
+        res = getattr(obj, "_calc_cache", None)
+        return int(res.total) if res is not None else int(obj.grand_total or 0)
+
+
 class TableMiniSerializer(serializers.ModelSerializer):
     store = serializers.IntegerField(source='store.id', read_only=True)
     number = serializers.SerializerMethodField()  # 互換：旧 number を復活（中身は code）
@@ -414,9 +485,10 @@ class BillItemSerializer(serializers.ModelSerializer):
         """
         OPEN中は effective_back_rate（都度計算）、
         CLOSED済みでも effective_back_rate が「確定値を返す実装」なら同じでOK。
+        店舗のリゾルバは context に持ち回し、明細ごとにキャッシュのバージョンを読まない。
         """
         try:
-            return obj.effective_back_rate
+            return obj.resolve_effective_back_rate(self.context.setdefault('back_rate_resolvers', {}))
         except Exception:
             # 旧互換：effective_back_rate が無いモデルのための保険
             return getattr(obj, 'back_rate', None)
@@ -772,8 +844,12 @@ class CustomerSerializer(serializers.ModelSerializer):
     # 派生：タグ名を comma-separated で返す（リスト表示で便利）
     tag_names = serializers.SerializerMethodField()
     
-    # ★ 最終来店日時（直近伝票から算出）
+    # ★ 最終来店日時・来店実績（CustomerStats から。一覧では stats を prefetch しておく）
     last_visit_at = serializers.SerializerMethodField()
+    visit_stats = serializers.SerializerMethodField()
+    
+    # ★ 検索時の類似度（?q= 指定時のみ。それ以外は null）
+    search_score = serializers.SerializerMethodField()
     
     # ★ 最終担当キャスト（ミニ形式）
     last_cast_obj = CastMiniSerializer(source='last_cast', read_only=True)
@@ -784,21 +860,34 @@ class CustomerSerializer(serializers.ModelSerializer):
             'id', 'full_name', 'alias', 'phone', 'birthday', 'photo', 'memo', 'receipt_name',
             'tags', 'tag_ids', 'tag_names',
             'has_bottle', 'bottle_shelf', 'bottle_memo',
-            'last_drink', 'last_cast', 'last_visit_at', 'last_cast_obj',
+            'last_drink', 'last_cast', 'last_visit_at', 'last_cast_obj', 'visit_stats', 'search_score',
             'created_at', 'updated_at'
         )
-        read_only_fields = ('last_drink', 'last_cast', 'last_visit_at', 'last_cast_obj', 'created_at', 'updated_at')
+        read_only_fields = (
+            'last_drink', 'last_cast', 'last_visit_at', 'last_cast_obj', 'visit_stats', 'search_score',
+            'created_at', 'updated_at',
+        )
     
     def get_tag_names(self, obj):
-        """タグ名をカンマ区切りで返す（検索・フィルタ用）"""
-        return ', '.join(obj.tags.values_list('name', flat=True))
+        """タグ名をカンマ区切りで返す（検索・フィルタ用）。prefetch 済みならクエリしない"""
+        return ', '.join(t.name for t in obj.tags.all())
     
     def get_last_visit_at(self, obj):
-        """直近伝票から最終来店日時を算出（closed_at優先、無ければopened_at）"""
-        latest = obj.bills.order_by('-closed_at', '-opened_at').values('closed_at', 'opened_at').first()
-        if latest:
-            return latest.get('closed_at') or latest.get('opened_at')
-        return None
+        """全店舗の締め済み伝票のうち最後の closed_at"""
+        lasts = [s.last_visit_at for s in obj.stats.all() if s.last_visit_at]
+        return max(lasts) if lasts else None
+
+    def get_visit_stats(self, obj):
+        """来店数・累計・平均・初回・最終（X-Store-Id があればその店舗、無ければ全店舗合算）"""
+        request = self.context.get('request')
+        store_id = getattr(getattr(request, 'store', None), 'id', None)
+        stats = [s for s in obj.stats.all() if store_id is None or s.store_id == store_id]
+        return stats_summary(stats)
+
+    def get_search_score(self, obj):
+        """search_customers() が注釈した類似度（0〜1）"""
+        score = getattr(obj, 'similarity', None)
+        return round(score, 3) if score is not None else None
 
 
 class CustomerLogSerializer(serializers.ModelSerializer):
@@ -934,7 +1023,7 @@ class BillSerializer(serializers.ModelSerializer):
             "discount_rule",
             "manual_discounts", "manual_discount_total",
             # ---- 給与スナップショット ----
-            "payroll_snapshot", "payroll_dirty",
+            "payroll_snapshot", "payroll_dirty", "payroll_dirty_at",
             # ---- 店舗会計ルール ----
             "store_billing_rule",
         )
@@ -943,7 +1032,7 @@ class BillSerializer(serializers.ModelSerializer):
             "closed_at", "set_rounds","ext_minutes",
             "paid_total","change_due",
             "manual_discount_total",
-            "payroll_snapshot", "payroll_dirty",
+            "payroll_snapshot", "payroll_dirty", "payroll_dirty_at",
             "table_atoms", "table_label", "table_atom_ids",  # Phase2: read-only
             "store_billing_rule",
         )
@@ -1142,21 +1231,30 @@ class BillSerializer(serializers.ModelSerializer):
         st = st or 0
         return max(0, obj.paid_total - st)
 
+    @staticmethod
+    def _first_customer(obj):
+        """customers.first()（pk 最小）。一覧で prefetch 済みならそこから選ぶ"""
+        cache = getattr(obj, '_prefetched_objects_cache', None)
+        if cache is not None and 'customers' in cache:
+            return min(cache['customers'], key=lambda c: c.pk, default=None)
+        return obj.customers.first()
+
     def get_customer_display_name(self, obj):
-        first = obj.customers.first()
+        first = self._first_customer(obj)
         return first.display_name if first else ''
 
     def get_payroll_dirty(self, obj):
         """
-        payroll_dirty 判定：snapshot が存在し、
-        現在の計算ハッシュが snapshot ハッシュと異なる場合 True。
+        payroll_dirty 判定：snapshot が存在し、保存後に給与へ影響する編集があれば True。
+        書き込み時に立つマーカー（payroll_dirty_at）を見るだけで再計算はしない。
+        ハッシュでの厳密な確認は POST /bills/{id}/payroll-verify/。
         """
-        from billing.services import is_payroll_dirty
-        return is_payroll_dirty(obj)
+        from billing.payroll.snapshot import payroll_dirty_flag
+        return payroll_dirty_flag(obj)
 
     def to_representation(self, obj):
         rep = super().to_representation(obj)
-        first = obj.customers.first()
+        first = self._first_customer(obj)
         rep['customer_display_name'] = first.display_name if first else ''
         return rep
 
@@ -1876,7 +1974,8 @@ class CastGoalSerializer(serializers.ModelSerializer):
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        pr  = instance.progress()
+        # 一覧では evaluate_goals() でまとめて計算した進捗を context['progress'] で渡す
+        pr  = (self.context.get('progress') or {}).get(instance.id) or instance.progress()
         rep['progress_value']   = pr['value']
         rep['progress_ratio']   = round(pr['ratio'], 4)
         rep['progress_percent'] = pr['percent']
@@ -0,0 +1,223 @@
+"""
+billing/services/affinity.py
+
+CustomerCastAffinity（顧客×キャスト相性）を保守するサービス
+- 寄与: 締め済み伝票1枚の served_by_cast 付き明細を、伝票の全顧客 × キャストで合算したもの
+- 差分更新: 変更前後の寄与を比べ、増えた行は ON CONFLICT upsert、減った行は F 式で減算
+- 全再構築: 店舗の締め済み伝票から作り直す（バックフィル・修復用）
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillCustomer, BillItem, CustomerCastAffinity, CustomerCastAffinityDay,
+)
+from billing.services.upsert import upsert_add
+
+EMPTY = (None, {})
+
+
+def affinity_scope(bill_id):
+    """(store_id, opened_at)。未クローズ・店舗不明なら None"""
+    row = Bill.objects.filter(pk=bill_id).values_list('table__store_id', 'opened_at', 'closed_at').first()
+    if not row or not row[0] or not row[2]:
+        return None
+    return (row[0], row[1])
+
+
+def bill_affinity_lines(bill_id) -> dict:
+    """伝票1枚の寄与 {(customer_id, cast_id): (spent, item_count)}（スコープに依らない）"""
+    per_cast = defaultdict(lambda: [0, 0])
+    for cast_id, price, qty in (
+        BillItem.objects.filter(bill_id=bill_id, served_by_cast__isnull=False)
+        .values_list('served_by_cast_id', 'price', 'qty')
+    ):
+        per_cast[cast_id][0] += (price or 0) * (qty or 0)
+        per_cast[cast_id][1] += 1
+    if not per_cast:
+        return {}
+    customer_ids = BillCustomer.objects.filter(bill_id=bill_id).values_list('customer_id', flat=True)
+    return {
+        (customer_id, cast_id): tuple(v)
+        for customer_id in customer_ids
+        for cast_id, v in per_cast.items()
+    }
+
+
+def bill_affinity(bill_id):
+    """(scope, lines)。未クローズなら EMPTY"""
+    scope = affinity_scope(bill_id)
+    return (scope, bill_affinity_lines(bill_id)) if scope else EMPTY
+
+
+def _rows(state, sign):
+    """(scope, lines) → {(store_id, customer_id, cast_id, date): [spent, items, bills, opened_at]}"""
+    scope, lines = state
+    if not scope:
+        return {}
+    store_id, opened_at = scope
+    day = timezone.localdate(opened_at)
+    return {
+        (store_id, customer_id, cast_id, day): [sign * spent, sign * items, sign, opened_at]
+        for (customer_id, cast_id), (spent, items) in lines.items()
+    }
+
+
+def apply_affinity_delta(before=EMPTY, after=EMPTY) -> None:
+    """
+    伝票の寄与 before → after の差分を CustomerCastAffinity / Day に反映する。
+    before / after は bill_affinity() の戻り値（スコープが変われば旧スコープから引いて新スコープに足す）。
+    """
+    delta = _rows(before, -1)
+    for key, (spent, items, bills, opened_at) in _rows(after, 1).items():
+        row = delta.setdefault(key, [0, 0, 0, None])
+        row[0] += spent
+        row[1] += items
+        row[2] += bills
+        row[3] = opened_at
+
+    grown, shrunk = [], []
+    for key, (spent, items, bills, opened_at) in delta.items():
+        if not (spent or items or bills):
+            continue
+        if spent < 0 or items < 0 or bills < 0:
+            shrunk.append((key, spent, items, bills))
+        else:
+            grown.append((key, spent, items, bills, opened_at))
+
+    if grown:
+        _add_grown(grown)
+    if shrunk:
+        _subtract_shrunk(shrunk)
+
+
+def _add_grown(grown) -> None:
+    # 通算行を upsert（最終来店は大きい方を残す）→ 返ってきた id で日別行を upsert
+    ids = upsert_add(
+        CustomerCastAffinity,
+        [
+            {
+                'store_id': store_id, 'customer_id': customer_id, 'cast_id': cast_id,
+                'spent_total': spent, 'item_count': items, 'bill_count': bills,
+                'last_served_at': opened_at if bills else None,
+            }
+            for (store_id, customer_id, cast_id, _), spent, items, bills, opened_at in grown
+        ],
+        unique_fields=('store', 'customer', 'cast'),
+        add_fields=('spent_total', 'item_count', 'bill_count'),
+        max_fields=('last_served_at',),
+        returning='id',
+    )
+    upsert_add(
+        CustomerCastAffinityDay,
+        [
+            {'affinity_id': affinity_id, 'date': day, 'spent': spent, 'item_count': items, 'bill_count': bills}
+            for affinity_id, ((_, _, _, day), spent, items, bills, _) in zip(ids, grown)
+        ],
+        unique_fields=('affinity', 'date'),
+        add_fields=('spent', 'item_count', 'bill_count'),
+    )
+
+
+def _subtract_shrunk(shrunk) -> None:
+    with transaction.atomic():
+        for (store_id, customer_id, cast_id, day), spent, items, bills in shrunk:
+            affinity = CustomerCastAffinity.objects.filter(store_id=store_id, customer_id=customer_id, cast_id=cast_id)
+            affinity.update(
+                spent_total=F('spent_total') + spent,
+                item_count=F('item_count') + items,
+                bill_count=F('bill_count') + bills,
+            )
+            CustomerCastAffinityDay.objects.filter(affinity__in=affinity, date=day).update(
+                spent=F('spent') + spent,
+                item_count=F('item_count') + items,
+                bill_count=F('bill_count') + bills,
+            )
+            CustomerCastAffinityDay.objects.filter(affinity__in=affinity, date=day, bill_count=0).delete()
+            if bills:
+                # 伝票が外れたときだけ最終来店を取り直す（減算では最大値を保てない）
+                affinity.update(last_served_at=_last_served_at(store_id, customer_id, cast_id))
+        CustomerCastAffinity.objects.filter(
+            bill_count=0,
+            store_id__in={k[0] for k, *_ in shrunk},
+            customer_id__in={k[1] for k, *_ in shrunk},
+        ).delete()
+
+
+def _last_served_at(store_id, customer_id, cast_id):
+    return (
+        Bill.objects.filter(
+            table__store_id=store_id, closed_at__isnull=False,
+            billcustomer__customer_id=customer_id, items__served_by_cast_id=cast_id,
+        ).aggregate(v=Max('opened_at'))['v']
+    )
+
+
+def rebuild_customer_cast_affinity(store_id: int) -> int:
+    """店舗の CustomerCastAffinity を締め済み伝票から作り直す。作成した通算行数を返す"""
+    per_bill = (
+        BillItem.objects.filter(
+            bill__table__store_id=store_id, bill__closed_at__isnull=False,
+            served_by_cast__isnull=False, bill__billcustomer__isnull=False,
+        )
+        .values('bill__billcustomer__customer_id', 'served_by_cast_id', 'bill_id', 'bill__opened_at')
+        .annotate(spent=Sum(F('price') * F('qty')), items=Count('id'))
+        .order_by()
+    )
+
+    totals = {}
+    days = defaultdict(lambda: [0, 0, 0])
+    for r in per_bill.iterator(chunk_size=2000):
+        key = (r['bill__billcustomer__customer_id'], r['served_by_cast_id'])
+        opened_at = r['bill__opened_at']
+        t = totals.setdefault(key, [0, 0, 0, opened_at])
+        t[0] += r['spent'] or 0
+        t[1] += r['items']
+        t[2] += 1
+        t[3] = max(t[3], opened_at)
+        d = days[(key, timezone.localdate(opened_at))]
+        d[0] += r['spent'] or 0
+        d[1] += r['items']
+        d[2] += 1
+
+    with transaction.atomic():
+        CustomerCastAffinity.objects.filter(store_id=store_id).delete()
+        created = CustomerCastAffinity.objects.bulk_create(
+            [
+                CustomerCastAffinity(
+                    store_id=store_id, customer_id=customer_id, cast_id=cast_id,
+                    spent_total=spent, item_count=items, bill_count=bills, last_served_at=last,
+                )
+                for (customer_id, cast_id), (spent, items, bills, last) in totals.items()
+            ],
+            batch_size=1000,
+        )
+        ids = dict(zip(totals, (a.pk for a in created)))
+        if None in ids.values():
+            # pk を返さない DB 向け
+            ids = {
+                (c, k): pk for pk, c, k in
+                CustomerCastAffinity.objects.filter(store_id=store_id).values_list('pk', 'customer_id', 'cast_id')
+            }
+        CustomerCastAffinityDay.objects.bulk_create(
+            [
+                CustomerCastAffinityDay(affinity_id=ids[key], date=day, spent=spent, item_count=items, bill_count=bills)
+                for (key, day), (spent, items, bills) in days.items()
+            ],
+            batch_size=1000,
+        )
+    return len(totals)
+
+
+def affinity_rows(store_id, days: int = 30):
+    """店舗の相性行（直近 days 日の売上 spent_recent を注釈）"""
+    since = timezone.localdate() - timedelta(days=days)
+    return (
+        CustomerCastAffinity.objects.filter(store_id=store_id)
+        .annotate(spent_recent=Coalesce(Sum('days__spent', filter=Q(days__date__gte=since)), 0))
+    )
@@ -1,6 +1,8 @@
 # billing/services/backrate.py（新規ファイル）
+import uuid
 from decimal import Decimal
 from typing import Optional
+from django.core.cache import cache
 from billing.models import ItemCategory, Store, Cast, CastCategoryRate
 
 # stay_type: 'free' | 'nom' | 'in' | 'dohan'
@@ -11,50 +13,25 @@ _STAYKEY = {
     'dohan': 'dohan',
 }
 
-def resolve_back_rate(*, store: Store, category: Optional[ItemCategory], cast: Optional[Cast], stay_type: str) -> Decimal:
+# (free, nomination, inhouse) の順で並べたタプルのインデックス
+_LANE_INDEX = {'free': 0, 'nomination': 1, 'inhouse': 2}
+
+
+def _pick_rate(key: str, ccr, cast_ovr, cat_rates, store) -> Decimal:
     """
-    優先順位:
-      1) CastCategoryRate（キャスト×カテゴリ）
-      2) Cast override（free/nomination/inhouse）
-      3) ItemCategory（カテゴリ基準）
-      4) Store 基準（今回追加：free/nomination/inhouse/dohan）
-      5) 0
+    優先順位の本体（resolve_back_rate / BackRateResolver 共通）。
+    ccr / cast_ovr / cat_rates は (free, nomination, inhouse) のタプル or None。
     """
-    key = _STAYKEY.get(stay_type, 'free')
+    idx = _LANE_INDEX.get(key)
 
-    # 1) CastCategoryRate
-    if cast and category:
-        ccr = CastCategoryRate.objects.filter(cast=cast, category=category).only(
-            'rate_free', 'rate_nomination', 'rate_inhouse'
-        ).first()
-        if ccr:
-            if key == 'free' and ccr.rate_free is not None:
-                return Decimal(ccr.rate_free)
-            if key == 'nomination' and ccr.rate_nomination is not None:
-                return Decimal(ccr.rate_nomination)
-            if key == 'inhouse' and ccr.rate_inhouse is not None:
-                return Decimal(ccr.rate_inhouse)
-
-    # 2) Cast override
-    if cast:
-        # dohan は個別override列がないためスキップ
-        if key == 'free' and cast.back_rate_free_override is not None:
-            return Decimal(cast.back_rate_free_override)
-        if key == 'nomination' and cast.back_rate_nomination_override is not None:
-            return Decimal(cast.back_rate_nomination_override)
-        if key == 'inhouse' and cast.back_rate_inhouse_override is not None:
-            return Decimal(cast.back_rate_inhouse_override)
-
-    # 3) ItemCategory 基準
-    if category:
-        if key == 'free' and category.back_rate_free is not None:
-            return Decimal(category.back_rate_free)
-        if key == 'nomination' and category.back_rate_nomination is not None:
-            return Decimal(category.back_rate_nomination)
-        if key == 'inhouse' and category.back_rate_inhouse is not None:
-            return Decimal(category.back_rate_inhouse)
-
-    # 4) Store 基準（今回の追加でここが効くようになる）
+    # 1) CastCategoryRate / 2) Cast override / 3) ItemCategory 基準
+    #    dohan は個別列がないため 4) へ
+    if idx is not None:
+        for lane in (ccr, cast_ovr, cat_rates):
+            if lane is not None and lane[idx] is not None:
+                return Decimal(lane[idx])
+
+    # 4) Store 基準
     if store:
         if key == 'free':
             return Decimal(store.back_rate_free_default or 0)
@@ -67,3 +44,148 @@ def resolve_back_rate(*, store: Store, category: Optional[ItemCategory], cast: O
 
     # 5) fallback
     return Decimal('0.00')
+
+
+def _cast_lanes(cast):
+    return (
+        cast.back_rate_free_override,
+        cast.back_rate_nomination_override,
+        cast.back_rate_inhouse_override,
+    )
+
+
+def _category_lanes(category):
+    return (
+        category.back_rate_free,
+        category.back_rate_nomination,
+        category.back_rate_inhouse,
+    )
+
+
+def resolve_back_rate(*, store: Store, category: Optional[ItemCategory], cast: Optional[Cast], stay_type: str) -> Decimal:
+    """
+    優先順位:
+      1) CastCategoryRate（キャスト×カテゴリ）
+      2) Cast override（free/nomination/inhouse）
+      3) ItemCategory（カテゴリ基準）
+      4) Store 基準（今回追加：free/nomination/inhouse/dohan）
+      5) 0
+
+    ※ 1件ごとに CastCategoryRate を引くため、ループ内では BackRateResolver を使うこと。
+    """
+    key = _STAYKEY.get(stay_type, 'free')
+
+    ccr = None
+    if cast and category:
+        ccr = CastCategoryRate.objects.filter(cast=cast, category=category).values_list(
+            'rate_free', 'rate_nomination', 'rate_inhouse'
+        ).first()
+
+    return _pick_rate(
+        key,
+        ccr,
+        _cast_lanes(cast) if cast else None,
+        _category_lanes(category) if category else None,
+        store,
+    )
+
+
+# ─────────────────────────────────────────────
+# 店舗単位のバック率リゾルバ（メモリ上で解決）
+# ─────────────────────────────────────────────
+_VERSION_KEY = 'billing:backrate:ver:{}'
+_GLOBAL = 'global'   # ItemCategory は店舗に属さないため全店共通のバージョン
+_RESOLVERS: dict = {}
+
+
+def _version_of(scope) -> str:
+    key = _VERSION_KEY.format(scope)
+    ver = cache.get(key)
+    if ver is None:
+        ver = uuid.uuid4().hex
+        if not cache.add(key, ver, None):
+            ver = cache.get(key) or ver
+    return ver
+
+
+def bump_back_rate_version(store_id=None) -> None:
+    """
+    バック率の元データが変わったら呼ぶ（signals から）。
+    store_id=None は全店共通（ItemCategory）の変更。
+    """
+    cache.set(_VERSION_KEY.format(store_id or _GLOBAL), uuid.uuid4().hex, None)
+
+
+class BackRateResolver:
+    """
+    1店舗分の CastCategoryRate / Cast override / ItemCategory 基準 / Store 基準を
+    まとめて読み込み、(cast, category, stay_type) をメモリ上で解決する。
+    優先順位は resolve_back_rate と同一。
+    """
+
+    def __init__(self, store: Store):
+        self.store = store
+        store_id = getattr(store, 'id', None)
+
+        self._categories = {
+            row[0]: row[1:]
+            for row in ItemCategory.objects.values_list(
+                'code', 'back_rate_free', 'back_rate_nomination', 'back_rate_inhouse'
+            )
+        }
+        self._casts = {
+            row[0]: row[1:]
+            for row in Cast.objects.filter(store_id=store_id).values_list(
+                'id', 'back_rate_free_override', 'back_rate_nomination_override', 'back_rate_inhouse_override'
+            )
+        }
+        self._ccr = {}
+        for row in CastCategoryRate.objects.filter(cast__store_id=store_id).values_list(
+            'cast_id', 'category_id', 'rate_free', 'rate_nomination', 'rate_inhouse'
+        ):
+            self._ccr[(row[0], row[1])] = row[2:]
+        # 他店所属キャスト等、初回ロード外の cast_id（1キャスト1クエリで遅延ロード）
+        self._ccr_loaded = set(self._casts)
+
+    def _load_ccr_for(self, cast_id):
+        for row in CastCategoryRate.objects.filter(cast_id=cast_id).values_list(
+            'category_id', 'rate_free', 'rate_nomination', 'rate_inhouse'
+        ):
+            self._ccr[(cast_id, row[0])] = row[1:]
+        self._ccr_loaded.add(cast_id)
+
+    def resolve(self, *, category: Optional[ItemCategory], cast: Optional[Cast], stay_type: str) -> Decimal:
+        key = _STAYKEY.get(stay_type, 'free')
+        cast_id = getattr(cast, 'id', None)
+        cat_code = getattr(category, 'pk', None)
+
+        ccr = None
+        if cast_id and cat_code:
+            if cast_id not in self._ccr_loaded:
+                self._load_ccr_for(cast_id)
+            ccr = self._ccr.get((cast_id, cat_code))
+
+        cast_ovr = None
+        if cast:
+            cast_ovr = self._casts.get(cast_id) or _cast_lanes(cast)
+
+        cat_rates = None
+        if category:
+            cat_rates = self._categories.get(cat_code) or _category_lanes(category)
+
+        return _pick_rate(key, ccr, cast_ovr, cat_rates, self.store)
+
+
+def get_back_rate_resolver(store: Store) -> BackRateResolver:
+    """
+    店舗ごとの BackRateResolver を返す（プロセス内キャッシュ）。
+    バージョンは Django cache に持つため、別プロセスでの保存でも無効化される。
+    """
+    store_id = getattr(store, 'id', None)
+    version = (_version_of(_GLOBAL), _version_of(store_id))
+    hit = _RESOLVERS.get(store_id)
+    if hit and hit[0] == version:
+        return hit[1]
+    resolver = BackRateResolver(store)
+    _RESOLVERS[store_id] = (version, resolver)
+    return resolver
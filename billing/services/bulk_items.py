@@ -0,0 +1,139 @@
+"""
+billing/services/bulk_items.py
+
+伝票明細の一括追加（1卓でまとめて注文されたときのまとめ書き）
+- BillItem は bulk_create で1回、KDS チケットも全明細分を1回で作成
+- 退店予定（SET/EXT）と金額の再計算は最後に1回だけ
+- 途中で失敗したら全件ロールバック（all-or-nothing）
+
+bulk_create は save() / post_save を通らないので、BillItem.save と signals が
+1件ずつやっている処理（既定値の補完・KDS・締め済み伝票の集計差分・顧客×キャスト相性の差分・
+目標の再評価マーカー）をここでまとめて行う。
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from billing.kds_broker import publish_ticket_event
+from billing.models import (
+    ROUTE_INHERIT, ROUTE_NONE, Bill, BillItem, BillItemCast, OrderTicket,
+    _recalc_bill_after_items_change,
+)
+from billing.payroll.snapshot import mark_payroll_dirty
+from billing.services.affinity import EMPTY, apply_affinity_delta, bill_affinity
+from billing.services.cast_summary import apply_delta, bill_contribution, bill_scope
+from billing.services.goal_progress import touch_closed_bills
+from billing.services.pl_snapshot import mark_daily_pl_stale
+
+
+def kds_route_for(item_master) -> str:
+    """商品の実ルート（inherit ならカテゴリの route）。KDS 対象外は ROUTE_NONE"""
+    if not item_master:
+        return ROUTE_NONE
+    route = item_master.route
+    if route == ROUTE_INHERIT:
+        route = getattr(item_master.category, 'route', ROUTE_NONE)
+    return route or ROUTE_NONE
+
+
+def _is_set_or_ext(item: BillItem) -> bool:
+    """BillItem.save と同じ判定（カテゴリコードを正とし、後方互換で部分一致）"""
+    cat = getattr(item.item_master, 'category', None)
+    cat_code = (getattr(cat, 'code', '') or '').lower()
+    code = (item.code or '').lower()
+    return cat_code in ('set', 'ext', 'extension') or 'set' in code or 'extension' in code
+
+
+def _prepare(item: BillItem) -> BillItem:
+    """BillItem.save の前処理と同じ補完"""
+    item.is_nomination = bool(item.is_nomination)
+    item.is_inhouse = bool(item.is_inhouse)
+    item.is_dohan = bool(item.is_dohan)
+    im = item.item_master
+    if im:
+        item.name = item.name or im.name
+        if item.price is None:
+            item.price = im.price_regular
+        if im.exclude_from_payout:
+            item.exclude_from_payout = True
+    return item
+
+
+def _publish_created(tickets) -> None:
+    """ステーション（route）ごとに1イベントで配信"""
+    by_route = defaultdict(list)
+    for t in tickets:
+        by_route[t.route].append(t)
+    for group in by_route.values():
+        publish_ticket_event(group[0], 'created', ids=[t.pk for t in group if t.pk])
+
+
+def add_bill_items(bill: Bill, rows: list[dict]) -> list[BillItem]:
+    """
+    rows（BillItemSerializer の validated_data 相当）をまとめて bill に追加する。
+
+    Args:
+        bill: table__store を select_related 済みの伝票
+        rows: [{item_master, qty, price, served_by_cast, served_by_cast_ids, ...}]
+    Returns:
+        作成した BillItem（rows と同じ順）
+    """
+    if not rows:
+        return []
+
+    with transaction.atomic():
+        # 締め済み伝票は CastDailySummary を差分で保守しているので、変更前の寄与を取っておく
+        scope = bill_scope(bill.pk) if bill.closed_at else None
+        before = bill_contribution(bill.pk) if scope else None
+        affinity_before = bill_affinity(bill.pk) if bill.closed_at else EMPTY
+
+        cast_ids_per_item = []
+        items = []
+        for row in rows:
+            row = dict(row)
+            cast_ids = row.pop('served_by_cast_ids', None)
+            if cast_ids is not None:
+                row['served_by_cast_id'] = cast_ids[0] if cast_ids else None
+                row.pop('served_by_cast', None)
+            cast_ids_per_item.append(cast_ids)
+            items.append(_prepare(BillItem(bill=bill, **row)))
+
+        items = BillItem.objects.bulk_create(items)
+
+        BillItemCast.objects.bulk_create([
+            BillItemCast(bill_item=item, cast_id=cast_id)
+            for item, cast_ids in zip(items, cast_ids_per_item)
+            for cast_id in cast_ids or ()
+        ])
+
+        # KDS チケット（1品=1枚）を全明細分まとめて作成
+        store_id = bill.table.store_id
+        tickets = OrderTicket.objects.bulk_create([
+            OrderTicket(
+                bill_item=item,
+                store_id=store_id,
+                route=route,
+                state=OrderTicket.STATE_NEW,
+                created_by_cast=bool(item.served_by_cast_id),
+            )
+            for item in items
+            if (route := kds_route_for(item.item_master)) != ROUTE_NONE
+            for _ in range(int(item.qty or 1))
+        ])
+
+        if bill.closed_at is None:
+            if any(_is_set_or_ext(item) for item in items):
+                bill.update_expected_out(save=True)
+        else:
+            if scope:
+                apply_delta(scope, before=before, after=bill_contribution(bill.pk))
+                mark_daily_pl_stale(scope)
+            if affinity_before is not EMPTY:
+                apply_affinity_delta(affinity_before, bill_affinity(bill.pk))
+            mark_payroll_dirty(bill.pk)
+            touch_closed_bills([bill.pk])
+
+        _recalc_bill_after_items_change(bill)
+        _publish_created(tickets)
+
+    return items
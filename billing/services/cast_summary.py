@@ -0,0 +1,229 @@
+"""
+billing/services/cast_summary.py
+
+CastDailySummary（キャスト×日×店舗）の売上列を保守するサービス
+- 差分更新: 伝票1枚の寄与（cast × 区分別の売上・同伴売上・本指名/同伴伝票数）を変更前後で比較し、差分だけを F 式で加減算
+- 全再構築: 店舗×日を Bill / BillItem / CastShift から生集計し直す（修復用）
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from billing.models import Bill, BillCastStay, BillItem, CastDailySummary, CastShift
+from billing.services.upsert import upsert_add
+
+SALES_COLUMNS = ('sales_free', 'sales_in', 'sales_nom', 'sales_champ')
+# Garden 暫定ランク用の集計（同伴伝票での自分の売上・本指名/同伴の伝票数）
+TALLY_COLUMNS = ('sales_dohan', 'nom_bills', 'dohan_bills')
+CONTRIBUTION_COLUMNS = SALES_COLUMNS + TALLY_COLUMNS
+CHAMP_CODES = ('champagne', 'original-champagne')
+
+
+def bill_scope(bill_id):
+    """(store_id, work_date)。work_date は closed_at の現地日付（closed_at__date と同じ）。未クローズ・店舗不明なら None"""
+    row = (
+        Bill.objects.filter(pk=bill_id)
+        .values_list('table__store_id', 'closed_at')
+        .first()
+    )
+    if not row or not row[0] or not row[1]:
+        return None
+    return (row[0], timezone.localdate(row[1]))
+
+
+def _lane_of(stay_type):
+    if stay_type == 'nom':
+        return 'sales_nom'
+    if stay_type == 'in':
+        return 'sales_in'
+    return 'sales_free'
+
+
+def _latest_stay_types(stays):
+    """cast_id → 伝票内で最新（entered_at 最大）の stay_type"""
+    latest = {}
+    for cast_id, entered_at, stay_type in stays:
+        if not cast_id:
+            continue
+        cur = latest.get(cast_id)
+        if cur is None or (entered_at and entered_at > cur[0]):
+            latest[cast_id] = (entered_at, stay_type)
+    return {cid: st for cid, (_, st) in latest.items()}
+
+
+def _accumulate(sums, stays, items):
+    """stays = [(cast_id, entered_at, stay_type)], items = [(served_by_cast_id, price, qty, category_code)]（伝票1枚分）"""
+    stay_types = _latest_stay_types(stays)
+    # 本指名・同伴は区分の最新に依らず「その伝票で一度でも付いたか」で数える（Garden 制度）
+    cast_ids_by_type = defaultdict(set)
+    for cast_id, _, stay_type in stays:
+        if cast_id:
+            cast_ids_by_type[stay_type].add(cast_id)
+    dohan_casts = cast_ids_by_type['dohan']
+
+    for cast_id, price, qty, cat_code in items:
+        if not cast_id:
+            continue
+        amt = int((price or 0) * (qty or 0))
+        row = sums[cast_id]
+        row[_lane_of(stay_types.get(cast_id, 'free'))] += amt
+        if cat_code in CHAMP_CODES:
+            row['sales_champ'] += amt
+        if cast_id in dohan_casts:
+            row['sales_dohan'] += amt
+
+    for cast_id in cast_ids_by_type['nom']:
+        sums[cast_id]['nom_bills'] += 1
+    for cast_id in dohan_casts:
+        sums[cast_id]['dohan_bills'] += 1
+
+
+def _empty_row():
+    return dict.fromkeys(CONTRIBUTION_COLUMNS, 0)
+
+
+def bill_contribution(bill_id) -> dict:
+    """
+    伝票1枚が CastDailySummary に与える寄与 {cast_id: {sales_*, sales_dohan, nom_bills, dohan_bills}}。
+    区分は伝票内の最新 stay、金額は price × qty（rebuild_cast_daily_summaries と同じ規則）。
+    """
+    sums = defaultdict(_empty_row)
+    _accumulate(
+        sums,
+        list(
+            BillCastStay.objects.filter(bill_id=bill_id)
+            .values_list('cast_id', 'entered_at', 'stay_type')
+        ),
+        BillItem.objects.filter(bill_id=bill_id)
+        .values_list('served_by_cast_id', 'price', 'qty', 'item_master__category__code'),
+    )
+    return dict(sums)
+
+
+def apply_delta(scope, before: dict | None = None, after: dict | None = None) -> None:
+    """
+    scope=(store_id, work_date) の CastDailySummary に after - before を加算する。
+    UPDATE ... SET col = col + delta なので同時更新でも取りこぼさない。
+    """
+    if not scope:
+        return
+    before = before or {}
+    after = after or {}
+    store_id, work_date = scope
+
+    shrunk, grown = [], []
+    for cast_id in set(before) | set(after):
+        old = before.get(cast_id) or {}
+        new = after.get(cast_id) or {}
+        delta = {
+            col: new.get(col, 0) - old.get(col, 0)
+            for col in CONTRIBUTION_COLUMNS
+            if new.get(col, 0) != old.get(col, 0)
+        }
+        if not delta:
+            continue
+        if any(v < 0 for v in delta.values()):
+            # 減算は CHECK 制約（PositiveInteger）と INSERT 値が衝突するので UPDATE で
+            shrunk.append(cast_id)
+            _add(store_id, cast_id, work_date, delta)
+        else:
+            grown.append({
+                'store_id': store_id, 'cast_id': cast_id, 'work_date': work_date,
+                **{col: delta.get(col, 0) for col in CONTRIBUTION_COLUMNS},
+            })
+
+    # 加算のみの行はまとめて1文の ON CONFLICT upsert
+    upsert_add(
+        CastDailySummary, grown,
+        unique_fields=('store', 'cast', 'work_date'),
+        add_fields=CONTRIBUTION_COLUMNS,
+    )
+
+    # 売上も勤務も無くなった行は全再構築と同じく消しておく
+    if shrunk:
+        CastDailySummary.objects.filter(
+            store_id=store_id, work_date=work_date, cast_id__in=shrunk,
+            worked_min=0, payroll=0,
+            **dict.fromkeys(CONTRIBUTION_COLUMNS, 0),
+        ).delete()
+
+
+def _add(store_id, cast_id, work_date, delta: dict) -> None:
+    qs = CastDailySummary.objects.filter(store_id=store_id, cast_id=cast_id, work_date=work_date)
+    updates = {col: F(col) + v for col, v in delta.items()}
+    if qs.update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            CastDailySummary.objects.create(
+                store_id=store_id, cast_id=cast_id, work_date=work_date,
+                **{col: max(v, 0) for col, v in delta.items()},
+            )
+    except IntegrityError:
+        # 同時に別プロセスが作成した → 加算で合流
+        qs.update(**updates)
+
+
+def rebuild_cast_daily_summaries(store_id: int, work_date) -> None:
+    """
+    該当 store × 日 の CastDailySummary を Bill / BillItem / CastShift から“生集計”で再構築する（修復用）。
+    - 売上は BillItem から cast × stay_type 別に合算
+    - 勤務分・時給は CastShift.worked_min / payroll_amount を合算（同日・同店）
+    """
+    if not store_id or not work_date:
+        return
+
+    # 1) 当日・当店のクローズ済 Bill が対象
+    bill_ids = list(
+        Bill.objects.filter(table__store_id=store_id, closed_at__date=work_date)
+        .values_list('id', flat=True)
+    )
+
+    # 2) cast × 区分の金額合算（stay 区分は伝票ごとに決まる）
+    stays_by_bill = defaultdict(list)
+    for bill_id, *row in BillCastStay.objects.filter(bill_id__in=bill_ids).values_list(
+        'bill_id', 'cast_id', 'entered_at', 'stay_type'
+    ):
+        stays_by_bill[bill_id].append(row)
+    items_by_bill = defaultdict(list)
+    for bill_id, *row in BillItem.objects.filter(bill_id__in=bill_ids).values_list(
+        'bill_id', 'served_by_cast_id', 'price', 'qty', 'item_master__category__code'
+    ):
+        items_by_bill[bill_id].append(row)
+
+    sums = defaultdict(_empty_row)
+    for bill_id in bill_ids:
+        _accumulate(sums, stays_by_bill[bill_id], items_by_bill[bill_id])
+
+    # 3) 勤務分・時給（CastShift 合算）
+    shifts = {
+        cid: (worked, pay)
+        for cid, worked, pay in CastShift.objects
+        .filter(store_id=store_id, clock_in__date=work_date, clock_out__isnull=False)
+        .values('cast_id')
+        .annotate(
+            worked=Coalesce(Sum('worked_min'), Value(0)),
+            pay=Coalesce(Sum('payroll_amount'), Value(0)),
+        )
+        .values_list('cast_id', 'worked', 'pay')
+    }
+
+    # 4) 既存の当日分を削除 → 再投入
+    with transaction.atomic():
+        CastDailySummary.objects.filter(store_id=store_id, work_date=work_date).delete()
+        bulks = []
+        for cid in set(sums) | set(shifts):
+            worked, pay = shifts.get(cid, (0, 0))
+            bulks.append(CastDailySummary(
+                store_id=store_id,
+                cast_id=cid,
+                work_date=work_date,
+                worked_min=int(worked),
+                payroll=int(pay),
+                **{col: int(v) for col, v in sums.get(cid, _empty_row()).items()},
+            ))
+        if bulks:
+            CastDailySummary.objects.bulk_create(bulks)
@@ -7,8 +7,14 @@
     - AUTO_SET_60: 必ず qty=1
     - AUTO_EXT_30: qty = ceil(max(0, stay_min - 60) / 30)
 - 何回実行しても同じ状態になる（冪等）
+
+reconcile_customer_charges は1伝票分（編集時に呼ばれる）、
+reconcile_open_bills は全店舗の OPEN 伝票をまとめて1パスで処理する（定期実行用）。
 """
 import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
 
 from django.db import transaction
@@ -28,6 +34,19 @@ def _minutes_between(start: datetime, end: datetime) -> int:
     return max(0, int((end - start).total_seconds() // 60))
 
 
+def _target_quantities(bc, now) -> tuple[int, int]:
+    """BillCustomer（arrived_at 確定済み）の (SET 数量, 延長数量)"""
+    end_at = bc.left_at or now
+    stay_min = _minutes_between(bc.arrived_at, end_at) if end_at > bc.arrived_at else 0
+
+    # SET は必ず 1
+    set_qty = 1
+    # 延長（30分単位・切り上げ、上限99）
+    over = max(0, stay_min - 60)
+    ext_qty = min(_ceil_div(over, 30), 99) if over > 0 else 0
+    return set_qty, ext_qty
+
+
 def _get_store(bill):
     """bill から store を解決（table FK → tables M2M の順で探索）"""
     if bill.table_id and hasattr(bill.table, 'store'):
@@ -164,14 +183,7 @@ def reconcile_customer_charges(bill_id: int, now=None) -> None:
             # arrived_at 未確定 → 起票しない
             continue
 
-        end_at = bc.left_at or now
-        stay_min = _minutes_between(bc.arrived_at, end_at) if end_at > bc.arrived_at else 0
-
-        # SET は必ず 1
-        set_qty = 1
-        # 延長（30分単位・切り上げ、上限99）
-        over = max(0, stay_min - 60)
-        ext_qty = min(_ceil_div(over, 30), 99) if over > 0 else 0
+        set_qty, ext_qty = _target_quantities(bc, now)
 
         changed |= _sync_auto_item(bill, bc.customer_id, auto_set, set_qty)
         changed |= _sync_auto_item(bill, bc.customer_id, auto_ext, ext_qty)
@@ -196,3 +208,160 @@ def reconcile_customer_charges(bill_id: int, now=None) -> None:
         from billing.models import _recalc_bill_after_items_change
         bill.update_expected_out(save=True)
         _recalc_bill_after_items_change(bill)
+
+
+@dataclass
+class ReconcileTick:
+    bills: int = 0          # 対象にした OPEN 伝票数
+    touched: int = 0        # 自動行に変更があった伝票数
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    elapsed_ms: int = 0
+
+
+def _store_ids_of(bill_rows) -> dict:
+    """{bill_id: store_id}（table FK → tables M2M の順、_get_store と同じ）"""
+    from billing.models import Bill
+
+    stores = {bid: sid for bid, sid in bill_rows if sid}
+    missing = [bid for bid, sid in bill_rows if not sid]
+    if missing:
+        through = Bill.tables.through
+        for bid, sid in (
+            through.objects.filter(bill_id__in=missing)
+            .order_by('bill_id', 'id')
+            .values_list('bill_id', 'table__store_id')
+        ):
+            stores.setdefault(bid, sid)
+    return stores
+
+
+def _auto_masters(store_ids) -> dict:
+    """{store_id: (auto_set, auto_ext)}。未作成の店舗だけ _ensure_auto_master で作る"""
+    from billing.models import ItemMaster, StoreSeatSetting, Store
+
+    found = defaultdict(dict)
+    for im in ItemMaster.objects.filter(store_id__in=store_ids, code__in=(AUTO_SET_CODE, AUTO_EXT_CODE)):
+        found[im.store_id][im.code] = im
+
+    masters = {}
+    lacking = [sid for sid in store_ids if len(found[sid]) < 2]
+    if lacking:
+        seat = {}
+        for st in StoreSeatSetting.objects.filter(store_id__in=lacking).order_by('-id'):
+            seat[st.store_id] = st    # reconcile_customer_charges の .first() と同じく最小 id が残る
+        for store in Store.objects.filter(id__in=lacking):
+            st = seat.get(store.id)
+            found[store.id][AUTO_SET_CODE] = found[store.id].get(AUTO_SET_CODE) or _ensure_auto_master(
+                store, AUTO_SET_CODE, 'set', 'セット（60分）', 60, (st.charge_per_person or 0) if st else 0,
+            )
+            found[store.id][AUTO_EXT_CODE] = found[store.id].get(AUTO_EXT_CODE) or _ensure_auto_master(
+                store, AUTO_EXT_CODE, 'extension', '延長（30分）', 30, (st.extension_30_price or 0) if st else 0,
+            )
+
+    for sid in store_ids:
+        auto_set, auto_ext = found[sid].get(AUTO_SET_CODE), found[sid].get(AUTO_EXT_CODE)
+        if auto_set is not None and auto_ext is not None:
+            masters[sid] = (auto_set, auto_ext)
+    return masters
+
+
+def reconcile_open_bills(now=None, store_ids=None) -> ReconcileTick:
+    """
+    全店舗（store_ids 指定時はその店舗）の OPEN 伝票について AUTO_SET / AUTO_EXT を同期する。
+    reconcile_customer_charges と同じ結果になるが、
+    - 伝票・BillCustomer・自動行はそれぞれ1クエリで読み、目標数量はメモリ上で計算
+    - 差分だけを bulk_create / bulk_update / 一括 delete で書く
+    - 金額の再計算は変更があった伝票だけ
+    編集中（行ロック中）の伝票は skip_locked で飛ばす（その編集側で reconcile される）。
+    """
+    from billing.models import Bill, BillCustomer, BillItem, _recalc_bill_after_items_change
+
+    started = time.monotonic()
+    now = now or timezone.now()
+    tick = ReconcileTick()
+
+    with transaction.atomic():
+        bills = Bill.objects.select_for_update(skip_locked=True, of=('self',)).filter(closed_at__isnull=True)
+        if store_ids is not None:
+            bills = bills.filter(table__store_id__in=store_ids)
+        store_of = _store_ids_of(list(bills.values_list('id', 'table__store_id')))
+        masters = _auto_masters(sorted(set(store_of.values())))
+        store_of = {bid: sid for bid, sid in store_of.items() if sid in masters}
+        tick.bills = len(store_of)
+        if not store_of:
+            tick.elapsed_ms = int((time.monotonic() - started) * 1000)
+            return tick
+
+        # 目標数量: {(bill_id, customer_id, master_id): qty}
+        targets = {}
+        active = defaultdict(set)     # bill_id → 現在の顧客（未着席を含む）
+        for bc in BillCustomer.objects.filter(bill_id__in=store_of).only('bill_id', 'customer_id', 'arrived_at', 'left_at'):
+            if not bc.customer_id:
+                continue
+            active[bc.bill_id].add(bc.customer_id)
+            if not bc.arrived_at:
+                continue
+            auto_set, auto_ext = masters[store_of[bc.bill_id]]
+            set_qty, ext_qty = _target_quantities(bc, now)
+            targets[(bc.bill_id, bc.customer_id, auto_set.id)] = set_qty
+            targets[(bc.bill_id, bc.customer_id, auto_ext.id)] = ext_qty
+
+        master_ids = {im.id for pair in masters.values() for im in pair}
+        existing = defaultdict(list)
+        for row in (
+            BillItem.objects.filter(bill_id__in=store_of, item_master_id__in=master_ids)
+            .order_by('id').values('id', 'bill_id', 'customer_id', 'item_master_id', 'qty')
+        ):
+            existing[(row['bill_id'], row['customer_id'], row['item_master_id'])].append(row)
+
+        to_create, to_update, to_delete = [], [], []
+        touched = set()
+        for key, rows in existing.items():
+            bill_id, customer_id, _ = key
+            if customer_id not in active[bill_id]:
+                # 現在の BillCustomer にいない顧客の自動行（顧客差し替え）
+                to_delete += [r['id'] for r in rows]
+                touched.add(bill_id)
+                continue
+            if key not in targets:
+                continue    # arrived_at 未確定の顧客は触らない
+            qty = targets[key]
+            if qty <= 0:
+                to_delete += [r['id'] for r in rows]
+                touched.add(bill_id)
+                continue
+            first, extras = rows[0], rows[1:]
+            if first['qty'] != qty:
+                to_update.append(BillItem(id=first['id'], qty=qty))
+                touched.add(bill_id)
+            if extras:
+                to_delete += [r['id'] for r in extras]
+                touched.add(bill_id)
+
+        by_id = {im.id: im for pair in masters.values() for im in pair}
+        for key, qty in targets.items():
+            if qty > 0 and key not in existing:
+                bill_id, customer_id, master_id = key
+                im = by_id[master_id]
+                to_create.append(BillItem(
+                    bill_id=bill_id, customer_id=customer_id, item_master=im,
+                    name=im.name, price=im.price_regular, qty=qty, exclude_from_payout=True,
+                ))
+                touched.add(bill_id)
+
+        BillItem.objects.bulk_create(to_create, batch_size=500)
+        BillItem.objects.bulk_update(to_update, ['qty'], batch_size=500)
+        if to_delete:
+            BillItem.objects.filter(id__in=to_delete).delete()
+
+        # 変更があった伝票だけ退店予定・金額を更新
+        for bill in Bill.objects.filter(id__in=touched).select_related('table__store'):
+            bill.update_expected_out(save=True)
+            _recalc_bill_after_items_change(bill)
+
+    tick.touched = len(touched)
+    tick.created, tick.updated, tick.deleted = len(to_create), len(to_update), len(to_delete)
+    tick.elapsed_ms = int((time.monotonic() - started) * 1000)
+    return tick
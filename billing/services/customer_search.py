@@ -0,0 +1,55 @@
+"""
+billing/services/customer_search.py
+
+顧客検索（氏名・あだ名・棚番号・電話）
+- Customer.search_text / phone_digits（正規化済みカラム）に対して検索する
+- phone_digits は q が数字と区切り記号だけのときだけ見る（A-12 の「12」で電話番号に当てない）
+  1〜3桁でも部分一致で当てる（従来の phone の部分一致と同じ）。類似度での順位付けは PHONE_MIN_DIGITS 桁以上
+- pg_trgm の GIN は3文字未満の語では効かない。1〜2文字の氏名検索も部分一致で当たるが索引は使われない
+- Postgres: pg_trgm の GIN インデックスで部分一致＋あいまい一致し、類似度順に並べる
+- SQLite（テスト）: LIKE の部分一致にフォールバック（前方一致を上位にする簡易スコア）
+"""
+from functools import reduce
+from operator import or_
+
+from django.db import connections
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+from billing.utils.search_text import PHONE_MIN_DIGITS, looks_like_phone, normalize_search_text, phone_digits
+
+
+def search_customers(qs, q):
+    """
+    qs を q で絞り込み、similarity（0〜1）を注釈して類似度順に並べる。
+    正規化して空になる q なら qs をそのまま返す。
+    """
+    term = normalize_search_text(q).replace('|', '')
+    digits = phone_digits(q) if looks_like_phone(q, min_digits=1) else ''
+    if not term and not digits:
+        return qs
+
+    hit = Q(search_text__contains=term) if term else Q()
+    if digits:
+        hit |= Q(phone_digits__contains=digits)
+
+    if connections[qs.db].vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+
+        scores = [TrigramWordSimilarity(Value(term), 'search_text')] if term else []
+        if len(digits) >= PHONE_MIN_DIGITS:
+            scores.append(TrigramSimilarity('phone_digits', Value(digits)))
+        if term:
+            # 部分一致に加えて、表記ゆれ・タイポもワード類似度（<% 演算子、GIN が効く）で拾う
+            hit |= Q(search_text__trigram_word_similar=term)
+        similarity = Greatest(*scores) if len(scores) > 1 else scores[0]
+    else:
+        prefix = []
+        if term:
+            prefix += [Q(search_text__startswith=term), Q(search_text__contains=f'|{term}')]
+        if digits:
+            prefix.append(Q(phone_digits__startswith=digits))
+        prefix = reduce(or_, prefix)
+        similarity = Case(When(prefix, then=Value(1.0)), default=Value(0.5), output_field=FloatField())
+
+    return qs.filter(hit).annotate(similarity=similarity).order_by('-similarity', '-updated_at')
@@ -0,0 +1,163 @@
+"""
+billing/services/customer_stats.py
+
+CustomerStats（店舗×顧客の来店実績）を保守するサービス
+- 来店 = 締め済み伝票に BillCustomer として載っていること
+- 差分更新: 伝票の「来店」（店舗・日時・grand_total・顧客）の変更前後を比べて加減算
+- 全再構築: 締め済み伝票から作り直す（バックフィル・修復用）
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Min, Sum, Value, When
+
+from billing.models import Bill, BillCustomer, CustomerStats
+from billing.services.upsert import upsert_add
+
+
+def visit_head(bill_id):
+    """(store_id, opened_at, closed_at, grand_total)。未クローズ・店舗不明なら None"""
+    row = (
+        Bill.objects.filter(pk=bill_id)
+        .values_list('table__store_id', 'opened_at', 'closed_at', 'grand_total')
+        .first()
+    )
+    if not row or not row[0] or not row[2]:
+        return None
+    return row
+
+
+def visit_customers(bill_id) -> frozenset:
+    return frozenset(BillCustomer.objects.filter(bill_id=bill_id).values_list('customer_id', flat=True))
+
+
+def bill_visit(bill_id):
+    """(head, customer_ids)。未クローズなら None"""
+    head = visit_head(bill_id)
+    return (head, visit_customers(bill_id)) if head else None
+
+
+def apply_visit_delta(before=None, after=None) -> None:
+    """
+    伝票1枚の来店 before → after（bill_visit() の戻り値）の差分を CustomerStats に反映する。
+    増える行は ON CONFLICT upsert（初回は小さい方・最終は大きい方を残す）、
+    減る・日時が動く行は F 式で加減算してから初回・最終を取り直す。
+    """
+    if before == after:
+        return
+    delta = {}
+    for visit, sign in ((before, -1), (after, 1)):
+        if not visit:
+            continue
+        (store_id, opened_at, closed_at, grand_total), customer_ids = visit
+        for customer_id in customer_ids:
+            row = delta.setdefault((store_id, customer_id), [0, 0, None, None])
+            row[0] += sign
+            row[1] += sign * (grand_total or 0)
+            if sign > 0:
+                row[2], row[3] = opened_at, closed_at
+
+    moved = before and after and before[0][:3] != after[0][:3]
+    grown, shrunk = [], []
+    for (store_id, customer_id), (visits, spent, first, last) in delta.items():
+        if visits < 0 or spent < 0 or (moved and visits == 0):
+            shrunk.append((store_id, customer_id, visits, spent))
+        elif visits or spent:
+            grown.append({
+                'store_id': store_id, 'customer_id': customer_id,
+                'visit_count': visits, 'total_spent': spent,
+                'first_visit_at': first, 'last_visit_at': last,
+            })
+
+    upsert_add(
+        CustomerStats, grown,
+        unique_fields=('store', 'customer'),
+        add_fields=('visit_count', 'total_spent'),
+        max_fields=('last_visit_at',),
+        min_fields=('first_visit_at',),
+    )
+    if shrunk:
+        _subtract(shrunk)
+
+
+def apply_spent_deltas(deltas: dict) -> None:
+    """
+    締め済み伝票の grand_total だけが変わったとき（recalc_bills の一括更新など）の反映。
+    deltas: {(store_id, customer_id): 増減額}。来店回数・初回・最終は変わらないので、
+    店舗ごとに CASE 式の加減算1文で更新する。
+    """
+    by_store = {}
+    for (store_id, customer_id), amount in deltas.items():
+        if amount:
+            by_store.setdefault(store_id, {})[customer_id] = amount
+    with transaction.atomic():
+        for store_id, amounts in by_store.items():
+            CustomerStats.objects.filter(store_id=store_id, customer_id__in=list(amounts)).update(
+                total_spent=F('total_spent') + Case(
+                    *[When(customer_id=c, then=Value(a)) for c, a in amounts.items()],
+                    default=Value(0), output_field=IntegerField(),
+                ),
+            )
+
+
+def _subtract(shrunk) -> None:
+    with transaction.atomic():
+        for store_id, customer_id, visits, spent in shrunk:
+            CustomerStats.objects.filter(store_id=store_id, customer_id=customer_id).update(
+                visit_count=F('visit_count') + visits,
+                total_spent=F('total_spent') + spent,
+            )
+        # 減算では最小・最大を保てないので、対象顧客だけ締め済み伝票から取り直す
+        for store_id in {s for s, *_ in shrunk}:
+            customer_ids = [c for s, c, *_ in shrunk if s == store_id]
+            CustomerStats.objects.filter(store_id=store_id, customer_id__in=customer_ids, visit_count=0).delete()
+            for r in _aggregate(store_id, customer_ids).values('customer_id', 'first', 'last'):
+                CustomerStats.objects.filter(store_id=store_id, customer_id=r['customer_id']).update(
+                    first_visit_at=r['first'], last_visit_at=r['last'],
+                )
+
+
+def _aggregate(store_id, customer_ids=None):
+    """締め済み伝票の BillCustomer を顧客ごとに集計（BillCustomer は伝票×顧客で一意なので膨らまない）"""
+    qs = BillCustomer.objects.filter(bill__table__store_id=store_id, bill__closed_at__isnull=False)
+    if customer_ids is not None:
+        qs = qs.filter(customer_id__in=customer_ids)
+    return (
+        qs.values('customer_id')
+        .annotate(
+            visits=Count('id'),
+            spent=Sum('bill__grand_total'),
+            first=Min('bill__opened_at'),
+            last=Max('bill__closed_at'),
+        )
+        .order_by()
+    )
+
+
+def rebuild_customer_stats(store_id: int) -> int:
+    """店舗の CustomerStats を締め済み伝票から作り直す。作成した行数を返す"""
+    rows = [
+        CustomerStats(
+            store_id=store_id, customer_id=r['customer_id'],
+            visit_count=r['visits'], total_spent=r['spent'] or 0,
+            first_visit_at=r['first'], last_visit_at=r['last'],
+        )
+        for r in _aggregate(store_id).iterator(chunk_size=2000)
+    ]
+    with transaction.atomic():
+        CustomerStats.objects.filter(store_id=store_id).delete()
+        CustomerStats.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def stats_summary(stats) -> dict:
+    """CustomerStats 行（複数店舗可）→ API 用の来店実績"""
+    visits = sum(s.visit_count for s in stats)
+    spent = sum(s.total_spent for s in stats)
+    firsts = [s.first_visit_at for s in stats if s.first_visit_at]
+    lasts = [s.last_visit_at for s in stats if s.last_visit_at]
+    return {
+        'visit_count': visits,
+        'total_spent': spent,
+        'avg_spend': spent // visits if visits else 0,
+        'first_visit_at': min(firsts) if firsts else None,
+        'last_visit_at': max(lasts) if lasts else None,
+    }
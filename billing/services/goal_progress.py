@@ -0,0 +1,172 @@
+"""
+billing/services/goal_progress.py
+
+CastGoal（キャスト目標）の進捗をまとめて評価するサービス
+- 目標を (店舗, 指標) ごとにまとめ、期間ごとの値を条件付き集計（FILTER）で1クエリに載せて cast_id で GROUP BY
+  （売上は手入力 CastManualSubtotal の有無で切り替えるので2クエリ）
+- 進捗・マイルストーン判定は CastGoal.progress_for() の純粋計算
+- record_new_hits_bulk / scan_store_milestones: 未通知マイルストーンの検出と milestones_hit の一括更新
+- touch_closed_bills / touched_store_ids: 差分スキャン用の変更マーカー（Bill.touched_at・手入力売上の updated_at）
+"""
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Q, Sum
+from django.utils import timezone
+
+from billing.models import Bill, BillCastStay, BillItem, CastGoal, CastManualSubtotal
+
+CHAMP_CODES = ('champagne', 'original-champagne')
+
+_SUBTOTAL = ExpressionWrapper(F('price') * F('qty'), output_field=IntegerField())
+
+
+def _grouped_values(qs, cast_field, cast_ids, bounds_list, *, date_field, aggregate) -> dict:
+    """{(cast_id, bounds): 値}。bounds ごとの aggregate(filter=期間) を1クエリに並べて cast で GROUP BY"""
+    lo = min(s for s, _ in bounds_list)
+    hi = max(e for _, e in bounds_list)
+    annotations = {
+        f'v{i}': aggregate(Q(**{f'{date_field}__range': bounds}))
+        for i, bounds in enumerate(bounds_list)
+    }
+    values = {}
+    for r in (
+        qs.filter(**{f'{cast_field}__in': cast_ids, f'{date_field}__range': (lo, hi)})
+        .values(cast_field)
+        .annotate(**annotations)
+        .order_by()
+    ):
+        for i, bounds in enumerate(bounds_list):
+            values[(r[cast_field], bounds)] = r[f'v{i}']
+    return values
+
+
+def _metric_values(store_id, metric, cast_ids, bounds_list) -> dict:
+    """指標1つ分の {(cast_id, bounds): 値}（CastGoal.current_value の規則）"""
+    items = BillItem.objects.filter(bill__table__store_id=store_id)
+    closed_on = 'bill__closed_at__date'
+
+    if metric == CastGoal.METRIC_REVENUE:
+        # 手入力値（CastManualSubtotal）がある期間はそちらを優先（行が無い期間は None）
+        manual = _grouped_values(
+            CastManualSubtotal.objects.filter(store_id=store_id), 'cast_id', cast_ids, bounds_list,
+            date_field='work_date', aggregate=lambda f: Sum('manual_subtotal', filter=f),
+        )
+        served = _grouped_values(
+            items, 'served_by_cast_id', cast_ids, bounds_list,
+            date_field=closed_on, aggregate=lambda f: Sum(_SUBTOTAL, filter=f),
+        )
+        return {
+            key: manual[key] if manual.get(key) is not None else served.get(key)
+            for key in set(manual) | set(served)
+        }
+
+    if metric in (CastGoal.METRIC_NOMINATIONS, CastGoal.METRIC_INHOUSE):
+        stay_type = 'nom' if metric == CastGoal.METRIC_NOMINATIONS else 'in'
+        return _grouped_values(
+            BillCastStay.objects.filter(bill__table__store_id=store_id, stay_type=stay_type),
+            'cast_id', cast_ids, bounds_list,
+            date_field=closed_on, aggregate=lambda f: Count('id', filter=f),
+        )
+
+    if metric in (CastGoal.METRIC_CHAMP_REVENUE, CastGoal.METRIC_CHAMP_COUNT):
+        expr = _SUBTOTAL if metric == CastGoal.METRIC_CHAMP_REVENUE else F('qty')
+        return _grouped_values(
+            items.filter(item_master__category__code__in=CHAMP_CODES),
+            'served_by_cast_id', cast_ids, bounds_list,
+            date_field=closed_on, aggregate=lambda f: Sum(expr, filter=f),
+        )
+
+    return {}
+
+
+def goal_values(goals, on_date=None) -> dict:
+    """{goal.id: 現在値}。goal.cast（store_id）を読むので select_related('cast') 推奨"""
+    groups = defaultdict(lambda: defaultdict(set))   # (store_id, metric) → bounds → {cast_id}
+    bounds_of = {}
+    for goal in goals:
+        bounds = goal.period_bounds(on_date)
+        bounds_of[goal.id] = bounds
+        groups[(goal.cast.store_id, goal.metric)][bounds].add(goal.cast_id)
+
+    values = {}
+    for (store_id, metric), by_bounds in groups.items():
+        cast_ids = set().union(*by_bounds.values())
+        values[(store_id, metric)] = _metric_values(store_id, metric, cast_ids, list(by_bounds))
+
+    return {
+        goal.id: int(
+            values[(goal.cast.store_id, goal.metric)].get((goal.cast_id, bounds_of[goal.id])) or 0
+        )
+        for goal in goals
+    }
+
+
+def evaluate_goals(goals, on_date=None) -> dict:
+    """{goal.id: progress dict}（CastGoal.progress と同じ形）"""
+    values = goal_values(goals, on_date)
+    return {goal.id: goal.progress_for(values[goal.id]) for goal in goals}
+
+
+@dataclass
+class GoalEvaluation:
+    goal: CastGoal
+    progress: dict
+    new_hits: list = field(default_factory=list)   # 今回新しく到達したマイルストーン
+
+
+def record_new_hits_bulk(goals, on_date=None) -> list:
+    """
+    目標すべての進捗を評価し、未通知のマイルストーンがあれば milestones_hit をまとめて更新する。
+    戻り値: goals と同じ順の [GoalEvaluation]（new_hits が空なら変化なし）
+    """
+    goals = list(goals)
+    progress = evaluate_goals(goals, on_date)
+    results, changed = [], []
+    now = timezone.now()
+    for goal in goals:
+        pr = progress[goal.id]
+        cur = set(goal.milestones_hit or [])
+        new = [m for m in pr['hits'] if m not in cur]
+        if new:
+            goal.milestones_hit = sorted(cur.union(new))
+            goal.updated_at = now
+            changed.append(goal)
+        results.append(GoalEvaluation(goal=goal, progress=pr, new_hits=new))
+    if changed:
+        with transaction.atomic():
+            CastGoal.objects.bulk_update(changed, ['milestones_hit', 'updated_at'])
+    return results
+
+
+def active_goals(store_ids=None):
+    qs = CastGoal.objects.filter(active=True).select_related('cast')
+    if store_ids is not None:
+        qs = qs.filter(cast__store_id__in=store_ids)
+    return qs
+
+
+def scan_store_milestones(store_ids=None, on_date=None) -> list:
+    """店舗（省略時は全店舗）の有効な目標すべてのマイルストーン検出"""
+    return record_new_hits_bulk(active_goals(store_ids), on_date)
+
+
+def touch_closed_bills(bill_ids) -> int:
+    """
+    締め済み伝票に touched_at（目標の再評価マーカー）を立てる。
+    締め・締め日時の変更（遡った締めを含む）・締め後の明細/stay 変更で signals / 一括追加から呼ぶ。
+    """
+    return Bill.objects.filter(pk__in=list(bill_ids), closed_at__isnull=False).update(touched_at=timezone.now())
+
+
+def touched_store_ids(since, store_ids=None) -> list:
+    """since 以降に伝票の締め・締め後の変更、または手入力売上の更新があった店舗 id"""
+    bills = Bill.objects.filter(Q(closed_at__gte=since) | Q(touched_at__gte=since), table__isnull=False)
+    manual = CastManualSubtotal.objects.filter(updated_at__gte=since)
+    if store_ids is not None:
+        bills = bills.filter(table__store_id__in=store_ids)
+        manual = manual.filter(store_id__in=store_ids)
+    touched = set(bills.values_list('table__store_id', flat=True).distinct())
+    touched.update(manual.values_list('store_id', flat=True).distinct())
+    return sorted(touched)
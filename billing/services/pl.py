@@ -4,6 +4,7 @@ from datetime import date, timedelta
 from django.db.models import Sum, F, Q, Value, IntegerField, Count
 from django.db.models.functions import Coalesce
 from billing.models import Bill, CastPayout, CastDailySummary
+from billing.services.snapshot_casts import snapshot_commission_total, snapshot_missing
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,38 +15,31 @@ def _bill_qs(store_id, df, dt):
                     closed_at__date__range=(df, dt)))
 
 
-def _calculate_commission_from_snapshot(bills):
+def _calculate_commission_from_snapshot(bills, missing_count=None):
     """
     ★ Phase A: payroll_snapshot ベースで歩合を集計
     
-    スナップショットから by_cast[].amount を合算。
+    スナップショットの by_cast[].amount は BillPayrollSnapshotCast の SUM で出す（JSON は読まない）。
     フォールバック：snapshot が無い Bill は BillCalculator で一時計算（DB 保存なし）。
     """
-    total = 0
-    
-    for bill in bills:
-        if bill.payroll_snapshot and isinstance(bill.payroll_snapshot, dict):
-            # snapshot の by_cast 配列から amount を合算
-            by_cast = bill.payroll_snapshot.get('by_cast', [])
-            bill_commission = sum(int(c.get('amount', 0)) for c in by_cast)
+    total = snapshot_commission_total(bills)
+    if missing_count == 0:
+        return int(total)
+
+    for bill in snapshot_missing(bills):
+        # フォールバック：snapshot がない Bill は BillCalculator で一時計算
+        try:
+            from billing.calculator import BillCalculator
+            result = BillCalculator(bill).execute()
+            payouts = result.cast_payouts
+            bill_commission = sum(p.amount for p in payouts)
             total += bill_commission
-            logger.debug(f"[PL] Bill {bill.id}: commission from snapshot = {bill_commission}")
-        else:
-            # フォールバック：snapshot がない Bill は BillCalculator で一時計算
-            try:
-                from billing.calculator import BillCalculator
-                result = BillCalculator(bill).execute()
-                payouts = result.cast_payouts
-                bill_commission = sum(p.amount for p in payouts)
-                total += bill_commission
-                logger.warning(
-                    f"[PL] Bill {bill.id}: snapshot missing, calculated commission = {bill_commission} "
-                    f"(will NOT save payout)"
-                )
-            except Exception as e:
-                logger.exception(f"[PL] Bill {bill.id}: failed to calculate commission: {e}")
-                bill_commission = 0
-                total += bill_commission
+            logger.warning(
+                f"[PL] Bill {bill.id}: snapshot missing, calculated commission = {bill_commission} "
+                f"(will NOT save payout)"
+            )
+        except Exception as e:
+            logger.exception(f"[PL] Bill {bill.id}: failed to calculate commission: {e}")
     
     return int(total)
 
@@ -61,6 +55,7 @@ def pl_range(store_id: int, df, dt):
         sales_cash  = Sum('paid_cash'),
         sales_card  = Sum('paid_card'),
         guest_count = Count('id'),
+        snapshot_missing = Count('id', filter=Q(payroll_snapshot__isnull=True) | Q(payroll_snapshot={})),
     )
     sales_total = int(agg['sales_total'] or 0)
     sales_cash  = int(agg['sales_cash']  or 0)
@@ -69,7 +64,7 @@ def pl_range(store_id: int, df, dt):
 
     # ★ Phase A: 歩合（出来高）を payroll_snapshot ベースで集計
     # （CastPayout 生成失敗の影響を遮断。現場の数字は snapshot/都度計算が正とする）
-    commission = _calculate_commission_from_snapshot(bills)
+    commission = _calculate_commission_from_snapshot(bills, missing_count=agg['snapshot_missing'])
 
     # 時給（固定）＝ CastDailySummary.payroll
     hourly_pay = int(CastDailySummary.objects
@@ -0,0 +1,186 @@
+"""
+billing/services/pl_snapshot.py
+
+DailyPLSnapshot（店舗×営業日の日次P&L）の読み書き
+- 営業中の当日: 毎回 get_daily_pl で生計算（保存しない）
+- 過去日: 保存済みの行を使う。無い / is_stale の日だけ get_daily_pl で作り直す
+- 未来日: クエリせずゼロ
+月次・年次は行を SQL で合算するため、確定済みの期間なら数クエリで済む。
+"""
+from __future__ import annotations
+
+from datetime import date, timedelta
+
+from django.db.models import Sum
+from django.db.models.functions import Coalesce, ExtractMonth
+from django.utils import timezone
+
+from billing.models import DailyPLSnapshot
+from billing.utils.bizday import business_date_for
+from billing.utils.pl_daily import empty_daily_pl, get_daily_pl
+
+# 月次・年次で合算するキー（DailyPLSnapshot の列）
+SUM_FIELDS = (
+    "sales_cash", "sales_card", "sales_total",
+    "guest_count", "commission", "hourly_pay",
+    "labor_cost", "operating_profit",
+)
+
+
+def _days(date_from: date, date_to: date):
+    cur = date_from
+    while cur <= date_to:
+        yield cur
+        cur += timedelta(days=1)
+
+
+def _strip(data: dict, include_breakdown: bool) -> dict:
+    if include_breakdown:
+        return data
+    return {k: v for k, v in data.items() if k != "group_sales"}
+
+
+def _sum_columns(data: dict) -> dict:
+    cols = {f: int(data.get(f) or 0) for f in SUM_FIELDS}
+    # 旧 get_monthly_pl 互換: sales_total が 0 の日は現金+カードで代用
+    if not cols["sales_total"]:
+        cols["sales_total"] = cols["sales_cash"] + cols["sales_card"]
+    return cols
+
+
+def refresh_daily_pl(business_date: date, *, store_id: int) -> dict:
+    """get_daily_pl を実行して DailyPLSnapshot に保存し、その結果を返す"""
+    data = get_daily_pl(business_date, store_id=store_id, include_breakdown=True)
+    DailyPLSnapshot.objects.update_or_create(
+        store_id=store_id,
+        business_date=business_date,
+        defaults={
+            **_sum_columns(data),
+            "data": data,
+            "is_stale": False,
+        },
+    )
+    return data
+
+
+def _prepare(store_id: int, date_from: date, date_to: date):
+    """
+    過去日の欠け・古い行を作り直し、(当日の営業日, 当日分の生計算結果 or None) を返す。
+    """
+    today = business_date_for(timezone.now(), store_id=store_id)
+
+    last_closed = min(date_to, today - timedelta(days=1))
+    if date_from <= last_closed:
+        fresh = set(
+            DailyPLSnapshot.objects
+            .filter(store_id=store_id, business_date__range=(date_from, last_closed), is_stale=False)
+            .values_list("business_date", flat=True)
+        )
+        for d in _days(date_from, last_closed):
+            if d not in fresh:
+                refresh_daily_pl(d, store_id=store_id)
+
+    live = None
+    if date_from <= today <= date_to:
+        live = get_daily_pl(today, store_id=store_id, include_breakdown=True)
+    return today, live
+
+
+def get_daily_pl_range(date_from: date, date_to: date, *, store_id: int,
+                       include_breakdown: bool = False) -> list[dict]:
+    """date_from〜date_to の日次P&Lを日付順に返す（get_daily_pl と同じ形）"""
+    today, live = _prepare(store_id, date_from, date_to)
+    rows = dict(
+        DailyPLSnapshot.objects
+        .filter(store_id=store_id, business_date__range=(date_from, min(date_to, today)))
+        .values_list("business_date", "data")
+    )
+
+    out = []
+    for d in _days(date_from, date_to):
+        if d == today and live is not None:
+            data = live
+        elif d in rows:
+            data = rows[d]
+        else:
+            data = empty_daily_pl(d, store_id=store_id)
+        out.append(_strip(data, include_breakdown))
+    return out
+
+
+def get_daily_pl_cached(target_date: date, *, store_id: int, include_breakdown: bool = False) -> dict:
+    return get_daily_pl_range(target_date, target_date, store_id=store_id,
+                              include_breakdown=include_breakdown)[0]
+
+
+def _sum_exprs():
+    return {f: Coalesce(Sum(f), 0) for f in SUM_FIELDS}
+
+
+def _add_live(totals: dict, live: dict) -> None:
+    for f, v in _sum_columns(live).items():
+        totals[f] += v
+
+
+def sum_daily_pl(date_from: date, date_to: date, *, store_id: int) -> dict:
+    """期間の SUM_FIELDS 合計（当日分は生計算を加算）"""
+    today, live = _prepare(store_id, date_from, date_to)
+    totals = (
+        DailyPLSnapshot.objects
+        .filter(store_id=store_id, business_date__range=(date_from, date_to))
+        .exclude(business_date__gte=today)
+        .aggregate(**_sum_exprs())
+    )
+    totals = {f: int(totals[f] or 0) for f in SUM_FIELDS}
+    if live is not None:
+        _add_live(totals, live)
+    return totals
+
+
+def sum_daily_rows(days) -> dict:
+    """get_daily_pl_range の結果（日次の行）の SUM_FIELDS 合計。sum_daily_pl と同じ値"""
+    totals = dict.fromkeys(SUM_FIELDS, 0)
+    for data in days:
+        _add_live(totals, data)
+    return totals
+
+
+def sum_daily_pl_by_month(year: int, *, store_id: int) -> dict[int, dict]:
+    """年内の SUM_FIELDS 合計を月別に {1: {...}, ..., 12: {...}} で返す"""
+    date_from, date_to = date(year, 1, 1), date(year, 12, 31)
+    today, live = _prepare(store_id, date_from, date_to)
+
+    by_month = {m: dict.fromkeys(SUM_FIELDS, 0) for m in range(1, 13)}
+    rows = (
+        DailyPLSnapshot.objects
+        .filter(store_id=store_id, business_date__range=(date_from, date_to))
+        .exclude(business_date__gte=today)
+        .annotate(m=ExtractMonth("business_date"))
+        .values("m")
+        .order_by()
+        .annotate(**_sum_exprs())
+    )
+    for row in rows:
+        by_month[row["m"]] = {f: int(row[f] or 0) for f in SUM_FIELDS}
+    if live is not None:
+        _add_live(by_month[today.month], live)
+    return by_month
+
+
+def mark_business_dates_stale(store_id, business_dates) -> None:
+    """指定営業日の DailyPLSnapshot を再計算対象にする。store_id=None は全店舗"""
+    qs = DailyPLSnapshot.objects.filter(business_date__in=list(business_dates), is_stale=False)
+    if store_id:
+        qs = qs.filter(store_id=store_id)
+    qs.update(is_stale=True)
+
+
+def mark_daily_pl_stale(scope) -> None:
+    """
+    scope=(store_id, 現地日付) に関わる DailyPLSnapshot を再計算対象にする。
+    締め時刻前の時間帯は前日の営業日に属するため、前日分も合わせて立てる。
+    """
+    if not scope or not scope[1]:
+        return
+    store_id, local_date = scope
+    mark_business_dates_stale(store_id, (local_date, local_date - timedelta(days=1)))
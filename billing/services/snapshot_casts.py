@@ -0,0 +1,92 @@
+"""
+billing/services/snapshot_casts.py
+
+Bill.payroll_snapshot の by_cast を BillPayrollSnapshotCast に正規化して保守・集計するサービス
+- 保守: スナップショット保存時に by_cast を行へ展開して作り直す（signals から）
+- 集計: 期間の歩合・立替控除は JSON を読まずに SQL の SUM で出す
+"""
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from billing.models import Bill, BillPayrollSnapshotCast, Cast
+
+ROW_FIELDS = ('amount', 'substitute_deduction', 'nomination', 'dohan')
+
+
+def rows_from_snapshot(snapshot) -> dict:
+    """snapshot → {cast_id: {amount, substitute_deduction, nomination, dohan}}（同一キャストは合算）"""
+    rows = {}
+    if not isinstance(snapshot, dict):
+        return rows
+    for rec in snapshot.get('by_cast') or []:
+        cid = rec.get('cast_id') or None   # cast 不明の行は None にまとめる
+        row = rows.setdefault(cid, dict.fromkeys(ROW_FIELDS, 0))
+        row['amount'] += int(rec.get('amount', 0) or 0)
+        row['substitute_deduction'] += int(rec.get('substitute_deduction', 0) or 0)
+        for b in rec.get('breakdown') or []:
+            if b.get('type') == 'nomination_pool':
+                row['nomination'] += int(b.get('amount', 0) or 0)
+            elif b.get('type') == 'dohan_pool':
+                row['dohan'] += int(b.get('amount', 0) or 0)
+    return rows
+
+
+def sync_snapshot_casts(bill_id, snapshot) -> bool:
+    """
+    bill の正規化行を snapshot に合わせる。変化が無ければ書き込まない。
+    Returns: 書き換えたら True
+    """
+    wanted = rows_from_snapshot(snapshot)
+    current = {
+        r['cast_id']: {f: r[f] for f in ROW_FIELDS}
+        for r in BillPayrollSnapshotCast.objects.filter(bill_id=bill_id).values('cast_id', *ROW_FIELDS)
+    }
+    if wanted == current:
+        return False
+
+    # 削除済みキャストは cast=None で金額だけ残す
+    ids = [cid for cid in wanted if cid]
+    alive = set(Cast.objects.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+    with transaction.atomic():
+        BillPayrollSnapshotCast.objects.filter(bill_id=bill_id).delete()
+        BillPayrollSnapshotCast.objects.bulk_create([
+            BillPayrollSnapshotCast(bill_id=bill_id, cast_id=cid if cid in alive else None, **vals)
+            for cid, vals in wanted.items()
+        ])
+    return True
+
+
+def snapshot_missing(bills):
+    """snapshot が無い（歩合を都度計算するしかない）伝票"""
+    return bills.filter(Q(payroll_snapshot__isnull=True) | Q(payroll_snapshot={}))
+
+
+def snapshot_commission_total(bills) -> int:
+    """bills の snapshot 歩合合計（by_cast[].amount の総和）"""
+    total = (
+        BillPayrollSnapshotCast.objects
+        .filter(bill__in=bills)
+        .aggregate(total=Sum('amount'))['total']
+    )
+    return int(total or 0)
+
+
+def substitute_deduction_by_cast(bills) -> dict:
+    """bills の snapshot 立替控除を cast_id 別に合計 {cast_id: int}"""
+    qs = (
+        BillPayrollSnapshotCast.objects
+        .filter(bill__in=bills, substitute_deduction__gt=0, cast__isnull=False)
+        .values('cast_id')
+        .order_by()
+        .annotate(total=Sum('substitute_deduction'))
+    )
+    return {r['cast_id']: int(r['total'] or 0) for r in qs}
+
+
+def bills_with_substitute_deduction(bills):
+    """立替控除のある伝票（明細を出すために snapshot を読む必要がある分だけ）"""
+    return Bill.objects.filter(
+        pk__in=BillPayrollSnapshotCast.objects
+        .filter(bill__in=bills, substitute_deduction__gt=0)
+        .values('bill_id')
+    )
@@ -0,0 +1,75 @@
+"""
+billing/services/upsert.py
+
+集計テーブルへの加算 upsert
+INSERT ... ON CONFLICT (一意キー) DO UPDATE SET col = col + EXCLUDED.col を1文で実行する。
+- 行が無ければ作成、あれば加算。行ロックの取り合いや get_or_create の競合で加算を失わない
+- PostgreSQL / SQLite(3.24+) 共通の構文
+"""
+from django.db import connections
+
+
+def upsert_add(model, rows, *, unique_fields, add_fields, max_fields=(), min_fields=(), returning=None, using='default'):
+    """
+    rows をまとめて加算 upsert する。
+
+    Args:
+        model: 対象モデル（unique_fields に一意制約があること）
+        rows: [{attname: value}]。unique_fields と add_fields を含める（加算値は 0 以上）。
+              1文で同じ行を2回更新できないので、一意キーは rows 内で重複させない
+              それ以外の列はモデルの既定値で INSERT される
+        unique_fields: 競合判定のフィールド名（例 ['store', 'date', 'hour']）
+        add_fields: 既存行に加算するフィールド名
+        max_fields: 既存行と比べて大きい方を残すフィールド名（NULL は無視。例 last_served_at）
+        min_fields: 同じく小さい方を残すフィールド名（例 first_visit_at）
+        returning: 指定すると各行のその列の値を返す（例 'id'）
+    Returns:
+        returning の値のリスト（rows と同じ順）。未指定なら []
+    """
+    if not rows:
+        return []
+
+    conn = connections[using]
+    qn = conn.ops.quote_name
+    meta = model._meta
+    table = qn(meta.db_table)
+    fields = [f for f in meta.concrete_fields if not f.primary_key]
+
+    unique = [meta.get_field(name) for name in unique_fields]
+    values_sql, params, keys = [], [], []
+    for row in rows:
+        obj = model(**row)
+        params.extend(f.get_db_prep_save(f.pre_save(obj, True), conn) for f in fields)
+        values_sql.append('(' + ', '.join(['%s'] * len(fields)) + ')')
+        keys.append(tuple(str(getattr(obj, f.attname)) for f in unique))
+
+    conflict = ', '.join(qn(f.column) for f in unique)
+    add_columns = [qn(meta.get_field(name).column) for name in add_fields]
+    sets = [f'{col} = {table}.{col} + EXCLUDED.{col}' for col in add_columns]
+    # GREATEST / LEAST は SQLite に無いので CASE で書く
+    for names, op in ((max_fields, '>'), (min_fields, '<')):
+        for name in names:
+            col = qn(meta.get_field(name).column)
+            sets.append(
+                f'{col} = CASE WHEN {table}.{col} IS NULL OR EXCLUDED.{col} {op} {table}.{col} '
+                f'THEN EXCLUDED.{col} ELSE {table}.{col} END'
+            )
+    # auto_now（updated_at 等）は更新時も進める
+    sets += [f'{qn(f.column)} = EXCLUDED.{qn(f.column)}' for f in fields if getattr(f, 'auto_now', False)]
+
+    sql = (
+        f'INSERT INTO {table} ({", ".join(qn(f.column) for f in fields)}) '
+        f'VALUES {", ".join(values_sql)} '
+        f'ON CONFLICT ({conflict}) DO UPDATE SET {", ".join(sets)}'
+    )
+    if returning:
+        sql += f' RETURNING {qn(meta.get_field(returning).column)}, {conflict}'
+
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        if not returning:
+            return []
+        # RETURNING の行順は保証されないので一意キーで rows の順に並べ直す
+        # （SQLite は日付を文字列で返すため str で比較）
+        found = {tuple(str(v) for v in r[1:]): r[0] for r in cur.fetchall()}
+        return [found[key] for key in keys]
@@ -9,13 +9,12 @@ from .models import (
     ROUTE_NONE, ROUTE_INHERIT,
 )
 
-from django.db.models.signals import pre_delete, post_delete, post_save
-from django.db import transaction
+from django.db.models.signals import pre_delete, post_delete, post_save, pre_save
+from .kds_broker import publish_ticket_event
+from .services.bulk_items import kds_route_for
 from django.utils import timezone
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
 
-from .models import Bill, BillItem, CastDailySummary
+from .models import Bill, BillItem
 
 
 User = get_user_model()
@@ -87,16 +86,8 @@ def create_order_tickets_on_item_create(sender, instance: 'BillItem', created, *
 
     if not created:
         return
-    im = getattr(instance, 'item_master', None)
-    if not im:
-        return
-
     # 実ルートを決定：アイテムが inherit ならカテゴリの route、なければアイテムの route
-    route = im.route
-    if route == ROUTE_INHERIT:
-        cat = getattr(im, 'category', None)
-        route = getattr(cat, 'route', ROUTE_NONE)
-
+    route = kds_route_for(getattr(instance, 'item_master', None))
     if route == ROUTE_NONE:
         return  # KDS対象外はチケットを作らない
 
@@ -104,7 +95,7 @@ def create_order_tickets_on_item_create(sender, instance: 'BillItem', created, *
     store = instance.bill.table.store
     by_cast = bool(getattr(instance, 'served_by_cast_id', None))
 
-    OrderTicket.objects.bulk_create([
+    tickets = OrderTicket.objects.bulk_create([
         OrderTicket(
             bill_item=instance,
             store=store,
@@ -114,128 +105,526 @@ def create_order_tickets_on_item_create(sender, instance: 'BillItem', created, *
         ) for _ in range(qty)
     ])
 
+    # KDS ステーションへ配信（pk は bulk_create で返らない DB もあるので None は除く）
+    publish_ticket_event(tickets[0], 'created', ids=[t.pk for t in tickets if t.pk])
 
 
 
-def _rebuild_cast_daily_summaries(store_id: int, work_date):
-    """
-    該当 store × 日 の CastDailySummary を Bill / BillItem / CastShift から“生集計”で再構築する。
-    - 売上は BillItem から cast × stay_type 別に合算
-    - 時給は CastShift.payroll_amount を合算（同日・同店）
-    """
-    from collections import defaultdict
-    if not store_id or not work_date:
-        return
-
-    # 1) 当日・当店のクローズ済 Bill が対象（opened_at基準にしたいなら変えてOK）
-    bills_qs = Bill.objects.filter(
-        table__store_id=store_id,
-        closed_at__date=work_date,
-    ).prefetch_related('stays', 'items__item_master__category')
-
-    # 2) cast × 区分の金額合算
-    sums = defaultdict(lambda: {'free':0, 'in':0, 'nom':0, 'champ':0})
-    cast_ids_seen = set()
-
-    for b in bills_qs:
-        # 伝票内での最新stayを使って stay_type を決める
-        latest_by_cast = {}
-        for s in b.stays.all():
-            cid = getattr(s.cast, 'id', None)
-            if not cid: continue
-            if (cid not in latest_by_cast) or (s.entered_at and s.entered_at > latest_by_cast[cid].entered_at):
-                latest_by_cast[cid] = s
-
-        for it in b.items.all():
-            cid = getattr(getattr(it, 'served_by_cast', None), 'id', None)
-            if not cid:
-                continue
-            cast_ids_seen.add(cid)
-
-            st = latest_by_cast.get(cid).stay_type if cid in latest_by_cast else 'free'
-            amt = int((it.price or 0) * (it.qty or 0))
-
-            if st == 'nom':
-                sums[cid]['nom']  += amt
-            elif st == 'in':
-                sums[cid]['in']   += amt
-            else:
-                sums[cid]['free'] += amt
-
-            cat = getattr(it.item_master, 'category', None)
-            if cat and cat.code in ('champagne', 'original-champagne'):
-                sums[cid]['champ'] += amt
-
-    # 3) 時給（CastShift → payroll_amount 合算）
-    from .models import CastShift
-    payroll_by_cast = dict(
-        CastShift.objects
-        .filter(store_id=store_id, clock_in__date=work_date, clock_out__isnull=False)
-        .values('cast_id')
-        .annotate(pay=Coalesce(Sum('payroll_amount'), Value(0)))
-        .values_list('cast_id', 'pay')
+
+# ---------- CastDailySummary の差分保守 ----------
+# クローズ済み伝票に関わる変更の前後で「伝票の寄与」を比べ、差分だけを F 式で加減算する。
+# 全再構築は修復用コマンド rebuild_cast_daily_summaries で明示的に行う。
+
+from .models import BillCastStay
+from .services.cast_summary import (
+    apply_delta, bill_contribution, bill_scope, rebuild_cast_daily_summaries,
+)
+
+# 互換: 旧名
+_rebuild_cast_daily_summaries = rebuild_cast_daily_summaries
+
+# 店舗・締め日に関係する Bill のフィールド（これ以外の save では寄与は変わらない）
+_SUMMARY_SCOPE_FIELDS = {'closed_at', 'table', 'table_id'}
+
+
+@receiver(pre_save, sender=Bill)
+def _summary_scope_before_bill_save(sender, instance: Bill, raw=False, update_fields=None, **kwargs):
+    instance._summary_scope_before = None
+    instance._summary_skip = bool(raw) or (
+        update_fields is not None and not (set(update_fields) & _SUMMARY_SCOPE_FIELDS)
     )
+    if instance._summary_skip or not instance.pk:
+        return
+    instance._summary_scope_before = bill_scope(instance.pk)
+
+
+@receiver(post_save, sender=Bill)
+def _summary_after_bill_save(sender, instance: Bill, created, **kwargs):
+    # memo / paid_cash 等の更新、未クローズの新規作成は何もしない
+    if getattr(instance, '_summary_skip', False):
+        return
+    if created and not instance.closed_at:
+        return
+
+    before = getattr(instance, '_summary_scope_before', None)
+    after = instance._summary_scope_after = bill_scope(instance.pk)
+    if before == after:
+        return
+
+    # 明細・stay は Bill の保存で変わらないので寄与は1回だけ計算し、旧スコープから新スコープへ移す
+    contribution = bill_contribution(instance.pk)
+    apply_delta(before, before=contribution)
+    apply_delta(after, after=contribution)
 
-    # 4) 既存の当日分を削除 → 再投入
-    CastDailySummary.objects.filter(store_id=store_id, work_date=work_date).delete()
-
-    bulks = []
-    for cid in cast_ids_seen.union(payroll_by_cast.keys()):
-        agg = sums.get(cid, {'free':0,'in':0,'nom':0,'champ':0})
-        bulks.append(CastDailySummary(
-            store_id    = store_id,
-            cast_id     = cid,
-            work_date   = work_date,
-            worked_min  = 0,  # 必要なら CastShift から Minutes 合算に変えてOK
-            payroll     = int(payroll_by_cast.get(cid, 0)),
-            sales_free  = int(agg['free']),
-            sales_in    = int(agg['in']),
-            sales_nom   = int(agg['nom']),
-            sales_champ = int(agg['champ']),
-        ))
-    if bulks:
-        CastDailySummary.objects.bulk_create(bulks)
-
-
-# ---- Bill 削除: 削除後に当日分を再構築（必須） ----
 
 @receiver(pre_delete, sender=Bill)
-def _remember_bill_scope(sender, instance: Bill, **kwargs):
-    try:
-        instance._store_id_for_rebuild = instance.table.store_id if instance.table_id else None
-        # “どの日で集計するか” は closed_at（無ければ opened_at の日付）
-        base_dt = instance.closed_at or instance.opened_at or timezone.now()
-        instance._work_date_for_rebuild = base_dt.date()
-    except Exception:
-        instance._store_id_for_rebuild = None
-        instance._work_date_for_rebuild = None
+def _summary_before_bill_delete(sender, instance: Bill, **kwargs):
+    scope = bill_scope(instance.pk)
+    instance._summary_before = (scope, bill_contribution(instance.pk) if scope else None)
+
 
 @receiver(post_delete, sender=Bill)
-def _rebuild_after_bill_delete(sender, instance: Bill, **kwargs):
-    store_id = getattr(instance, '_store_id_for_rebuild', None)
-    work_date = getattr(instance, '_work_date_for_rebuild', None)
-    if store_id and work_date:
-        transaction.on_commit(lambda: _rebuild_cast_daily_summaries(store_id, work_date))
+def _summary_after_bill_delete(sender, instance: Bill, **kwargs):
+    scope, contribution = getattr(instance, '_summary_before', (None, None))
+    apply_delta(scope, before=contribution)
+
 
+def _is_own_delete(sender, origin) -> bool:
+    """Bill 等の削除に伴うカスケードではなく、その行自体の削除か"""
+    return isinstance(origin, sender) or getattr(origin, 'model', None) is sender
+
+
+def _remember_bill_contribution(instance):
+    scope = bill_scope(instance.bill_id) if instance.bill_id else None
+    instance._summary_before = (scope, bill_contribution(instance.bill_id)) if scope else None
+
+
+def _apply_bill_contribution_change(instance):
+    remembered = getattr(instance, '_summary_before', None)
+    if not remembered:
+        return
+    scope, before = remembered
+    apply_delta(scope, before=before, after=bill_contribution(instance.bill_id))
+
+
+@receiver(pre_save, sender=BillItem)
+@receiver(pre_save, sender=BillCastStay)
+def _summary_before_line_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        instance._summary_before = None
+        return
+    _remember_bill_contribution(instance)
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=BillCastStay)
+def _summary_after_line_save(sender, instance, **kwargs):
+    _apply_bill_contribution_change(instance)
+
+
+@receiver(pre_delete, sender=BillItem)
+@receiver(pre_delete, sender=BillCastStay)
+def _summary_before_line_delete(sender, instance, origin=None, **kwargs):
+    if not _is_own_delete(sender, origin):
+        # 伝票ごと削除される場合は Bill 側で差し引く
+        instance._summary_before = None
+        return
+    _remember_bill_contribution(instance)
+
+
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=BillCastStay)
+def _summary_after_line_delete(sender, instance, **kwargs):
+    _apply_bill_contribution_change(instance)
+
+
+# ---------- CastGoal 再評価マーカー（Bill.touched_at） ----------
+# scan_goal_milestones --every は closed_at だけでは締め後の編集や遡った締めを拾えないので、
+# 締め済み伝票の寄与が変わったときに touched_at を立てる（CastDailySummary 側の判定をそのまま使う）
+
+from .services.goal_progress import touch_closed_bills
 
-# ---- Bill クローズ/再クローズ: その日だけ再構築（推奨） ----
 
 @receiver(post_save, sender=Bill)
-def _rebuild_after_bill_close(sender, instance: Bill, created, **kwargs):
-    # loaddata中は発火させない
-    if kwargs.get("raw"):
+def _goal_touch_after_bill_save(sender, instance: Bill, **kwargs):
+    # 締め・締め日時・卓の変更でスコープ（店舗, 締め日）が変わったとき（_summary_after_bill_save が計算済み）
+    after = instance.__dict__.get('_summary_scope_after')
+    if after and after != getattr(instance, '_summary_scope_before', None):
+        touch_closed_bills([instance.pk])
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=BillCastStay)
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=BillCastStay)
+def _goal_touch_after_line_change(sender, instance, **kwargs):
+    # 締め済み伝票の行だけ _summary_before が立つ（伝票ごとの削除は対象外）
+    if getattr(instance, '_summary_before', None):
+        touch_closed_bills([instance.bill_id])
+
+
+# ---------- DailyPLSnapshot の無効化 ----------
+# 締め済み伝票・明細・経費・時給サマリが変わった営業日の行に is_stale を立てる（再計算は参照時）
+
+from .models import CastDailySummary, PersonnelExpense, PersonnelExpenseSettlementEvent
+from .services.pl_snapshot import mark_business_dates_stale, mark_daily_pl_stale
+
+
+@receiver(post_save, sender=Bill)
+def _pl_stale_after_bill_save(sender, instance: Bill, created, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, '_summary_scope_before', None)
+    if hasattr(instance, '_summary_scope_after'):
+        after = instance.__dict__.pop('_summary_scope_after')
+    else:
+        # 入金額・スナップショット等の更新でも P&L は変わる
+        after = bill_scope(instance.pk) if instance.closed_at else None
+    mark_daily_pl_stale(before)
+    if after != before:
+        mark_daily_pl_stale(after)
+
+
+@receiver(post_delete, sender=Bill)
+def _pl_stale_after_bill_delete(sender, instance: Bill, **kwargs):
+    scope, _ = getattr(instance, '_summary_before', (None, None))
+    mark_daily_pl_stale(scope)
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=BillCastStay)
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=BillCastStay)
+def _pl_stale_after_line_change(sender, instance, **kwargs):
+    remembered = getattr(instance, '_summary_before', None)
+    if remembered:
+        mark_daily_pl_stale(remembered[0])
+
+
+@receiver(post_save, sender=CastDailySummary)
+@receiver(post_delete, sender=CastDailySummary)
+def _pl_stale_after_cast_summary(sender, instance, **kwargs):
+    # 時給は business_date で集計される
+    if instance.business_date:
+        mark_business_dates_stale(instance.store_id, [instance.business_date])
+
+
+def _pl_stale_for_expense(expense):
+    # get_daily_pl は subject_user の所属店舗で絞るため、全店舗分を立てる
+    if expense and expense.occurred_at:
+        mark_daily_pl_stale((None, timezone.localdate(expense.occurred_at)))
+
+
+@receiver(post_save, sender=PersonnelExpense)
+@receiver(post_delete, sender=PersonnelExpense)
+def _pl_stale_after_expense(sender, instance, **kwargs):
+    _pl_stale_for_expense(instance)
+
+
+@receiver(post_save, sender=PersonnelExpenseSettlementEvent)
+@receiver(post_delete, sender=PersonnelExpenseSettlementEvent)
+def _pl_stale_after_settlement(sender, instance, **kwargs):
+    _pl_stale_for_expense(PersonnelExpense.objects.filter(pk=instance.expense_id).first())
+
+
+# ---- バック率リゾルバの無効化（CastCategoryRate / Cast / ItemCategory / Store） ----
+
+from .models import Cast, CastCategoryRate, ItemCategory
+from .services.backrate import bump_back_rate_version
+
+
+@receiver(post_save, sender=CastCategoryRate)
+@receiver(post_delete, sender=CastCategoryRate)
+def _invalidate_backrate_on_ccr(sender, instance, **kwargs):
+    store_id = Cast.objects.filter(pk=instance.cast_id).values_list('store_id', flat=True).first()
+    bump_back_rate_version(store_id)
+
+
+@receiver(post_save, sender=Cast)
+@receiver(post_delete, sender=Cast)
+def _invalidate_backrate_on_cast(sender, instance, **kwargs):
+    bump_back_rate_version(instance.store_id)
+
+
+@receiver(post_save, sender=ItemCategory)
+@receiver(post_delete, sender=ItemCategory)
+def _invalidate_backrate_on_category(sender, instance, **kwargs):
+    bump_back_rate_version(None)
+
+
+@receiver(post_save, sender=Store)
+def _invalidate_backrate_on_store(sender, instance, **kwargs):
+    bump_back_rate_version(instance.id)
+
+
+# ---------- payroll_dirty マーカー ----------
+# 締め済み伝票の給与に影響する書き込みがあったら Bill.payroll_dirty_at を立てる。
+# 一覧の payroll_dirty はこのマーカーを見るだけ（ハッシュ再計算は verify エンドポイントで）。
+
+from django.db.models.signals import m2m_changed
+
+from .models import BillCustomerNomination, BillDiscountLine, BillSubstituteItem
+from .payroll.snapshot import mark_payroll_dirty
+
+# 給与スナップショットに影響する Bill 自身のフィールド（update_fields 名 → 属性名）
+_PAYROLL_BILL_FIELDS = {
+    'discount_rule': 'discount_rule_id',
+    'main_cast': 'main_cast_id',
+    'apply_service_charge': 'apply_service_charge',
+    'apply_tax': 'apply_tax',
+}
+
+
+@receiver(pre_save, sender=Bill)
+def _payroll_fields_before_bill_save(sender, instance: Bill, raw=False, update_fields=None, **kwargs):
+    instance._payroll_fields_changed = False
+    # 未クローズ・snapshot 未保存・既に dirty の伝票は見る必要がない
+    if raw or not instance.pk or not instance.closed_at or not instance.payroll_snapshot:
+        return
+    if instance.payroll_dirty_at is not None:
         return
+    fields = _PAYROLL_BILL_FIELDS
+    if update_fields is not None:
+        fields = {k: v for k, v in fields.items() if k in update_fields or v in update_fields}
+        if not fields:
+            return
+    stored = Bill.objects.filter(pk=instance.pk).values(*fields.values()).first()
+    instance._payroll_fields_changed = bool(stored) and any(
+        stored[attr] != getattr(instance, attr) for attr in fields.values()
+    )
+
+
+@receiver(post_save, sender=Bill)
+def _payroll_dirty_after_bill_save(sender, instance: Bill, **kwargs):
+    if instance.__dict__.pop('_payroll_fields_changed', False):
+        mark_payroll_dirty(instance.pk)
+
+
+def _is_bill_cascade(origin) -> bool:
+    return isinstance(origin, Bill) or getattr(origin, 'model', None) is Bill
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=BillCastStay)
+@receiver(post_save, sender=BillCustomerNomination)
+@receiver(post_save, sender=BillSubstituteItem)
+@receiver(post_save, sender=BillDiscountLine)
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=BillCastStay)
+@receiver(post_delete, sender=BillCustomerNomination)
+@receiver(post_delete, sender=BillSubstituteItem)
+@receiver(post_delete, sender=BillDiscountLine)
+def _payroll_dirty_after_line_change(sender, instance, raw=False, origin=None, **kwargs):
+    # 伝票ごと削除されるときのカスケードは対象外
+    if raw or _is_bill_cascade(origin):
+        return
+    mark_payroll_dirty(instance.bill_id)
+
+
+@receiver(m2m_changed, sender=Bill.nominated_casts.through)
+def _payroll_dirty_after_nominated_casts(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        mark_payroll_dirty(instance.pk)
+    elif pk_set:
+        for bill_id in pk_set:
+            mark_payroll_dirty(bill_id)
+
+
+# ---------- payroll_snapshot の正規化（BillPayrollSnapshotCast） ----------
+
+from .services.snapshot_casts import sync_snapshot_casts
+
+
+@receiver(post_save, sender=Bill)
+def _sync_snapshot_casts_after_bill_save(sender, instance: Bill, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None:
+        if 'payroll_snapshot' not in update_fields:
+            return
+    elif created or not instance.closed_at:
+        # snapshot は締め済み伝票にしか無い
+        return
+    sync_snapshot_casts(instance.pk, instance.payroll_snapshot)
+
+
+# ---------- 所属・ロールのキャッシュ無効化（accounts.access / middleware） ----------
+
+from accounts.access import bump_access_version
+from accounts.models import StoreMembership
+from .middleware import forget_store
+
+
+@receiver(post_save, sender=StoreMembership)
+@receiver(post_delete, sender=StoreMembership)
+@receiver(post_save, sender=Staff)
+@receiver(post_delete, sender=Staff)
+@receiver(post_save, sender=Cast)
+@receiver(post_delete, sender=Cast)
+def _bump_access_on_member_change(sender, instance, **kwargs):
+    bump_access_version(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def _bump_access_on_user_save(sender, instance, **kwargs):
+    # 旧フィールド user.store も所属に含めている
+    bump_access_version(instance.pk)
+
+
+@receiver(m2m_changed, sender=Staff.stores.through)
+def _bump_access_on_staff_stores(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_access_version(instance.user_id)
+        return
+    # store 側から staff を付け外しした場合
+    staffs = Staff.objects.all() if pk_set is None else Staff.objects.filter(pk__in=pk_set)
+    for user_id in staffs.values_list('user_id', flat=True):
+        bump_access_version(user_id)
+
+
+@receiver(post_delete, sender=Store)
+def _forget_deleted_store(sender, instance, **kwargs):
+    forget_store(instance.pk)
+
+
+# ---------- 顧客×キャスト相性（CustomerCastAffinity）の差分保守 ----------
+# 締め済み伝票の明細・顧客の変更前後で寄与を比べて加減算する。全再構築は rebuild_customer_cast_affinity。
+
+from .models import BillCustomer
+from .services.affinity import EMPTY, affinity_scope, apply_affinity_delta, bill_affinity, bill_affinity_lines
+
+# 相性のスコープ（店舗・日付・締め）に関係する Bill のフィールド
+_AFFINITY_SCOPE_FIELDS = {'closed_at', 'table', 'table_id', 'opened_at'}
+
+
+@receiver(pre_save, sender=Bill)
+def _affinity_scope_before_bill_save(sender, instance: Bill, raw=False, update_fields=None, **kwargs):
+    skip = bool(raw) or not instance.pk or (
+        update_fields is not None and not (set(update_fields) & _AFFINITY_SCOPE_FIELDS)
+    )
+    instance._affinity_scope_before = False if skip else affinity_scope(instance.pk)
 
-    # 新規作成時は何もしない（close時にだけ走らせたい）
-    if not instance.closed_at:
+
+@receiver(post_save, sender=Bill)
+def _affinity_after_bill_save(sender, instance: Bill, created, **kwargs):
+    before = instance.__dict__.pop('_affinity_scope_before', False)
+    if before is False:
+        return
+    after = affinity_scope(instance.pk)
+    if before == after:
+        return
+    # 明細・顧客は Bill の保存で変わらないので、同じ寄与を旧スコープから新スコープへ移す
+    lines = bill_affinity_lines(instance.pk)
+    apply_affinity_delta((before, lines), (after, lines))
+
+
+@receiver(pre_delete, sender=Bill)
+def _affinity_before_bill_delete(sender, instance: Bill, **kwargs):
+    instance._affinity_before = bill_affinity(instance.pk)
+
+
+@receiver(post_delete, sender=Bill)
+def _affinity_after_bill_delete(sender, instance: Bill, **kwargs):
+    apply_affinity_delta(getattr(instance, '_affinity_before', EMPTY))
+
+
+@receiver(pre_save, sender=BillItem)
+@receiver(pre_save, sender=BillCustomer)
+def _affinity_before_line_save(sender, instance, raw=False, **kwargs):
+    instance._affinity_before = None if raw or not instance.bill_id else bill_affinity(instance.bill_id)
+
+
+@receiver(pre_delete, sender=BillItem)
+@receiver(pre_delete, sender=BillCustomer)
+def _affinity_before_line_delete(sender, instance, origin=None, **kwargs):
+    # 伝票ごと削除される場合は Bill 側で差し引く
+    own = _is_own_delete(sender, origin) and instance.bill_id
+    instance._affinity_before = bill_affinity(instance.bill_id) if own else None
+
+
+@receiver(post_save, sender=BillItem)
+@receiver(post_save, sender=BillCustomer)
+@receiver(post_delete, sender=BillItem)
+@receiver(post_delete, sender=BillCustomer)
+def _affinity_after_line_change(sender, instance, **kwargs):
+    before = instance.__dict__.pop('_affinity_before', None)
+    if before is None or before is EMPTY:
+        # 未クローズ伝票の明細・顧客の変更（明細の保存で締め状態は変わらない）
+        return
+    apply_affinity_delta(before, bill_affinity(instance.bill_id))
+
+
+@receiver(m2m_changed, sender=Bill.customers.through)
+def _affinity_after_customers_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # bill.customers.add() は through を bulk_create するので BillCustomer の post_save を通らない
+    # （remove / clear は through の delete なので BillCustomer の post_delete で処理される）
+    if action == 'pre_add':
+        bill_ids = pk_set if reverse else [instance.pk]
+        instance._affinity_m2m_before = {bill_id: bill_affinity(bill_id) for bill_id in bill_ids or ()}
+    elif action == 'post_add':
+        for bill_id, before in instance.__dict__.pop('_affinity_m2m_before', {}).items():
+            if before is not EMPTY:
+                apply_affinity_delta(before, bill_affinity(bill_id))
+
+
+# ---------- 顧客来店実績（CustomerStats）の差分保守 ----------
+# 締め済み伝票の店舗・日時・grand_total・顧客の変更前後を比べて加減算する。全再構築は rebuild_customer_stats。
+
+from .services.customer_stats import apply_visit_delta, bill_visit, visit_customers, visit_head
+
+_VISIT_FIELDS = {'closed_at', 'table', 'table_id', 'opened_at', 'grand_total'}
+
+
+@receiver(pre_save, sender=Bill)
+def _visit_before_bill_save(sender, instance: Bill, raw=False, update_fields=None, **kwargs):
+    instance._visit_head_before = False
+    if raw or not instance.pk:
         return
+    if update_fields is not None:
+        fields = set(update_fields)
+        if not (fields & _VISIT_FIELDS):
+            return
+        # 未クローズ伝票の金額再計算（明細追加ごとに走る）は来店に関係しない
+        if 'closed_at' not in fields and instance.closed_at is None:
+            return
+    instance._visit_head_before = visit_head(instance.pk)
 
-    try:
-        store_id = instance.table.store_id if instance.table_id else None
-        work_date = instance.closed_at.date()
-    except Exception:
-        store_id = None
-        work_date = None
 
-    if store_id and work_date:
-        transaction.on_commit(lambda: _rebuild_cast_daily_summaries(store_id, work_date))
+@receiver(post_save, sender=Bill)
+def _visit_after_bill_save(sender, instance: Bill, **kwargs):
+    before = instance.__dict__.pop('_visit_head_before', False)
+    if before is False:
+        return
+    after = visit_head(instance.pk)
+    if before == after:
+        return
+    # 顧客は Bill の保存で変わらない
+    customers = visit_customers(instance.pk)
+    apply_visit_delta(before and (before, customers), after and (after, customers))
+
+
+@receiver(pre_delete, sender=Bill)
+def _visit_before_bill_delete(sender, instance: Bill, **kwargs):
+    instance._visit_before = bill_visit(instance.pk)
+
+
+@receiver(post_delete, sender=Bill)
+def _visit_after_bill_delete(sender, instance: Bill, **kwargs):
+    apply_visit_delta(getattr(instance, '_visit_before', None))
+
+
+@receiver(pre_save, sender=BillCustomer)
+def _visit_before_billcustomer_save(sender, instance, raw=False, **kwargs):
+    instance._visit_before = None if raw else bill_visit(instance.bill_id)
+
+
+@receiver(pre_delete, sender=BillCustomer)
+def _visit_before_billcustomer_delete(sender, instance, origin=None, **kwargs):
+    # 伝票ごと削除される場合は Bill 側で差し引く
+    instance._visit_before = bill_visit(instance.bill_id) if _is_own_delete(sender, origin) else None
+
+
+@receiver(post_save, sender=BillCustomer)
+@receiver(post_delete, sender=BillCustomer)
+def _visit_after_billcustomer_change(sender, instance, **kwargs):
+    before = instance.__dict__.pop('_visit_before', None)
+    if before is None:
+        # 未クローズ伝票
+        return
+    apply_visit_delta(before, bill_visit(instance.bill_id))
+
+
+@receiver(m2m_changed, sender=Bill.customers.through)
+def _visit_after_customers_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # bill.customers.add() は BillCustomer の post_save を通らない（remove / clear は post_delete で処理）
+    if action == 'pre_add':
+        bill_ids = pk_set if reverse else [instance.pk]
+        instance._visit_m2m_before = {bill_id: bill_visit(bill_id) for bill_id in bill_ids or ()}
+    elif action == 'post_add':
+        for bill_id, before in instance.__dict__.pop('_visit_m2m_before', {}).items():
+            if before is not None:
+                apply_visit_delta(before, bill_visit(bill_id))
@@ -39,3 +39,41 @@ def staff_user(store):
     staff = Staff.objects.create(user=user)
     staff.stores.add(store)          # 所属店舗を付与
     return user
+
+
+@pytest.fixture
+def query_budget():
+    """
+    クエリ数の上限を検証する（P&L 等のベンチマーク用）。
+    上限を超えたら、各 SELECT の EXPLAIN を添えて失敗させる。
+
+        with query_budget(6) as ctx:
+            get_daily_pl(...)
+    """
+    from contextlib import contextmanager
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    def _explain(sql):
+        if not sql.lstrip().upper().startswith("SELECT"):
+            return ""
+        prefix = connection.ops.explain_query_prefix()
+        try:
+            with connection.cursor() as cur:
+                cur.execute(f"{prefix} {sql}")
+                return "\n".join("    " + " ".join(str(c) for c in row) for row in cur.fetchall())
+        except Exception as e:  # 再実行できない SQL は計画なしで出す
+            return f"    (explain failed: {e})"
+
+    @contextmanager
+    def _budget(max_queries):
+        with CaptureQueriesContext(connection) as ctx:
+            yield ctx
+        if len(ctx) > max_queries:
+            report = "\n".join(
+                f"[{i}] {q['sql']}\n{_explain(q['sql'])}"
+                for i, q in enumerate(ctx.captured_queries, 1)
+            )
+            pytest.fail(f"{len(ctx)} queries > budget {max_queries}\n{report}")
+
+    return _budget
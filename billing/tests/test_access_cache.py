@@ -0,0 +1,69 @@
+"""
+所属・cap 解決のキャッシュ（accounts.access / AttachStoreMiddleware）のテスト
+
+- 2回目以降のリクエスト（新しい user オブジェクト）では DB を読まないこと
+- StoreMembership / Staff の変更で次の判定に反映されること
+"""
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from accounts.caps import get_caps_for
+from accounts.models import StoreMembership, StoreRole
+from billing.middleware import get_store_ref
+from billing.models import Staff, Store
+from billing.views import user_store_ids
+
+User = get_user_model()
+
+
+class AccessCacheTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='access-a', name='A')
+        self.other = Store.objects.create(slug='access-b', name='B')
+        self.user = User.objects.create_user('access-user', password='pass')
+        self.membership = StoreMembership.objects.create(user=self.user, store=self.store, role=StoreRole.STAFF)
+
+    def _fresh_user(self):
+        """リクエストごとに認証で取り直される user 相当"""
+        return User.objects.get(pk=self.user.pk)
+
+    def test_caps_cached_across_requests(self):
+        self.assertIn('operate_orders', get_caps_for(self._fresh_user(), self.store.id))
+
+        user = self._fresh_user()
+        with self.assertNumQueries(0):
+            caps = get_caps_for(user, self.store.id)
+            self.assertEqual(user_store_ids(user), {self.store.id})
+        self.assertNotIn('user_manage', caps)
+        self.assertEqual(get_caps_for(self._fresh_user(), self.other.id), set())
+
+    def test_membership_change_invalidates(self):
+        get_caps_for(self._fresh_user(), self.store.id)
+
+        self.membership.role = StoreRole.MANAGER
+        self.membership.save()
+        self.assertIn('user_manage', get_caps_for(self._fresh_user(), self.store.id))
+
+        StoreMembership.objects.create(user=self.user, store=self.other, role=StoreRole.OWNER)
+        self.assertIn('view_pl_multi', get_caps_for(self._fresh_user(), None))
+
+    def test_staff_stores_change_invalidates(self):
+        staff, _ = Staff.objects.get_or_create(user=self.user)
+        self.assertNotIn(self.other.id, user_store_ids(self._fresh_user()))
+
+        staff.stores.add(self.other)
+        self.assertIn(self.other.id, user_store_ids(self._fresh_user()))
+
+        self.other.staff_members.remove(staff)
+        self.assertNotIn(self.other.id, user_store_ids(self._fresh_user()))
+
+    def test_store_ref_cached(self):
+        get_store_ref(self.store.id)
+        with self.assertNumQueries(0):
+            store = get_store_ref(self.store.id)
+        self.assertEqual(store.id, self.store.id)
+        self.assertEqual(store.slug, 'access-a')   # 他の属性は遅延ロード
+
+        with self.assertRaises(Store.DoesNotExist):
+            get_store_ref(self.other.id + 1000)
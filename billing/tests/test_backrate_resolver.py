@@ -0,0 +1,167 @@
+"""
+BackRateResolver（店舗単位のバック率キャッシュ）のテスト
+
+- resolve_back_rate と同じ優先順位で同じ値を返すこと
+- CastCategoryRate / Cast / ItemCategory / Store の保存で無効化されること
+- 明細数が増えてもクエリ数が増えないこと（ベンチマーク）
+- 明細一覧のシリアライズでバージョン確認が明細数に比例しないこと
+"""
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from billing.models import (
+    Bill, BillItem, Cast, CastCategoryRate, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.serializers import BillItemSerializer
+from billing.services import backrate
+from billing.services.backrate import (
+    BackRateResolver, get_back_rate_resolver, resolve_back_rate,
+)
+
+User = get_user_model()
+
+STAY_TYPES = ('free', 'nom', 'in', 'dohan')
+
+
+class BackRateResolverTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(
+            slug='br-store', name='BR',
+            back_rate_free_default=Decimal('0.05'),
+            back_rate_nomination_default=Decimal('0.06'),
+            back_rate_inhouse_default=Decimal('0.07'),
+            back_rate_dohan_default=Decimal('0.08'),
+        )
+        self.table = Table.objects.create(store=self.store, code='T01')
+        self.drink = ItemCategory.objects.create(
+            code='br-drink', name='ドリンク',
+            back_rate_free=Decimal('0.30'),
+            back_rate_nomination=Decimal('0.40'),
+            back_rate_inhouse=Decimal('0.35'),
+        )
+        self.food = ItemCategory.objects.create(code='br-food', name='フード')
+        self.item = ItemMaster.objects.create(
+            store=self.store, name='ショット', price_regular=1000, category=self.drink,
+        )
+        self.plain = Cast.objects.create(
+            user=User.objects.create_user('br1'), stage_name='A', store=self.store,
+        )
+        self.overridden = Cast.objects.create(
+            user=User.objects.create_user('br2'), stage_name='B', store=self.store,
+            back_rate_free_override=Decimal('0.50'),
+        )
+        CastCategoryRate.objects.create(
+            cast=self.overridden, category=self.drink, rate_nomination=Decimal('0.60'),
+        )
+
+    def test_matches_resolve_back_rate(self):
+        resolver = BackRateResolver(self.store)
+        for cast in (None, self.plain, self.overridden):
+            for cat in (None, self.drink, self.food):
+                for stay in STAY_TYPES:
+                    expected = resolve_back_rate(store=self.store, category=cat, cast=cast, stay_type=stay)
+                    got = resolver.resolve(category=cat, cast=cast, stay_type=stay)
+                    self.assertEqual(got, expected, (cast, cat, stay))
+
+    def test_cast_from_other_store_is_loaded_lazily(self):
+        other = Store.objects.create(slug='br-other', name='Other')
+        guest = Cast.objects.create(user=User.objects.create_user('br3'), stage_name='G', store=other)
+        CastCategoryRate.objects.create(cast=guest, category=self.drink, rate_free=Decimal('0.11'))
+
+        resolver = BackRateResolver(self.store)
+        self.assertEqual(
+            resolver.resolve(category=self.drink, cast=guest, stay_type='free'),
+            Decimal('0.11'),
+        )
+
+    def test_invalidated_on_save(self):
+        first = get_back_rate_resolver(self.store)
+        self.assertIs(get_back_rate_resolver(self.store), first)
+
+        CastCategoryRate.objects.create(cast=self.plain, category=self.drink, rate_free=Decimal('0.99'))
+        second = get_back_rate_resolver(self.store)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.resolve(category=self.drink, cast=self.plain, stay_type='free'), Decimal('0.99'))
+
+        self.drink.back_rate_inhouse = Decimal('0.12')
+        self.drink.save()
+        third = get_back_rate_resolver(self.store)
+        self.assertIsNot(third, second)
+        self.assertEqual(third.resolve(category=self.drink, cast=self.plain, stay_type='in'), Decimal('0.12'))
+
+        self.store.back_rate_dohan_default = Decimal('0.20')
+        self.store.save()
+        self.assertEqual(
+            get_back_rate_resolver(self.store).resolve(category=self.drink, cast=self.plain, stay_type='dohan'),
+            Decimal('0.20'),
+        )
+
+    def test_query_count_per_bill(self):
+        """
+        ベンチマーク: 40明細×2キャストの伝票で、旧方式（明細ごとに resolve_back_rate）と
+        リゾルバ方式のクエリ数を比較する。
+        """
+        bill = Bill.objects.create(table=self.table)
+        for i in range(40):
+            BillItem.objects.create(
+                bill=bill, item_master=self.item, qty=1, price=1000,
+                served_by_cast=self.plain if i % 2 else self.overridden,
+            )
+        items = list(bill.items.select_related('item_master__category', 'served_by_cast'))
+        casts = (self.plain, self.overridden)
+
+        with CaptureQueriesContext(connection) as legacy:
+            legacy_rates = [
+                resolve_back_rate(store=self.store, category=it.item_master.category, cast=c, stay_type='free')
+                for it in items for c in casts
+            ]
+
+        with CaptureQueriesContext(connection) as batched:
+            resolver = BackRateResolver(self.store)
+            batched_rates = [
+                resolver.resolve(category=it.item_master.category, cast=c, stay_type='free')
+                for it in items for c in casts
+            ]
+
+        self.assertEqual(legacy_rates, batched_rates)
+        self.assertEqual(len(legacy), len(items) * len(casts))
+        # ItemCategory / Cast / CastCategoryRate の3クエリで固定
+        self.assertEqual(
+            len(batched), 3,
+            f'items={len(items)} casts={len(casts)} legacy={len(legacy)} resolver={len(batched)}',
+        )
+
+    def test_serializer_reads_version_once(self):
+        bill = Bill.objects.create(table=self.table)
+        for i in range(40):
+            BillItem.objects.create(
+                bill=bill, item_master=self.item, qty=1, price=1000,
+                served_by_cast=self.plain if i % 2 else self.overridden,
+            )
+        items = list(bill.items.select_related('bill__table__store', 'item_master__category', 'served_by_cast'))
+        expected = [it.effective_back_rate for it in items]
+
+        # 明細ごとではなく、シリアライズ1回で全店共通＋店舗のバージョンを1回ずつ
+        with mock.patch.object(backrate, '_version_of', wraps=backrate._version_of) as version_of:
+            data = BillItemSerializer(items, many=True).data
+        self.assertEqual([Decimal(str(row['back_rate'])) for row in data], expected)
+        self.assertEqual(version_of.call_count, 2)
+
+    def test_close_uses_resolver(self):
+        bill = Bill.objects.create(table=self.table)
+        BillItem.objects.create(
+            bill=bill, item_master=self.item, qty=1, price=1000,
+            served_by_cast=self.overridden, is_nomination=True,
+        )
+        BillItem.objects.create(
+            bill=bill, item_master=self.item, qty=1, price=1000, served_by_cast=self.plain,
+        )
+        bill.close()
+        rates = sorted(bill.items.values_list('back_rate', flat=True))
+        self.assertEqual(rates, [Decimal('0.30'), Decimal('0.60')])
@@ -0,0 +1,104 @@
+"""
+BatchBillCalculator（複数伝票の一括計算）のテスト
+
+- 伝票ごとの BillCalculator と同じ結果を返すこと
+- 伝票数が増えてもクエリ数が一定であること
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from billing.calculator import BatchBillCalculator, BillCalculator
+from billing.models import (
+    Bill, BillCastStay, BillCustomer, BillCustomerNomination, BillItem, Cast, Customer,
+    DiscountRule, ItemCategory, ItemMaster, SeatType, Store, StoreSeatSetting, Table,
+)
+
+User = get_user_model()
+
+
+class BatchBillCalculatorTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='batch-store', name='Batch')
+        self.vip = SeatType.objects.create(code='vip', name='VIP')
+        StoreSeatSetting.objects.create(store=self.store, seat_type=self.vip, service_rate=Decimal('0.25'))
+        self.table = Table.objects.create(store=self.store, code='T01')
+        self.vip_table = Table.objects.create(store=self.store, code='V01', seat_type=self.vip)
+        self.category = ItemCategory.objects.create(code='batch-drink', name='ドリンク')
+        self.item = ItemMaster.objects.create(
+            store=self.store, name='ショット', price_regular=3000, category=self.category,
+        )
+        self.discount = DiscountRule.objects.create(store=self.store, name='初回', amount_off=1000)
+        self.cast = Cast.objects.create(
+            user=User.objects.create_user('batch1'), stage_name='A', store=self.store,
+        )
+        self.other = Cast.objects.create(
+            user=User.objects.create_user('batch2'), stage_name='B', store=self.store,
+        )
+
+    def _make_bill(self, i):
+        now = timezone.now()
+        bill = Bill.objects.create(
+            table=self.vip_table if i % 2 else self.table,
+            discount_rule=self.discount if i % 3 == 0 else None,
+            main_cast=self.cast if i % 2 == 0 else None,
+        )
+        bill.nominated_casts.add(self.other)
+        BillCastStay.objects.create(bill=bill, cast=self.cast, entered_at=now, stay_type='nom')
+        customer = bill.customers.first() or Customer.objects.create()
+        bc, _ = BillCustomer.objects.get_or_create(bill=bill, customer=customer)
+        bc.arrived_at = now - timedelta(hours=1)
+        bc.save()
+        BillCustomerNomination.objects.create(
+            bill=bill, customer=customer, cast=self.cast, started_at=now - timedelta(hours=1),
+        )
+        for n in range(3):
+            BillItem.objects.create(
+                bill=bill, item_master=self.item, qty=n + 1, price=3000,
+                served_by_cast=self.cast if n else self.other,
+                is_nomination=(n == 0), back_rate=Decimal('0.10'),
+                ordered_at=now - timedelta(minutes=30),
+            )
+        return bill
+
+    def _assert_same(self, bills):
+        results = BatchBillCalculator(Bill.objects.filter(id__in=[b.id for b in bills])).execute()
+        for bill in bills:
+            expected = BillCalculator(Bill.objects.get(pk=bill.pk)).execute()
+            got = results[bill.id]
+            self.assertEqual(got.as_dict(), expected.as_dict())
+            self.assertEqual(
+                sorted((p.cast_id, p.amount) for p in got.cast_payouts),
+                sorted((p.cast_id, p.amount) for p in expected.cast_payouts),
+            )
+
+    def test_matches_single_calculator(self):
+        self._assert_same([self._make_bill(i) for i in range(4)])
+
+    @override_settings(USE_TIMEBOXED_NOM_POOL=True)
+    def test_matches_single_calculator_timeboxed(self):
+        self._assert_same([self._make_bill(i) for i in range(4)])
+
+    def test_query_count_is_flat(self):
+        bills = [self._make_bill(i) for i in range(2)]
+
+        with CaptureQueriesContext(connection) as small:
+            BatchBillCalculator(Bill.objects.filter(id__in=[b.id for b in bills])).execute()
+
+        bills += [self._make_bill(i) for i in range(2, 8)]
+        with CaptureQueriesContext(connection) as large:
+            BatchBillCalculator(Bill.objects.filter(id__in=[b.id for b in bills])).execute()
+
+        self.assertEqual(len(small), len(large))
+
+    def test_accepts_list_of_bills(self):
+        bills = [self._make_bill(i) for i in range(3)]
+        fresh = list(Bill.objects.filter(id__in=[b.id for b in bills]))
+        results = BatchBillCalculator(fresh).execute()
+        self.assertEqual(set(results), {b.id for b in bills})
@@ -0,0 +1,109 @@
+# billing/tests/test_bill_board.py
+from datetime import timedelta
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from billing.models import (
+    Bill, BillCustomer, BillItem, Cast, Customer, ItemCategory, ItemMaster, Store, Table,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def floor():
+    store = Store.objects.create(slug="board-store", name="Board", service_rate=10, tax_rate=10)
+    tables = [Table.objects.create(store=store, code=code) for code in ("A", "B", "C")]
+    drink = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=drink, code="HB")
+    cast = Cast.objects.create(user=User.objects.create_user(username="board-cast"), stage_name="あかり", store=store)
+
+    admin = User.objects.create_superuser("board-admin", password="x")
+    client = APIClient()
+    client.force_authenticate(admin)
+    return store, tables, item, cast, client
+
+
+def _open_bill(table, item, n_items, **kw):
+    bill = Bill.objects.create(table=table, **kw)
+    bill.tables.add(table)
+    for q in range(n_items):
+        BillItem.objects.create(bill=bill, item_master=item, qty=q + 1, price=item.price_regular)
+    return bill
+
+
+def _board(client, store, query=""):
+    res = client.get(f"/api/billing/bills/board/{query}", HTTP_X_STORE_ID=str(store.id))
+    assert res.status_code == 200, res.content
+    return res.json()
+
+
+def test_board_matches_bill_list_totals(floor):
+    store, (a, b, c), item, cast, client = floor
+    now = timezone.now()
+    first = _open_bill(a, item, 3, pax=2, main_cast=cast, expected_out=now - timedelta(minutes=5))
+    second = _open_bill(b, item, 1, pax=1, expected_out=now + timedelta(hours=1))
+    closed = _open_bill(c, item, 2)
+    closed.closed_at = now
+    closed.save(update_fields=["closed_at"])
+    # customers.first() と同じく pk が小さい顧客の名前（新規伝票の stub 顧客は外す）
+    BillCustomer.objects.filter(bill=first).delete()
+    later = Customer.objects.create(full_name="B 後", phone="+81900000002")
+    earlier = Customer.objects.create(full_name="A 先", phone="+81900000001")
+    BillCustomer.objects.create(bill=first, customer=later)
+    BillCustomer.objects.create(bill=first, customer=earlier)
+
+    rows = {r["id"]: r for r in _board(client, store)}
+    assert set(rows) == {first.id, second.id}
+
+    listed = client.get("/api/billing/bills/", HTTP_X_STORE_ID=str(store.id)).json()
+    listed = {r["id"]: r for r in (listed["results"] if isinstance(listed, dict) else listed)}
+    for bill_id, row in rows.items():
+        assert row["grand_total"] == listed[bill_id]["grand_total"]
+        assert row["customer_display_name"] == listed[bill_id]["customer_display_name"]
+
+    assert rows[first.id] == {
+        **rows[first.id],
+        "table_id": a.id, "table_label": "A", "status": "overdue", "pax": 2,
+        "main_cast_id": cast.id, "main_cast_name": "あかり", "customer_display_name": "B 後",
+    }
+    assert (rows[second.id]["status"], rows[second.id]["main_cast_name"]) == ("open", None)
+
+
+def test_board_query_count_is_fixed(floor):
+    store, (a, b, c), item, cast, client = floor
+    _open_bill(a, item, 2, main_cast=cast)
+    _board(client, store)   # 店舗解決のキャッシュを温める
+
+    def count():
+        with CaptureQueriesContext(connection) as ctx:
+            _board(client, store)
+        return len(ctx.captured_queries)
+
+    few = count()
+    for n in range(6):
+        _open_bill((a, b, c)[n % 3], item, n + 1, main_cast=cast)
+    assert count() == few
+
+
+def test_board_sparse_fields(floor):
+    store, (a, _, _), item, cast, client = floor
+    _open_bill(a, item, 2, main_cast=cast)
+    _board(client, store)
+
+    with CaptureQueriesContext(connection) as full:
+        _board(client, store)
+    with CaptureQueriesContext(connection) as sparse:
+        rows = _board(client, store, "?fields=table_label,status")
+    assert list(rows[0]) == ["id", "table_label", "status"]
+    # 金額・顧客を返さないなら伝票グラフを読まない
+    assert len(sparse.captured_queries) < len(full.captured_queries)
+
+    res = client.get("/api/billing/bills/board/?fields=id,items", HTTP_X_STORE_ID=str(store.id))
+    assert res.status_code == 400
+    assert "items" in res.json()["fields"]
@@ -0,0 +1,114 @@
+"""
+明細一括追加（POST /bills/<id>/items/bulk/）のテスト
+
+- N 行を1回の再計算・1回のチケット作成で追加できること
+- 1行でも不正なら何も作らないこと（all-or-nothing）
+- 締め済み伝票では CastDailySummary / CustomerCastAffinity が全再構築と一致すること
+"""
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import StoreMembership, StoreRole
+from billing.models import (
+    Bill, BillItem, Cast, CastDailySummary, CustomerCastAffinity, ItemCategory, ItemMaster, OrderTicket, Store, Table,
+)
+from billing.services import bulk_items
+from billing.services.affinity import rebuild_customer_cast_affinity
+from billing.services.cast_summary import rebuild_cast_daily_summaries
+
+User = get_user_model()
+
+
+class BillItemsBulkTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(
+            slug='bulk-store', name='Bulk', service_rate=Decimal('0'), tax_rate=Decimal('0'),
+        )
+        self.table = Table.objects.create(store=self.store, code='T01')
+        self.bill = Bill.objects.create(table=self.table)
+        kitchen = ItemCategory.objects.create(code='bulk-food', name='フード', route='kitchen')
+        drink = ItemCategory.objects.create(code='bulk-drink', name='ドリンク')
+        self.food = ItemMaster.objects.create(store=self.store, name='唐揚げ', price_regular=800, category=kitchen)
+        self.glass = ItemMaster.objects.create(store=self.store, name='ハイボール', price_regular=1000, category=drink)
+        self.cast = Cast.objects.create(user=User.objects.create_user('bulk-cast'), stage_name='A', store=self.store)
+
+        user = User.objects.create_superuser('bulk-admin', password='pass')
+        StoreMembership.objects.create(user=user, store=self.store, role=StoreRole.MANAGER, is_primary=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.client.credentials(HTTP_X_STORE_ID=str(self.store.id))
+
+    def _post(self, rows, bill=None):
+        bill = bill or self.bill
+        return self.client.post(f'/api/billing/bills/{bill.id}/items/bulk/', rows, format='json')
+
+    def test_bulk_adds_items_with_one_recalc(self):
+        rows = [
+            {'item_master': self.food.id, 'qty': 2},
+            {'item_master': self.glass.id, 'qty': 3, 'served_by_cast_id': self.cast.id},
+            {'item_master': self.glass.id, 'qty': 1, 'price': 1500, 'served_by_cast_ids': [self.cast.id]},
+        ]
+        recalc = mock.patch.object(
+            bulk_items, '_recalc_bill_after_items_change',
+            wraps=bulk_items._recalc_bill_after_items_change,
+        )
+        with recalc as spy:
+            res = self._post({'items': rows})
+        self.assertEqual(res.status_code, 201, res.content)
+        self.assertEqual(spy.call_count, 1)
+        self.assertEqual([r['qty'] for r in res.json()], [2, 3, 1])
+
+        items = list(BillItem.objects.filter(bill=self.bill))
+        self.assertEqual([(i.name, i.price) for i in items], [('唐揚げ', 800), ('ハイボール', 1000), ('ハイボール', 1500)])
+        self.assertEqual(items[2].served_by_cast_id, self.cast.id)
+        self.assertEqual(list(items[2].served_by_casts.values_list('id', flat=True)), [self.cast.id])
+
+        # KDS 対象（kitchen）の商品だけ、数量分のチケット
+        self.assertEqual(OrderTicket.objects.filter(bill_item=items[0], route='kitchen').count(), 2)
+        self.assertEqual(OrderTicket.objects.filter(bill_item__bill=self.bill).count(), 2)
+
+        self.bill.refresh_from_db()
+        self.assertEqual(self.bill.subtotal, 1600 + 3000 + 1500)
+
+    def test_invalid_row_creates_nothing(self):
+        res = self._post([
+            {'item_master': self.food.id, 'qty': 1},
+            {'item_master': self.glass.id, 'qty': 0},
+        ])
+        self.assertEqual(res.status_code, 400, res.content)
+        self.assertFalse(BillItem.objects.filter(bill=self.bill).exists())
+        self.assertFalse(OrderTicket.objects.exists())
+
+    def test_closed_bill_keeps_cast_summary(self):
+        BillItem.objects.create(bill=self.bill, item_master=self.glass, qty=1, price=1000, served_by_cast=self.cast)
+        self.bill.close()
+        self.bill.refresh_from_db()
+
+        res = self._post([{'item_master': self.glass.id, 'qty': 2, 'served_by_cast_id': self.cast.id}])
+        self.assertEqual(res.status_code, 201, res.content)
+
+        columns = ('cast_id', 'sales_free', 'sales_in', 'sales_nom', 'sales_champ')
+        incremental = list(CastDailySummary.objects.filter(store=self.store).values_list(*columns))
+        rebuild_cast_daily_summaries(self.store.id, timezone.localdate(self.bill.closed_at))
+        self.assertEqual(incremental, list(CastDailySummary.objects.filter(store=self.store).values_list(*columns)))
+        self.assertEqual(incremental, [(self.cast.id, 3000, 0, 0, 0)])
+
+    def test_closed_bill_keeps_customer_cast_affinity(self):
+        BillItem.objects.create(bill=self.bill, item_master=self.glass, qty=1, price=1000, served_by_cast=self.cast)
+        self.bill.close()
+        self.bill.refresh_from_db()
+
+        res = self._post([{'item_master': self.glass.id, 'qty': 2, 'served_by_cast_id': self.cast.id}])
+        self.assertEqual(res.status_code, 201, res.content)
+
+        columns = ('customer_id', 'cast_id', 'spent_total', 'item_count', 'bill_count')
+        incremental = list(CustomerCastAffinity.objects.filter(store=self.store).values_list(*columns))
+        rebuild_customer_cast_affinity(self.store.id)
+        self.assertEqual(incremental, list(CustomerCastAffinity.objects.filter(store=self.store).values_list(*columns)))
+        self.assertEqual([row[2:4] for row in incremental], [(3000, 2)])
@@ -0,0 +1,145 @@
+"""
+CastDailySummary 差分保守のテスト
+
+- クローズ後の明細・stay・伝票の変更を差分で反映した結果が、全再構築と一致すること
+- 売上に関係しない伝票の保存では CastDailySummary に触れないこと
+- 差分更新では worked_min / payroll を壊さないこと
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillCastStay, BillItem, Cast, CastDailySummary,
+    ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services.cast_summary import rebuild_cast_daily_summaries
+
+User = get_user_model()
+
+COLUMNS = ('cast_id', 'sales_free', 'sales_in', 'sales_nom', 'sales_champ')
+
+
+class CastSummaryIncrementalTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='cds-store', name='CDS')
+        self.table = Table.objects.create(store=self.store, code='T01')
+        self.champ = ItemCategory.objects.create(code='champagne', name='シャンパン')
+        self.drink = ItemCategory.objects.create(code='cds-drink', name='ドリンク')
+        self.bottle = ItemMaster.objects.create(
+            store=self.store, name='モエ', price_regular=20000, category=self.champ,
+        )
+        self.glass = ItemMaster.objects.create(
+            store=self.store, name='ハイボール', price_regular=1000, category=self.drink,
+        )
+        self.a = Cast.objects.create(user=User.objects.create_user('cds1'), stage_name='A', store=self.store)
+        self.b = Cast.objects.create(user=User.objects.create_user('cds2'), stage_name='B', store=self.store)
+
+    def _rows(self):
+        return sorted(
+            CastDailySummary.objects.filter(store=self.store).values_list(*COLUMNS)
+        )
+
+    def _rebuilt_rows(self, work_date):
+        incremental = self._rows()
+        rebuild_cast_daily_summaries(self.store.id, work_date)
+        return incremental, self._rows()
+
+    def _closed_bill(self):
+        now = timezone.now()
+        bill = Bill.objects.create(table=self.table)
+        BillCastStay.objects.create(bill=bill, cast=self.a, entered_at=now - timedelta(hours=1), stay_type='free')
+        BillCastStay.objects.create(bill=bill, cast=self.a, entered_at=now, stay_type='nom')
+        BillCastStay.objects.create(bill=bill, cast=self.b, entered_at=now, stay_type='in')
+        BillItem.objects.create(bill=bill, item_master=self.bottle, qty=1, price=20000, served_by_cast=self.a)
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=3, price=1000, served_by_cast=self.b)
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=1, price=1000)
+        bill.close()
+        bill.refresh_from_db()
+        return bill
+
+    def test_close_matches_rebuild(self):
+        bill = self._closed_bill()
+        self._closed_bill()
+        incremental, rebuilt = self._rebuilt_rows(timezone.localdate(bill.closed_at))
+        self.assertEqual(incremental, rebuilt)
+        self.assertIn((self.a.id, 0, 0, 40000, 40000), incremental)
+        self.assertIn((self.b.id, 0, 6000, 0, 0), incremental)
+
+    def test_edits_after_close_match_rebuild(self):
+        bill = self._closed_bill()
+        other = self._closed_bill()
+
+        # 明細の追加・数量変更・削除
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=2, price=1000, served_by_cast=self.a)
+        item = bill.items.filter(served_by_cast=self.b).first()
+        item.qty = 5
+        item.save()
+        other.items.filter(served_by_cast=self.a).first().delete()
+
+        # stay 区分の変更（場内 → フリー）
+        stay = bill.stays.get(cast=self.b)
+        stay.stay_type = 'free'
+        stay.save()
+
+        incremental, rebuilt = self._rebuilt_rows(timezone.localdate(bill.closed_at))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_reopen_and_delete_match_rebuild(self):
+        bill = self._closed_bill()
+        reopened = self._closed_bill()
+        deleted = self._closed_bill()
+        work_date = timezone.localdate(bill.closed_at)
+
+        reopened.closed_at = None
+        reopened.save()
+        deleted.delete()
+
+        incremental, rebuilt = self._rebuilt_rows(work_date)
+        self.assertEqual(incremental, rebuilt)
+
+        bill.delete()
+        self.assertFalse(CastDailySummary.objects.filter(store=self.store).exists())
+
+    def test_moving_closed_at_moves_contribution(self):
+        bill = self._closed_bill()
+        today = timezone.localdate(bill.closed_at)
+        bill.closed_at = bill.closed_at - timedelta(days=1)
+        bill.save(update_fields=['closed_at'])
+
+        self.assertFalse(CastDailySummary.objects.filter(store=self.store, work_date=today).exists())
+        incremental, rebuilt = self._rebuilt_rows(today - timedelta(days=1))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_unrelated_bill_save_does_not_touch_summary(self):
+        bill = self._closed_bill()
+        bill.paid_cash = 5000
+        with CaptureQueriesContext(connection) as ctx:
+            bill.save(update_fields=['paid_cash'])
+        self.assertFalse(any('castdailysummary' in q['sql'].lower() for q in ctx.captured_queries))
+
+    def test_delta_keeps_worked_min(self):
+        bill = self._closed_bill()
+        work_date = timezone.localdate(bill.closed_at)
+        CastDailySummary.objects.filter(store=self.store, cast=self.a, work_date=work_date).update(
+            worked_min=180, payroll=6000,
+        )
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=1, price=1000, served_by_cast=self.a)
+
+        rec = CastDailySummary.objects.get(store=self.store, cast=self.a, work_date=work_date)
+        self.assertEqual((rec.worked_min, rec.payroll, rec.sales_nom), (180, 6000, 21000))
+
+    def test_repair_command(self):
+        bill = self._closed_bill()
+        work_date = timezone.localdate(bill.closed_at)
+        expected = self._rows()
+        CastDailySummary.objects.filter(store=self.store).update(sales_nom=1)
+
+        call_command('rebuild_cast_daily_summaries', '--date', work_date.isoformat(), '--store-slug', self.store.slug)
+        self.assertEqual(self._rows(), expected)
@@ -0,0 +1,72 @@
+"""
+Bill.close の時間別サマリ（HourlySalesSummary / HourlyCastSales）加算 upsert のテスト
+
+- 同じ時間帯に締めた伝票が1行に加算されること
+- キャスト別の区分・シャンパン売上が明細1パスの集計と一致すること
+- 既存行があっても upsert で加算（作り直さない）されること
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillCastStay, BillItem, Cast, CastDailySummary, HourlyCastSales,
+    HourlySalesSummary, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services.upsert import upsert_add
+
+User = get_user_model()
+
+
+class CloseRollupUpsertTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='rollup-store', name='Rollup')
+        self.table = Table.objects.create(store=self.store, code='T01')
+        champ = ItemCategory.objects.create(code='champagne', name='シャンパン')
+        drink = ItemCategory.objects.create(code='drink', name='ドリンク')
+        self.bottle = ItemMaster.objects.create(store=self.store, name='モエ', price_regular=20000, category=champ)
+        self.glass = ItemMaster.objects.create(store=self.store, name='ハイボール', price_regular=1000, category=drink)
+        self.a = Cast.objects.create(user=User.objects.create_user('rollup1'), stage_name='A', store=self.store)
+        self.b = Cast.objects.create(user=User.objects.create_user('rollup2'), stage_name='B', store=self.store)
+
+    def _close(self):
+        now = timezone.now()
+        bill = Bill.objects.create(table=self.table)
+        BillCastStay.objects.create(bill=bill, cast=self.a, entered_at=now - timedelta(minutes=30), stay_type='nom')
+        BillCastStay.objects.create(bill=bill, cast=self.b, entered_at=now, stay_type='in')
+        BillItem.objects.create(bill=bill, item_master=self.bottle, qty=1, price=20000, served_by_cast=self.a)
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=3, price=1000, served_by_cast=self.b)
+        BillItem.objects.create(bill=bill, item_master=self.glass, qty=1, price=1000)
+        bill.close()
+        bill.refresh_from_db()
+        return bill
+
+    def test_two_bills_same_hour(self):
+        first = self._close()
+        second = self._close()
+
+        summary = HourlySalesSummary.objects.get(store=self.store)
+        self.assertEqual(summary.bill_count, 2)
+        self.assertEqual(summary.sales_total, first.grand_total + second.grand_total)
+        self.assertEqual((summary.sales_champagne, summary.sales_drink), (40000, 8000))
+
+        rows = {r.cast_id: r for r in HourlyCastSales.objects.filter(hourly_summary=summary)}
+        a, b = rows[self.a.id], rows[self.b.id]
+        self.assertEqual((a.bill_count, a.sales_total, a.sales_nom, a.sales_champagne), (2, 40000, 40000, 40000))
+        self.assertEqual((b.bill_count, b.sales_total, b.sales_in, b.sales_free, b.sales_champagne), (2, 6000, 6000, 0, 0))
+
+    def test_upsert_adds_to_existing_row(self):
+        key = {'store_id': self.store.id, 'cast_id': self.a.id, 'work_date': timezone.localdate()}
+        CastDailySummary.objects.create(**key, worked_min=120, sales_nom=500)
+
+        upsert_add(
+            CastDailySummary,
+            [{**key, 'sales_nom': 1000, 'sales_champ': 300}],
+            unique_fields=('store', 'cast', 'work_date'),
+            add_fields=('sales_nom', 'sales_champ'),
+        )
+        row = CastDailySummary.objects.get(**key)
+        self.assertEqual((row.worked_min, row.sales_nom, row.sales_champ), (120, 1500, 300))
@@ -0,0 +1,132 @@
+"""
+顧客×キャスト相性（CustomerCastAffinity）のテスト
+
+- クローズ・締め後の編集で差分更新した結果が全再構築と一致すること
+- 伝票ごとの削除・顧客の追加で相性が付け替わること
+- match / affinity エンドポイントが集計済み行を返すこと（明細 JOIN による二重計上が無い）
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import StoreMembership, StoreRole
+from billing.models import (
+    Bill, BillCustomer, BillItem, Cast, Customer, CustomerCastAffinity, CustomerCastAffinityDay,
+    ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services.affinity import rebuild_customer_cast_affinity
+
+User = get_user_model()
+
+COLUMNS = ('customer_id', 'cast_id', 'spent_total', 'item_count', 'bill_count', 'last_served_at')
+DAY_COLUMNS = ('affinity__customer_id', 'affinity__cast_id', 'date', 'spent', 'item_count', 'bill_count')
+
+
+class CustomerCastAffinityTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='aff-store', name='Aff')
+        self.table = Table.objects.create(store=self.store, code='T01')
+        cat = ItemCategory.objects.create(code='aff-drink', name='ドリンク')
+        self.glass = ItemMaster.objects.create(store=self.store, name='ハイボール', price_regular=1000, category=cat)
+        self.a = Cast.objects.create(user=User.objects.create_user('aff1'), stage_name='A', store=self.store)
+        self.b = Cast.objects.create(user=User.objects.create_user('aff2'), stage_name='B', store=self.store)
+        self.taro = Customer.objects.create(full_name='太郎')
+        self.jiro = Customer.objects.create(full_name='次郎')
+
+    def _closed_bill(self, customers, lines, days_ago=0):
+        bill = Bill.objects.create(table=self.table, opened_at=timezone.now() - timedelta(days=days_ago))
+        BillCustomer.objects.filter(bill=bill).delete()
+        for c in customers:
+            BillCustomer.objects.create(bill=bill, customer=c)
+        for cast, qty in lines:
+            BillItem.objects.create(bill=bill, item_master=self.glass, qty=qty, price=1000, served_by_cast=cast)
+        bill.close()
+        bill.refresh_from_db()
+        return bill
+
+    def _state(self):
+        return (
+            sorted(CustomerCastAffinity.objects.filter(store=self.store).values_list(*COLUMNS)),
+            sorted(CustomerCastAffinityDay.objects.filter(affinity__store=self.store).values_list(*DAY_COLUMNS)),
+        )
+
+    def _assert_matches_rebuild(self):
+        incremental = self._state()
+        rebuild_customer_cast_affinity(self.store.id)
+        self.assertEqual(incremental, self._state())
+        return incremental
+
+    def test_close_and_edits_match_rebuild(self):
+        first = self._closed_bill([self.taro, self.jiro], [(self.a, 2), (self.a, 1), (self.b, 1)], days_ago=40)
+        second = self._closed_bill([self.taro], [(self.a, 3)])
+        (rows, _) = self._assert_matches_rebuild()
+        self.assertIn((self.taro.id, self.a.id, 6000, 3, 2, second.opened_at), rows)
+        self.assertIn((self.jiro.id, self.b.id, 1000, 1, 1, first.opened_at), rows)
+
+        # 締め後の編集: 数量変更・担当替え・削除・顧客の追加/削除
+        item = second.items.first()
+        item.qty = 5
+        item.served_by_cast = self.b
+        item.save()
+        first.items.filter(served_by_cast=self.b).delete()
+        second.customers.add(self.jiro)
+        BillCustomer.objects.filter(bill=first, customer=self.taro).delete()
+        (rows, _) = self._assert_matches_rebuild()
+        self.assertIn((self.taro.id, self.b.id, 5000, 1, 1, second.opened_at), rows)
+        # 太郎×A は両方の伝票から外れたので行ごと消える
+        self.assertNotIn(self.a.id, [r[1] for r in rows if r[0] == self.taro.id])
+
+    def test_bill_delete_and_reopen(self):
+        bill = self._closed_bill([self.taro], [(self.a, 1)])
+        other = self._closed_bill([self.taro], [(self.a, 2)], days_ago=3)
+
+        bill.delete()
+        (rows, _) = self._assert_matches_rebuild()
+        self.assertEqual(rows, [(self.taro.id, self.a.id, 2000, 1, 1, other.opened_at)])
+
+        # 締めを戻すと消え、締め直すと戻る
+        other.closed_at = None
+        other.save(update_fields=['closed_at'])
+        self.assertEqual(self._state(), ([], []))
+        other.closed_at = timezone.now()
+        other.save(update_fields=['closed_at'])
+        (rows, days) = self._assert_matches_rebuild()
+        self.assertEqual(days, [(self.taro.id, self.a.id, timezone.localdate(other.opened_at), 2000, 1, 1)])
+
+    def test_endpoints_read_rollup(self):
+        self._closed_bill([self.taro, self.jiro], [(self.a, 2), (self.a, 1)], days_ago=40)
+        recent = self._closed_bill([self.taro], [(self.a, 1), (self.b, 4)])
+
+        user = User.objects.create_superuser('aff-admin', password='pass')
+        StoreMembership.objects.create(user=user, store=self.store, role=StoreRole.MANAGER, is_primary=True)
+        client = APIClient()
+        client.force_authenticate(user)
+        client.credentials(HTTP_X_STORE_ID=str(self.store.id))
+
+        res = client.get('/api/billing/customers/match/', {'cast_id': self.a.id, 'sort': 'spent_total'})
+        self.assertEqual(res.status_code, 200, res.content)
+        results = res.json()['results']
+        self.assertEqual([r['customer']['id'] for r in results], [self.taro.id, self.jiro.id])
+        taro = results[0]
+        self.assertEqual(
+            {k: taro['affinity'][k] for k in ('spent_with_cast_total', 'spent_with_cast_30d', 'served_item_count', 'served_bill_count')},
+            {'spent_with_cast_total': 4000, 'spent_with_cast_30d': 1000, 'served_item_count': 3, 'served_bill_count': 2},
+        )
+        self.assertEqual(taro['stats']['visit_count'], 2)
+
+        res = client.get('/api/billing/customers/match/', {'cast_id': self.a.id, 'min_spent_30d': 1})
+        self.assertEqual([r['customer']['id'] for r in res.json()['results']], [self.taro.id])
+
+        res = client.get(f'/api/billing/customers/{self.taro.id}/affinity/', {'cast_id': self.b.id})
+        self.assertEqual(res.status_code, 200, res.content)
+        self.assertEqual(res.json()['affinity']['spent_with_cast_total'], 4000)
+        # 顧客全体の売上は伝票単位（明細 JOIN で膨らまない）
+        self.assertEqual(
+            res.json()['stats']['total_spent'],
+            sum(Bill.objects.filter(customers=self.taro).values_list('grand_total', flat=True)),
+        )
+        self.assertEqual(res.json()['stats']['last_visit_at'][:19], recent.closed_at.isoformat()[:19])
@@ -0,0 +1,127 @@
+"""
+顧客検索のテスト
+
+- 正規化（カタカナ/ひらがな・半角カナ・全角英数・電話番号の区切り）
+- save で search_text / phone_digits が更新されること
+- /customers/?q= が表記ゆれを吸収し、前方一致を上位に返すこと（SQLite フォールバック）
+- 電話番号らしくない q（棚番号など）は電話番号に当てないこと
+"""
+import pytest
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from accounts.models import StoreMembership, StoreRole
+from billing.models import Customer, Store
+from billing.utils.search_text import (
+    customer_search_text, looks_like_phone, normalize_search_text, phone_digits,
+)
+
+User = get_user_model()
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('タナカ', 'たなか'),
+    ('ﾀﾅｶ', 'たなか'),
+    ('たなか', 'たなか'),
+    ('ＡＢＣ　ｄｅｆ', 'abcdef'),
+    ('A-12', 'a-12'),
+    ('', ''),
+    (None, ''),
+])
+def test_normalize_search_text(raw, expected):
+    assert normalize_search_text(raw) == expected
+
+
+def test_phone_digits():
+    assert phone_digits('090-1234-5678') == '09012345678'
+    assert phone_digits('０９０（１２３４）５６７８') == '09012345678'
+    assert phone_digits(None) == ''
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('090-1234-5678', True),
+    ('+81 (90) 1234', True),
+    ('０９０（１２３４）', True),
+    ('1234', True),
+    ('123', False),
+    ('A-12', False),
+    ('B-1234', False),
+    ('', False),
+])
+def test_looks_like_phone(raw, expected):
+    assert looks_like_phone(raw) is expected
+
+
+def test_looks_like_phone_short_digits():
+    assert looks_like_phone('12', min_digits=1)
+    assert not looks_like_phone('A-12', min_digits=1)
+    assert not looks_like_phone('-', min_digits=1)
+
+
+def test_customer_search_text_keeps_fields_apart():
+    assert customer_search_text('田中', 'タナ', 'A-1') == '田中|たな|a-1'
+
+
+class CustomerSearchTest(TestCase):
+
+    def setUp(self):
+        store = Store.objects.create(slug='search-store', name='Search')
+        user = User.objects.create_superuser('search-admin', password='pass')
+        StoreMembership.objects.create(user=user, store=store, role=StoreRole.MANAGER, is_primary=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.client.credentials(HTTP_X_STORE_ID=str(store.id))
+
+    def _search(self, q):
+        res = self.client.get('/api/billing/customers/', {'q': q})
+        self.assertEqual(res.status_code, 200, res.content)
+        return [c['full_name'] for c in res.json()]
+
+    def test_save_refreshes_search_fields(self):
+        c = Customer.objects.create(full_name='ﾀﾅｶ', phone='090-1111-2222')
+        self.assertEqual((c.search_text, c.phone_digits), ('たなか||', '09011112222'))
+
+        c.alias = 'タロー'
+        c.save(update_fields=['alias'])
+        c.refresh_from_db()
+        self.assertEqual(c.search_text, 'たなか|たろー|')
+
+    def test_search_folds_kana_and_width(self):
+        Customer.objects.create(full_name='タナカ')
+        Customer.objects.create(full_name='ヤマダ', alias='おたなっち')
+        Customer.objects.create(full_name='鈴木', bottle_shelf='B-5')
+
+        # ひらがなで打っても、カタカナ・半角カナの登録に当たる。前方一致が先
+        self.assertEqual(self._search('たな'), ['タナカ', 'ヤマダ'])
+        self.assertEqual(self._search('ﾀﾅｶ'), ['タナカ'])
+        self.assertEqual(self._search('ｂ－５'), ['鈴木'])
+
+    def test_search_by_phone_digits(self):
+        Customer.objects.create(full_name='佐藤', phone='090-1234-5678')
+        Customer.objects.create(full_name='高橋', phone='03 5555 1234')
+
+        self.assertEqual(self._search('09012345678'), ['佐藤'])
+        # どちらも途中一致なので同点 → 更新の新しい順
+        self.assertEqual(self._search('1234'), ['高橋', '佐藤'])
+        res = self.client.get('/api/billing/customers/', {'q': '5555-1234'})
+        self.assertEqual([(c['full_name'], c['search_score']) for c in res.json()], [('高橋', 0.5)])
+
+    def test_shelf_code_does_not_match_phone(self):
+        Customer.objects.create(full_name='中村', bottle_shelf='A-12')
+        Customer.objects.create(full_name='小林', phone='090-1212-3456')
+        Customer.objects.create(full_name='加藤', bottle_shelf='B-1234', phone='03-1234-0000')
+
+        self.assertEqual(self._search('A-12'), ['中村'])
+        self.assertEqual(self._search('B-1234'), ['加藤'])
+        self.assertEqual(self._search('1234'), ['加藤', '小林'])
+
+    def test_short_digit_query_still_matches_phone(self):
+        Customer.objects.create(full_name='中村', bottle_shelf='A-12')
+        Customer.objects.create(full_name='小林', phone='090-1212-3456')
+
+        # 1〜3桁でも電話番号の部分一致で当たる（棚番号は数字以外を含むので電話番号には当てない）
+        self.assertEqual(self._search('345'), ['小林'])
+        # 「12」は棚番号 A-12 の文字列にも部分一致する（電話番号としては小林だけ）
+        self.assertEqual(sorted(self._search('12')), sorted(['小林', '中村']))
+        self.assertEqual(self._search('A-12'), ['中村'])
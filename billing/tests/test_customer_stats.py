@@ -0,0 +1,149 @@
+"""
+顧客来店実績（CustomerStats）のテスト
+
+- クローズ・締め後の編集・削除の差分更新が全再構築と一致すること
+- 顧客一覧・タグ一覧・伝票一覧（ネストした顧客）のクエリ数が件数に依らないこと
+- タグ分析が伝票×明細の JOIN で膨らまないこと
+"""
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from accounts.models import StoreMembership, StoreRole
+from billing.models import (
+    Bill, BillCustomer, BillItem, Customer, CustomerStats, CustomerTag, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services.customer_stats import rebuild_customer_stats
+from billing.views import CustomerTagAnalyticsView
+
+User = get_user_model()
+
+COLUMNS = ('store_id', 'customer_id', 'visit_count', 'total_spent', 'first_visit_at', 'last_visit_at')
+
+
+class CustomerStatsTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(slug='cstat-store', name='CStat')
+        self.table = Table.objects.create(store=self.store, code='T01')
+        cat = ItemCategory.objects.create(code='cstat-drink', name='ドリンク')
+        self.glass = ItemMaster.objects.create(store=self.store, name='ハイボール', price_regular=1000, category=cat)
+        self.vip = CustomerTag.objects.create(code='cstat-vip', name='VIP')
+        self.taro = Customer.objects.create(full_name='太郎')
+        self.jiro = Customer.objects.create(full_name='次郎')
+        self.taro.tags.add(self.vip)
+        self.jiro.tags.add(self.vip)
+
+        self.user = User.objects.create_superuser('cstat-admin', password='pass')
+        StoreMembership.objects.create(user=self.user, store=self.store, role=StoreRole.MANAGER, is_primary=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.client.credentials(HTTP_X_STORE_ID=str(self.store.id))
+
+    def _closed_bill(self, customers, qty):
+        bill = Bill.objects.create(table=self.table)
+        BillCustomer.objects.filter(bill=bill).delete()
+        for c in customers:
+            BillCustomer.objects.create(bill=bill, customer=c)
+        # 明細を複数行にして、明細 JOIN なら grand_total が重複計上される形にする
+        for _ in range(qty):
+            BillItem.objects.create(bill=bill, item_master=self.glass, qty=1, price=1000)
+        bill.close()
+        bill.refresh_from_db()
+        return bill
+
+    def _state(self):
+        return sorted(CustomerStats.objects.values_list(*COLUMNS))
+
+    def _assert_matches_rebuild(self):
+        incremental = self._state()
+        rebuild_customer_stats(self.store.id)
+        self.assertEqual(incremental, self._state())
+        return incremental
+
+    def test_incremental_matches_rebuild(self):
+        first = self._closed_bill([self.taro, self.jiro], 2)
+        second = self._closed_bill([self.taro], 3)
+        rows = self._assert_matches_rebuild()
+        taro = CustomerStats.objects.get(customer=self.taro)
+        self.assertEqual((taro.visit_count, taro.total_spent), (2, first.grand_total + second.grand_total))
+        self.assertEqual((taro.first_visit_at, taro.last_visit_at), (first.opened_at, second.closed_at))
+        self.assertEqual(taro.avg_spend, taro.total_spent // 2)
+        self.assertEqual(len(rows), 2)
+
+        # 締め後の明細追加（grand_total が変わる）・顧客の付け外し・伝票削除
+        BillItem.objects.create(bill=first, item_master=self.glass, qty=2, price=1000)
+        second.customers.add(self.jiro)
+        BillCustomer.objects.filter(bill=first, customer=self.taro).delete()
+        self._assert_matches_rebuild()
+
+        second.delete()
+        self._assert_matches_rebuild()
+        self.assertFalse(CustomerStats.objects.filter(customer=self.taro).exists())
+
+    def test_open_bill_recalc_skips_stats(self):
+        bill = Bill.objects.create(table=self.table)
+        with CaptureQueriesContext(connection) as ctx:
+            BillItem.objects.create(bill=bill, item_master=self.glass, qty=1, price=1000)
+        self.assertFalse(any('billing_customerstats' in q['sql'] for q in ctx.captured_queries))
+        self.assertFalse(CustomerStats.objects.exists())
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200, res.content)
+        return len(ctx.captured_queries), res.json()
+
+    def test_lists_run_constant_queries(self):
+        self._closed_bill([self.taro, self.jiro], 1)
+        # 店舗解決はキャッシュされるので、1回目の呼び出しで温めてから数える
+        self.client.get('/api/billing/customers/')
+        few, customers = self._count_queries('/api/billing/customers/')
+        few_tags, _ = self._count_queries('/api/billing/customer-tags/')
+
+        for n in range(5):
+            c = Customer.objects.create(full_name=f'客{n}')
+            c.tags.add(CustomerTag.objects.create(code=f'cstat-t{n}', name=f'T{n}'))
+            self._closed_bill([c], 1)
+        many, _ = self._count_queries('/api/billing/customers/')
+        many_tags, tags = self._count_queries('/api/billing/customer-tags/')
+
+        self.assertEqual(few, many)
+        self.assertEqual(few_tags, many_tags)
+        taro = next(c for c in customers if c['id'] == self.taro.id)
+        self.assertEqual(taro['tag_names'], 'VIP')
+        self.assertEqual(taro['visit_stats']['visit_count'], 1)
+        self.assertIsNotNone(taro['last_visit_at'])
+        self.assertEqual(next(t for t in tags if t['code'] == 'cstat-vip')['customer_count'], 2)
+
+    def test_bill_list_nested_customers_run_constant_queries(self):
+        bill = self._closed_bill([self.taro], 1)
+        self.client.get('/api/billing/bills/')
+        few, _ = self._count_queries('/api/billing/bills/')
+
+        for n in range(4):
+            c = Customer.objects.create(full_name=f'客{n}')
+            c.tags.add(self.vip)
+            BillCustomer.objects.create(bill=bill, customer=c)
+        with self.assertNumQueries(few):
+            res = self.client.get('/api/billing/bills/')
+        row = next(b for b in res.json() if b['id'] == bill.id)
+        self.assertEqual(len(row['customers']), 5)
+        self.assertEqual(row['customer_display_name'], self.taro.display_name)
+        taro = next(c for c in row['customers'] if c['id'] == self.taro.id)
+        self.assertEqual((taro['tag_names'], taro['visit_stats']['visit_count']), ('VIP', 1))
+
+    def test_tag_analytics_reads_stats(self):
+        first = self._closed_bill([self.taro, self.jiro], 3)
+        second = self._closed_bill([self.taro], 2)
+
+        request = APIRequestFactory().get('/customer-analytics/by-tag/', {'tag_code': 'cstat-vip'})
+        force_authenticate(request, user=self.user)
+        with self.assertNumQueries(2):
+            res = CustomerTagAnalyticsView.as_view()(request)
+        by_id = {c['id']: c for c in res.data['customers']}
+        self.assertEqual(by_id[self.taro.id]['total_spent'], first.grand_total + second.grand_total)
+        self.assertEqual(by_id[self.taro.id]['visit_count'], 2)
+        self.assertEqual(res.data['summary']['total_visits'], 3)
@@ -0,0 +1,131 @@
+"""
+DailyPLSnapshot（日次P&Lの保存）のテスト
+
+- 月次・年次が get_daily_pl の日別ループと同じ値になること
+- 確定済みの年次P&Lが数クエリで返ること
+- 月次 API が当日分を1回だけ生計算すること
+- 締め済み伝票の変更で該当日が再計算されること
+"""
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from billing.api.pl_views import MonthlyPLAPIView
+from billing.models import (
+    Bill, BillItem, DailyPLSnapshot, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services import pl_snapshot
+from billing.services.pl_snapshot import SUM_FIELDS, get_daily_pl_cached, get_daily_pl_range
+from billing.utils.pl_daily import empty_daily_pl, get_daily_pl
+from billing.utils.pl_monthly import get_monthly_pl
+from billing.utils.pl_yearly import get_yearly_pl
+
+
+class DailyPLSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(
+            slug='pl-store', name='PL', service_rate=Decimal('0'), tax_rate=Decimal('0'),
+            business_day_cutoff_hour=6,
+        )
+        self.table = Table.objects.create(store=self.store, code='T01')
+        cat = ItemCategory.objects.create(code='pl-drink', name='ドリンク', major_group='drink')
+        self.item = ItemMaster.objects.create(store=self.store, name='ハイボール', price_regular=1000, category=cat)
+        self.year = timezone.localdate().year - 1
+
+    def _bill_on(self, d: date, qty: int, hour: int = 22):
+        bill = Bill.objects.create(table=self.table)
+        BillItem.objects.create(bill=bill, item_master=self.item, qty=qty, price=1000)
+        bill.close()
+        closed_at = timezone.make_aware(datetime.combine(d, time(hour)))
+        Bill.objects.filter(pk=bill.pk).update(closed_at=closed_at, paid_cash=qty * 1000)
+        return Bill.objects.get(pk=bill.pk)
+
+    def _legacy_month(self, month):
+        first = date(self.year, month, 1)
+        agg = dict.fromkeys(SUM_FIELDS, 0)
+        d = first
+        while d.month == month:
+            day = get_daily_pl(d, store_id=self.store.id)
+            for f in SUM_FIELDS:
+                agg[f] += int(day[f] or 0)
+            d += timedelta(days=1)
+        return agg
+
+    def test_monthly_matches_daily_loop(self):
+        self._bill_on(date(self.year, 3, 10), 2)
+        self._bill_on(date(self.year, 3, 11), 3, hour=2)   # 締め前 → 3/10 営業日
+        self._bill_on(date(self.year, 3, 20), 1)
+
+        expected = self._legacy_month(3)
+        got = get_monthly_pl(self.year, 3, store_id=self.store.id)
+        self.assertEqual({f: got[f] for f in SUM_FIELDS}, expected)
+        self.assertEqual(DailyPLSnapshot.objects.filter(store=self.store).count(), 31)
+
+        days = get_daily_pl_range(date(self.year, 3, 1), date(self.year, 3, 31), store_id=self.store.id)
+        self.assertEqual(days[9], get_daily_pl(date(self.year, 3, 10), store_id=self.store.id))
+
+    def test_monthly_api_computes_today_once(self):
+        today = pl_snapshot.business_date_for(timezone.now(), store_id=self.store.id)
+        bill = Bill.objects.create(table=self.table)
+        BillItem.objects.create(bill=bill, item_master=self.item, qty=2, price=1000)
+        bill.close()
+        get_monthly_pl(today.year, today.month, store_id=self.store.id)   # 過去日のスナップショットを作っておく
+
+        request = APIRequestFactory().get(
+            '/pl/monthly/', {'year': today.year, 'month': today.month, 'store_id': self.store.id},
+        )
+        with mock.patch.object(pl_snapshot, 'get_daily_pl', wraps=pl_snapshot.get_daily_pl) as live:
+            res = MonthlyPLAPIView.as_view()(request)
+        self.assertEqual(res.status_code, 200, res.data)
+        self.assertEqual([c.args[0] for c in live.call_args_list], [today])
+
+        total = res.data['monthly_total']
+        expected = get_monthly_pl(today.year, today.month, store_id=self.store.id)
+        self.assertEqual({f: total[f] for f in SUM_FIELDS}, {f: expected[f] for f in SUM_FIELDS})
+        self.assertEqual(total['sales_total'], sum(d['sales_total'] for d in res.data['days']))
+
+    def test_yearly_is_a_handful_of_queries(self):
+        self._bill_on(date(self.year, 5, 1), 4)
+        d, rows = date(self.year, 1, 1), []
+        while d.year == self.year:
+            if d != date(self.year, 5, 1):
+                rows.append(DailyPLSnapshot(
+                    store=self.store, business_date=d, data=empty_daily_pl(d, store_id=self.store.id),
+                ))
+            d += timedelta(days=1)
+        DailyPLSnapshot.objects.bulk_create(rows)
+
+        first = get_yearly_pl(self.year, store_id=self.store.id)
+        with CaptureQueriesContext(connection) as ctx:
+            second = get_yearly_pl(self.year, store_id=self.store.id)
+
+        self.assertEqual(first, second)
+        self.assertLessEqual(len(ctx), 4)
+        self.assertEqual(second['months'][4]['totals']['sales_total'], 4000)
+        self.assertEqual(second['totals']['sales_total'], 4000)
+
+    def test_bill_edit_marks_day_stale(self):
+        bill = self._bill_on(date(self.year, 6, 1), 2)
+        day = get_daily_pl_cached(date(self.year, 6, 1), store_id=self.store.id)
+        self.assertEqual(day['sales_cash'], 2000)
+
+        bill.paid_cash = 5000
+        bill.save(update_fields=['paid_cash'])
+        self.assertTrue(DailyPLSnapshot.objects.get(store=self.store, business_date=date(self.year, 6, 1)).is_stale)
+
+        day = get_daily_pl_cached(date(self.year, 6, 1), store_id=self.store.id)
+        self.assertEqual(day['sales_cash'], 5000)
+
+        BillItem.objects.create(bill=bill, item_master=self.item, qty=1, price=1000)
+        self.assertTrue(DailyPLSnapshot.objects.get(store=self.store, business_date=date(self.year, 6, 1)).is_stale)
+
+    def test_empty_daily_pl_has_same_keys(self):
+        d = date(self.year, 7, 1)
+        self.assertEqual(set(empty_daily_pl(d, store_id=self.store.id)), set(get_daily_pl(d, store_id=self.store.id)))
@@ -0,0 +1,147 @@
+# billing/tests/test_excel_export.py
+import zipfile
+from datetime import timedelta
+from io import BytesIO
+
+import pytest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from billing.excel import generate_bill_excel, generate_daily_report, generate_daily_zip
+from billing.models import (
+    Bill, BillCastStay, BillItem, BillSubstituteItem, Cast, Customer, ItemCategory, ItemMaster, Store, Table,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def night():
+    store = Store.objects.create(slug="excel-store", name="Excel", service_rate=0, tax_rate=0)
+    table = Table.objects.create(store=store, code="A 1")
+    drink = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=drink, code="HB")
+    cast = Cast.objects.create(user=User.objects.create_user(username="excel-cast"), stage_name="みゆ", store=store)
+    customer = Customer.objects.create(full_name="山田太郎", phone="+81901110000")
+
+    closed_at = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    bills = []
+    for n in range(5):
+        bill = Bill.objects.create(table=table, opened_at=closed_at - timedelta(hours=2, minutes=n), pax=2,
+                                   memo=f"memo {n}", paid_cash=1000 * n)
+        bill.customers.add(customer)
+        for q in range(n + 1):
+            BillItem.objects.create(bill=bill, item_master=item, qty=q + 1, price=1000, served_by_cast=cast)
+        BillSubstituteItem.objects.create(bill=bill, item_master=item, cast=cast, name="タバコ", price=600)
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=bill.opened_at, stay_type="nom")
+        bill.closed_at = closed_at
+        bill.save(update_fields=["closed_at"])
+        bills.append(bill)
+    return store, bills
+
+
+def _values(xlsx_bytes):
+    ws = load_workbook(BytesIO(xlsx_bytes)).active
+    widths = {k: v.width for k, v in ws.column_dimensions.items() if v.width}
+    return [list(r) for r in ws.iter_rows(values_only=True)], widths, [str(r) for r in ws.merged_cells.ranges]
+
+
+def test_daily_zip_is_streamed_per_bill(night):
+    store, bills = night
+    admin = User.objects.create_superuser("excel-admin", password="x")
+    client = APIClient()
+    client.force_authenticate(admin)
+
+    date = timezone.localdate(bills[0].closed_at).isoformat()
+    res = client.get(f"/api/billing/excel/daily-zip/?date={date}", HTTP_X_STORE_ID=str(store.id))
+    assert res.status_code == 200
+    assert isinstance(res, StreamingHttpResponse)
+    chunks = list(res.streaming_content)
+    # 伝票ごとに1断片 + セントラルディレクトリ
+    assert len(chunks) == len(bills) + 1
+
+    with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+        names = zf.namelist()
+        ordered = sorted(bills, key=lambda b: b.opened_at)
+        assert names == [
+            f"bill_{b.id}_A_1_{timezone.localtime(b.opened_at):%H%M}.xlsx" for b in ordered
+        ]
+        for bill, name in zip(ordered, names):
+            rows, widths, _ = _values(zf.read(name))
+            assert rows == _values(generate_bill_excel(Bill.objects.get(pk=bill.id)).getvalue())[0]
+            assert ["注文", "注文日時", "担当", "個数", "計"] in [r[:5] for r in rows]
+            assert widths["A"] == 9 and widths["F"] == 8   # 「立替による控除」+2 / 短い列は最小 8
+
+
+def test_bill_excel_rows_and_widths(night, django_assert_max_num_queries):
+    _, bills = night
+    bill = Bill.objects.get(pk=bills[2].id)
+    with django_assert_max_num_queries(10):
+        rows, widths, _ = _values(generate_bill_excel(bill).getvalue())
+
+    items = [r for r in rows if r[2] == "みゆ" and r[0] == "ハイボール"]
+    assert [(r[3], r[4]) for r in items] == [(1, 1000), (2, 2000), (3, 3000)]
+    assert ["総額", bill.grand_total] in [r[:2] for r in rows]
+    assert ["タバコ", None, "みゆ", 1, 600] in [[r[0], None, *r[2:5]] for r in rows]
+    assert (widths["B"], widths["C"]) == (18, 8)   # 注文日時 "YYYY-MM-DD HH:MM" +2 / 「対象キャスト」は最小幅
+
+
+def test_daily_report_totals_merge_and_widths(night):
+    _, bills = night
+    bills = list(Bill.objects.filter(pk__in=[b.id for b in bills]).order_by("opened_at"))
+    rows, widths, merged = _values(generate_daily_report(bills, "2026-01-30").getvalue())
+
+    assert merged == ["A1:Q1"]
+    assert rows[0][0] == "売上日報 2026-01-30"
+    total = rows[-1]
+    assert total[0] == "合計"
+    assert total[3] == 2 * len(bills)
+    assert total[12] == sum(b.grand_total for b in bills)
+    assert total[13] == 1000 * sum(range(len(bills)))
+    assert widths["A"] == 17   # 結合したタイトルの文字数も含める（従来と同じ）
+
+
+def test_generate_daily_zip(night):
+    _, bills = night
+    assert generate_daily_zip([]) is None
+    with zipfile.ZipFile(generate_daily_zip(list(Bill.objects.filter(pk__in=[b.pk for b in bills])))) as zf:
+        assert len(zf.namelist()) == len(bills)
+
+
+def test_daily_zip_streams_chunk_by_chunk_under_asgi(night, monkeypatch):
+    """ASGI でも ZIP を読み切らず、断片を要求されるごとに1伝票ずつ描画する"""
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from rest_framework.authtoken.models import Token
+
+    from billing import excel
+
+    store, bills = night
+    admin = User.objects.create_superuser("excel-asgi", password="x")
+    token = Token.objects.create(user=admin)
+    rendered = []
+    render = excel._render_sheet
+    monkeypatch.setattr(excel, "_render_sheet", lambda *a, **kw: rendered.append(1) or render(*a, **kw))
+
+    async def fetch():
+        date = timezone.localdate(bills[0].closed_at).isoformat()
+        res = await AsyncClient().get(
+            f"/api/billing/excel/daily-zip/?date={date}",
+            headers={"authorization": f"Token {token.key}", "x-store-id": str(store.id)},
+        )
+        assert res.status_code == 200 and res.is_async
+        chunks = []
+        async for chunk in res.streaming_content:
+            chunks.append(chunk)
+            if len(chunks) == 1:
+                first_rendered = len(rendered)
+        return first_rendered, chunks
+
+    first_rendered, chunks = async_to_sync(fetch)()
+    assert first_rendered == 1
+    assert len(chunks) == len(bills) + 1
+    with zipfile.ZipFile(BytesIO(b"".join(chunks))) as zf:
+        assert len(zf.namelist()) == len(bills)
@@ -0,0 +1,137 @@
+# billing/tests/test_garden_stats.py
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from billing.models import (
+    Bill, BillCastStay, BillItem, Cast, CastDailySummary, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.payroll.engines import get_engine
+from billing.payroll.engines.stores.garden import (
+    calculate_garden_stats, calculate_garden_stats_bulk, garden_stats_from_tally,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def garden():
+    store = Store.objects.create(slug="garden", name="Garden", service_rate=0, tax_rate=0)
+    table = Table.objects.create(store=store, code="T01")
+    cat = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ボトル", price_regular=100_000, category=cat, code="BTL")
+    casts = [
+        Cast.objects.create(user=User.objects.create_user(username=f"g{i}"), stage_name=f"G{i}", store=store)
+        for i in range(3)
+    ]
+    return store, table, item, casts
+
+
+def _closed_bill(table, item, lines, stays=()):
+    now = timezone.now()
+    bill = Bill.objects.create(table=table, opened_at=now)
+    for cast, qty in lines:
+        BillItem.objects.create(bill=bill, item_master=item, qty=qty, price=100_000, served_by_cast=cast)
+    for cast, stay_type in stays:
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=now, stay_type=stay_type)
+    bill.closed_at = now
+    bill.save(update_fields=["closed_at"])
+    return bill
+
+
+def test_bulk_matches_per_cast_and_runs_two_queries(garden, django_assert_num_queries):
+    store, table, item, (a, b, c) = garden
+    # A: 同伴伝票で 6本＋通常伝票で 2本（同伴伝票の B の明細は A の同伴売上に入らない）
+    _closed_bill(table, item, [(a, 6), (b, 1)], stays=[(a, "dohan"), (b, "nom")])
+    _closed_bill(table, item, [(a, 2)], stays=[(a, "nom"), (a, "nom")])
+    # 期間外（未締め）は数えない
+    open_bill = Bill.objects.create(table=table)
+    BillItem.objects.create(bill=open_bill, item_master=item, qty=9, price=100_000, served_by_cast=c)
+
+    today = timezone.localdate()
+    with django_assert_num_queries(2):
+        stats = calculate_garden_stats_bulk(store, [a.id, b.id, c.id], today, today)
+
+    assert stats[a.id]["sales_total"] == 800_000
+    assert stats[a.id]["dohan_sales_total"] == 600_000
+    assert (stats[a.id]["dohan_count"], stats[a.id]["nom_count"]) == (1, 1)
+    assert stats[a.id]["points"] == 80 + 1 + 2
+    assert stats[a.id]["rank"] == "A"
+    assert stats[a.id]["slide_back"] == 88_000  # 80万は 11%
+    assert (stats[b.id]["sales_total"], stats[b.id]["dohan_sales_total"], stats[b.id]["nom_count"]) == (100_000, 0, 1)
+    assert stats[c.id]["sales_total"] == 0 and stats[c.id]["rank"] == "D"
+
+    for cast in (a, b, c):
+        assert calculate_garden_stats(store, cast.id, today, today) == stats[cast.id]
+
+
+def test_engine_finalize_payroll_lines_batches(garden, django_assert_num_queries):
+    from billing.models import PayrollRun, PayrollRunLine
+
+    store, table, item, (a, b, c) = garden
+    _closed_bill(table, item, [(a, 8)])
+    today = timezone.localdate()
+    run = PayrollRun.objects.create(store=store, period_start=today, period_end=today)
+    lines = [
+        PayrollRunLine.objects.create(run=run, cast=cast, worked_min=60, commission=0)
+        for cast in (a, b, c)
+    ]
+
+    engine = get_engine(store)
+    with django_assert_num_queries(2):
+        extras = engine.finalize_payroll_lines(lines, today, today)
+
+    assert [line.garden_snapshot["rank"] for line in lines] == ["A", "D", "D"]
+    assert lines[0].hourly_pay == 4000
+    assert [[r.label for r in rows] for rows in extras] == [["GDN_SLIDE"], [], []]
+    assert extras[0][0].cast_id == a.id and extras[0][0].run_id == run.id
+
+
+def test_tally_follows_close_and_edits(garden, django_assert_num_queries):
+    store, table, item, (a, b, c) = garden
+    first = _closed_bill(table, item, [(a, 6), (b, 1)], stays=[(a, "dohan"), (b, "nom")])
+    _closed_bill(table, item, [(a, 2), (c, 1)], stays=[(a, "nom"), (c, "dohan")])
+
+    # 締め後の編集: 明細の数量変更・同伴の取り消し・明細の削除
+    line = first.items.get(served_by_cast=a)
+    line.qty = 7
+    line.save()
+    BillCastStay.objects.filter(bill=first, cast=a).delete()
+    first.items.filter(served_by_cast=b).delete()
+
+    today = timezone.localdate()
+    ids = [a.id, b.id, c.id]
+    with django_assert_num_queries(1):
+        tally = garden_stats_from_tally(store, ids, today, today)
+    assert tally == calculate_garden_stats_bulk(store, ids, today, today)
+    assert (tally[a.id]["sales_total"], tally[a.id]["dohan_count"], tally[a.id]["nom_count"]) == (900_000, 0, 1)
+    assert (tally[b.id]["sales_total"], tally[b.id]["nom_count"]) == (0, 1)
+    assert (tally[c.id]["dohan_sales_total"], tally[c.id]["dohan_count"]) == (100_000, 1)
+
+    call_command("check_garden_tally")
+
+
+def test_check_command_reports_and_repairs(garden):
+    store, table, item, (a, _, _) = garden
+    _closed_bill(table, item, [(a, 3)], stays=[(a, "dohan")])
+    CastDailySummary.objects.filter(cast=a).update(sales_dohan=0, dohan_bills=5)
+
+    with pytest.raises(CommandError, match="1 cast"):
+        call_command("check_garden_tally")
+    call_command("check_garden_tally", "--repair")
+    row = CastDailySummary.objects.get(cast=a)
+    assert (row.sales_dohan, row.dohan_bills) == (300_000, 1)
+
+
+def test_payroll_status_reads_tally(garden):
+    store, table, item, (a, _, _) = garden
+    _closed_bill(table, item, [(a, 8)], stays=[(a, "nom")])
+
+    client = APIClient()
+    client.force_authenticate(a.user)
+    res = client.get("/api/billing/payroll/status/", HTTP_X_STORE_ID=str(store.id))
+    assert res.status_code == 200, res.content
+    assert (res.json()["sales_total"], res.json()["nom_count"], res.json()["rank"]) == (800_000, 1, "A")
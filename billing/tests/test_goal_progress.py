@@ -0,0 +1,161 @@
+# billing/tests/test_goal_progress.py
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from accounts.models import User
+from billing.models import (
+    Bill, BillCastStay, BillItem, Cast, CastGoal, CastManualSubtotal, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.services.goal_progress import evaluate_goals, goal_values, record_new_hits_bulk, touched_store_ids
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def shop():
+    store = Store.objects.create(slug="goal-store", name="Goal", service_rate=0, tax_rate=0)
+    table = Table.objects.create(store=store, code="T01")
+    drink = ItemCategory.objects.create(code="drink", name="ドリンク")
+    champ = ItemCategory.objects.create(code="champagne", name="シャンパン")
+    items = {
+        "drink": ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=drink, code="HB"),
+        "champ": ItemMaster.objects.create(store=store, name="モエ", price_regular=30000, category=champ, code="MOET"),
+    }
+    casts = [
+        Cast.objects.create(user=User.objects.create_user(username=f"goal{i}"), stage_name=f"G{i}", store=store)
+        for i in range(2)
+    ]
+    return store, table, items, casts
+
+
+def _closed_bill(table, lines, stays=(), closed_at=None):
+    closed_at = closed_at or timezone.now()
+    bill = Bill.objects.create(table=table, opened_at=closed_at)
+    for item, cast, qty in lines:
+        BillItem.objects.create(bill=bill, item_master=item, qty=qty, price=item.price_regular, served_by_cast=cast)
+    for cast, stay_type in stays:
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=closed_at, stay_type=stay_type)
+    bill.closed_at = closed_at
+    bill.save(update_fields=["closed_at"])
+    return bill
+
+
+def _goal(cast, metric, target, period=CastGoal.PERIOD_MONTHLY, **kw):
+    return CastGoal.objects.create(cast=cast, metric=metric, target_value=target, period_kind=period, **kw)
+
+
+def test_bulk_values_match_per_goal_rules(shop, django_assert_max_num_queries):
+    store, table, items, (a, b) = shop
+    today = timezone.localdate()
+    _closed_bill(table, [(items["drink"], a, 3), (items["champ"], a, 2), (items["drink"], b, 1)],
+                 stays=[(a, "nom"), (b, "in")])
+    _closed_bill(table, [(items["champ"], b, 1)], stays=[(a, "nom")])
+
+    created = [
+        _goal(a, CastGoal.METRIC_REVENUE, 100_000),
+        _goal(a, CastGoal.METRIC_REVENUE, 10_000, CastGoal.PERIOD_DAILY),
+        _goal(b, CastGoal.METRIC_REVENUE, 100_000),
+        _goal(a, CastGoal.METRIC_NOMINATIONS, 4),
+        _goal(b, CastGoal.METRIC_INHOUSE, 1),
+        _goal(a, CastGoal.METRIC_CHAMP_REVENUE, 120_000),
+        _goal(b, CastGoal.METRIC_CHAMP_COUNT, 2),
+        # 期間外（先月まで）の目標
+        _goal(a, CastGoal.METRIC_REVENUE, 1, CastGoal.PERIOD_CUSTOM,
+              start_date=today - timedelta(days=40), end_date=today - timedelta(days=35)),
+    ]
+    # b の売上は手入力があればそちらを優先
+    CastManualSubtotal.objects.create(store=store, cast=b, work_date=today, manual_subtotal=5000)
+
+    goals = list(CastGoal.objects.select_related("cast").order_by("id"))
+    assert [g.id for g in goals] == [g.id for g in created]
+    # 指標ごとに1クエリ（売上だけ手入力＋明細の2クエリ）
+    with django_assert_max_num_queries(6):
+        values = goal_values(goals)
+
+    assert [values[g.id] for g in goals] == [63_000, 63_000, 5000, 2, 1, 60_000, 1, 0]
+    for goal in goals:
+        assert goal.current_value() == values[goal.id]
+
+    progress = evaluate_goals(goals)
+    assert progress[goals[3].id]["percent"] == 50
+    assert progress[goals[4].id]["hits"] == [50, 80, 90, 100]
+
+
+def test_record_new_hits_bulk_marks_once(shop):
+    store, table, items, (a, b) = shop
+    goal = _goal(a, CastGoal.METRIC_REVENUE, 10_000)
+    other = _goal(b, CastGoal.METRIC_REVENUE, 10_000)
+    _closed_bill(table, [(items["drink"], a, 8)])
+
+    [first, second] = record_new_hits_bulk([goal, other])
+    assert (first.new_hits, first.progress["percent"]) == ([50, 80], 80)
+    assert second.new_hits == []
+    goal.refresh_from_db()
+    assert goal.milestones_hit == [50, 80]
+
+    _closed_bill(table, [(items["drink"], a, 2)])
+    assert goal.record_new_hits() == ([90, 100], goal.progress())
+    assert record_new_hits_bulk([goal])[0].new_hits == []
+
+
+def test_scan_command_updates_whole_store(shop):
+    store, table, items, (a, b) = shop
+    ga = _goal(a, CastGoal.METRIC_NOMINATIONS, 1)
+    gb = _goal(b, CastGoal.METRIC_NOMINATIONS, 2)
+    _closed_bill(table, [], stays=[(a, "nom"), (b, "nom")])
+
+    call_command("scan_goal_milestones", "--store-slug", store.slug)
+    ga.refresh_from_db()
+    gb.refresh_from_db()
+    assert (ga.milestones_hit, gb.milestones_hit) == ([50, 80, 90, 100], [50])
+
+
+def test_incremental_scan_picks_up_edits_and_backdated_closes(shop):
+    store, table, items, (a, b) = shop
+    other = Store.objects.create(slug="goal-other", name="Other")
+    other_table = Table.objects.create(store=other, code="O1")
+    old = _closed_bill(table, [(items["drink"], a, 1)], closed_at=timezone.now() - timedelta(days=1))
+    _closed_bill(other_table, [], closed_at=timezone.now() - timedelta(days=1))
+    open_bill = Bill.objects.create(table=other_table)
+
+    since = timezone.now()
+    assert touched_store_ids(since) == []
+
+    # 締め後の明細追加（closed_at は since より前のまま）
+    BillItem.objects.create(bill=old, item_master=items["drink"], qty=1, price=1000, served_by_cast=a)
+    BillItem.objects.create(bill=open_bill, item_master=items["drink"], qty=1, price=1000, served_by_cast=b)
+    assert touched_store_ids(since) == [store.id]
+
+    # closed_at を遡らせた締め
+    since = timezone.now()
+    _closed_bill(other_table, [], closed_at=since - timedelta(days=2))
+    assert touched_store_ids(since) == [other.id]
+    assert touched_store_ids(since, [store.id]) == []
+
+    # 手入力売上の更新
+    since = timezone.now()
+    CastManualSubtotal.objects.create(store=store, cast=a, work_date=timezone.localdate(), manual_subtotal=5000)
+    assert touched_store_ids(since) == [store.id]
+
+
+def test_goals_endpoint_uses_batched_progress(shop, django_assert_max_num_queries):
+    from rest_framework.test import APIClient
+
+    store, table, items, (a, _) = shop
+    for metric in (CastGoal.METRIC_REVENUE, CastGoal.METRIC_NOMINATIONS, CastGoal.METRIC_CHAMP_COUNT):
+        for target in (10, 20, 30):
+            _goal(a, metric, target)
+    _closed_bill(table, [(items["drink"], a, 1)], stays=[(a, "nom")])
+
+    admin = User.objects.create_superuser("goal-admin", password="x")
+    client = APIClient()
+    client.force_authenticate(admin)
+    client.get(f"/api/billing/casts/{a.id}/goals/", HTTP_X_STORE_ID=str(store.id))
+    with django_assert_max_num_queries(12):
+        res = client.get(f"/api/billing/casts/{a.id}/goals/", HTTP_X_STORE_ID=str(store.id))
+    assert res.status_code == 200, res.content
+    by_metric = {g["metric"]: g["progress_value"] for g in res.json()}
+    assert by_metric == {"revenue": 1000, "nominations": 1, "champ_count": 0}
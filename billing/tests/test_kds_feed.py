@@ -0,0 +1,98 @@
+"""
+KDS チケットの push 配信（kds_broker）のテスト
+
+- チケット作成・ACK・READY がコミット後に該当チャネルへ届くこと
+- long-poll が通知で起きて即座に返ること
+- SSE ストリームが新着と更新を送ること
+"""
+import asyncio
+import threading
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+
+from billing import kds_broker
+from billing.kds_broker import READY_ROUTE, InProcessBroker, channel_for
+from billing.kds_views import _ticket_events, _wait_for_tickets
+from billing.models import Bill, BillItem, ItemCategory, ItemMaster, OrderTicket, Store, Table
+
+
+class KDSFeedTest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(kds_broker, '_broker', InProcessBroker())
+        self.broker = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.store = Store.objects.create(
+            slug='kds-store', name='KDS', service_rate=Decimal('0'), tax_rate=Decimal('0'),
+        )
+        self.table = Table.objects.create(store=self.store, code='T01')
+        self.bill = Bill.objects.create(table=self.table)
+        cat = ItemCategory.objects.create(code='kds-food', name='フード', major_group='food', route='kitchen')
+        self.item = ItemMaster.objects.create(store=self.store, name='唐揚げ', price_regular=800, category=cat)
+
+    def test_ticket_creation_publishes_after_commit(self):
+        with self.broker.subscribe(channel_for(self.store.id, 'kitchen')) as sub:
+            with self.captureOnCommitCallbacks(execute=True):
+                BillItem.objects.create(bill=self.bill, item_master=self.item, qty=2, price=800)
+                self.assertIsNone(sub.wait(0))   # コミット前は届かない
+            event = sub.wait(0)
+
+        ids = set(OrderTicket.objects.filter(store=self.store).values_list('pk', flat=True))
+        self.assertEqual(event['type'], 'created')
+        self.assertEqual(set(event['ids']), ids)
+
+    def test_ready_goes_to_station_and_ready_channels(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            BillItem.objects.create(bill=self.bill, item_master=self.item, qty=1, price=800)
+        ticket = OrderTicket.objects.get(store=self.store)
+
+        station = self.broker.subscribe(channel_for(self.store.id, 'kitchen'))
+        ready = self.broker.subscribe(channel_for(self.store.id, READY_ROUTE))
+        other = self.broker.subscribe(channel_for(self.store.id, 'drinker'))
+        with station, ready, other:
+            with self.captureOnCommitCallbacks(execute=True):
+                ticket.mark_ready()
+            self.assertEqual(station.wait(0)['ids'], [ticket.pk])
+            self.assertEqual(ready.wait(0)['type'], 'ready')
+            self.assertIsNone(other.wait(0))
+
+    def test_long_poll_wakes_on_publish(self):
+        channel = channel_for(self.store.id, 'kitchen')
+        results = iter([[], [{'id': 1}]])
+        timer = threading.Timer(0.05, self.broker._dispatch, [channel, {'type': 'created', 'ids': [1]}])
+        timer.start()
+
+        data = _wait_for_tickets(channel, lambda: next(results), timeout=5)
+        timer.join()
+        self.assertEqual(data, [{'id': 1}])
+
+    def test_long_poll_times_out_empty(self):
+        data = _wait_for_tickets(channel_for(self.store.id, 'kitchen'), lambda: [], timeout=0.05)
+        self.assertEqual(data, [])
+
+    def test_sse_stream_sends_tickets_and_updates(self):
+        channel = channel_for(self.store.id, 'kitchen')
+        batches = iter([[], [{'id': 7}], []])
+
+        async def run():
+            stream = _ticket_events(channel, lambda cursor: next(batches), 'tickets', 0)
+            frames = [await stream.__anext__()]                       # retry:
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.05)
+            self.broker._dispatch(channel, {'type': 'created', 'ids': [7]})
+            frames.append(await pending)
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0.05)
+            self.broker._dispatch(channel, {'type': 'ack', 'ids': [7]})
+            frames.append(await pending)
+            await stream.aclose()
+            return frames
+
+        frames = asyncio.run(run())
+        self.assertTrue(frames[0].startswith('retry:'))
+        self.assertIn('event: tickets', frames[1])
+        self.assertIn('"cursor": 7', frames[1])
+        self.assertIn('event: update', frames[2])
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 
 from django.test import TestCase
@@ -187,3 +187,74 @@ class TestNominationPayoutTimeboxedBase(TestCase):
         totals = engine.nomination_payouts_timeboxed(bill)
 
         assert totals == {cast_a.id: 2000}
+
+    def test_many_switches_match_segment_scan(self):
+        """指名の入れ替えが多い長時間伝票でも、区間ごとに全明細を走査した結果と一致する"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from billing.calculator import BatchBillCalculator
+
+        store, bill, customer, arrived_at, _ = self._create_store_bill_customer()
+        bc = BillCustomer.objects.get(bill=bill, customer=customer)
+        bc.left_at = self._make_dt(23, 0)
+        bc.save(update_fields=["left_at"])
+        casts = [self._create_cast(store, f"cast_sw{i}", f"Cast SW{i}") for i in range(9)]
+        # 20分ごとに交代（前の指名と5分重なる）、最後の1人は継続中
+        for i, cast in enumerate(casts):
+            started_at = self._make_dt(20, 0) + timedelta(minutes=20 * i)
+            BillCustomerNomination.objects.create(
+                bill=bill, customer=customer, cast=cast, started_at=started_at,
+                ended_at=None if i == len(casts) - 1 else started_at + timedelta(minutes=25),
+            )
+
+        category = self._create_category(code="drink_sw", name="DrinkSW")
+        item_master = self._create_item_master(store, category, name="Drink SW")
+        for n in range(36):
+            # 区間の境界ちょうど（10分刻み）と途中の両方に置く
+            minute = n * 5
+            self._create_bill_item(bill, item_master, 1000 + n * 100, self._make_dt(20 + minute // 60, minute % 60))
+
+        def segment_scan():
+            pr = Decimal("0.20")
+            items = list(bill.items.all())
+            noms = list(BillCustomerNomination.objects.filter(bill=bill))
+            start, end = arrived_at, self._make_dt(23, 0)
+            times = sorted({start, end} | {
+                t for n in noms
+                for t in (max(n.started_at, start), min(n.ended_at or end, end))
+            })
+            totals = {}
+            for t_i, t_j in zip(times, times[1:]):
+                active = list(dict.fromkeys(
+                    n.cast_id for n in noms if n.started_at <= t_i and (n.ended_at is None or t_i < n.ended_at)
+                ))
+                subtotal = sum(it.subtotal for it in items if t_i <= it.ordered_at < t_j)
+                if active and subtotal:
+                    each = int(int(Decimal(subtotal) * pr) // len(active))
+                    for cast_id in active:
+                        totals[cast_id] = totals.get(cast_id, 0) + each
+            return totals
+
+        expected = segment_scan()
+        assert set(expected) == {c.id for c in casts}
+        assert BaseEngine(store).nomination_payouts_timeboxed(bill) == expected
+
+        # 伝票グラフを prefetch 済みならクエリなしで計算できる
+        [prefetched] = BatchBillCalculator.prefetch(Bill.objects.filter(pk=bill.pk))
+        with CaptureQueriesContext(connection) as ctx:
+            assert BaseEngine(store).nomination_payouts_timeboxed(prefetched) == expected
+        assert len(ctx.captured_queries) == 0
+
+    def test_ordered_subtotals_half_open_ranges(self):
+        from types import SimpleNamespace
+
+        from billing.payroll.nom_timeline import OrderedSubtotals
+
+        rows = [(self._make_dt(20, 10), 300), (self._make_dt(20, 0), 100), (self._make_dt(20, 10), 30), (None, 9999)]
+        pool = OrderedSubtotals(SimpleNamespace(ordered_at=t, subtotal=s) for t, s in rows)
+
+        assert pool.between(self._make_dt(20, 0), self._make_dt(20, 10)) == 100
+        assert pool.between(self._make_dt(20, 10), self._make_dt(21, 0)) == 330
+        assert pool.between(self._make_dt(19, 0), self._make_dt(21, 0)) == 430
+        assert pool.between(self._make_dt(21, 0), self._make_dt(20, 0)) == 0
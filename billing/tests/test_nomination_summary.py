@@ -294,6 +294,35 @@ class TestNominationSummaryService:
         # 3333.33... は ROUND_HALF_UP で 3333.33
         assert result['per_cast_share'] == '3333.33'
 
+    def test_queries_do_not_grow_with_customers(self, setup_with_items, django_assert_num_queries):
+        """（テスト7）本指名客が増えても 本指名・伝票顧客・明細 の3クエリ"""
+        d = setup_with_items
+        arrived_at, left_at = d['arrived_at'], d['left_at']
+        BillCustomer.objects.filter(pk=d['bill_customer_a'].pk).update(arrived_at=arrived_at, left_at=left_at)
+        customers = [d['customer_a']]
+        for i in range(5):
+            customer = Customer.objects.create(full_name=f'Extra {i}', phone=f'+8190999900{i:02d}')
+            BillCustomer.objects.create(
+                bill=d['bill'], customer=customer,
+                arrived_at=arrived_at + timedelta(minutes=10 * i), left_at=left_at,
+            )
+            customers.append(customer)
+        for customer in customers:
+            BillCustomerNomination.objects.create(
+                bill=d['bill'], customer=customer, cast=d['cast1'], started_at=arrived_at,
+            )
+        for minutes in (5, 15, 25, 35, 45, 55):
+            BillItem.objects.create(
+                bill=d['bill'], item_master=d['item'], name='Drink',
+                price=1000, qty=1, ordered_at=arrived_at + timedelta(minutes=minutes),
+            )
+
+        with django_assert_num_queries(3):
+            results = build_nomination_summaries(d['bill'])
+
+        assert [r['customer_id'] for r in results] == [c.id for c in customers]
+        assert [r['subtotal'] for r in results] == ['6000', '6000', '5000', '4000', '3000', '2000']
+
 
 @pytest.mark.django_db
 class TestNominationSummaryAPI:
@@ -0,0 +1,99 @@
+# billing/tests/test_payroll_computation.py
+from unittest import mock
+
+import pytest
+from django.utils import timezone
+
+from accounts.models import User
+from billing.calculator import BillCalculator
+from billing.models import (
+    Bill, BillCastStay, BillItem, BillItemCast, BillSubstituteItem, Cast, ItemCategory, ItemMaster, Store, Table,
+)
+from billing.payroll.computation import PayrollComputation, payroll_graph_prefetch
+from billing.payroll.engines.base import BaseEngine
+from billing.payroll.snapshot import build_payroll_snapshot
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def shop():
+    store = Store.objects.create(slug="comp-store", name="Comp", service_rate=10, tax_rate=10, nom_pool_rate=0.2)
+    table = Table.objects.create(store=store, code="T01")
+    cat = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=cat, code="HB")
+    casts = [
+        Cast.objects.create(user=User.objects.create_user(username=f"comp{i}"), stage_name=f"C{i}", store=store)
+        for i in range(3)
+    ]
+    return store, table, item, casts
+
+
+def _bill(table, item, casts, n_items):
+    now = timezone.now()
+    a, b, c = casts
+    bill = Bill.objects.create(table=table, opened_at=now, main_cast=a)
+    bill.nominated_casts.add(b)
+    for cast, stay_type in ((a, "nom"), (b, "nom"), (c, "in")):
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=now, stay_type=stay_type)
+    for i in range(n_items):
+        line = BillItem.objects.create(
+            bill=bill, item_master=item, qty=1 + i % 2, price=1000, served_by_cast=casts[i % 3],
+            back_rate="0.10", is_nomination=(i % 4 == 0),
+        )
+        if i % 3 == 1:
+            BillItemCast.objects.create(bill_item=line, cast=b)
+            BillItemCast.objects.create(bill_item=line, cast=c)
+    BillSubstituteItem.objects.create(bill=bill, item_master=item, cast=c, price=1000, qty=1, )
+    return Bill.objects.get(pk=bill.pk)
+
+
+def test_one_pass_matches_calculator_and_snapshot(shop):
+    store, table, item, casts = shop
+    bill = _bill(table, item, casts, 6)
+
+    with mock.patch.object(BaseEngine, "nomination_payouts", autospec=True,
+                           side_effect=BaseEngine.nomination_payouts) as nom, \
+         mock.patch.object(BaseEngine, "dohan_payouts", autospec=True,
+                           side_effect=BaseEngine.dohan_payouts) as dohan:
+        comp = PayrollComputation(bill)
+        snap = comp.snapshot()
+    # エンジン計算は金額・CastPayout・スナップショットで共有して1回だけ
+    assert (nom.call_count, dohan.call_count) == (1, 1)
+
+    expected = BillCalculator(Bill.objects.get(pk=bill.pk)).execute()
+    assert comp.result.as_dict() == expected.as_dict()
+    assert sorted((p.cast_id, p.amount) for p in comp.cast_payouts) == \
+        sorted((p.cast_id, p.amount) for p in expected.cast_payouts)
+    assert snap["totals"]["grand_total"] == expected.total
+    assert snap["totals"]["labor_total"] == sum(p.amount for p in expected.cast_payouts) + snap["totals"]["item_total"]
+    assert snap["totals"]["substitute_deduction_total"] == bill.substitute_items.get().substitute_amount > 0
+
+    fresh = build_payroll_snapshot(Bill.objects.get(pk=bill.pk))
+    assert (fresh["hash"], fresh["by_cast"], fresh["items"]) == (snap["hash"], snap["by_cast"], snap["items"])
+    # 呼び出し側の bill には prefetch キャッシュを残さない（編集後の再計算が古い明細を読まない）
+    assert not getattr(bill, "_prefetched_objects_cache", None)
+
+
+def test_query_count_does_not_grow_with_items(shop, django_assert_num_queries):
+    store, table, item, casts = shop
+    small = _bill(table, item, casts, 3)
+    large = _bill(table, item, casts, 24)
+    build_payroll_snapshot(small)   # 店舗の単価リゾルバを温める
+
+    # 伝票・卓/店舗・本指名キャスト・明細・担当キャスト・立替・stay・本指名・顧客・顧客指名
+    with django_assert_num_queries(10):
+        build_payroll_snapshot(Bill.objects.get(pk=small.pk))
+    with django_assert_num_queries(10):
+        build_payroll_snapshot(Bill.objects.get(pk=large.pk))
+
+
+def test_prefetched_batch_runs_without_queries(shop, django_assert_num_queries):
+    store, table, item, casts = shop
+    bills = [_bill(table, item, casts, 4) for _ in range(3)]
+    expected = {b.id: build_payroll_snapshot(b)["hash"] for b in bills}
+
+    loaded = list(payroll_graph_prefetch(Bill.objects.filter(id__in=expected)))
+    with django_assert_num_queries(0):
+        hashes = {b.id: PayrollComputation(b, prefetched=True).snapshot()["hash"] for b in loaded}
+    assert hashes == expected
@@ -0,0 +1,102 @@
+"""
+payroll_dirty マーカー（Bill.payroll_dirty_at）のテスト
+
+- 締め済み・snapshot 保存済みの伝票への給与影響のある書き込みでマーカーが立つこと
+- Serializer はハッシュを再計算せずマーカーだけを見ること
+- verify でハッシュ比較し、マーカーを実態に合わせること
+"""
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillCastStay, BillDiscountLine, BillItem, Cast, DiscountRule,
+    ItemCategory, ItemMaster, Store, Table,
+)
+from billing.payroll.snapshot import compute_current_hash, verify_payroll_dirty
+from billing.serializers import BillSerializer
+
+User = get_user_model()
+
+
+class PayrollDirtyMarkerTest(TestCase):
+
+    def setUp(self):
+        self.store = Store.objects.create(
+            slug='dirty-store', name='Dirty', service_rate=Decimal('0'), tax_rate=Decimal('0'),
+        )
+        table = Table.objects.create(store=self.store, code='T01')
+        category = ItemCategory.objects.create(code='dirty-drink', name='ドリンク', back_rate_free=Decimal('0.30'))
+        self.item = ItemMaster.objects.create(store=self.store, name='ショット', price_regular=1000, category=category)
+        self.cast = Cast.objects.create(
+            user=User.objects.create_user(username='dirty-cast', password='pass'),
+            stage_name='A', store=self.store,
+        )
+        self.bill = Bill.objects.create(table=table)
+        BillItem.objects.create(bill=self.bill, item_master=self.item, qty=1, price=1000, served_by_cast=self.cast)
+        Bill.objects.filter(pk=self.bill.pk).update(
+            closed_at=timezone.now(), payroll_snapshot={'hash': 'sha256:saved', 'totals': {}},
+        )
+        self.bill.refresh_from_db()
+
+    def _dirty_at(self):
+        return Bill.objects.values_list('payroll_dirty_at', flat=True).get(pk=self.bill.pk)
+
+    def test_line_writes_mark_dirty(self):
+        self.assertIsNone(self._dirty_at())
+        BillItem.objects.create(bill=self.bill, item_master=self.item, qty=1, price=1000)
+        first = self._dirty_at()
+        self.assertIsNotNone(first)
+
+        # 既に dirty なら最初の時刻を残す
+        BillDiscountLine.objects.create(bill=self.bill, label='端数', amount=100)
+        self.assertEqual(self._dirty_at(), first)
+
+    def test_stay_and_discount_line_mark_dirty(self):
+        BillCastStay.objects.create(bill=self.bill, cast=self.cast, stay_type='in', entered_at=timezone.now())
+        self.assertIsNotNone(self._dirty_at())
+
+        Bill.objects.filter(pk=self.bill.pk).update(payroll_dirty_at=None)
+        BillDiscountLine.objects.filter(bill=self.bill).delete()
+        BillDiscountLine.objects.create(bill=self.bill, label='端数', amount=100)
+        self.assertIsNotNone(self._dirty_at())
+
+    def test_bill_fields(self):
+        self.bill.memo = 'メモだけ'
+        self.bill.save()
+        self.assertIsNone(self._dirty_at())
+
+        self.bill.discount_rule = DiscountRule.objects.create(store=self.store, code='d10', name='10%')
+        self.bill.save(update_fields=['discount_rule'])
+        self.assertIsNotNone(self._dirty_at())
+
+    def test_open_bill_is_not_marked(self):
+        Bill.objects.filter(pk=self.bill.pk).update(closed_at=None)
+        BillItem.objects.create(bill=self.bill, item_master=self.item, qty=1, price=1000)
+        self.assertIsNone(self._dirty_at())
+
+    def test_serializer_does_not_rehash(self):
+        BillItem.objects.create(bill=self.bill, item_master=self.item, qty=1, price=1000)
+        self.bill.refresh_from_db()
+        with mock.patch('billing.payroll.snapshot.compute_current_hash', side_effect=AssertionError):
+            data = BillSerializer(self.bill).data
+        self.assertTrue(data['payroll_dirty'])
+
+    def test_verify_clears_marker_when_hash_matches(self):
+        Bill.objects.filter(pk=self.bill.pk).update(
+            payroll_snapshot={'hash': compute_current_hash(self.bill), 'totals': {}},
+            payroll_dirty_at=timezone.now(),
+        )
+        self.bill.refresh_from_db()
+
+        result = verify_payroll_dirty(self.bill)
+        self.assertFalse(result['payroll_dirty'])
+        self.assertIsNone(self._dirty_at())
+
+    def test_verify_sets_marker_when_hash_differs(self):
+        result = verify_payroll_dirty(self.bill)
+        self.assertTrue(result['payroll_dirty'])
+        self.assertIsNotNone(self._dirty_at())
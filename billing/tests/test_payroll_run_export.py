@@ -0,0 +1,140 @@
+"""
+PayrollRun CSV エクスポートのテスト
+
+- サマリ・出勤・売上明細がキャスト順に並ぶこと（ストリーミング出力）
+- PayrollRunLine / PayrollRunBackRow が保存されること
+"""
+import csv
+import io
+from datetime import date, datetime, time
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import StoreMembership
+from billing.exports.payroll_run_csv import CSV_COLUMNS
+from billing.models import (
+    Bill, BillItem, Cast, CastDailySummary, CastPayout, ItemCategory, ItemMaster,
+    PayrollRun, PayrollRunBackRow, PayrollRunLine, Store, Table,
+)
+
+User = get_user_model()
+
+DF, DT = date(2026, 3, 1), date(2026, 3, 31)
+
+
+@pytest.fixture
+def export_setup(db):
+    store = Store.objects.create(slug='export-store', name='Export')
+    other = Store.objects.create(slug='export-other', name='Other')
+    table = Table.objects.create(store=store, code='T01')
+    cat = ItemCategory.objects.create(code='export-drink', name='ドリンク')
+    master = ItemMaster.objects.create(store=store, name='ハイボール', price_regular=1000, category=cat)
+
+    def make_cast(name, s=store):
+        return Cast.objects.create(user=User.objects.create_user(f'export-{name}'), stage_name=name, store=s)
+
+    casts = {name: make_cast(name) for name in ('B', 'A', 'C')}
+    helper = make_cast('H', other)
+
+    bill = Bill.objects.create(table=table)
+    closed_at = timezone.make_aware(datetime.combine(date(2026, 3, 10), time(21)))
+    Bill.objects.filter(pk=bill.pk).update(closed_at=closed_at)
+    for cast, amount in ((casts['A'], 300), (casts['A'], 200), (casts['B'], 100), (helper, 50)):
+        item = BillItem.objects.create(bill=bill, item_master=master, qty=2, price=1000, served_by_cast=cast)
+        CastPayout.objects.create(bill=bill, bill_item=item, cast=cast, amount=amount)
+
+    for day, minutes, pay in ((date(2026, 3, 10), 240, 8000), (date(2026, 3, 11), 120, 4000)):
+        CastDailySummary.objects.update_or_create(
+            store=store, cast=casts['B'], work_date=day,
+            defaults={'worked_min': minutes, 'payroll': pay},
+        )
+
+    user = User.objects.create_superuser('export-admin', password='pass')
+    StoreMembership.objects.create(user=user, store=store, is_primary=True)
+    client = APIClient()
+    client.force_authenticate(user)
+    return store, casts, client
+
+
+def _post(store, client):
+    resp = client.post(
+        '/api/billing/payroll/runs/export.csv',
+        {'from': DF.isoformat(), 'to': DT.isoformat()},
+        format='json', HTTP_X_STORE_ID=str(store.id),
+    )
+    assert resp.status_code == 200
+    assert resp.streaming
+    text = b''.join(resp.streaming_content).decode('utf-8')
+    assert text.startswith('\ufeff')
+    return list(csv.reader(io.StringIO(text.lstrip('\ufeff'))))
+
+
+def test_export_rows_grouped_by_cast(export_setup):
+    store, casts, client = export_setup
+    rows = _post(store, client)
+
+    assert rows[0] == CSV_COLUMNS
+    summaries = [r for r in rows[1:] if r[0]]
+    assert [r[0] for r in summaries] == ['A', 'B', 'C']
+    assert summaries[0][2] == '500'                      # A のバック合計
+    assert summaries[1][1:3] == ['12000', '100']         # B の時給・バック
+
+    by_cast, current = {}, None
+    for r in rows[1:]:
+        if r[0]:
+            current = r[0]
+        elif r[5]:
+            by_cast.setdefault(current, []).append((r[5], r[-1]))
+    assert by_cast['A'] == [('出勤日時', ''), ('売上', '300'), ('売上', '200')]
+    assert by_cast['B'] == [('出勤日時', ''), ('出勤日時', ''), ('売上', '100')]
+    assert by_cast['C'] == [('出勤日時', ''), ('売上', '')]
+
+
+def test_export_saves_run(export_setup):
+    store, casts, client = export_setup
+    _post(store, client)
+
+    run = PayrollRun.objects.get(store=store)
+    assert PayrollRunLine.objects.filter(run=run).count() == 3
+    assert PayrollRunLine.objects.get(run=run, cast=casts['A']).commission == 500
+    # 他店キャストのバックも根拠行には残る
+    assert PayrollRunBackRow.objects.filter(run=run).count() == 4
+
+
+def test_export_streams_rows_under_asgi(export_setup, monkeypatch):
+    """ASGI でも CSV を読み切らず、1行ずつ送る（sync_to_async(list) で溜めない）"""
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+    from rest_framework.authtoken.models import Token
+
+    from billing.exports import payroll_run_csv
+
+    store, casts, _ = export_setup
+    token = Token.objects.create(user=User.objects.get(username='export-admin'))
+    written = []
+    row = payroll_run_csv._row
+    monkeypatch.setattr(payroll_run_csv, '_row', lambda *a: written.append(1) or row(*a))
+
+    async def fetch():
+        resp = await AsyncClient().post(
+            '/api/billing/payroll/runs/export.csv',
+            {'from': DF.isoformat(), 'to': DT.isoformat()},
+            content_type='application/json',
+            headers={'authorization': f'Token {token.key}', 'x-store-id': str(store.id)},
+        )
+        assert resp.status_code == 200 and resp.is_async
+        chunks = []
+        async for chunk in resp.streaming_content:
+            chunks.append(chunk)
+            if len(chunks) == 1:
+                first_written = len(written)
+        return first_written, chunks
+
+    first_written, chunks = async_to_sync(fetch)()
+    assert first_written == 1
+    text = b''.join(chunks).decode('utf-8')
+    assert len(chunks) == len(written) > 1
+    assert text.startswith('\ufeff') and text.count('\n') == len(chunks)
@@ -0,0 +1,89 @@
+"""
+get_daily_pl の集計値とクエリ数のベンチマーク
+
+- major_group 別集計・伝票合計・立替経費が正しく出ること
+- クエリ数が予算内であること（増えたら EXPLAIN 付きで失敗）
+"""
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillItem, Cast, ItemCategory, ItemMaster,
+    PersonnelExpense, PersonnelExpenseCategory, PersonnelExpenseSettlementEvent,
+    Store, Table,
+)
+from billing.utils.pl_daily import get_daily_pl
+
+User = get_user_model()
+
+DAY = date(2026, 3, 10)
+
+# business window の Store / 伝票合計 / major_group 集計 / snapshot 歩合の SUM / 時給 / 立替経費
+DAILY_PL_QUERY_BUDGET = 6
+
+
+def _at(hour):
+    return timezone.make_aware(datetime.combine(DAY, time(hour)))
+
+
+@pytest.fixture
+def pl_day(db):
+    store = Store.objects.create(
+        slug='pl-q', name='PLQ', service_rate=Decimal('0'), tax_rate=Decimal('0'),
+    )
+    table = Table.objects.create(store=store, code='T01')
+    masters = {}
+    for group, price in (('set', 5000), ('drink', 1000), ('champagne', 30000), ('food', 800)):
+        cat = ItemCategory.objects.create(code=f'plq-{group}', name=group, major_group=group)
+        masters[group] = ItemMaster.objects.create(store=store, name=group, price_regular=price, category=cat)
+
+    for i in range(3):
+        bill = Bill.objects.create(table=table)
+        for group, qty in (('set', 2), ('drink', i + 1), ('food', 1)):
+            BillItem.objects.create(bill=bill, item_master=masters[group], qty=qty, price=masters[group].price_regular)
+        if i == 0:
+            BillItem.objects.create(bill=bill, item_master=masters['champagne'], qty=1, price=30000)
+        Bill.objects.filter(pk=bill.pk).update(
+            closed_at=_at(21), settled_total=20000, paid_cash=15000, paid_card=5000,
+        )
+        bill.payroll_snapshot = {'by_cast': [{'amount': 1000}]}
+        bill.save(update_fields=['payroll_snapshot'])
+
+    user = User.objects.create_user('plq-cast', store=store)
+    Cast.objects.create(user=user, stage_name='A', store=store)
+    category = PersonnelExpenseCategory.objects.create(store=store, code='taxi', name='タクシー')
+    for amount, settlements in ((3000, (1000, 500)), (2000, ())):
+        expense = PersonnelExpense.objects.create(
+            store=store, category=category, subject_user=user, subject_role='cast',
+            amount=amount, occurred_at=_at(22),
+        )
+        for s in settlements:
+            PersonnelExpenseSettlementEvent.objects.create(expense=expense, amount=s)
+    return store
+
+
+def test_daily_pl_values(pl_day):
+    pl = get_daily_pl(DAY, store_id=pl_day.id, include_breakdown=True)
+
+    assert pl['sales_total'] == 60000
+    assert (pl['sales_cash'], pl['sales_card']) == (45000, 15000)
+    assert pl['guest_count'] == 6
+    assert (pl['drink_sales'], pl['drink_qty']) == (6000, 6)
+    assert (pl['champagne_sales'], pl['champagne_qty']) == (30000, 1)
+    assert pl['other_sales'] == 2400
+    assert pl['subtotal'] == 30000 + 6000 + 30000 + 2400
+    assert pl['commission'] == 3000
+    assert pl['group_sales']['extension'] == {'sales': 0, 'qty': 0}
+    # 回収イベントが複数あっても経費額は重複しない
+    assert pl['personnel_expenses_collect_created'] == 5000
+    assert pl['personnel_expenses_collect_settled'] == 1500
+    assert pl['personnel_expenses_collect_outstanding'] == 3500
+
+
+def test_daily_pl_query_budget(pl_day, query_budget):
+    with query_budget(DAILY_PL_QUERY_BUDGET):
+        get_daily_pl(DAY, store_id=pl_day.id, include_breakdown=True)
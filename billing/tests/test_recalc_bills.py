@@ -0,0 +1,118 @@
+# billing/tests/test_recalc_bills.py
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from accounts.models import User
+from billing.calculator import BillCalculator
+from billing.management.commands.recalc_bills import recalc_chunk
+from billing.models import (
+    Bill, BillCastStay, BillItem, Cast, CastPayout, CustomerStats, DailyPLSnapshot, ItemCategory, ItemMaster,
+    Store, Table,
+)
+from billing.services.customer_stats import rebuild_customer_stats
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def shop():
+    store = Store.objects.create(slug="recalc-store", name="Recalc", service_rate=10, tax_rate=10)
+    table = Table.objects.create(store=store, code="T01")
+    cat = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=cat, code="HB")
+    cast = Cast.objects.create(user=User.objects.create_user(username="recalc"), stage_name="R", store=store)
+    return store, table, item, cast
+
+
+def _closed_bills(shop, n):
+    store, table, item, cast = shop
+    now = timezone.now()
+    bills = []
+    for i in range(n):
+        bill = Bill.objects.create(table=table, opened_at=now)
+        BillItem.objects.create(bill=bill, item_master=item, qty=i + 1, price=1000, served_by_cast=cast, back_rate="0.10")
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=now, stay_type="nom")
+        bills.append(bill)
+    Bill.objects.filter(id__in=[b.id for b in bills]).update(closed_at=now)
+    return bills
+
+
+def _run(*args):
+    out = StringIO()
+    call_command("recalc_bills", *args, stdout=out)
+    return out.getvalue()
+
+
+def test_bulk_write_matches_calculator(shop):
+    store, *_ = shop
+    bills = _closed_bills(shop, 5)
+    stale = bills[:2]
+    Bill.objects.filter(id__in=[b.id for b in stale]).update(
+        subtotal=1, service_charge=1, tax=1, grand_total=1, total=1,
+    )
+    for bill in bills:
+        CastPayout.objects.create(bill=bill, cast=shop[3], amount=99_999)
+    rebuild_customer_stats(store.id)
+    today = timezone.localdate()
+    pl = DailyPLSnapshot.objects.create(store=store, business_date=today, is_stale=False)
+
+    output = _run("--chunk-size", "2")
+    assert "Recalculation complete! (2 Bills changed)" in output
+
+    for bill in Bill.objects.filter(id__in=[b.id for b in bills]):
+        expected = BillCalculator(bill).execute()
+        assert (bill.subtotal, bill.service_charge, bill.tax, bill.grand_total, bill.total) == (
+            expected.subtotal, expected.service_fee, expected.tax, expected.total, expected.total,
+        )
+        assert sorted(p.amount for p in bill.payouts.all()) == sorted(p.amount for p in expected.cast_payouts)
+    assert not CastPayout.objects.filter(amount=99_999).exists()
+
+    # signals を通らない分: 日次P&L の stale と顧客の累計金額
+    pl.refresh_from_db()
+    assert pl.is_stale
+    stats = {s.customer_id: s.total_spent for s in CustomerStats.objects.filter(store=store)}
+    rebuild_customer_stats(store.id)
+    assert stats == {s.customer_id: s.total_spent for s in CustomerStats.objects.filter(store=store)}
+
+
+def test_payout_only_chunk_marks_pl_stale(shop):
+    store, *_ = shop
+    bills = _closed_bills(shop, 2)
+    recalc_chunk([b.id for b in bills])   # 金額は計算結果どおりに揃える
+    CastPayout.objects.filter(bill__in=bills).update(amount=99_999)
+    pl = DailyPLSnapshot.objects.create(store=store, business_date=timezone.localdate(), is_stale=False)
+
+    result = recalc_chunk([b.id for b in bills])
+    # 金額の差分は無くても CastPayout は作り直されるので、P&L は無効化する
+    assert result.changes == []
+    assert not CastPayout.objects.filter(amount=99_999).exists()
+    pl.refresh_from_db()
+    assert pl.is_stale
+
+
+def test_chunk_query_count_does_not_grow_with_bills(shop, django_assert_max_num_queries):
+    small = [b.id for b in _closed_bills(shop, 2)]
+    large = [b.id for b in _closed_bills(shop, 12)]
+    Bill.objects.filter(id__in=small + large).update(grand_total=1)
+
+    # 伝票グラフ読み込み＋席種設定＋書き込み（bulk_update / 削除 / bulk_create / P&L / 顧客）
+    with django_assert_max_num_queries(20) as small_ctx:
+        recalc_chunk(small)
+    with django_assert_max_num_queries(len(small_ctx.captured_queries)):
+        recalc_chunk(large)
+
+
+def test_dry_run_diff_reports_without_writing(shop):
+    bills = _closed_bills(shop, 3)
+    Bill.objects.filter(pk=bills[0].pk).update(grand_total=1, total=1)
+    before = list(Bill.objects.order_by("id").values_list("grand_total", "total"))
+
+    output = _run("--dry-run", "--diff")
+    expected = BillCalculator(Bill.objects.get(pk=bills[0].pk)).execute().total
+    assert f"Bill #{bills[0].id}: grand_total 1 → {expected}, total 1 → {expected}" in output
+    assert "Dry run: 1 Bills would change." in output
+    assert list(Bill.objects.order_by("id").values_list("grand_total", "total")) == before
+    assert not CastPayout.objects.exists()
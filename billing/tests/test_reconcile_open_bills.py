@@ -0,0 +1,112 @@
+"""
+OPEN 伝票の自動 SET / 延長の一括 reconcile（reconcile_open_bills）のテスト
+
+- 1伝票ずつの reconcile_customer_charges と同じ自動行になること
+- 変更の無い tick では何も書かないこと
+- 退店済み顧客・差し替えられた顧客の扱い
+"""
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from billing.models import (
+    Bill, BillCustomer, BillItem, Customer, ItemCategory, Store, StoreSeatSetting, Table,
+)
+from billing.services.customer_charge_reconcile import (
+    AUTO_EXT_CODE, AUTO_SET_CODE, reconcile_customer_charges, reconcile_open_bills,
+)
+
+
+class ReconcileOpenBillsTest(TestCase):
+
+    def setUp(self):
+        ItemCategory.objects.create(code='set', name='セット')
+        ItemCategory.objects.create(code='extension', name='延長')
+        self.now = timezone.now()
+        self.stores = []
+        for slug in ('recon-a', 'recon-b'):
+            store = Store.objects.create(slug=slug, name=slug)
+            StoreSeatSetting.objects.create(store=store, charge_per_person=5000, extension_30_price=3000)
+            self.stores.append((store, Table.objects.create(store=store, code='T01')))
+
+    def _bill(self, table, *stays):
+        """stays: [(来店からの分数, 退店までの分数 or None)]"""
+        bill = Bill.objects.create(table=table)
+        BillCustomer.objects.filter(bill=bill).delete()
+        for arrived_min, left_min in stays:
+            BillCustomer.objects.create(
+                bill=bill, customer=Customer.objects.create(),
+                arrived_at=self.now - timedelta(minutes=arrived_min),
+                left_at=None if left_min is None else self.now - timedelta(minutes=left_min),
+            )
+        return bill
+
+    def _auto_rows(self):
+        return sorted(
+            BillItem.objects.filter(item_master__code__in=(AUTO_SET_CODE, AUTO_EXT_CODE))
+            .values_list('bill_id', 'customer_id', 'item_master__code', 'qty', 'price')
+        )
+
+    def _setup_bills(self):
+        (_, ta), (_, tb) = self.stores
+        return [
+            self._bill(ta, (30, None), (95, None)),
+            self._bill(ta, (200, 20)),
+            self._bill(tb, (61, None)),
+        ]
+
+    def test_matches_per_bill_reconcile(self):
+        bills = self._setup_bills()
+        for bill in bills:
+            reconcile_customer_charges(bill.id, now=self.now)
+        expected = self._auto_rows()
+        totals = dict(Bill.objects.values_list('id', 'total'))
+        BillItem.objects.all().delete()
+
+        tick = reconcile_open_bills(now=self.now)
+        self.assertEqual(self._auto_rows(), expected)
+        self.assertEqual(dict(Bill.objects.values_list('id', 'total')), totals)
+        self.assertEqual((tick.bills, tick.touched), (3, 3))
+        # 95分 → 延長2、200-20=180分 → 延長4、61分 → 延長1
+        self.assertIn((bills[1].id, bills[1].billcustomer_set.get().customer_id, AUTO_EXT_CODE, 4, 3000), expected)
+
+    def test_idle_tick_writes_nothing(self):
+        self._setup_bills()
+        reconcile_open_bills(now=self.now)
+        # 伝票・自動マスタ・BillCustomer・自動行の4 SELECT（+ SAVEPOINT/RELEASE）
+        with self.assertNumQueries(6):
+            tick = reconcile_open_bills(now=self.now)
+        self.assertEqual(tick.touched, 0)
+
+        # 時間が進めば延長だけ増える
+        tick = reconcile_open_bills(now=self.now + timedelta(minutes=31))
+        self.assertEqual((tick.touched, tick.updated, tick.created), (2, 2, 1))
+
+    def test_replaced_customer_and_closed_bill(self):
+        (_, ta), _ = self.stores
+        bill = self._bill(ta, (90, None))
+        closed = self._bill(ta, (90, None))
+        reconcile_open_bills(now=self.now)
+        Bill.objects.filter(pk=closed.pk).update(closed_at=self.now)
+
+        BillCustomer.objects.filter(bill=bill).delete()
+        BillCustomer.objects.create(bill=bill, customer=Customer.objects.create(), arrived_at=self.now)
+        BillItem.objects.filter(bill=closed).delete()
+
+        reconcile_open_bills(now=self.now)
+        new_customer = bill.billcustomer_set.get().customer_id
+        self.assertEqual(
+            sorted(BillItem.objects.filter(bill=bill).values_list('customer_id', 'item_master__code', 'qty')),
+            [(new_customer, AUTO_SET_CODE, 1)],
+        )
+        self.assertFalse(BillItem.objects.filter(bill=closed).exists())
+
+    def test_command_reports_tick(self):
+        self._setup_bills()
+        out = StringIO()
+        call_command('reconcile_open_bills', '--store-slug', 'recon-b', stdout=out)
+        self.assertIn('bills=1 touched=1', out.getvalue())
+        self.assertIn('elapsed_ms=', out.getvalue())
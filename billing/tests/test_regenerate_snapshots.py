@@ -0,0 +1,129 @@
+# billing/tests/test_regenerate_snapshots.py
+import json
+from io import StringIO
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+
+from accounts.models import User
+from billing.management.commands.regenerate_payroll_snapshots import FILTER_OPTIONS, regenerate_chunk
+from billing.models import Bill, BillCastStay, BillItem, Cast, ItemCategory, ItemMaster, Store, Table
+from billing.payroll.computation import PayrollComputation
+from billing.services import generate_payroll_snapshot
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def bills():
+    store = Store.objects.create(slug="regen-store", name="Regen", service_rate=10, tax_rate=10)
+    table = Table.objects.create(store=store, code="T01")
+    cat = ItemCategory.objects.create(code="drink", name="ドリンク")
+    item = ItemMaster.objects.create(store=store, name="ハイボール", price_regular=1000, category=cat, code="HB")
+    cast = Cast.objects.create(user=User.objects.create_user(username="regen"), stage_name="R", store=store)
+    now = timezone.now()
+    out = []
+    for i in range(5):
+        bill = Bill.objects.create(table=table, opened_at=now)
+        BillItem.objects.create(bill=bill, item_master=item, qty=i + 1, price=1000, served_by_cast=cast, back_rate="0.10")
+        BillCastStay.objects.create(bill=bill, cast=cast, entered_at=now, stay_type="nom")
+        Bill.objects.filter(pk=bill.pk).update(closed_at=now)
+        out.append(Bill.objects.get(pk=bill.pk))
+    return out
+
+
+def _run(tmp_path, *args):
+    out = StringIO()
+    call_command(
+        "regenerate_payroll_snapshots", "--only-closed", "--chunk-size", "2",
+        "--checkpoint", str(tmp_path / "ck.json"), *args, stdout=out,
+    )
+    return out.getvalue()
+
+
+def _filters(**overrides):
+    filters = {k: None for k in FILTER_OPTIONS}
+    filters.update(only_closed=True, force=False)
+    filters.update(overrides)
+    return filters
+
+
+def test_chunks_match_single_bill_snapshots(bills, tmp_path):
+    expected = {b.id: generate_payroll_snapshot(b)["hash"] for b in bills}
+
+    output = _run(tmp_path)
+    assert "bills/sec" in output and "ETA" in output
+    assert "Done: 5 regenerated, 0 skipped, 0 failed" in output
+    assert {b.id: b.payroll_snapshot["hash"] for b in Bill.objects.all()} == expected
+    # 全件終わったらチェックポイントは消える
+    assert not (tmp_path / "ck.json").exists()
+
+    # 2回目は既存 snapshot をスキップ
+    assert "Done: 0 regenerated, 5 skipped" in _run(tmp_path)
+
+
+def test_resume_continues_after_last_committed_id(bills, tmp_path):
+    (tmp_path / "ck.json").write_text(json.dumps({"filters": _filters(), "last_id": bills[2].id}))
+
+    output = _run(tmp_path, "--resume")
+    assert "Resuming after Bill #%d: 2 Bills left" % bills[2].id in output
+    assert [b.payroll_snapshot is not None for b in Bill.objects.order_by("id")] == [False] * 3 + [True] * 2
+
+    (tmp_path / "ck.json").write_text(json.dumps({"filters": _filters(force=True), "last_id": 0}))
+    with pytest.raises(CommandError, match="different filters"):
+        _run(tmp_path, "--resume")
+
+
+def test_stop_on_error_keeps_checkpoint_before_failed_chunk(bills, tmp_path):
+    real = PayrollComputation.snapshot
+    bad_id = bills[3].id
+
+    def snapshot(self):
+        if self.bill.id == bad_id:
+            raise ValueError("boom")
+        return real(self)
+
+    with mock.patch.object(PayrollComputation, "snapshot", snapshot):
+        with pytest.raises(CommandError, match=f"Bill #{bad_id}: boom"):
+            _run(tmp_path, "--stop-on-error")
+
+    checkpoint = json.loads((tmp_path / "ck.json").read_text())
+    assert checkpoint["last_id"] == bills[1].id
+    # 失敗したチャンクでも他の伝票はコミット済み、失敗した伝票は触らない
+    assert [b.payroll_snapshot is not None for b in Bill.objects.order_by("id")] == [True, True, True, False, False]
+
+    output = _run(tmp_path, "--resume")
+    assert "Done: 2 regenerated, 1 skipped, 0 failed" in output
+
+
+def test_regenerate_chunk_reports_per_bill(bills):
+    result = regenerate_chunk([b.id for b in bills[:3]])
+    assert (result.last_id, result.regenerated, result.skipped, result.errors) == (bills[2].id, 3, 0, [])
+    assert regenerate_chunk([bills[0].id]).skipped == 1
+
+
+def test_failed_bills_are_kept_in_checkpoint_and_retried(bills, tmp_path):
+    real = PayrollComputation.snapshot
+    bad_id = bills[1].id
+
+    def snapshot(self):
+        if self.bill.id == bad_id:
+            raise ValueError("boom")
+        return real(self)
+
+    with mock.patch.object(PayrollComputation, "snapshot", snapshot):
+        output = _run(tmp_path)
+    assert "Done: 4 regenerated, 0 skipped, 1 failed" in output
+    assert f"#{bad_id}" in output and "--resume" in output
+    # 失敗が残るのでチェックポイントは消さない
+    checkpoint = json.loads((tmp_path / "ck.json").read_text())
+    assert (checkpoint["last_id"], checkpoint["failed_ids"]) == (bills[4].id, [bad_id])
+
+    output = _run(tmp_path, "--resume")
+    assert "1 Bills left (1 failed before)" in output
+    assert "Done: 1 regenerated, 0 skipped, 0 failed" in output
+    assert all(b.payroll_snapshot for b in Bill.objects.all())
+    assert not (tmp_path / "ck.json").exists()
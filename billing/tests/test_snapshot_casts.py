@@ -0,0 +1,84 @@
+"""
+BillPayrollSnapshotCast（payroll_snapshot の by_cast 正規化）のテスト
+
+- snapshot 保存時に行が作り直されること
+- 期間の歩合・立替控除が JSON を読まずに SUM で出ること
+"""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from billing.models import Bill, BillPayrollSnapshotCast, Cast, Store, Table
+from billing.services.snapshot_casts import (
+    snapshot_commission_total, snapshot_missing, substitute_deduction_by_cast,
+)
+
+User = get_user_model()
+
+
+def _snapshot(*casts):
+    return {
+        'hash': 'sha256:x',
+        'by_cast': [
+            {
+                'cast_id': cid, 'amount': amount, 'substitute_deduction': ded,
+                'breakdown': [
+                    {'type': 'nomination_pool', 'amount': nom},
+                    {'type': 'item_back', 'amount': amount - nom},
+                ],
+            }
+            for cid, amount, ded, nom in casts
+        ],
+    }
+
+
+class SnapshotCastTest(TestCase):
+
+    def setUp(self):
+        store = Store.objects.create(slug='snap-store', name='Snap', service_rate=Decimal('0'), tax_rate=Decimal('0'))
+        self.table = Table.objects.create(store=store, code='T01')
+        self.a, self.b = (
+            Cast.objects.create(user=User.objects.create_user(f'snap-{n}'), stage_name=n, store=store)
+            for n in ('A', 'B')
+        )
+
+    def _closed_bill(self, snapshot=None):
+        bill = Bill.objects.create(table=self.table)
+        Bill.objects.filter(pk=bill.pk).update(closed_at=timezone.now())
+        bill.refresh_from_db()
+        if snapshot is not None:
+            bill.payroll_snapshot = snapshot
+            bill.save(update_fields=['payroll_snapshot'])
+        return bill
+
+    def test_rows_follow_snapshot(self):
+        bill = self._closed_bill(_snapshot((self.a.id, 3000, 500, 1000), (self.b.id, 2000, 0, 0)))
+        rows = {r.cast_id: r for r in BillPayrollSnapshotCast.objects.filter(bill=bill)}
+        self.assertEqual((rows[self.a.id].amount, rows[self.a.id].substitute_deduction, rows[self.a.id].nomination),
+                         (3000, 500, 1000))
+        self.assertEqual(rows[self.b.id].amount, 2000)
+
+        # 再生成で置き換わる
+        bill.payroll_snapshot = _snapshot((self.a.id, 1000, 0, 0))
+        bill.save(update_fields=['payroll_snapshot'])
+        self.assertEqual(
+            list(BillPayrollSnapshotCast.objects.filter(bill=bill).values_list('cast_id', 'amount')),
+            [(self.a.id, 1000)],
+        )
+
+    def test_period_sums(self):
+        self._closed_bill(_snapshot((self.a.id, 3000, 500, 0)))
+        self._closed_bill(_snapshot((self.a.id, 1000, 200, 0), (self.b.id, 4000, 0, 0)))
+        no_snapshot = self._closed_bill()
+        bills = Bill.objects.filter(table=self.table)
+
+        self.assertEqual(snapshot_commission_total(bills), 8000)
+        self.assertEqual(substitute_deduction_by_cast(bills), {self.a.id: 700})
+        self.assertEqual(list(snapshot_missing(bills)), [no_snapshot])
+
+    def test_deleted_cast_keeps_amount(self):
+        bill = self._closed_bill(_snapshot((self.a.id, 3000, 0, 0), (999999, 500, 0, 0)))
+        self.assertEqual(snapshot_commission_total(Bill.objects.filter(pk=bill.pk)), 3500)
+        self.assertTrue(BillPayrollSnapshotCast.objects.filter(bill=bill, cast__isnull=True, amount=500).exists())
@@ -24,7 +24,7 @@ from .views import (
 )
 
 from .api.pl_views import DailyPLAPIView, MonthlyPLAPIView, YearlyPLAPIView
-from .kds_views import KDSTicketList, KDSTicketAck, KDSTicketReady, KDSReadyList, KDSTakeTicket, KDSTicketLongPoll, KDSReadyLongPoll, StaffList, KDSTakenTodayList
+from .kds_views import KDSTicketList, KDSTicketAck, KDSTicketReady, KDSReadyList, KDSTakeTicket, KDSTicketLongPoll, KDSReadyLongPoll, StaffList, KDSTakenTodayList, kds_stream
 from .api_kds import order_events
 
 router = DefaultRouter()
@@ -56,6 +56,8 @@ urlpatterns = [
     # Bill 配下のネスト（drf-nestedなしで明示）
     path("bills/<int:bill_pk>/items/",
          BillItemViewSet.as_view({"get": "list", "post": "create"}), name="billitem-list"),
+    path("bills/<int:bill_pk>/items/bulk/",
+         BillItemViewSet.as_view({"post": "bulk_create"}), name="billitem-bulk"),
     path("bills/<int:bill_pk>/items/<int:pk>/",
          BillItemViewSet.as_view({"get": "retrieve", "put": "update",
                                   "patch": "partial_update", "delete": "destroy"}),
@@ -116,6 +118,7 @@ urlpatterns = [
     path('kds/take/',       KDSTakeTicket.as_view(), name='kds_take'),
     path('kds/longpoll-tickets/', KDSTicketLongPoll.as_view(), name='kds_longpoll_tickets'),
     path('kds/longpoll-ready/',   KDSReadyLongPoll.as_view(),  name='kds_longpoll_ready'),
+    path('kds/stream/',           kds_stream,                  name='kds_stream'),
     path('kds/staffs/', StaffList.as_view(), name='kds_staff_list'),
     path('kds/taken-today/', KDSTakenTodayList.as_view(), name='kds_taken_today'),
     path('order-events/', order_events, name='order-events'),
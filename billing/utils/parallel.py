@@ -0,0 +1,44 @@
+# billing/utils/parallel.py
+"""
+管理コマンドのチャンク処理をプロセスプールへ配る共通部品
+- 結果はチャンクの順に返す（imap）。呼び出し側は「ここまで全部コミット済み」を連続した範囲として扱える
+- fork 元の DB 接続は共有しない（親で閉じてからプールを作り、各ワーカーが自分の接続を張る）
+- SQLite は書き込みが直列なので常に1プロセス
+"""
+import multiprocessing
+
+from django.db import connection, connections
+
+
+def parallel_workers(requested: int, n_chunks: int) -> int:
+    """実際に使うワーカー数（チャンク数以下・SQLite は 1）"""
+    workers = max(1, min(requested, n_chunks))
+    if workers > 1 and connection.vendor == 'sqlite':
+        return 1
+    return workers
+
+
+def _init_worker():
+    connections.close_all()
+
+
+def _call(job):
+    func, args = job
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def map_chunks(func, jobs, workers: int):
+    """
+    func(*args) を jobs の順に実行して結果を返すジェネレータ。
+    workers > 1 なら fork したプロセスプールで実行する（func はモジュール直下の関数であること）。
+    """
+    if workers <= 1:
+        for args in jobs:
+            yield func(*args)
+        return
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker) as pool:
+        yield from pool.imap(_call, [(func, args) for args in jobs])
@@ -2,58 +2,62 @@
 from __future__ import annotations
 from datetime import date
 from decimal import Decimal
-from django.db.models import F, Sum, Value, IntegerField, Q, CharField 
+from django.db.models import F, Sum, Value, IntegerField, Q, CharField, OuterRef, Subquery, Count
 from django.db.models.functions import Coalesce
-from billing.models  import Bill, BillItem, PersonnelExpense
+from billing.models  import Bill, BillItem, PersonnelExpense, PersonnelExpenseSettlementEvent
 from billing.utils.services import cast_payroll_sum_by_business_date
-from billing.calculator import BillCalculator
+from billing.services.snapshot_casts import snapshot_commission_total, snapshot_missing
+from billing.calculator import BillCalculator, BatchBillCalculator
 from billing.utils.bizday import get_business_window
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
-__all__ = ["get_daily_pl"]
+__all__ = ["get_daily_pl", "empty_daily_pl"]
 
 # 大カテゴリの定義（backward compatibility のため残す）
 DRINK_CATEGORY_CODES = set(getattr(settings, "PL_DRINK_CATEGORY_CODES", {"cast-drink"}))
 DRINK_ITEM_PREFIXES  = set(getattr(settings, "PL_DRINK_ITEM_PREFIXES",  set()))
 
+# group_sales に出す major_group
+MAJOR_GROUPS = ('drink', 'champagne', 'food', 'other', 'set', 'extension', 'other_fee')
+
 def _calc_open_bill_total(bill: Bill) -> int:
     return BillCalculator(bill).execute().total
 
 
-def _calculate_commission_from_snapshot(bills) -> int:
+def _calculate_commission_from_snapshot(bills, missing_count=None) -> int:
     """
     ★ Phase A: payroll_snapshot ベースで歩合を集計
     
-    スナップショットから by_cast[].amount を合算。
-    フォールバック：snapshot が無い Bill は BillCalculator で一時計算（DB 保存なし）。
+    スナップショットの by_cast[].amount は BillPayrollSnapshotCast の SUM で出す（JSON は読まない）。
+    フォールバック：snapshot が無い Bill は BatchBillCalculator で一括の一時計算（DB 保存なし）。
+    missing_count: snapshot の無い伝票数が分かっていれば渡す（0 なら一覧を引かない）
     """
-    total = 0
-    
-    for bill in bills:
-        if bill.payroll_snapshot and isinstance(bill.payroll_snapshot, dict):
-            # snapshot の by_cast 配列から amount を合算
-            by_cast = bill.payroll_snapshot.get('by_cast', [])
-            bill_commission = sum(int(c.get('amount', 0)) for c in by_cast)
-            total += bill_commission
-            logger.debug(f"[PL] Bill {bill.id}: commission from snapshot = {bill_commission}")
-        else:
-            # フォールバック：snapshot がない Bill は BillCalculator で一時計算
-            try:
-                result = BillCalculator(bill).execute()
-                payouts = result.cast_payouts
-                bill_commission = sum(p.amount for p in payouts)
-                total += bill_commission
-                logger.warning(
-                    f"[PL] Bill {bill.id}: snapshot missing, calculated commission = {bill_commission} "
-                    f"(will NOT save payout)"
-                )
-            except Exception as e:
-                logger.exception(f"[PL] Bill {bill.id}: failed to calculate commission: {e}")
-                bill_commission = 0
-                total += bill_commission
+    total = snapshot_commission_total(bills)
+
+    if missing_count == 0:
+        return int(total)
+    missing = list(snapshot_missing(bills))
+    if not missing:
+        return int(total)
+
+    # フォールバック：snapshot がない Bill をまとめて一時計算
+    try:
+        results = BatchBillCalculator(missing).execute()
+    except Exception as e:
+        logger.exception(f"[PL] failed to calculate commission for {len(missing)} bills: {e}")
+        return int(total)
+
+    for bill in missing:
+        result = results.get(bill.id)
+        bill_commission = sum(p.amount for p in result.cast_payouts) if result else 0
+        total += bill_commission
+        logger.warning(
+            f"[PL] Bill {bill.id}: snapshot missing, calculated commission = {bill_commission} "
+            f"(will NOT save payout)"
+        )
     
     return int(total)
 
@@ -79,32 +83,38 @@ def get_daily_pl(target_date: date, *, store_id: int, include_breakdown: bool =
         Bill.objects
         .filter(closed_at__gte=start_dt, closed_at__lt=end_dt, table__store_id=store_id)
         .select_related("table__store")
-        .prefetch_related("items")
     )
 
-    subtotal_sum = (
+    # ─────────────── 伝票合計（売上・現金・カード）を1クエリで ───────────────────
+    # ★ 会計上は settled_total 優先、無ければ grand_total
+    bill_sums = bills.aggregate(
+        sales_total=Coalesce(Sum(Coalesce(F("settled_total"), F("grand_total"), Value(0), output_field=IntegerField())), 0),
+        sales_cash=Coalesce(Sum("paid_cash"), 0),
+        sales_card=Coalesce(Sum("paid_card"), 0),
+        snapshot_missing=Count("id", filter=Q(payroll_snapshot__isnull=True) | Q(payroll_snapshot={})),
+    )
+    sales_total = bill_sums["sales_total"] or 0
+
+    # ─────────────── major_group ベース集計（GROUP BY 1クエリ） ───────────────────
+    group_sales = {g: {'sales': 0, 'qty': 0} for g in MAJOR_GROUPS}
+    subtotal_sum = 0
+    grouped = (
         BillItem.objects
         .filter(bill__in=bills)
-        .aggregate(s=Coalesce(Sum(F("price") * F("qty")), 0))
-    )["s"] or 0
-
-    # ★ 会計上は settled_total 優先、無ければ grand_total
-    sales_total = bills.aggregate(
-        s=Coalesce(Sum(Coalesce(F("settled_total"), F("grand_total"), Value(0), output_field=IntegerField())), 0)
-    )["s"] or 0
-
-    items = BillItem.objects.filter(bill__in=bills).select_related("item_master__category")
-
-    # ─────────────── major_group ベース集計 ───────────────────
-    group_sales = {}
-    for major_group in ['drink', 'champagne', 'food', 'other', 'set', 'extension', 'other_fee']:
-        group_items = items.filter(item_master__category__major_group=major_group)
-        sales = group_items.aggregate(s=Coalesce(Sum(F("price") * F("qty")), 0))["s"] or 0
-        qty = group_items.aggregate(c=Coalesce(Sum("qty"), 0))["c"] or 0
-        group_sales[major_group] = {
-            'sales': int(sales),
-            'qty': int(qty),
-        }
+        .values(major_group=F("item_master__category__major_group"))
+        .order_by()
+        .annotate(
+            sales=Coalesce(Sum(F("price") * F("qty")), 0),
+            qty=Coalesce(Sum("qty"), 0),
+        )
+    )
+    for row in grouped:
+        subtotal_sum += int(row["sales"] or 0)
+        if row["major_group"] in group_sales:
+            group_sales[row["major_group"]] = {
+                'sales': int(row["sales"] or 0),
+                'qty': int(row["qty"] or 0),
+            }
 
     # ─────────────── 主要KPI ───────────────────
     # guest_count = set グループの qty 合計
@@ -134,16 +144,12 @@ def get_daily_pl(target_date: date, *, store_id: int, include_breakdown: bool =
     )
 
     # ─────────────── 人件費・利益 ───────────────────
-    paid_sums = bills.aggregate(
-        sales_cash=Coalesce(Sum("paid_cash"), 0),
-        sales_card=Coalesce(Sum("paid_card"), 0),
-    )
-    sales_cash = int(paid_sums["sales_cash"] or 0)
-    sales_card = int(paid_sums["sales_card"] or 0)
+    sales_cash = int(bill_sums["sales_cash"] or 0)
+    sales_card = int(bill_sums["sales_card"] or 0)
 
     # ★ Phase A: 歩合を payroll_snapshot ベースで集計
     # （CastPayout 生成失敗の影響を遮断。現場の数字は snapshot/都度計算が正とする）
-    commission = _calculate_commission_from_snapshot(bills)
+    commission = _calculate_commission_from_snapshot(bills, missing_count=bill_sums["snapshot_missing"])
     
     # 時給=CastDailySummary（business date）
     hourly_pay = int(cast_payroll_sum_by_business_date(target_date, target_date, store_id) or 0)
@@ -159,16 +165,22 @@ def get_daily_pl(target_date: date, *, store_id: int, include_breakdown: bool =
         occurred_at__lt=end_dt,
     )
     
-    personnel_expenses_collect_created = int(
-        collect_expenses.aggregate(
-            s=Coalesce(Sum('amount'), Value(0), output_field=IntegerField())
-        )['s'] or 0
+    # 回収額は経費ごとのサブクエリにして、経費額と同じ1クエリで合算（JOIN で金額が重複しないように）
+    settled_per_expense = (
+        PersonnelExpenseSettlementEvent.objects
+        .filter(expense=OuterRef("pk"))
+        .values("expense")
+        .annotate(s=Sum("amount"))
+        .values("s")
     )
-    personnel_expenses_collect_settled = int(
-        collect_expenses.aggregate(
-            s=Coalesce(Sum('settlement_events__amount'), Value(0), output_field=IntegerField())
-        )['s'] or 0
+    expense_sums = collect_expenses.annotate(
+        settled_sum=Coalesce(Subquery(settled_per_expense), Value(0), output_field=IntegerField())
+    ).aggregate(
+        created=Coalesce(Sum('amount'), Value(0), output_field=IntegerField()),
+        settled=Coalesce(Sum('settled_sum'), Value(0), output_field=IntegerField()),
     )
+    personnel_expenses_collect_created = int(expense_sums['created'] or 0)
+    personnel_expenses_collect_settled = int(expense_sums['settled'] or 0)
     personnel_expenses_collect_outstanding = int(
         personnel_expenses_collect_created - personnel_expenses_collect_settled
     )
@@ -215,3 +227,26 @@ def get_daily_pl(target_date: date, *, store_id: int, include_breakdown: bool =
         }
 
     return result
+
+
+# get_daily_pl が返す数値キー（group_sales 以外）
+DAILY_PL_NUMERIC_KEYS = (
+    "guest_count", "subtotal", "sales_total", "sales_cash", "sales_card", "avg_spend",
+    "drink_sales", "drink_qty", "drink_unit_price",
+    "champagne_sales", "champagne_qty",
+    "extension_sales", "extension_qty",
+    "other_sales",
+    "commission", "hourly_pay", "labor_cost", "operating_profit",
+    "personnel_expenses_collect_created",
+    "personnel_expenses_collect_settled",
+    "personnel_expenses_collect_outstanding",
+)
+
+
+def empty_daily_pl(target_date: date, *, store_id: int) -> dict:
+    """未来日など、集計対象が存在しない日の get_daily_pl 相当（クエリなし）"""
+    return {
+        "date": target_date.isoformat(),
+        "store_id": store_id,
+        **dict.fromkeys(DAILY_PL_NUMERIC_KEYS, 0),
+    }
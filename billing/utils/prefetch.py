@@ -0,0 +1,13 @@
+# billing/utils/prefetch.py
+"""
+prefetch_related 済みの関連を読むための共通部品
+- 計算器・給与エンジン・本指名タイムラインが「prefetch 済みなら使い、無ければ自分で引く」を同じ形で書く
+"""
+
+
+def prefetched_list(obj, name):
+    """prefetch_related 済みならそのリストを返す（未取得なら None）。"""
+    cache = getattr(obj, "_prefetched_objects_cache", None) or {}
+    if name in cache:
+        return list(cache[name])
+    return None
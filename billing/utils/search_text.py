@@ -0,0 +1,49 @@
+# billing/utils/search_text.py
+"""
+検索用の文字列正規化
+- NFKC で全角英数・半角カナを畳む（ｶﾀｶﾅ → カタカナ、ＡＢＣ → ABC）
+- カタカナ → ひらがな、英字は小文字、空白・記号の区切りは詰める
+- 電話番号は数字だけにする（090-1234-5678 → 09012345678）
+- 電話番号らしい入力か（数字と区切り記号だけ・数字が一定桁以上）の判定
+"""
+import re
+import unicodedata
+
+_KATAKANA = ''.join(chr(c) for c in range(ord('ァ'), ord('ヶ') + 1))
+_HIRAGANA = ''.join(chr(c) for c in range(ord('ぁ'), ord('ゖ') + 1))
+_KANA_FOLD = str.maketrans(_KATAKANA, _HIRAGANA)
+_SPACES = re.compile(r'\s+')
+_NON_DIGITS = re.compile(r'\D+')
+_PHONE_LIKE = re.compile(r'[\d\s+\-()]+')
+PHONE_MIN_DIGITS = 4
+
+
+def normalize_search_text(value) -> str:
+    """表記ゆれを畳んだ検索キー（空白は除去）"""
+    if not value:
+        return ''
+    text = unicodedata.normalize('NFKC', str(value)).lower().translate(_KANA_FOLD)
+    return _SPACES.sub('', text)
+
+
+def phone_digits(value) -> str:
+    """電話番号の数字だけ（NFKC 後なので全角数字も拾う）"""
+    if not value:
+        return ''
+    return _NON_DIGITS.sub('', unicodedata.normalize('NFKC', str(value)))
+
+
+def looks_like_phone(value, min_digits=PHONE_MIN_DIGITS) -> bool:
+    """
+    数字・空白・+ - ( ) だけで、数字が min_digits 桁以上か（A-12 のような棚番号は外す）。
+    min_digits=1 なら「数字だけの短い入力」も電話番号の一部として扱う。
+    """
+    if not value:
+        return False
+    text = unicodedata.normalize('NFKC', str(value)).strip()
+    return bool(_PHONE_LIKE.fullmatch(text)) and len(phone_digits(text)) >= min_digits
+
+
+def customer_search_text(full_name='', alias='', bottle_shelf='') -> str:
+    """Customer.search_text の値（項目をまたいで一致しないよう区切り文字で連結）"""
+    return '|'.join(normalize_search_text(v) for v in (full_name, alias, bottle_shelf))
@@ -0,0 +1,33 @@
+# billing/utils/streaming.py
+"""
+同期ジェネレータを断片ごとに流す StreamingHttpResponse
+- WSGI: そのまま渡す
+- ASGI: Django は同期イテレータを sync_to_async(list) で読み切ってから送るので、
+  1断片ずつ sync_to_async(next) で取り出す非同期イテレータに包む
+  （thread_sensitive なので view と同じスレッド・同じ DB 接続で読む）
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+_DONE = object()
+
+
+async def aiter_sync(iterator):
+    """同期イテレータ → 非同期イテレータ（次の断片が要求されるまで読まない）"""
+    it = iter(iterator)
+    step = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (chunk := await step(it, _DONE)) is not _DONE:
+            yield chunk
+    finally:
+        close = getattr(it, "close", None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def streaming_response(request, iterator, **kwargs) -> StreamingHttpResponse:
+    """request が ASGI なら非同期イテレータで、WSGI なら同期イテレータのまま流す"""
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        iterator = aiter_sync(iterator)
+    return StreamingHttpResponse(iterator, **kwargs)
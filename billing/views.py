@@ -53,6 +53,11 @@ from .serializers import (
 )
 from .filters import CastPayoutFilter, CastItemFilter
 from .services import get_cast_sales, sync_nomination_fees
+from .services.affinity import affinity_rows
+from .services.customer_search import search_customers
+from .services.goal_progress import evaluate_goals
+from .services.customer_stats import stats_summary
+from .services.bulk_items import add_bill_items
 from billing.utils.customer_log import log_customer_change
 
 from rest_framework.decorators import action
@@ -85,33 +90,12 @@ from .exports.payroll_run_csv import PayrollRunExportCSVView
 #   ※ superuser でも “全店舗” は返さない（所属/関係のある店舗のみ）
 # ────────────────────────────────────────────────────────────────────
 def user_store_ids(user):
-    if not getattr(user, "is_authenticated", False):
-        return set()
-
-    # リクエストスコープキャッシュ（userオブジェクトに属性付与、リクエスト終了で消える）
-    cache_attr = "_cached_store_ids"
-    if hasattr(user, cache_attr):
-        return getattr(user, cache_attr)
-
-    ids = set()
-
-    # 1) StoreMembership を一次情報に
-    from accounts.models import StoreMembership
-    ids.update(StoreMembership.objects.filter(user=user).values_list("store_id", flat=True))
-
-    # 2) 既存の互換（必要なら残す）
-    from .models import Staff, Cast
-    ids.update(Cast.objects.filter(user=user).values_list("store_id", flat=True))
-    for st in Staff.objects.filter(user=user).prefetch_related("stores"):
-        ids.update(st.stores.values_list("id", flat=True))
-
-    # 3) 旧フィールド互換
-    sid = getattr(user, "store_id", None)
-    if sid:
-        ids.add(sid)
-
-    setattr(user, cache_attr, ids)
-    return ids
+    """
+    所属店舗ID（StoreMembership + Cast + Staff + 旧 User.store）。
+    リクエスト内・リクエスト間とも accounts.access でキャッシュされる。
+    """
+    from accounts.access import get_user_access
+    return set(get_user_access(user).store_ids)
 
 
 def _can_edit_cast_goals(user, cast):
@@ -272,8 +256,19 @@ class BillViewSet(viewsets.ModelViewSet):
         sid = self._sid()
         qs = bills_in_store_qs(sid)
         
-        # 既存フィルタを保持
-        qs = qs.select_related("table__store").prefetch_related("items", "stays", "nominated_casts").order_by("-opened_at")
+        # 既存フィルタを保持（一覧では BatchBillCalculator 用の伝票グラフをまとめて prefetch）
+        if self.action == "list":
+            from django.db.models import Prefetch
+            from .calculator import BatchBillCalculator
+            # ネストした CustomerSerializer の tags / stats / last_cast も顧客数に依らず読む
+            customers = Customer.objects.select_related("last_cast").prefetch_related("tags", "stats")
+            qs = (
+                BatchBillCalculator.prefetch(qs)
+                .prefetch_related(Prefetch("customers", queryset=customers))
+                .order_by("-opened_at")
+            )
+        else:
+            qs = qs.select_related("table__store").prefetch_related("items", "stays", "nominated_casts").order_by("-opened_at")
 
         # ▼ ここで「?cast=◯◯」を stays 経由で絞る（＝担当キャストのみ）
         cast_id = self.request.query_params.get("cast")
@@ -282,6 +277,67 @@ class BillViewSet(viewsets.ModelViewSet):
 
         return qs
 
+    def list(self, request, *args, **kwargs):
+        """
+        一覧：未クローズ伝票の金額を BatchBillCalculator で一括計算し、
+        BillSerializer._calc のキャッシュに載せてから返す。
+        """
+        from .calculator import BatchBillCalculator
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        bills = list(page if page is not None else queryset)
+
+        open_bills = [b for b in bills if b.closed_at is None]
+        results = BatchBillCalculator(open_bills).execute()
+        for b in open_bills:
+            b._calc_cache = results.get(b.id)
+
+        serializer = self.get_serializer(bills, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=["get"], url_path="board")
+    def board(self, request):
+        """
+        フロアボード用：未クローズ伝票のフラットな一覧（ページングなし）
+
+        GET /api/billing/bills/board/?fields=id,table_label,status,grand_total
+
+        - 伝票数によらず固定クエリ数（伝票＋卓/main_cast、卓M2M、要求された列に必要な prefetch だけ）
+        - grand_total を要求したときだけ BatchBillCalculator で一括計算する
+        - fields 省略時は全列（BillBoardSerializer.Meta.fields）
+        """
+        from django.db.models import Prefetch
+        from .calculator import BatchBillCalculator
+        from .models import BillCustomer
+        from .querysets import bills_in_store_qs
+        from .serializers import BillBoardSerializer
+
+        fields = BillBoardSerializer.parse_fields(request.query_params.get("fields"))
+        qs = (
+            bills_in_store_qs(self._sid())
+            .filter(closed_at__isnull=True)
+            .select_related("table", "main_cast")
+            .order_by("opened_at")
+        )
+        if "grand_total" in fields:
+            qs = BatchBillCalculator.prefetch(qs)
+        elif "customer_display_name" in fields:
+            qs = qs.prefetch_related(
+                Prefetch("billcustomer_set", queryset=BillCustomer.objects.select_related("customer"))
+            )
+        bills = list(qs)
+
+        if "grand_total" in fields:
+            results = BatchBillCalculator(bills).execute()
+            for b in bills:
+                b._calc_cache = results.get(b.id)
+
+        context = {**self.get_serializer_context(), "now": timezone.now()}
+        return Response(BillBoardSerializer(bills, many=True, fields=fields, context=context).data)
+
     def _validate_table_ids_in_store(self, sid, ids):
         ids = [int(x) for x in (ids or []) if x is not None]
         if not ids:
@@ -394,6 +450,17 @@ class BillViewSet(viewsets.ModelViewSet):
             )
         return Response({"ok": True}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=["post"], url_path="payroll-verify")
+    def payroll_verify(self, request, pk=None):
+        """
+        給与スナップショットの dirty をハッシュ再計算で確認する（重いので都度呼び出し）。
+        結果に合わせて payroll_dirty_at を立てる／外す。
+        """
+        from billing.payroll.snapshot import verify_payroll_dirty
+
+        bill = self.get_object()
+        return Response(verify_payroll_dirty(bill), status=status.HTTP_200_OK)
+
     @action(detail=True, methods=["get"], url_path="nomination-summaries")
     def nomination_summaries(self, request, pk=None):
         """
@@ -689,6 +756,38 @@ class BillItemViewSet(viewsets.ModelViewSet):
 
         serializer.save(bill=bill, **extra)
 
+    def bulk_create(self, request, bill_pk=None):
+        """
+        POST /bills/<id>/items/bulk/
+        明細 N 行をまとめて追加（KDS チケット・退店予定・金額再計算は1回ずつ）。
+        body は明細の配列（または {"items": [...]}）。1行でも不正なら何も作らない。
+        """
+        sid = StoreScopedModelViewSet.require_store(self, request)
+        bill = get_object_or_404(Bill.objects.select_related("table__store"), pk=bill_pk)
+        if bill.table.store_id != sid:
+            raise PermissionDenied("他店舗の伝票です。")
+        self._require_manage_if_closed(bill)
+        self.check_object_permissions(request, bill)
+
+        rows = request.data.get("items") if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list) or not rows:
+            raise ValidationError({"items": "明細の配列を指定してください。"})
+
+        serializer = self.get_serializer(data=rows, many=True)
+        serializer.is_valid(raise_exception=True)
+
+        # served_by_cast の自動補完（perform_create と同じ）
+        user = request.user
+        cast = Cast.objects.filter(user=user).first()
+        if cast and not Staff.objects.filter(user=user).exists():
+            for row in serializer.validated_data:
+                if not row.get("served_by_cast"):
+                    row["served_by_cast"] = cast
+
+        items = add_bill_items(bill, serializer.validated_data)
+        items = self.get_queryset().filter(pk__in=[i.pk for i in items]).prefetch_related("served_by_casts")
+        return Response(self.get_serializer(items, many=True).data, status=status.HTTP_201_CREATED)
+
     def perform_update(self, serializer):
         instance = serializer.instance
         self._require_manage_if_closed(instance.bill)
@@ -828,7 +927,9 @@ class CastViewSet(StoreScopedModelViewSet):
             active = request.query_params.get('active')
             if active in ('0','1','true','false','True','False'):
                 qs = qs.filter(active=active in ('1','true','True'))
-            ser = CastGoalSerializer(qs, many=True)
+            # 進捗は目標ごとではなく指標ごとの集計1回でまとめて出す
+            goals = list(qs)
+            ser = CastGoalSerializer(goals, many=True, context={'progress': evaluate_goals(goals)})
             return Response(ser.data)
 
         # POST
@@ -1211,7 +1312,7 @@ class BillStayViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
 # ────────────────────────────────────────────────────────────────────
 class CustomerViewSet(viewsets.ModelViewSet):
     """
-    /api/customers/?q= 検索（氏名・あだ名・電話・棚番号）
+    /api/customers/?q= 検索（氏名・あだ名・電話・棚番号。かな・半角全角ゆれを吸収し類似度順）
     /api/customers/?has_bottle=true マイボトル有り顧客のみ
     /api/customers/?bottle_shelf=A-12 特定の棚番号で検索
     ※ 現状グローバル。将来は store FK 追加を検討。
@@ -1221,7 +1322,8 @@ class CustomerViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        qs = super().get_queryset()
+        # 一覧の tag_names / last_visit_at / visit_stats を顧客ごとのクエリにしない
+        qs = super().get_queryset().select_related('last_cast').prefetch_related('tags', 'stats')
         
         # display_name がない（full_name と alias の両方が空）顧客を除外
         # ただし、一覧表示（list）と相性チェック（match）の時のみ
@@ -1229,14 +1331,10 @@ class CustomerViewSet(viewsets.ModelViewSet):
         if self.action in ['list', 'match_ranking']:
             qs = qs.exclude(Q(full_name='') & Q(alias=''))
         
+        # 正規化カラム＋pg_trgm で検索し、類似度順（similarity を注釈）に並べる
         q = self.request.query_params.get("q")
         if q:
-            qs = qs.filter(
-                Q(full_name__icontains=q) |
-                Q(alias__icontains=q) |
-                Q(phone__icontains=q) |
-                Q(bottle_shelf__icontains=q)
-            )
+            qs = search_customers(qs, q)
         
         # タグフィルタ（tag_code=vip&tag_code=regular のような複数指定対応）
         tag_codes = self.request.query_params.getlist("tag_code")
@@ -1282,6 +1380,7 @@ class CustomerViewSet(viewsets.ModelViewSet):
         GET /api/billing/customers/match/?cast_id=<id>&sort=spent_30d&min_spent_30d=10000&limit=20
         
         Phase1: BillItem.served_by_cast が付いた明細のみを「そのキャストの売上」とみなす
+        集計は締め済み伝票の CustomerCastAffinity（差分更新）を読む。30日は opened_at の日付単位。
         """
         cast_id = request.query_params.get('cast_id')
         if not cast_id:
@@ -1297,108 +1396,52 @@ class CustomerViewSet(viewsets.ModelViewSet):
         if not store:
             return Response({'error': 'Store not found'}, status=400)
         
-        # 顧客×キャスト相性集計
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        
-        # BillItem 起点で Customer ごとに集計
+        # 顧客×キャスト相性（CustomerCastAffinity の集計済み行を読むだけ）
         # 名前なし顧客を除外（full_name と alias の両方が空の顧客）
-        customers_with_stats = Customer.objects.filter(
-            bills__table__store=store,
-            bills__items__served_by_cast_id=cast_id
-        ).exclude(
-            Q(full_name='') & Q(alias='')
-        ).annotate(
-            # 通算売上（served_by_cast 付き明細の price * qty 合計）
-            spent_with_cast_total=Coalesce(
-                Sum(
-                    F('bills__items__price') * F('bills__items__qty'),
-                    filter=Q(bills__items__served_by_cast_id=cast_id) & Q(bills__table__store=store)
-                ),
-                0
-            ),
-            
-            # 直近30日売上
-            spent_with_cast_30d=Coalesce(
-                Sum(
-                    F('bills__items__price') * F('bills__items__qty'),
-                    filter=Q(bills__items__served_by_cast_id=cast_id) & 
-                           Q(bills__table__store=store) & 
-                           Q(bills__opened_at__gte=thirty_days_ago)
-                ),
-                0
-            ),
-            
-            # served_by_cast 付き明細件数
-            served_item_count=Count('bills__items', 
-                                   filter=Q(bills__items__served_by_cast_id=cast_id) & Q(bills__table__store=store)),
-            
-            # served_by_cast 付き明細が含まれる伝票数（distinct bill）
-            served_bill_count=Count('bills', 
-                                   filter=Q(bills__items__served_by_cast_id=cast_id) & Q(bills__table__store=store),
-                                   distinct=True),
-            
-            # 最後に served_by_cast が発生した日時（opened_at 基準）
-            last_served_at=Max('bills__opened_at', 
-                              filter=Q(bills__items__served_by_cast_id=cast_id) & Q(bills__table__store=store)),
-            
-            # Customer全体 stats（参考）
-            visit_count=Count('bills', filter=Q(bills__table__store=store), distinct=True),
-            total_spent=Coalesce(Sum('bills__grand_total', filter=Q(bills__table__store=store)), 0),
-            last_visit_at=Max('bills__opened_at', filter=Q(bills__table__store=store))
-        ).distinct()
+        rows = (
+            affinity_rows(store.id, days=30)
+            .filter(cast_id=cast_id)
+            .exclude(Q(customer__full_name='') & Q(customer__alias=''))
+            .select_related('customer__last_cast')
+            .prefetch_related('customer__tags', 'customer__stats')
+        )
         
         # フィルタ適用
         min_spent_30d = request.query_params.get('min_spent_30d')
         if min_spent_30d:
-            customers_with_stats = customers_with_stats.filter(spent_with_cast_30d__gte=int(min_spent_30d))
+            rows = rows.filter(spent_recent__gte=int(min_spent_30d))
         
         min_spent_total = request.query_params.get('min_spent_total')
         if min_spent_total:
-            customers_with_stats = customers_with_stats.filter(spent_with_cast_total__gte=int(min_spent_total))
+            rows = rows.filter(spent_total__gte=int(min_spent_total))
         
         min_served_bill_count = request.query_params.get('min_served_bill_count')
         if min_served_bill_count:
-            customers_with_stats = customers_with_stats.filter(served_bill_count__gte=int(min_served_bill_count))
+            rows = rows.filter(bill_count__gte=int(min_served_bill_count))
         
         # ソート
         sort_param = request.query_params.get('sort', 'spent_30d')
         sort_map = {
-            'spent_30d': '-spent_with_cast_30d',
-            'spent_total': '-spent_with_cast_total',
+            'spent_30d': '-spent_recent',
+            'spent_total': '-spent_total',
             'last_served': '-last_served_at',
-            'served_bill_count': '-served_bill_count',
+            'served_bill_count': '-bill_count',
         }
-        order_by = sort_map.get(sort_param, '-spent_with_cast_30d')
-        customers_with_stats = customers_with_stats.order_by(order_by)
+        order_by = sort_map.get(sort_param, '-spent_recent')
+        rows = rows.order_by(order_by, 'customer_id')
         
         # リミット
         limit = int(request.query_params.get('limit', 20))
         limit = min(limit, 100)  # 上限100
-        customers_with_stats = customers_with_stats[:limit]
+        rows = list(rows[:limit])
         
-        # レスポンス構築
+        # レスポンス構築（Customer全体 stats は CustomerStats）
         results = []
-        for customer in customers_with_stats:
-            spent_total = int(customer.spent_with_cast_total or 0)
-            spent_30d = int(customer.spent_with_cast_30d or 0)
-            bill_count = int(customer.served_bill_count or 0)
-            
+        for row in rows:
             results.append({
-                'customer': CustomerSerializer(customer).data,
-                'stats': {
-                    'visit_count': int(customer.visit_count or 0),
-                    'total_spent': int(customer.total_spent or 0),
-                    'last_visit_at': customer.last_visit_at,
-                },
-                'affinity': {
-                    'cast_id': int(cast_id),
-                    'spent_with_cast_total': spent_total,
-                    'spent_with_cast_30d': spent_30d,
-                    'served_item_count': int(customer.served_item_count or 0),
-                    'served_bill_count': bill_count,
-                    'last_served_at': customer.last_served_at,
-                    'avg_spent_per_bill_with_cast': int(spent_total / bill_count) if bill_count > 0 else 0,
-                }
+                'customer': CustomerSerializer(row.customer, context={'request': request}).data,
+                'stats': _visit_stats_payload(row.customer, store.id),
+                'affinity': _affinity_payload(cast_id, row),
             })
         
         return Response({
@@ -1429,54 +1472,37 @@ class CustomerViewSet(viewsets.ModelViewSet):
         if not store:
             return Response({'error': 'Store not found'}, status=400)
         
-        # 顧客×キャスト相性集計
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        
-        # BillItem から集計
-        items = BillItem.objects.filter(
-            bill__customers=customer,
-            bill__table__store=store,
-            served_by_cast_id=cast_id
-        )
-        
-        spent_with_cast_total = sum((item.price or 0) * item.qty for item in items)
-        
-        items_30d = items.filter(bill__opened_at__gte=thirty_days_ago)
-        spent_with_cast_30d = sum((item.price or 0) * item.qty for item in items_30d)
-        
-        served_item_count = items.count()
-        served_bill_count = items.values('bill').distinct().count()
-        
-        last_served_bill = items.order_by('-bill__opened_at').first()
-        last_served_at = last_served_bill.bill.opened_at if last_served_bill else None
-        
-        # Customer全体 stats
-        customer_bills = Bill.objects.filter(customers=customer, table__store=store)
-        visit_count = customer_bills.count()
-        total_spent = customer_bills.aggregate(total=Sum('grand_total'))['total'] or 0
-        last_visit = customer_bills.order_by('-opened_at').first()
-        last_visit_at = last_visit.opened_at if last_visit else None
+        row = affinity_rows(store.id, days=30).filter(customer=customer, cast_id=cast_id).first()
         
         return Response({
-            'customer': CustomerSerializer(customer).data,
+            'customer': CustomerSerializer(customer, context={'request': request}).data,
             'cast': CastSerializer(cast).data,
-            'stats': {
-                'visit_count': int(visit_count),
-                'total_spent': int(total_spent),
-                'last_visit_at': last_visit_at,
-            },
-            'affinity': {
-                'cast_id': int(cast_id),
-                'spent_with_cast_total': int(spent_with_cast_total),
-                'spent_with_cast_30d': int(spent_with_cast_30d),
-                'served_item_count': int(served_item_count),
-                'served_bill_count': int(served_bill_count),
-                'last_served_at': last_served_at,
-                'avg_spent_per_bill_with_cast': int(spent_with_cast_total / served_bill_count) if served_bill_count > 0 else 0,
-            }
+            'stats': _visit_stats_payload(customer, store.id),
+            'affinity': _affinity_payload(cast_id, row),
         })
 
 
+def _visit_stats_payload(customer, store_id):
+    """店舗の来店実績（customer.stats は prefetch 済み）"""
+    summary = stats_summary([s for s in customer.stats.all() if s.store_id == store_id])
+    return {k: summary[k] for k in ('visit_count', 'total_spent', 'last_visit_at')}
+
+
+def _affinity_payload(cast_id, row):
+    """CustomerCastAffinity 行（spent_recent 注釈付き）→ API の affinity 部分。行が無ければ 0"""
+    spent_total = row.spent_total if row else 0
+    bill_count = row.bill_count if row else 0
+    return {
+        'cast_id': int(cast_id),
+        'spent_with_cast_total': spent_total,
+        'spent_with_cast_30d': int(row.spent_recent) if row else 0,
+        'served_item_count': row.item_count if row else 0,
+        'served_bill_count': bill_count,
+        'last_served_at': row.last_served_at if row else None,
+        'avg_spent_per_bill_with_cast': int(spent_total / bill_count) if bill_count > 0 else 0,
+    }
+
+
 # ────────────────────────────────────────────────────────────────────
 # 店舗お知らせ（StoreNotice）— 自店ロック
 # ────────────────────────────────────────────────────────────────────
@@ -1499,6 +1525,9 @@ class CustomerTagViewSet(viewsets.ModelViewSet):
     queryset = CustomerTag.objects.all().order_by('code')
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_queryset(self):
+        return super().get_queryset().annotate(customer_count=Count('customers'))
+
     def get_serializer_class(self):
         # create/update は共通の CustomerTagSerializer を使用
         if self.action in ('create', 'update', 'partial_update'):
@@ -1512,7 +1541,7 @@ class CustomerTagViewSet(viewsets.ModelViewSet):
                 fields = CustomerTagSerializer.Meta.fields + ('description', 'customer_count', 'created_at')
 
             def get_customer_count(self, obj):
-                return obj.customers.count()
+                return obj.customer_count
 
         return CustomerTagWithCountSerializer
 
@@ -1552,13 +1581,12 @@ class CustomerTagAnalyticsView(APIView):
 
         tag = get_object_or_404(CustomerTag, code=tag_code, is_active=True)
 
-        # annotate で1クエリに集約
-        # - billcustomer: BillCustomer.customer FK逆参照（related_name未指定 → ルックアップ名 'billcustomer'）
-        # - bills: Bill.customers M2M の related_name='bills'
+        # CustomerStats（店舗×顧客）を顧客ごとに全店舗合算して1クエリで読む
+        # （stats は顧客あたり店舗数の行しか無いので JOIN で膨らまない）
         customers = tag.customers.annotate(
-            visit_count=Count('billcustomer', distinct=True),
-            total_spent=Sum('bills__grand_total'),
-            last_visited=Max('bills__closed_at'),
+            visit_count=Sum('stats__visit_count'),
+            total_spent=Sum('stats__total_spent'),
+            last_visited=Max('stats__last_visit_at'),
         )
 
         customer_stats = []
@@ -2520,9 +2548,10 @@ class PayrollStatusView(APIView):
         today = timezone.localdate()
         period_start, period_end = get_default_payroll_period(store, today)
 
-        from billing.payroll.engines.stores.garden import calculate_garden_stats
+        # 暫定値は日次集計（CastDailySummary）から。伝票・明細の生集計はしない
+        from billing.payroll.engines.stores.garden import garden_stats_from_tally
 
-        stats = calculate_garden_stats(store, cast.id, period_start, today)
+        stats = garden_stats_from_tally(store, [cast.id], period_start, today)[cast.id]
         monthly_back = stats["slide_back"] + stats["dohan_back"] + stats["b_back"]
 
         return Response({
@@ -2584,22 +2613,21 @@ class DailyZipDownloadView(APIView):
             raise ValidationError({'date': 'YYYY-MM-DD形式で指定してください。'})
 
         from .querysets import bills_in_store_qs
+        from .excel import BILL_EXCEL_PREFETCH, iter_daily_zip
+        from .utils.streaming import streaming_response
         bills = list(
             bills_in_store_qs(sid)
             .filter(closed_at__date=target_date)
             .select_related('table')
-            .prefetch_related('tables', 'items__served_by_cast', 'items__served_by_casts',
-                              'substitute_items__cast', 'stays__cast', 'customers')
+            .prefetch_related(*BILL_EXCEL_PREFETCH)
             .order_by('opened_at')
         )
 
         if not bills:
             return Response({'detail': '指定日の伝票がありません。'}, status=status.HTTP_404_NOT_FOUND)
 
-        from .excel import generate_daily_zip
-        zip_buf = generate_daily_zip(bills)
-
-        response = HttpResponse(zip_buf.getvalue(), content_type='application/zip')
+        # 伝票ごとの xlsx ができた順に ZIP エントリとして流す（ZIP 全体はメモリに持たない）
+        response = streaming_response(request, iter_daily_zip(bills), content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename="{date_str}_bills.zip"'
         return response
 
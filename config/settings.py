@@ -241,10 +241,16 @@ REST_SESSION_LOGIN = False
 # ── DB ───────────────────────────────────────────────────────────────
 db_url = env("DATABASE_URL", default=None)
 
+# web は ASGI（config.asgi + UvicornWorker）で動かす。ASGI では同期ビューが executor のスレッドごとに
+# 接続を開き、永続接続（conn_max_age > 0）だと回収されるまで開いたままになって Postgres の接続が溜まる。
+# Django の推奨どおり既定は 0（リクエストごとに閉じる）。接続の使い回しが要るなら pgbouncer 等の
+# 外部プーラを前に置く（psycopg2 なのでドライバ側の pool オプションは無い）。
+DB_CONN_MAX_AGE = env.int("DB_CONN_MAX_AGE", default=0)
+
 if db_url:
     # DATABASE_URL があれば、DEBUGでも常にそれを使う（Postgres推奨）
     DATABASES = {
-        "default": dj_database_url.parse(db_url, conn_max_age=600)
+        "default": dj_database_url.parse(db_url, conn_max_age=DB_CONN_MAX_AGE)
     }
 elif DEBUG:
     DATABASES = {
@@ -255,7 +261,7 @@ elif DEBUG:
     }
 else:
     DATABASES = {
-        "default": dj_database_url.config(conn_max_age=600, ssl_require=True)
+        "default": dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE, ssl_require=True)
     }
 
 